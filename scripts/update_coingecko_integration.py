@@ -2,21 +2,39 @@
 """
 CoinGecko Integration Update Script
 This script handles updating and synchronizing data from CoinGecko API.
+
+Each run writes one versioned, compressed columnar snapshot (see
+src/ml-engine/main_app/infrastructure/snapshots.py) under data/coingecko.
+
+The full `/coins/markets` universe is crawled page by page into data/coingecko-markets.
+Pages are fetched concurrently under one shared rate budget and each page is written to
+disk as soon as it arrives, so memory does not grow with the number of pages. Progress is
+checkpointed after every page; an interrupted crawl resumes with the pages still missing
+on the next run (pass --restart to start over).
 """
 
 import os
 import sys
 import json
+import gzip
 import time
+import shutil
 import logging
+import argparse
+import threading
 import requests
-import stat
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "ml-engine"))
+from main_app.infrastructure.snapshots import write_snapshot  # noqa: E402
 
 # Constants
-JSON_INDENT = 2
 DEFAULT_TOP_COINS_LIMIT = 250
 DEFAULT_PAGE = 1
+MARKETS_PER_PAGE = 250
+MAX_RETRIES = 5
+RATE_LIMIT_LOW_WATERMARK = 5
 REQUEST_TIMEOUT = 30
 API_VERSION = "1.0.0"
 ERROR_EXIT_CODE = 1
@@ -34,7 +52,13 @@ COINGECKO_API_BASE = "https://api.coingecko.com/api/v3"
 COINGECKO_API_KEY = os.environ.get("COINGECKO_API_KEY", "")
 if not COINGECKO_API_KEY:
     logger.warning("COINGECKO_API_KEY not set - running in free tier mode with rate limits")
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "coingecko")
+SNAPSHOT_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+SNAPSHOT_DATASET = "coingecko"
+CRAWL_ROOT = os.path.join(SNAPSHOT_ROOT, "coingecko-markets")
+CRAWL_WORKERS = int(os.environ.get("COINGECKO_CRAWL_WORKERS", "4"))
+CRAWLS_KEPT = 2
+# the free tier allows roughly 30 calls a minute, paid plans 500
+CALLS_PER_MINUTE = float(os.environ.get("COINGECKO_CALLS_PER_MINUTE", "500" if COINGECKO_API_KEY else "30"))
 
 def get_headers():
     """
@@ -47,27 +71,84 @@ def get_headers():
         headers["X-CG-Pro-API-Key"] = COINGECKO_API_KEY
     return headers
 
-def respect_rate_limits(response):
-    """Check response headers and respect rate limits"""
-    try:
-        remaining = int(response.headers.get("X-RateLimit-Remaining", "999"))
-        if remaining < 5:
-            reset_time = response.headers.get('X-RateLimit-Reset')
-            if reset_time:
-                sleep_time = max(int(reset_time) - time.time(), 0) + 1
-                logger.info(f"Rate limit approaching, sleeping for {sleep_time} seconds")
-                time.sleep(sleep_time)
-            else:
-                logger.info("Rate limit approaching, sleeping for 10 seconds")
-                time.sleep(10)
-    except ValueError:
-        time.sleep(0.5)  # Default delay on parse error
-    else:
-        time.sleep(0.5)  # Default delay between requests
+class RateBudget:
+    """
+    Token bucket shared by every request thread.
+
+    Each request takes one token; tokens refill at `calls_per_minute`. A 429 response or an
+    almost exhausted X-RateLimit window pauses the whole budget rather than the thread that
+    saw it, so concurrent workers never overrun the limit together.
+    """
+
+    def __init__(self, calls_per_minute, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = calls_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, min(calls_per_minute / 10.0, 10.0))
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks the calling thread until it may issue one request"""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    delay = (1 - self.tokens) / self.rate
+            self._sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, self._clock() + seconds)
+
+    def observe(self, response):
+        """Pauses the budget when the response says the rate limit is (nearly) exhausted"""
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After", "")
+            seconds = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else 60.0
+            logger.info(f"Rate limited, pausing all requests for {seconds} seconds")
+            self.pause(seconds)
+            return
+        try:
+            remaining = int(response.headers.get("X-RateLimit-Remaining", "999"))
+            if remaining < RATE_LIMIT_LOW_WATERMARK:
+                reset_time = response.headers.get("X-RateLimit-Reset")
+                seconds = max(int(reset_time) - time.time(), 0) + 1 if reset_time else 10
+                logger.info(f"Rate limit approaching, pausing all requests for {seconds} seconds")
+                self.pause(seconds)
+        except ValueError:
+            pass
+
+RATE_BUDGET = RateBudget(CALLS_PER_MINUTE)
+
+def rate_limited_get(url, params=None):
+    """
+    Issues a GET request under the shared rate budget, retrying rate-limited (429) responses.
+
+    Returns the response; raises for other HTTP errors.
+    """
+    for _ in range(MAX_RETRIES):
+        RATE_BUDGET.acquire()
+        response = requests.get(url, headers=get_headers(), params=params, timeout=REQUEST_TIMEOUT)
+        RATE_BUDGET.observe(response)
+        if response.status_code != 429:
+            response.raise_for_status()
+            return response
+    response.raise_for_status()
+    return response
 
 def fetch_coins_list():
     """
-    Fetches the complete list of coins from the CoinGecko API and saves it to a local JSON file.
+    Fetches the complete list of coins from the CoinGecko API.
 
     Returns:
         The list of coins as parsed from the API response, or None if the request fails.
@@ -76,18 +157,10 @@ def fetch_coins_list():
     logger.info(f"Fetching coins list from {url}")
 
     try:
-        response = requests.get(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        respect_rate_limits(response)
+        response = rate_limited_get(url)
         coins = response.json()
 
-        # Save to file
-        output_file = os.path.join(DATA_DIR, "coins_list.json")
-        with open(output_file, "w") as f:
-            json.dump(coins, f, indent=JSON_INDENT)
-        os.chmod(output_file, stat.S_IRUSR | stat.S_IWUSR)
-
-        logger.info(f"Saved {len(coins)} coins to {output_file}")
+        logger.info(f"Fetched {len(coins)} coins")
         return coins
     except Exception as e:
         logger.error(
@@ -102,24 +175,17 @@ def fetch_global_data():
     """
     Fetches global cryptocurrency market data from the CoinGecko API.
 
-    Retrieves overall market statistics, saves the data to 'global.json' in the data directory,
-    and returns the parsed JSON data. Returns None if the request fails.
+    Retrieves overall market statistics and returns the parsed JSON data. Returns None if the
+    request fails.
     """
     url = f"{COINGECKO_API_BASE}/global"
     logger.info(f"Fetching global market data from {url}")
 
     try:
-        response = requests.get(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        respect_rate_limits(response)
+        response = rate_limited_get(url)
         global_data = response.json()
 
-        # Save to file
-        output_file = os.path.join(DATA_DIR, "global.json")
-        with open(output_file, "w") as f:
-            json.dump(global_data, f, indent=JSON_INDENT)
-
-        logger.info(f"Saved global market data to {output_file}")
+        logger.info("Fetched global market data")
         return global_data
     except Exception as e:
         logger.error(
@@ -130,13 +196,23 @@ def fetch_global_data():
         )
         return None
 
+def markets_params(page, per_page):
+    return {
+        "vs_currency": "usd",
+        "order": "market_cap_desc",
+        "per_page": per_page,
+        "page": page,
+        "sparkline": False,
+        "price_change_percentage": "1h,24h,7d"
+    }
+
 def fetch_top_coins(limit=DEFAULT_TOP_COINS_LIMIT):
     """
     Fetches detailed market data for the top cryptocurrencies by market capitalization.
 
     Retrieves market data for the top `limit` coins from the CoinGecko API, including price change
-    percentages over 1 hour, 24 hours, and 7 days. Saves the resulting data to a JSON file in the
-    data directory. Returns the data as a list of dictionaries, or None if the request fails.
+    percentages over 1 hour, 24 hours, and 7 days. Returns the data as a list of dictionaries,
+    or None if the request fails.
 
     Args:
         limit: The number of top coins to fetch (default is DEFAULT_TOP_COINS_LIMIT).
@@ -145,29 +221,15 @@ def fetch_top_coins(limit=DEFAULT_TOP_COINS_LIMIT):
         A list of dictionaries containing market data for each coin, or None on failure.
     """
     url = f"{COINGECKO_API_BASE}/coins/markets"
-    params = {
-        "vs_currency": "usd",
-        "order": "market_cap_desc",
-        "per_page": limit,
-        "page": DEFAULT_PAGE,
-        "sparkline": False,
-        "price_change_percentage": "1h,24h,7d"
-    }
+    params = markets_params(DEFAULT_PAGE, limit)
 
     logger.info(f"Fetching top {limit} coins from {url}")
 
     try:
-        response = requests.get(url, headers=get_headers(), params=params, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        respect_rate_limits(response)
+        response = rate_limited_get(url, params=params)
         top_coins = response.json()
 
-        # Save to file
-        output_file = os.path.join(DATA_DIR, f"top_{limit}_coins.json")
-        with open(output_file, "w") as f:
-            json.dump(top_coins, f, indent=JSON_INDENT)
-
-        logger.info(f"Saved top {len(top_coins)} coins to {output_file}")
+        logger.info(f"Fetched top {len(top_coins)} coins")
         return top_coins
     except Exception as e:
         logger.error(
@@ -184,17 +246,10 @@ def fetch_categories():
     logger.info(f"Fetching categories from {url}")
 
     try:
-        response = requests.get(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        respect_rate_limits(response)
+        response = rate_limited_get(url)
         categories = response.json()
 
-        # Save to file
-        output_file = os.path.join(DATA_DIR, "categories.json")
-        with open(output_file, "w") as f:
-            json.dump(categories, f, indent=JSON_INDENT)
-
-        logger.info(f"Saved {len(categories)} categories to {output_file}")
+        logger.info(f"Fetched {len(categories)} categories")
         return categories
     except Exception as e:
         logger.error(
@@ -205,48 +260,166 @@ def fetch_categories():
         )
         return None
 
-def update_metadata():
-    """Update metadata file with timestamp and version info"""
-    metadata = {
-        "last_updated": datetime.utcnow().isoformat(),
-        "version": API_VERSION,
-        "api_base": COINGECKO_API_BASE
-    }
-
-    output_file = os.path.join(DATA_DIR, "metadata.json")
-    with open(output_file, "w") as f:
-        json.dump(metadata, f, indent=JSON_INDENT)
-    os.chmod(output_file, stat.S_IRUSR | stat.S_IWUSR)
+class MarketsCrawl:
+    """
+    Crawls every `/coins/markets` page into `<root>/in-progress` and publishes the finished
+    crawl as `<root>/<version>` (pointed to by `<root>/CURRENT`).
 
-    logger.info(f"Updated metadata at {output_file}")
+    Each page is stored as `page-NNNNN.jsonl.gz` and recorded in `checkpoint.json`, both
+    written atomically, before the next page is scheduled on that worker.
+    """
 
-def main():
+    def __init__(self, root=CRAWL_ROOT, per_page=MARKETS_PER_PAGE, workers=CRAWL_WORKERS):
+        self.root = root
+        self.per_page = per_page
+        self.workers = workers
+        self.directory = os.path.join(root, "in-progress")
+        self.checkpoint_file = os.path.join(self.directory, "checkpoint.json")
+
+    def load_checkpoint(self, restart=False):
+        if restart:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, "r") as f:
+                checkpoint = json.load(f)
+            if checkpoint["per_page"] == self.per_page:
+                logger.info(f"Resuming markets crawl with {len(checkpoint['completed'])} pages already done")
+                return checkpoint
+            shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        return {"per_page": self.per_page, "started_at": datetime.now(timezone.utc).isoformat(),
+                "completed": {}, "last_page": None}
+
+    def save_checkpoint(self, checkpoint):
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def page_file(self, page, directory=None):
+        return os.path.join(directory or self.directory, f"page-{page:05d}.jsonl.gz")
+
+    def fetch_page(self, page):
+        """Fetches one page and streams it to disk; returns the number of coins on it"""
+        url = f"{COINGECKO_API_BASE}/coins/markets"
+        coins = rate_limited_get(url, params=markets_params(page, self.per_page)).json()
+        tmp_file = f"{self.page_file(page)}.tmp"
+        with gzip.open(tmp_file, "wt") as f:
+            for coin in coins:
+                f.write(json.dumps(coin, separators=(",", ":")))
+                f.write("\n")
+        os.replace(tmp_file, self.page_file(page))
+        return len(coins)
+
+    def run(self, restart=False):
+        """
+        Crawls all missing pages and publishes the crawl.
+
+        Returns:
+            (directory, pages, coins) of the published crawl. Raises on a failed page; the
+            checkpoint keeps every completed page for the next run.
+        """
+        checkpoint = self.load_checkpoint(restart)
+        completed = checkpoint["completed"]
+        next_page = 1
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def schedule():
+                nonlocal next_page
+                while len(in_flight) < self.workers and \
+                        (checkpoint["last_page"] is None or next_page <= checkpoint["last_page"]):
+                    if str(next_page) not in completed:
+                        in_flight[executor.submit(self.fetch_page, next_page)] = next_page
+                    next_page += 1
+
+            schedule()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = in_flight.pop(future)
+                    coins = future.result()
+                    completed[str(page)] = coins
+                    if coins < self.per_page and (checkpoint["last_page"] is None or page < checkpoint["last_page"]):
+                        checkpoint["last_page"] = page  # a short page is the end of the universe
+                    self.save_checkpoint(checkpoint)
+                    logger.info(f"Crawled markets page {page} ({coins} coins)")
+                schedule()
+
+        last_page = checkpoint["last_page"]
+        for page in [int(page) for page in completed if int(page) > last_page]:
+            del completed[str(page)]  # overshoot past the end while pages were in flight
+            os.remove(self.page_file(page))
+        return self.publish(last_page, sum(completed.values()))
+
+    def publish(self, pages, coins):
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        directory = os.path.join(self.root, version)
+        os.remove(self.checkpoint_file)
+        os.rename(self.directory, directory)
+        pointer_tmp = os.path.join(self.root, ".CURRENT.tmp")
+        with open(pointer_tmp, "w") as f:
+            f.write(version)
+        os.replace(pointer_tmp, os.path.join(self.root, "CURRENT"))
+
+        crawls = sorted(entry for entry in os.listdir(self.root)
+                        if entry[:1].isdigit() and os.path.isdir(os.path.join(self.root, entry)))
+        for old in crawls[:-CRAWLS_KEPT]:
+            shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+        return directory, pages, coins
+
+    def iter_coins(self, directory, pages):
+        """Streams the coins of a published crawl in market-cap order"""
+        for page in range(1, pages + 1):
+            with gzip.open(self.page_file(page, directory), "rt") as f:
+                for line in f:
+                    yield json.loads(line)
+
+def main(argv=None):
     """
-    Coordinates the full update process for CoinGecko data, including fetching all datasets,
-    saving them locally, updating metadata, and logging progress.
+    Coordinates the full update process for CoinGecko data: crawls the markets universe,
+    fetches all other datasets, writes them as one snapshot and logs progress.
 
-    Exits the program with status ERROR_EXIT_CODE if any data fetch fails.
+    Exits the program with status ERROR_EXIT_CODE, leaving the previous snapshot current, if
+    any data fetch fails. A failed crawl keeps its checkpoint and resumes on the next run.
     """
+    parser = argparse.ArgumentParser(description="Update CoinGecko data")
+    parser.add_argument("--restart", action="store_true", help="discard an interrupted markets crawl")
+    args = parser.parse_args(argv)
+
     logger.info("Starting CoinGecko integration update")
     start_time = time.time()
+    as_of = datetime.now(timezone.utc)
 
-    # Create data directory if it doesn't exist
-    os.makedirs(DATA_DIR, exist_ok=True)
+    try:
+        crawl_dir, crawl_pages, crawl_coins = MarketsCrawl().run(restart=args.restart)
+        logger.info(f"Crawled {crawl_coins} coins on {crawl_pages} pages into {crawl_dir}")
+    except Exception:
+        logger.exception("Markets crawl failed; completed pages are kept for the next run")
+        sys.exit(ERROR_EXIT_CODE)
 
     # Fetch all required data
-    success = all([
-        fetch_coins_list() is not None,
-        fetch_global_data() is not None,
-        fetch_top_coins() is not None,
-        fetch_categories() is not None
-    ])
-
-    if not success:
+    coins_list = fetch_coins_list()
+    global_data = fetch_global_data()
+    top_coins = fetch_top_coins()
+    categories = fetch_categories()
+
+    if any(data is None for data in (coins_list, global_data, top_coins, categories)):
         logger.error("One or more operations failed")
         sys.exit(ERROR_EXIT_CODE)
 
-    # Update metadata
-    update_metadata()
+    tables = {
+        "coins_list": coins_list,
+        "global": [global_data.get("data", global_data)],
+        f"top_{DEFAULT_TOP_COINS_LIMIT}_coins": top_coins,
+        "categories": categories,
+    }
+    snapshot_dir = write_snapshot(SNAPSHOT_DATASET, tables, root=SNAPSHOT_ROOT, as_of=as_of, source={
+        "version": API_VERSION,
+        "api_base": COINGECKO_API_BASE,
+        "markets_crawl": {"directory": crawl_dir, "pages": crawl_pages, "coins": crawl_coins},
+    })
+    logger.info(f"Wrote snapshot {snapshot_dir} ({', '.join(f'{name}: {len(rows)} rows' for name, rows in tables.items())})")
 
     elapsed_time = time.time() - start_time
     logger.info(f"CoinGecko integration update completed in {elapsed_time:.2f} seconds")
@@ -2,16 +2,36 @@
 """
 DefiLlama Integration Update Script
 This script handles updating and synchronizing data from DefiLlama API.
+
+Each run writes one versioned, compressed columnar snapshot (see
+src/ml-engine/main_app/infrastructure/snapshots.py) under data/defillama. The ml-engine
+serves from it when started with VV_DATA_SOURCE=snapshot.
+
+Syncs are incremental by default: all endpoints are fetched concurrently with conditional
+requests (ETag/Last-Modified validators kept in data/defillama/metadata.json), unchanged
+tables are carried over from the previous snapshot without being rewritten, and no new
+snapshot is written at all when nothing changed. Protocols are diffed by id; the added,
+changed and removed records of a run are stored in the `protocol_changes` table.
+Pass --full to ignore the stored validators and refetch everything.
 """
 
 import os
 import sys
 import json
-import time
 import stat
+import time
+import hashlib
 import logging
+import argparse
 import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+ML_ENGINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "ml-engine")
+sys.path.insert(0, ML_ENGINE_DIR)
+from main_app.infrastructure.snapshots import current_snapshot_dir, Snapshot, write_snapshot  # noqa: E402
 
 # Constants
 JSON_INDENT = 2
@@ -29,12 +49,24 @@ logger = logging.getLogger("defillama-integration")
 
 # Configuration
 DEFILLAMA_API_BASE = "https://api.llama.fi"
+DEFILLAMA_YIELDS_API_BASE = "https://yields.llama.fi"
 DEFILLAMA_API_KEY = os.environ.get("DEFILLAMA_API_KEY", "")
-DATA_DIR = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-    "data",
-    "defillama"
-)
+SNAPSHOT_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+SNAPSHOT_DATASET = "defillama"
+# pools whose full history is snapshotted: the ml-engine's pinned pools plus any extra ids
+PINNED_POOLS_FILE = os.path.join(ML_ENGINE_DIR, "static_data", "pinned_pools.json")
+EXTRA_POOL_IDS = [pool_id for pool_id in os.environ.get("DEFILLAMA_SNAPSHOT_POOLS", "").split(",") if pool_id]
+METADATA_FILE = os.path.join(SNAPSHOT_ROOT, SNAPSHOT_DATASET, "metadata.json")
+SYNC_WORKERS = int(os.environ.get("DEFILLAMA_SYNC_WORKERS", "8"))
+
+# snapshot table -> (API base, endpoint); pool histories are added per pool as 'pool_charts/<pool id>'
+TABLE_ENDPOINTS = {
+    "protocols": (DEFILLAMA_API_BASE, "protocols"),
+    "tvl": (DEFILLAMA_API_BASE, "charts"),
+    "chains": (DEFILLAMA_API_BASE, "chains"),
+    "yield_pools": (DEFILLAMA_YIELDS_API_BASE, "pools"),
+}
+POOL_CHARTS_PREFIX = "pool_charts/"
 
 def get_headers():
     """
@@ -49,97 +81,232 @@ def get_headers():
         headers["Authorization"] = f"Bearer {DEFILLAMA_API_KEY}"
     return headers
 
-def fetch_and_save_data(endpoint, filename, data_description):
-    """Generic function to fetch data from DefiLlama API and save it to a file"""
-    url = f"{DEFILLAMA_API_BASE}/{endpoint}"
-    logger.info(f"Fetching {data_description} from {url}")
+def fetch_endpoint(key, url, validators=None):
+    """
+    Fetches one endpoint, conditionally if validators from the previous run are given.
+
+    Returns a result dict with the HTTP status (304 when unchanged, None on failure), the
+    decoded body, the new validators, a content hash, the payload size and the elapsed time.
+    """
+    headers = get_headers()
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
 
+    result = {"key": key, "url": url, "status": None, "data": None, "bytes": 0}
+    start = time.perf_counter()
     try:
-        response = requests.get(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+        response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        result["bytes"] = len(response.content)
+        if response.status_code == 304:
+            result.update(status=304, etag=validators.get("etag"), last_modified=validators.get("last_modified"),
+                          content_hash=validators.get("content_hash"))
+            return result
         response.raise_for_status()
         data = response.json()
-
-        # Save to file
-        output_file = os.path.join(DATA_DIR, filename)
-        with open(output_file, "w") as f:
-            json.dump(data, f, indent=JSON_INDENT)
-        os.chmod(output_file, stat.S_IRUSR | stat.S_IWUSR)
-
-        logger.info(f"Saved {data_description} to {output_file}")
-        return data
+        if isinstance(data, dict) and "status" in data and "data" in data:  # yields.llama.fi envelope
+            if data["status"] != "success":
+                raise ValueError(f"DefiLlama returned status '{data['status']}'")
+            data = data["data"]
+        result.update(status=response.status_code, data=data, etag=response.headers.get("ETag"),
+                      last_modified=response.headers.get("Last-Modified"),
+                      content_hash=hashlib.sha256(response.content).hexdigest())
     except requests.exceptions.RequestException:
-        logger.exception(f"Network error while fetching {data_description}")
-        return None
-    except json.JSONDecodeError:
-        logger.exception(f"Failed to decode JSON response from {data_description} API")
-        return None
-    except IOError:
-        logger.exception(f"Failed to write {data_description} to {output_file}")
-        return None
+        logger.exception(f"Network error while fetching {key}")
+    except (json.JSONDecodeError, ValueError):
+        logger.exception(f"Failed to decode JSON response from {key} API")
     except Exception:
-        logger.exception(f"Unexpected error while fetching {data_description}")
-        return None
-
-def fetch_protocols():
-    """Fetch all protocols from DefiLlama"""
-    protocols = fetch_and_save_data("protocols", "protocols.json", "protocols")
-    if protocols:
-        logger.info(f"Fetched {len(protocols)} protocols")
-    return protocols
-
-def fetch_tvl_data():
-    """Fetch TVL data from DefiLlama"""
-    return fetch_and_save_data("charts", "tvl.json", "TVL data")
-
-def fetch_chains():
-    """Fetch chains data from DefiLlama"""
-    return fetch_and_save_data("chains", "chains.json", "chains data")
-
-def update_metadata():
-    """  
-    The metadata file is saved in the data directory with user read/write permissions.
+        logger.exception(f"Unexpected error while fetching {key}")
+    finally:
+        result["seconds"] = time.perf_counter() - start
+    return result
+
+def get_snapshot_pool_ids():
+    """Returns the pinned ml-engine pools followed by any extra ids from DEFILLAMA_SNAPSHOT_POOLS"""
+    pool_ids = []
+    if os.path.exists(PINNED_POOLS_FILE):
+        with open(PINNED_POOLS_FILE, "r") as f:
+            pool_ids.extend(json.load(f).values())
+    return list(dict.fromkeys(pool_ids + EXTRA_POOL_IDS))
+
+def get_endpoints(pool_ids):
+    """Returns endpoint key -> URL for every endpoint synced in a run"""
+    endpoints = {table: f"{base}/{endpoint}" for table, (base, endpoint) in TABLE_ENDPOINTS.items()}
+    for pool_id in pool_ids:
+        endpoints[f"{POOL_CHARTS_PREFIX}{pool_id}"] = f"{DEFILLAMA_YIELDS_API_BASE}/chart/{pool_id}"
+    return endpoints
+
+def load_metadata():
+    """Loads the sync state of the previous run (validators per endpoint, protocol hashes)"""
+    if not os.path.exists(METADATA_FILE):
+        return {"endpoints": {}, "protocol_hashes": {}}
+    with open(METADATA_FILE, "r") as f:
+        metadata = json.load(f)
+    metadata.setdefault("endpoints", {})
+    metadata.setdefault("protocol_hashes", {})
+    return metadata
+
+def update_metadata(endpoints, protocol_hashes, report):
+    """
+    Atomically replaces the sync state; the file is saved with user read/write permissions.
     """
-    output_file = os.path.join(DATA_DIR, "metadata.json")
     metadata = {
-        "last_updated": datetime.utcnow().isoformat(),
+        "last_updated": datetime.now(timezone.utc).isoformat(),
         "version": API_VERSION,
-        "api_base": DEFILLAMA_API_BASE
+        "api_base": DEFILLAMA_API_BASE,
+        "endpoints": endpoints,
+        "protocol_hashes": protocol_hashes,
+        "last_sync": report,
     }
+    os.makedirs(os.path.dirname(METADATA_FILE), exist_ok=True)
+    tmp_file = f"{METADATA_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(metadata, f, indent=JSON_INDENT)
+    os.chmod(tmp_file, stat.S_IRUSR | stat.S_IWUSR)
+    os.replace(tmp_file, METADATA_FILE)
+    logger.info(f"Updated metadata at {METADATA_FILE}")
 
-    try:
-        with open(output_file, "w") as f:
-            json.dump(metadata, f, indent=JSON_INDENT)
-        os.chmod(output_file, stat.S_IRUSR | stat.S_IWUSR)
-        logger.info(f"Updated metadata at {output_file}")
-    except IOError as e:
-        logger.exception(f"Failed to write metadata to {output_file}, Error: {str(e)}")
-
-def main():
+def record_key(record):
+    return str(record.get("id") or record.get("slug") or record.get("name"))
+
+def record_hash(record):
+    return hashlib.sha256(json.dumps(record, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def diff_protocols(protocols, previous_hashes):
     """
-    Coordinates the full DefiLlama data update process, including data fetching and metadata refresh.
-    
-    Creates the data directory if needed, retrieves protocols, TVL, and chains data from the DefiLlama API, saves them locally, updates metadata, and logs progress. Exits with an error if any data fetch fails.
+    Diffs the protocol set against the hashes of the previous run.
+
+    Returns:
+        (hashes, changes): the new id -> hash map and the added/changed/removed records,
+        each tagged with a `change` field.
     """
+    hashes, changes = {}, []
+    for protocol in protocols:
+        key = record_key(protocol)
+        hashes[key] = record_hash(protocol)
+        if key not in previous_hashes:
+            changes.append(dict(protocol, change="added"))
+        elif previous_hashes[key] != hashes[key]:
+            changes.append(dict(protocol, change="changed"))
+    changes.extend({"id": key, "change": "removed"} for key in previous_hashes if key not in hashes)
+    return hashes, changes
+
+def previous_pool_rows(snapshot, pool_ids):
+    """Returns the previous snapshot's history rows of the given pools"""
+    keep = np.array([pool_id in pool_ids for pool_id in snapshot.dictionary("pool_charts", "pool")] + [False])
+    return snapshot.records("pool_charts", np.flatnonzero(keep[snapshot.codes("pool_charts", "pool")]))
+
+def sync(full=False):
+    """
+    Runs one sync and writes a snapshot if anything changed.
+
+    Returns:
+        (snapshot_dir or None, report): the written snapshot and the per-endpoint report.
+    """
+    metadata = load_metadata()
+    previous_dir = current_snapshot_dir(SNAPSHOT_DATASET, SNAPSHOT_ROOT)
+    previous = Snapshot(previous_dir) if previous_dir and not full else None
+
+    def has_previous(key):
+        if key.startswith(POOL_CHARTS_PREFIX):
+            return has_previous("pool_charts") and \
+                previous.lookup("pool_charts", "pool", key[len(POOL_CHARTS_PREFIX):]) >= 0
+        return previous is not None and key in previous.tables
+
+    # Fetch all endpoints concurrently, conditionally where the previous snapshot can stand in for a 304
+    endpoints = get_endpoints(get_snapshot_pool_ids())
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as executor:
+        futures = {key: executor.submit(fetch_endpoint, key, url,
+                                        metadata["endpoints"].get(key) if has_previous(key) else None)
+                   for key, url in endpoints.items()}
+        results = {key: future.result() for key, future in futures.items()}
+
+    failed = [key for key, result in results.items() if result["status"] is None]
+    if failed:
+        raise RuntimeError(f"Failed to fetch: {', '.join(failed)}")
+
+    def unchanged(key):
+        previous_hash = metadata["endpoints"].get(key, {}).get("content_hash")
+        return has_previous(key) and (results[key]["status"] == 304 or results[key]["content_hash"] == previous_hash)
+
+    tables, carry_over, report = {}, [], {}
+    for key, result in results.items():
+        report[key] = {"status": result["status"], "bytes": result["bytes"], "seconds": round(result["seconds"], 3),
+                       "changed": not unchanged(key)}
+
+    for table in TABLE_ENDPOINTS:
+        if unchanged(table):
+            carry_over.append(table)
+        else:
+            tables[table] = results[table]["data"]
+
+    protocol_hashes = metadata["protocol_hashes"] if previous_dir else {}
+    if "protocols" in tables:
+        protocol_hashes, changes = diff_protocols(tables["protocols"], protocol_hashes)
+        tables["protocol_changes"] = changes
+        report["protocols"]["diff"] = {change: sum(1 for record in changes if record["change"] == change)
+                                       for change in ("added", "changed", "removed")}
+
+    chart_keys = [key for key in results if key.startswith(POOL_CHARTS_PREFIX)]
+    changed_charts = [key for key in chart_keys if not unchanged(key)]
+    pool_ids = {key[len(POOL_CHARTS_PREFIX):] for key in chart_keys}
+    previous_pools = set(previous.dictionary("pool_charts", "pool")) if has_previous("pool_charts") else set()
+    if changed_charts or pool_ids != previous_pools or not has_previous("pool_charts"):
+        unchanged_pools = {key[len(POOL_CHARTS_PREFIX):] for key in chart_keys if key not in changed_charts}
+        rows = previous_pool_rows(previous, unchanged_pools) if unchanged_pools else []
+        for key in changed_charts:
+            rows.extend(dict(point, pool=key[len(POOL_CHARTS_PREFIX):]) for point in results[key]["data"])
+        tables["pool_charts"] = rows
+    else:
+        carry_over.append("pool_charts")
+
+    endpoint_state = {key: {"etag": result.get("etag"), "last_modified": result.get("last_modified"),
+                            "content_hash": result.get("content_hash")} for key, result in results.items()}
+
+    snapshot_dir = None
+    if tables:
+        snapshot_dir = write_snapshot(SNAPSHOT_DATASET, tables, root=SNAPSHOT_ROOT, carry_over=carry_over, source={
+            "version": API_VERSION,
+            "api_base": DEFILLAMA_API_BASE,
+            "yields_api_base": DEFILLAMA_YIELDS_API_BASE,
+            "sync": report,
+        })
+    update_metadata(endpoint_state, protocol_hashes, report)
+    return snapshot_dir, report
+
+def main(argv=None):
+    """
+    Coordinates the DefiLlama data update process, including data fetching and snapshot writing.
+
+    Syncs protocols, TVL, chains, yield pools and pool histories from the DefiLlama API, writes a snapshot if anything changed and logs a per-endpoint report. Exits with an error, leaving the previous snapshot current, if any data fetch fails.
+    """
+    parser = argparse.ArgumentParser(description="Sync DefiLlama data into a columnar snapshot")
+    parser.add_argument("--full", action="store_true", help="ignore stored validators and refetch everything")
+    args = parser.parse_args(argv)
+
     logger.info("Starting DefiLlama integration update")
     start_time = time.time()
-    
-    # Create data directory if it doesn't exist
-    os.makedirs(DATA_DIR, exist_ok=True)
-    
-    # Fetch all required data
-    protocols = fetch_protocols()
-    tvl_data = fetch_tvl_data()
-    chains = fetch_chains()
-    
-    if not all([protocols, tvl_data, chains]):
-        logger.error("One or more data fetches failed")
+
+    try:
+        snapshot_dir, report = sync(full=args.full)
+    except Exception:
+        logger.exception("One or more data fetches failed")
         sys.exit(ERROR_EXIT_CODE)
-    
-    # Update metadata
-    update_metadata()
-    
+
+    for key, entry in report.items():
+        changes = " ".join(f"{name}={count}" for name, count in entry.get("diff", {}).items())
+        logger.info(f"{key}: status={entry['status']} bytes={entry['bytes']} seconds={entry['seconds']:.3f} "
+                    f"changed={entry['changed']}{' ' + changes if changes else ''}")
+    if snapshot_dir:
+        logger.info(f"Wrote snapshot {snapshot_dir}")
+    else:
+        logger.info("No changes since the previous snapshot")
+
     elapsed_time = time.time() - start_time
-    logger.info(f"DefiLlama integration update completed in {elapsed_time:.2f} seconds")
+    logger.info(f"DefiLlama integration update completed in {elapsed_time:.2f} seconds, "
+                f"{sum(entry['bytes'] for entry in report.values())} bytes downloaded")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Goldsky Integration Update Script
+This script handles ingesting the Goldsky vault subgraph into the ml-engine's columnar store.
+
+Each run pages through the subgraph's vaults, transactions and price updates from the last
+committed cursor of each entity (see src/ml-engine/main_app/infrastructure/goldsky.py), so
+only entities newer than the previous run are fetched. The store lives under
+VV_GOLDSKY_STORE_DIR and the subgraph is read from VV_GOLDSKY_SUBGRAPH_URL.
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "ml-engine"))
+from main_app.infrastructure.goldsky import ENTITIES, GoldskyIngestor  # noqa: E402
+
+# Constants
+ERROR_EXIT_CODE = 1
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger("goldsky-integration")
+
+
+def main(argv=None):
+    """
+    Ingests the Goldsky subgraph entities selected on the command line (all by default) and logs
+    the number of rows ingested per entity. Exits with an error if an entity fails to sync; the
+    entities synced before it keep their committed cursors.
+    """
+    names = [spec.name for spec in ENTITIES]
+    parser = argparse.ArgumentParser(description="Sync the Goldsky vault subgraph into the columnar store")
+    parser.add_argument("--entity", action="append", choices=names,
+                        help="entity to sync (repeatable; default: all)")
+    args = parser.parse_args(argv)
+
+    logger.info("Starting Goldsky integration update")
+    start_time = time.time()
+
+    try:
+        ingestor = GoldskyIngestor()
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(ERROR_EXIT_CODE)
+    for spec in ENTITIES:
+        if args.entity and spec.name not in args.entity:
+            continue
+        try:
+            ingested = ingestor.sync(spec)
+        except Exception:
+            logger.exception(f"Failed to sync {spec.name}")
+            sys.exit(ERROR_EXIT_CODE)
+        logger.info(f"{spec.name}: {ingested} rows ingested")
+
+    elapsed_time = time.time() - start_time
+    logger.info(f"Goldsky integration update completed in {elapsed_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Cold-start import benchmark for the ml-engine service.
+
+Imports `main_app.main` in fresh interpreters, reports the median wall-clock import time
+and which heavy modules were pulled in, and compares the result with the stored baseline.
+Exits with a non-zero status if the import time regressed beyond the allowed threshold or
+a module that must stay lazy was imported eagerly.
+
+Usage (from src/ml-engine):
+    python benchmarks/import_time.py [--runs 5] [--threshold 0.25] [--update-baseline]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ML_ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(ML_ENGINE_DIR, "benchmarks", "baselines", "import_time.json")
+
+TARGET_MODULE = "main_app.main"
+# modules only needed once a model runs; importing them at startup is a regression
+LAZY_MODULES = ["pypfopt", "cvxpy", "scipy", "jsonschema", "pandas",
+                "main_app.models.black_litterman.BlPortfolioModel"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(runs: int) -> dict:
+    """Imports the target module in `runs` fresh interpreters and returns the median time and eager modules."""
+    probe = _PROBE.format(target=TARGET_MODULE, lazy=LAZY_MODULES)
+    timings, loaded = [], set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", probe], cwd=ML_ENGINE_DIR, check=True,
+                                capture_output=True, text=True).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        timings.append(sample["seconds"])
+        loaded.update(sample["loaded"])
+    return {"median_seconds": statistics.median(timings), "runs": runs, "eager_lazy_modules": sorted(loaded)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    result = measure(args.runs)
+    print(json.dumps(result, indent=2))
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(BASELINE_FILE), exist_ok=True)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return
+
+    failed = False
+    if result["eager_lazy_modules"]:
+        print(f"FAIL: modules that must load lazily were imported at startup: {result['eager_lazy_modules']}")
+        failed = True
+
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r") as f:
+            baseline = json.load(f)
+        limit = baseline["median_seconds"] * (1 + args.threshold)
+        if result["median_seconds"] > limit:
+            print(f"FAIL: import took {result['median_seconds']:.3f}s, baseline {baseline['median_seconds']:.3f}s "
+                  f"(limit {limit:.3f}s)")
+            failed = True
+    else:
+        print("No baseline found; run with --update-baseline to record one.")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Single-machine HTTP load test for the ml-engine service.
+
+Starts the DefiLlama stand-in (`benchmarks/upstream.py`) and the service under uvicorn
+pointed at it, then drives a mixed workload built from the requests in an `.http` file
+(default: `http_requests/main_app_endpoints.http`). Reports throughput, p50/p95/p99 latency
+and error rate per route as JSON on stdout.
+
+Open-loop runs (`--rate`) send requests on a fixed arrival schedule whatever the service's
+response time, and measure latency from each request's *scheduled* start, so queueing in the
+service shows up in the percentiles instead of silently lowering the offered load.
+`dispatch_lag_ms` reports how far the load generator itself fell behind its schedule; if it
+is large the client, not the service, is the bottleneck. Closed-loop runs (`--concurrency`)
+keep a fixed number of requests in flight and measure maximum throughput instead.
+
+Usage (from src/ml-engine):
+    python benchmarks/loadtest.py --rate 20 [--duration 30] [--mix market_data=4,run_model=1]
+                                  [--workers 1] [--upstream-latency 0.05] [--poisson]
+    python benchmarks/loadtest.py --concurrency 8 [--duration 30]
+    python benchmarks/loadtest.py --rate 20 --url http://localhost:8000   # an already running service
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+ML_ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ML_ENGINE_DIR not in sys.path:
+    sys.path.insert(0, ML_ENGINE_DIR)
+
+from benchmarks.upstream import UpstreamStandIn  # noqa: E402
+
+DEFAULT_REQUESTS_FILE = os.path.join(ML_ENGINE_DIR, "http_requests", "main_app_endpoints.http")
+SERVICE_START_TIMEOUT_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class RequestTemplate:
+    """One request of the workload; `group` (the first path segment) is what `--mix` weights."""
+    method: str
+    path: str
+    headers: Tuple[Tuple[str, str], ...]
+    body: Optional[bytes]
+
+    @property
+    def route(self) -> str:
+        return f"{self.method} {self.path}"
+
+    @property
+    def group(self) -> str:
+        return self.path.strip("/").split("/", 1)[0]
+
+
+@dataclass(frozen=True)
+class Sample:
+    route: str
+    status: int  # 0 if the request failed without a response (timeout, connection error)
+    latency: float
+    dispatch_lag: float
+
+
+def parse_http_file(path: str) -> List[RequestTemplate]:
+    """
+    Parses the requests of a JetBrains/VS Code `.http` file: `@name = value` variables,
+    `###`-separated requests of a request line, headers, a blank line and an optional body.
+    The host in request URLs is dropped; requests are sent to the service under test.
+    """
+    with open(path, "r") as f:
+        text = f.read()
+    variables = dict(re.findall(r"^@(\w+)\s*=\s*(.*?)\s*$", text, flags=re.MULTILINE))
+    text = re.sub(r"\{\{(\w+)\}\}", lambda m: variables.get(m.group(1), m.group(0)), text)
+
+    templates = []
+    for block in re.split(r"^###.*$", text, flags=re.MULTILINE)[1:]:
+        lines = [line for line in block.strip("\n").splitlines() if not line.startswith(("#", "//"))]
+        if not lines:
+            continue
+        method, url = lines[0].split()[:2]
+        path = "/" + re.sub(r"^(https?://)?[^/]*/?", "", url)
+        headers, body_start = [], len(lines)
+        for n, line in enumerate(lines[1:], start=1):
+            if not line.strip():
+                body_start = n + 1
+                break
+            name, value = line.split(":", 1)
+            headers.append((name.strip(), value.strip()))
+        body = "\n".join(lines[body_start:]).strip()
+        templates.append(RequestTemplate(method.upper(), path, tuple(headers), body.encode() if body else None))
+    return templates
+
+
+def parse_mix(mix: str, templates: List[RequestTemplate]) -> List[float]:
+    """
+    Turns `group=weight,...` into one weight per template. A group's weight is shared equally
+    by its templates; groups not mentioned get weight 0. An empty mix weights templates equally.
+    """
+    if not mix:
+        return [1.0] * len(templates)
+    weights = {}
+    for item in mix.split(","):
+        group, weight = item.split("=")
+        weights[group.strip()] = float(weight)
+    groups = {template.group for template in templates}
+    unknown = set(weights) - groups
+    if unknown:
+        raise ValueError(f"Unknown request groups in mix: {sorted(unknown)}. Available: {sorted(groups)}")
+    sizes = {group: sum(t.group == group for t in templates) for group in groups}
+    return [weights.get(t.group, 0.0) / sizes[t.group] for t in templates]
+
+
+def arrival_offsets(rate: float, duration: float, poisson: bool = False, seed: int = 0) -> List[float]:
+    """Seconds after the start at which each request is due: evenly spaced, or a Poisson process."""
+    if not poisson:
+        return [n / rate for n in range(int(rate * duration))]
+    rng = np.random.default_rng(seed)
+    offsets = np.cumsum(rng.exponential(1 / rate, int(rate * duration * 1.5) + 10))
+    return offsets[offsets < duration].tolist()
+
+
+async def send(client: httpx.AsyncClient, template: RequestTemplate, scheduled: float, dispatched: float) -> Sample:
+    """Sends one request; latency runs from `scheduled` (perf_counter time) to the end of the response body."""
+    try:
+        response = await client.request(template.method, template.path, headers=dict(template.headers),
+                                        content=template.body)
+        status = response.status_code
+    except httpx.HTTPError:
+        status = 0
+    return Sample(template.route, status, time.perf_counter() - scheduled, dispatched - scheduled)
+
+
+async def run_open_loop(client: httpx.AsyncClient, templates: List[RequestTemplate], weights: List[float],
+                        rate: float, duration: float, poisson: bool = False, seed: int = 0) -> Tuple[List[Sample], float]:
+    """
+    Sends requests at `rate` per second for `duration` seconds without waiting for responses,
+    then waits for the stragglers. Returns the samples and the elapsed seconds.
+    """
+    offsets = arrival_offsets(rate, duration, poisson, seed)
+    chosen = random.Random(seed).choices(templates, weights=weights, k=len(offsets))
+    start = time.perf_counter()
+    tasks = []
+    for offset, template in zip(offsets, chosen):
+        scheduled = start + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(client, template, scheduled, time.perf_counter())))
+    samples = await asyncio.gather(*tasks)
+    return list(samples), time.perf_counter() - start
+
+
+async def run_closed_loop(client: httpx.AsyncClient, templates: List[RequestTemplate], weights: List[float],
+                          concurrency: int, duration: float, seed: int = 0) -> Tuple[List[Sample], float]:
+    """Keeps `concurrency` requests in flight for `duration` seconds. Returns the samples and the elapsed seconds."""
+    start = time.perf_counter()
+    deadline = start + duration
+    samples = []
+
+    async def worker(n):
+        rng = random.Random(seed + n)
+        while time.perf_counter() < deadline:
+            now = time.perf_counter()
+            samples.append(await send(client, rng.choices(templates, weights=weights)[0], now, now))
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def summarise(samples: List[Sample], elapsed: float) -> Dict[str, dict]:
+    """Per-route (and overall, under 'all') request counts, throughput, latency percentiles and errors."""
+    by_route: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        by_route.setdefault(sample.route, []).append(sample)
+    by_route["all"] = samples
+
+    summary = {}
+    for route, route_samples in sorted(by_route.items()):
+        if not route_samples:
+            continue
+        latencies = np.array([s.latency for s in route_samples]) * 1000
+        lags = np.array([s.dispatch_lag for s in route_samples]) * 1000
+        statuses: Dict[str, int] = {}
+        for sample in route_samples:
+            statuses[str(sample.status)] = statuses.get(str(sample.status), 0) + 1
+        errors = sum(1 for s in route_samples if s.status == 0 or s.status >= 400)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary[route] = {
+            "requests": len(route_samples),
+            "throughput_rps": round(len(route_samples) / elapsed, 3),
+            "error_rate": round(errors / len(route_samples), 4),
+            "statuses": statuses,
+            "latency_ms": {"p50": round(p50, 2), "p95": round(p95, 2), "p99": round(p99, 2),
+                           "max": round(float(latencies.max()), 2)},
+            "dispatch_lag_ms": {"p99": round(float(np.percentile(lags, 99)), 2), "max": round(float(lags.max()), 2)},
+        }
+    return summary
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve(upstream_url: str, workers: int, extra_env: Optional[dict] = None):
+    """Runs the service under uvicorn against `upstream_url` and yields its base URL once it answers."""
+    port = free_port()
+    env = dict(os.environ, VV_DEFILLAMA_YIELDS_URL=upstream_url, VV_DATA_SOURCE="live", **(extra_env or {}))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main_app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"], cwd=ML_ENGINE_DIR, env=env)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + SERVICE_START_TIMEOUT_SECONDS
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Service exited with status {process.returncode} during start-up")
+            try:
+                if httpx.get(f"{url}/market_data/symbols", timeout=5).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Service did not answer within {SERVICE_START_TIMEOUT_SECONDS}s")
+            time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def load(url: str, templates: List[RequestTemplate], weights: List[float], args) -> Tuple[List[Sample], float]:
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        for template in templates:  # warm-up: loads the model and fills the service's caches
+            await send(client, template, time.perf_counter(), time.perf_counter())
+        if args.rate:
+            return await run_open_loop(client, templates, weights, args.rate, args.duration, args.poisson, args.seed)
+        return await run_closed_loop(client, templates, weights, args.concurrency, args.duration, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--rate", type=float, help="open loop: requests per second")
+    mode.add_argument("--concurrency", type=int, help="closed loop: requests kept in flight")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--requests", default=DEFAULT_REQUESTS_FILE, help=".http file with the workload's requests")
+    parser.add_argument("--mix", default="", help="weights per path group, e.g. market_data=4,run_model=1")
+    parser.add_argument("--poisson", action="store_true", help="open loop: Poisson instead of evenly spaced arrivals")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="seconds the stand-in waits per response")
+    parser.add_argument("--days", type=int, default=400, help="history length served by the stand-in")
+    parser.add_argument("--url", help="load an already running service instead of starting one")
+    args = parser.parse_args()
+
+    templates = parse_http_file(args.requests)
+    weights = parse_mix(args.mix, templates)
+
+    with contextlib.ExitStack() as stack:
+        url = args.url
+        if url is None:
+            upstream = UpstreamStandIn(days=args.days, latency=args.upstream_latency).start()
+            stack.callback(upstream.stop)
+            url = stack.enter_context(serve(upstream.url, args.workers))
+        samples, elapsed = asyncio.run(load(url, templates, weights, args))
+
+    report = {
+        "mode": "open" if args.rate else "closed",
+        "offered_rps": args.rate,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "elapsed": round(elapsed, 3),
+        "workers": args.workers,
+        "routes": summarise(samples, elapsed),
+    }
+    for route, stats in report["routes"].items():
+        latency = stats["latency_ms"]
+        print(f"{route}: {stats['throughput_rps']:.1f} req/s, p50 {latency['p50']:.0f}ms, p95 {latency['p95']:.0f}ms, "
+              f"p99 {latency['p99']:.0f}ms, errors {stats['error_rate']:.1%}", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Stage-level benchmark of the model pipelines on synthetic universes.
+
+For every scenario (number of assets x history length x number of views) the model is run
+end to end (payload validation, decode, every tracked stage of the model, e.g.
+`BlPortfolioModel` and `BlExplicitReturnViewGenerator`, result serialisation) against
+synthetic APY/TVL histories. Views only apply to the Black-Litterman model.
+The median time per stage, and of the whole run, is reported and compared with the stored
+baseline; stages nested in others (e.g. `fetch` in `histories`) are reported on their own and
+count once, within their parent, towards the total. One more run
+is made with memory accounting (see `main_app.infrastructure.memory`), and its peak and
+retained bytes, in total and per stage, are compared as well. Exits with a non-zero status
+if any stage's time or peak memory regressed beyond its threshold.
+
+Market data is served from memory, so the `fetch` stage measures only the hand-off to the
+model, not the network.
+
+Usage (from src/ml-engine):
+    python benchmarks/pipeline.py [--model blacklitterman] [--assets 5,50,200] [--days 400]
+                                  [--views 10] [--repeat 3] [--threshold 0.25] [--memory-threshold 0.25]
+                                  [--update-baseline]
+    python benchmarks/pipeline.py --model hrp --assets 1000
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import statistics
+import sys
+import time
+import warnings
+
+ML_ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ML_ENGINE_DIR not in sys.path:
+    sys.path.insert(0, ML_ENGINE_DIR)
+
+from benchmarks.synthetic import synthetic_histories, synthetic_hrp_payload, synthetic_payload, \
+    synthetic_symbols  # noqa: E402
+from main_app.infrastructure.covariance import get_union_covariance  # noqa: E402
+from main_app.infrastructure.memory import MemoryAccount  # noqa: E402
+from main_app.infrastructure.metrics import REGISTRY, STAGE_LATENCY, track_stage  # noqa: E402
+from main_app.infrastructure.stage_graph import fingerprint, get_stage_cache  # noqa: E402
+from main_app.models.registry import MODEL_REGISTRY  # noqa: E402
+
+BASELINE_FILE = os.path.join(ML_ENGINE_DIR, "benchmarks", "baselines", "pipeline.json")
+MODEL_MODULES = {
+    "blacklitterman": "main_app.models.black_litterman.BlPortfolioModel",
+    "hrp": "main_app.models.hrp.HrpPortfolioModel",
+}
+# stage changes below this many seconds are noise, whatever the relative change
+MIN_REGRESSION_SECONDS = 0.002
+# and peak memory changes below this many bytes
+MIN_MEMORY_REGRESSION_BYTES = 1 << 20
+
+
+def scenario_name(assets: int, days: int, views: int, model: str = "blacklitterman") -> str:
+    if model == "blacklitterman":
+        return f"assets={assets},days={days},views={views}"
+    return f"model={model},assets={assets},days={days}"
+
+
+def model_payload(model: str, symbols: list, views: int) -> dict:
+    return synthetic_payload(symbols, views) if model == "blacklitterman" else synthetic_hrp_payload(symbols)
+
+
+@contextlib.contextmanager
+def synthetic_market_data(histories, model: str = "blacklitterman"):
+    """Serves the model's market data from `histories` instead of DefiLlama, versioned by their content."""
+    module = importlib.import_module(MODEL_MODULES[model])
+    original = module.get_historic_tvl_and_apy_from_symbol, module.history_version
+    # fingerprinted up front, so the timed runs only pay for a lookup, as for a shared panel's version
+    versions = {symbol: fingerprint(history) for symbol, history in histories.items()}
+    module.get_historic_tvl_and_apy_from_symbol = lambda symbol, *args, **kwargs: histories[symbol.upper()].copy()
+    module.history_version = lambda symbol: versions[symbol.upper()]
+    try:
+        yield
+    finally:
+        module.get_historic_tvl_and_apy_from_symbol, module.history_version = original
+
+
+def run_once(payload: dict, model: str = "blacklitterman") -> dict:
+    """
+    Runs the model once, with no memoised state, and returns the seconds of the whole run
+    ('total') and spent per 'component.stage' ('stages').
+    """
+    REGISTRY.reset()
+    get_stage_cache().clear()
+    get_union_covariance().clear()
+    start = time.perf_counter()
+    with track_stage("ModelEndpoint", "validate"):
+        MODEL_REGISTRY.validate(model, payload)
+    result = MODEL_REGISTRY.run(model, payload)
+    with track_stage("ModelEndpoint", "serialise"):
+        result.to_json()
+    total = time.perf_counter() - start
+    return {"total": total,
+            "stages": {f"{labels['component']}.{labels['stage']}": seconds
+                       for labels, _, seconds in STAGE_LATENCY.series()}}
+
+
+def measure_memory(payload: dict, model: str = "blacklitterman") -> dict:
+    """Runs the model once under memory accounting and returns its peak and retained bytes, in total and per stage."""
+    with MemoryAccount() as account:
+        run_once(payload, model)
+    report = account.report()
+    REGISTRY.reset()
+    return {"peak_bytes": report["peak_bytes"], "retained_bytes": report["retained_bytes"],
+            "stages": {stage: figures["peak_bytes"] for stage, figures in report["stages"].items()}}
+
+
+def measure_scenario(assets: int, days: int, views: int, repeat: int = 3, model: str = "blacklitterman") -> dict:
+    """
+    Returns the median seconds per stage (and in total) over `repeat` runs of one scenario, and
+    the memory of one more, accounted, run.
+
+    A warm-up run loads the model and primes imports before timing.
+    """
+    symbols = synthetic_symbols(assets)
+    payload = model_payload(model, symbols, views)
+    with synthetic_market_data(synthetic_histories(symbols, days), model):
+        run_once(payload, model)
+        samples = [run_once(payload, model) for _ in range(repeat)]
+        memory = measure_memory(payload, model)
+    REGISTRY.reset()
+    stages = {stage: statistics.median(sample["stages"].get(stage, 0.0) for sample in samples)
+              for stage in sorted(set().union(*(sample["stages"] for sample in samples)))}
+    return {"stages": stages, "total": statistics.median(sample["total"] for sample in samples),
+            "memory": memory}
+
+
+def compare(result: dict, baseline: dict, threshold: float, min_seconds: float = MIN_REGRESSION_SECONDS,
+            memory_threshold: float = 0.25, min_bytes: int = MIN_MEMORY_REGRESSION_BYTES) -> list:
+    """
+    Returns human-readable regressions: stages (or totals) slower than baseline * (1 + threshold)
+    by more than `min_seconds`, and stage (or total) peak memory above baseline * (1 + memory_threshold)
+    by more than `min_bytes`. Scenarios, stages or memory figures missing from the baseline are skipped.
+    """
+    regressions = []
+    for scenario, current in result["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        pairs = [(stage, seconds, previous["stages"].get(stage)) for stage, seconds in current["stages"].items()]
+        pairs.append(("total", current["total"], previous["total"]))
+        for stage, seconds, reference in pairs:
+            if reference is None:
+                continue
+            if seconds > reference * (1 + threshold) and seconds - reference > min_seconds:
+                regressions.append(f"{scenario} {stage}: {seconds:.4f}s vs baseline {reference:.4f}s")
+        memory, previous_memory = current.get("memory"), previous.get("memory")
+        if memory is None or previous_memory is None:
+            continue
+        pairs = [(stage, peak, previous_memory["stages"].get(stage)) for stage, peak in memory["stages"].items()]
+        pairs.append(("total", memory["peak_bytes"], previous_memory["peak_bytes"]))
+        for stage, peak, reference in pairs:
+            if reference is None:
+                continue
+            if peak > reference * (1 + memory_threshold) and peak - reference > min_bytes:
+                regressions.append(f"{scenario} {stage} peak memory: {peak / 2 ** 20:.1f} MiB "
+                                   f"vs baseline {reference / 2 ** 20:.1f} MiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="blacklitterman", choices=sorted(MODEL_MODULES))
+    parser.add_argument("--assets", default="5,50,200", help="comma-separated universe sizes (up to 2000)")
+    parser.add_argument("--days", default="400", help="comma-separated history lengths in days")
+    parser.add_argument("--views", default="10", help="comma-separated view counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative slowdown per stage against the baseline (0.25 = 25%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.25,
+                        help="allowed relative growth of peak memory per stage against the baseline")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", FutureWarning)
+
+    result = {"repeat": args.repeat, "scenarios": {}}
+    views_counts = list(map(int, args.views.split(","))) if args.model == "blacklitterman" else [0]
+    for assets in map(int, args.assets.split(",")):
+        for days in map(int, args.days.split(",")):
+            for views in views_counts:
+                name = scenario_name(assets, days, views, args.model)
+                result["scenarios"][name] = measure_scenario(assets, days, views, args.repeat, args.model)
+                print(f"{name}: {result['scenarios'][name]['total']:.4f}s, "
+                      f"peak {result['scenarios'][name]['memory']['peak_bytes'] / 2 ** 20:.1f} MiB", file=sys.stderr)
+    print(json.dumps(result, indent=2))
+
+    if args.update_baseline:
+        baseline = {"scenarios": {}}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE, "r") as f:
+                baseline = json.load(f)
+        baseline["repeat"] = args.repeat
+        baseline["scenarios"].update(result["scenarios"])
+        os.makedirs(os.path.dirname(BASELINE_FILE), exist_ok=True)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return
+
+    if not os.path.exists(BASELINE_FILE):
+        print("No baseline found; run with --update-baseline to record one.")
+        sys.exit(0)
+    with open(BASELINE_FILE, "r") as f:
+        regressions = compare(result, json.load(f), args.threshold, memory_threshold=args.memory_threshold)
+    for regression in regressions:
+        print(f"FAIL: {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
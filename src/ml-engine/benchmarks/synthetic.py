@@ -0,0 +1,94 @@
+"""
+Synthetic market data and model payloads for benchmarks and load tests.
+
+Histories have the shape of DefiLlama's `/chart/{pool}` series (ISO timestamps plus
+`tvlUsd`/`apy` columns) and are deterministic for a given symbol, so runs are comparable.
+"""
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+HISTORY_END = datetime(2025, 5, 1, 23, 1, 56, tzinfo=timezone.utc)
+
+
+def synthetic_symbols(count: int) -> List[str]:
+    return [f"SYN{n:04d}" for n in range(count)]
+
+
+def synthetic_history(symbol: str, days: int) -> pd.DataFrame:
+    """A random-walk APY/TVL history for a symbol, one observation per day ending at HISTORY_END."""
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    apy = np.clip(2 + 6 * rng.random() + np.cumsum(rng.normal(0, 0.1, days)), 0.5, None)
+    tvl = 10 ** rng.uniform(6, 9) * np.exp(np.cumsum(rng.normal(0, 0.01, days)))
+    timestamps = pd.date_range(end=HISTORY_END, periods=days, freq="D")
+    return pd.DataFrame({
+        "timestamp": timestamps.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "tvlUsd": tvl.astype(np.int64),
+        "apy": apy,
+        "apyBase": apy,
+        "apyReward": None,
+        "il7d": None,
+        "apyBase7d": None,
+    })
+
+
+def synthetic_histories(symbols: List[str], days: int) -> Dict[str, pd.DataFrame]:
+    return {symbol: synthetic_history(symbol, days) for symbol in symbols}
+
+
+def synthetic_pool(symbol: str, pool_id: str, days: int) -> dict:
+    """A `/pools` entry for a synthetic pool whose latest TVL/APY match `synthetic_history`."""
+    latest = synthetic_history(pool_id, days).iloc[-1]
+    return {
+        "chain": "Ethereum", "exposure": "single", "ilRisk": "no", "outlier": False, "pool": pool_id,
+        "predictions": {"predictedClass": None, "predictedProbability": None, "binnedConfidence": None},
+        "project": "synthetic", "stablecoin": False, "symbol": symbol, "apy": float(latest["apy"]),
+        "apyBase": float(latest["apy"]), "apyBase7d": None, "apyBaseInception": None, "apyMean30d": None,
+        "apyPct1D": None, "apyPct30D": None, "apyPct7D": None, "apyReward": None, "count": days, "il7d": None,
+        "mu": None, "poolMeta": None, "tvlUsd": int(latest["tvlUsd"]), "volumeUsd1d": None, "volumeUsd7d": None,
+        "sigma": None, "underlyingTokens": [], "rewardTokens": [],
+    }
+
+
+def synthetic_payload(symbols: List[str], views: int, seed: int = 0) -> dict:
+    """
+    A valid Black-Litterman payload over `symbols` with `views` explicit views.
+
+    Even views are absolute views on one asset; odd views are long/short relative views.
+    """
+    rng = np.random.default_rng(seed)
+    portfolio_views = []
+    for n in range(views):
+        weights = [0] * len(symbols)
+        weights[n % len(symbols)] = 1
+        if n % 2 and len(symbols) > 1:
+            weights[(n + 1) % len(symbols)] = -1
+        portfolio_views.append({
+            "Symbols": symbols,
+            "Weights": weights,
+            "ExpectedReturn": float(rng.uniform(-0.02, 0.08)),
+            "Confidence": float(rng.uniform(0.25, 0.75)),
+        })
+    return {
+        "Model": "BlackLitterman",
+        "Submodel": "ExplicitExcessReturnView-v0",
+        "AssetSymbols": symbols,
+        "ModelParameters": {"RiskAversion": 2.5, "UncertaintyInPrior": 0.05},
+        "RiskFreeRates": [{"term": "1Y", "rate": 0.0175}],
+        "PortfolioViews": portfolio_views,
+        "AssetStaticData": [{"Symbol": symbol} for symbol in symbols],
+    }
+
+
+def synthetic_hrp_payload(symbols: List[str], linkage_method: str = "single") -> dict:
+    """A valid Hierarchical Risk Parity payload over `symbols`."""
+    return {
+        "Model": "HierarchicalRiskParity",
+        "Submodel": "CorrelationDistance-v0",
+        "AssetSymbols": symbols,
+        "ModelParameters": {"LinkageMethod": linkage_method},
+        "AssetStaticData": [{"Symbol": symbol} for symbol in symbols],
+    }
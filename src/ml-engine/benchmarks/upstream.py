@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the DefiLlama yields API, used by the load-test harness.
+
+Serves `/pools` (one synthetic pool per pinned symbol, plus `--extra-pools` unpinned ones)
+and `/chart/{pool}` (a deterministic synthetic history per pool) over plain HTTP, with an
+optional fixed delay per response to mimic upstream latency. Point the service at it with
+`VV_DEFILLAMA_YIELDS_URL=http://127.0.0.1:<port>`.
+
+Usage (from src/ml-engine):
+    python benchmarks/upstream.py [--port 8100] [--days 400] [--latency 0.05] [--extra-pools 0]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ML_ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ML_ENGINE_DIR not in sys.path:
+    sys.path.insert(0, ML_ENGINE_DIR)
+
+from benchmarks.synthetic import synthetic_history, synthetic_pool  # noqa: E402
+from main_app.infrastructure.pool_resolver import PINNED_POOLS_FILE, load_json_map  # noqa: E402
+
+
+class UpstreamStandIn:
+    """
+    Threaded HTTP server answering DefiLlama yields requests from synthetic data.
+
+    Responses are rendered once per path and cached, so the stand-in costs little next to
+    the service under test. `requests` counts the responses served per endpoint.
+    """
+
+    def __init__(self, port: int = 0, days: int = 400, latency: float = 0.0, extra_pools: int = 0):
+        self.days = days
+        self.latency = latency
+        self.pinned = load_json_map(PINNED_POOLS_FILE)
+        self.extra_pools = extra_pools
+        self.requests = {"pools": 0, "chart": 0, "not_found": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "UpstreamStandIn":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="upstream-stand-in", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @lru_cache(maxsize=None)
+    def pools_body(self) -> bytes:
+        pools = [synthetic_pool(symbol, pool_id, self.days) for symbol, pool_id in self.pinned.items()]
+        pools += [synthetic_pool(f"LOAD{n:04d}", f"load-pool-{n:04d}", self.days) for n in range(self.extra_pools)]
+        return json.dumps({"status": "success", "data": pools}).encode()
+
+    @lru_cache(maxsize=4096)
+    def chart_body(self, pool_id: str) -> bytes:
+        history = synthetic_history(pool_id, self.days)
+        return json.dumps({"status": "success", "data": json.loads(history.to_json(orient="records"))}).encode()
+
+    def respond(self, path: str):
+        """Returns (status, endpoint, body) for a request path."""
+        path = path.split("?", 1)[0].rstrip("/")
+        if path == "/pools":
+            return 200, "pools", self.pools_body()
+        if path.startswith("/chart/"):
+            return 200, "chart", self.chart_body(path[len("/chart/"):])
+        return 404, "not_found", json.dumps({"message": "not found"}).encode()
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, endpoint, body = stand_in.respond(self.path)
+                with stand_in._lock:
+                    stand_in.requests[endpoint] += 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--days", type=int, default=400, help="history length served by /chart")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to delay every response")
+    parser.add_argument("--extra-pools", type=int, default=0, help="unpinned synthetic pools listed by /pools")
+    args = parser.parse_args()
+
+    stand_in = UpstreamStandIn(args.port, args.days, args.latency, args.extra_pools).start()
+    print(f"Serving DefiLlama stand-in at {stand_in.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stand_in.stop()
+
+
+if __name__ == "__main__":
+    main()
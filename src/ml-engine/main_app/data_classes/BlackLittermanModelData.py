@@ -3,11 +3,22 @@ from dataclasses_json import dataclass_json
 from typing import List, Optional
 
 
+@dataclass_json
+@dataclass
+class SignalWeight:
+    Signal: str
+    Weight: float
+    Horizon: Optional[int] = field(default=None)
+
+
 @dataclass_json
 @dataclass
 class ModelParameters:
     RiskAversion: Optional[float] = field(default=2.5)
     UncertaintyInPrior: Optional[float] = field(default=0.05)
+    Signals: Optional[List[SignalWeight]] = field(default=None)
+    RiskReport: Optional[bool] = field(default=False)
+    RiskConfidence: Optional[float] = field(default=0.95)
 
 
 @dataclass_json
@@ -52,5 +63,5 @@ class BlackLittermanModelData:
     AssetSymbols: List[str]
     ModelParameters: ModelParameters
     RiskFreeRates: Optional[List[RiskFreeRate]]
-    PortfolioViews: Optional[List[ExplicitReturnView]]
+    PortfolioViews: Optional[List[ExplicitReturnView]] = field(default=None)
     AssetStaticData: List[AssetStaticData] = field(default=None)
\ No newline at end of file
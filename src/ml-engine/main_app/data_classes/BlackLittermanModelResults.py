@@ -1,6 +1,6 @@
-from dataclasses import dataclass
-from dataclasses_json import dataclass_json
-from typing import List
+from dataclasses import dataclass, field
+from dataclasses_json import config, dataclass_json
+from typing import List, Optional
 
 
 @dataclass_json
@@ -24,11 +24,38 @@ class AllocationResult:
     weight: float
 
 
+@dataclass_json
+@dataclass
+class AssetRiskContribution:
+    asset: str
+    marginal: float
+    component: float
+    percent: float
+
+
+@dataclass_json
+@dataclass
+class RiskReport:
+    Confidence: float
+    Volatility: float
+    HistoricalVaR: float
+    HistoricalCVaR: float
+    ParametricVaR: float
+    ParametricCVaR: float
+    MaxDrawdown: float
+    CurrentDrawdown: float
+    MeanDrawdown: float
+    LongestDrawdownDays: int
+    RiskContributions: List[AssetRiskContribution]
+
+
 @dataclass_json
 @dataclass
 class ModelResult:
     Views: List[ViewResult]
     Allocations: List[AllocationResult]
+    # only present when requested with ModelParameters.RiskReport
+    Risk: Optional[RiskReport] = field(default=None, metadata=config(exclude=lambda risk: risk is None))
 
 
 @dataclass_json
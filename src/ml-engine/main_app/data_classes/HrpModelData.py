@@ -0,0 +1,23 @@
+from dataclasses import dataclass, field
+from dataclasses_json import dataclass_json
+from typing import List, Optional
+
+from main_app.data_classes.BlackLittermanModelData import AssetStaticData
+
+
+@dataclass_json
+@dataclass
+class HrpModelParameters:
+    LinkageMethod: Optional[str] = field(default="single")
+    RiskReport: Optional[bool] = field(default=False)
+    RiskConfidence: Optional[float] = field(default=0.95)
+
+
+@dataclass_json
+@dataclass
+class HrpModelData:
+    Model: str
+    Submodel: str
+    AssetSymbols: List[str]
+    ModelParameters: HrpModelParameters = field(default_factory=HrpModelParameters)
+    AssetStaticData: Optional[List[AssetStaticData]] = field(default=None)
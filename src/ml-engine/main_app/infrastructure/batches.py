@@ -0,0 +1,132 @@
+"""
+Batches of model runs answered in one round-trip.
+
+A `BatchRun` takes the payloads of one model and gives one outcome per payload, in order.
+Identical payloads (equal as JSON, whatever the key order) are run once and share their
+outcome. Before the first run, the history of every symbol requested anywhere in the batch
+is fetched concurrently, at most once each, and every run of the batch reads those frames
+(see `defi_llama.shared_market_data`). A payload that fails validation or whose run fails
+only fails its own outcome (mapped to a status by the caller's `fail`).
+
+The whole batch runs under the caller's one latency budget. Payloads are not started once it
+has run out, and those not finished by then are reported as 504s, next to the outcomes of
+the payloads that did finish.
+"""
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol, shared_market_data
+from main_app.infrastructure.metrics import REGISTRY, track_stage
+from main_app.infrastructure.resilience import current_budget
+
+BATCH_MAX_REQUESTS = int(os.environ.get("VV_BATCH_MAX_REQUESTS", "100"))
+BATCH_PREFETCH_WORKERS = int(os.environ.get("VV_BATCH_PREFETCH_WORKERS", "8"))
+
+BATCH_ITEMS = REGISTRY.counter("vv_batch_items_total", "Batched model requests by outcome.",
+                               labels=("model", "result"))
+
+_COMPONENT = "Batch"
+
+
+@dataclass
+class BatchOutcome:
+    """The outcome of one payload: `result` if it ran, else an HTTP `status` and an `error` message."""
+    status: int
+    result: Any = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        if self.error is not None:
+            return {"status": self.status, "error": self.error}
+        return {"status": self.status, "result": self.result}
+
+
+def payload_key(payload: Any) -> str:
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"))
+
+
+class BatchRun:
+    """
+    One batch's distinct payloads and their outcomes, which are filled in as the runs finish,
+    so the outcomes reached so far can be read while `run` is still going.
+
+    Args:
+        model_name: The model, for metrics.
+        payloads: The batch's payloads.
+    """
+
+    def __init__(self, model_name: str, payloads: Sequence[Any]):
+        self.model_name = model_name
+        self._keys = [payload_key(payload) for payload in payloads]
+        self._distinct = {key: payload for key, payload in zip(self._keys, payloads)}
+        self._outcomes: Dict[str, BatchOutcome] = {}
+        BATCH_ITEMS.inc(len(payloads) - len(self._distinct), model=model_name, result="deduplicated")
+
+    def run(self, run: Callable[[Any], Any], fail: Callable[[Exception], Optional[BatchOutcome]]):
+        """
+        Runs each distinct payload once, under the current latency budget, with the upstream
+        sources fetched once for the whole batch. No payload is started once the budget has
+        run out.
+
+        Args:
+            run: Validates and runs one payload, returning its (serialisable) result.
+            fail: Maps an exception raised by `run` to the payload's outcome, or None to re-raise it.
+        """
+        budget = current_budget()
+        with shared_market_data():
+            prefetch(_symbols(self._distinct.values()))
+            for key, payload in self._distinct.items():
+                if budget is not None and budget.expired:
+                    return
+                try:
+                    outcome = BatchOutcome(200, result=run(payload))
+                except Exception as e:
+                    outcome = fail(e)
+                    if outcome is None:
+                        raise
+                self._outcomes[key] = outcome
+                BATCH_ITEMS.inc(model=self.model_name, result="computed" if outcome.error is None else "failed")
+
+    def outcomes(self) -> List[BatchOutcome]:
+        """The outcomes in the order of the payloads; a 504 for each payload not run to the end."""
+        outcomes = dict(self._outcomes)
+        for key in self._distinct.keys() - outcomes.keys():
+            outcomes[key] = BatchOutcome(504, error="The batch's latency budget ran out before this payload was run")
+            BATCH_ITEMS.inc(model=self.model_name, result="expired")
+        return [outcomes[key] for key in self._keys]
+
+
+def prefetch(symbols: Sequence[str], workers: int = BATCH_PREFETCH_WORKERS):
+    """
+    Fetches the symbols' histories concurrently into the enclosing `shared_market_data` block.
+    Failures are left for the runs that need the symbol to report.
+    """
+    if not symbols:
+        return
+
+    def fetch(symbol):
+        try:
+            get_historic_tvl_and_apy_from_symbol(symbol)
+        except Exception:
+            pass
+
+    with track_stage(_COMPONENT, "prefetch"):
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(symbols)))) as pool:
+            # each task runs in its own copy of the caller's context, sharing its histories and budget
+            contexts = [contextvars.copy_context() for _ in symbols]
+            for _ in pool.map(lambda context, symbol: context.run(fetch, symbol), contexts, symbols):
+                pass
+
+
+def _symbols(payloads) -> List[str]:
+    symbols = {}
+    for payload in payloads:
+        asset_symbols = payload.get("AssetSymbols") if isinstance(payload, dict) else None
+        for symbol in asset_symbols if isinstance(asset_symbols, list) else []:
+            if isinstance(symbol, str):
+                symbols.setdefault(symbol.upper(), symbol)
+    return list(symbols.values())
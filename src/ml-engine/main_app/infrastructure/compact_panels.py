@@ -0,0 +1,175 @@
+"""
+Compact in-memory representation of pool histories and the per-asset panels built from them.
+
+Upstream frames carry ISO timestamp strings, `datetime.date` indexes and float64 columns.
+Here a day is an int32 count of days since the Unix epoch (UTC), values are stored as
+float32, and panels keep one contiguous column per asset (column-major), so a panel takes
+about half the memory of the equivalent DataFrame and resampling is plain array work.
+Values are promoted to float64 only when a panel is handed to the covariance and optimiser
+math through `Panel.to_frame`.
+"""
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+STORAGE_DTYPE = np.float32
+DAY_DTYPE = np.int32
+_NS_PER_DAY = 86_400 * 10 ** 9
+_EPOCH = date(1970, 1, 1)
+
+
+def epoch_days(timestamps) -> np.ndarray:
+    """Converts timestamps (ISO strings, datetimes or epoch nanoseconds) into UTC epoch days."""
+    if isinstance(timestamps, pd.Series) and pd.api.types.is_datetime64_any_dtype(timestamps.dtype):
+        # e.g. the mapped epoch nanoseconds of a shared panel: no parsing needed
+        return (timestamps.to_numpy(dtype="datetime64[ns]").view(np.int64) // _NS_PER_DAY).astype(DAY_DTYPE)
+    strings = np.asarray(timestamps)
+    if strings.dtype.kind in "OUS" and len(strings):
+        try:
+            # numpy parses ASCII bytes into dates about ten times faster than unicode strings
+            strings = strings.astype(bytes)
+        except (UnicodeEncodeError, TypeError, ValueError):
+            strings = None
+        if strings is not None and np.char.endswith(strings, b"Z").all():
+            # UTC ISO strings (DefiLlama's format): the date is the first 10 characters
+            return strings.astype("S10").astype("datetime64[D]").view(np.int64).astype(DAY_DTYPE)
+    values = pd.to_datetime(pd.Series(timestamps), utc=True, format="ISO8601")
+    return (values.to_numpy(dtype="datetime64[ns]").view(np.int64) // _NS_PER_DAY).astype(DAY_DTYPE)
+
+
+def days_to_dates(days: np.ndarray) -> List[date]:
+    return [_EPOCH + timedelta(days=int(day)) for day in days]
+
+
+def dates_to_days(dates: Sequence[date]) -> np.ndarray:
+    return np.fromiter(((d - _EPOCH).days for d in dates), dtype=DAY_DTYPE, count=len(dates))
+
+
+def _numeric(column: pd.Series) -> np.ndarray:
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind in "iuf":
+        return column.to_numpy().astype(np.float64, copy=False)
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        return column.to_numpy(dtype=np.float64, na_value=np.nan)
+    return pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _last_valid_per_day(days: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Groups rows by day and keeps each column's last non-NaN value of the day (NaN if none),
+    matching `DataFrame.groupby(...).last()`. Returns ascending unique days and their values.
+    """
+    if len(days) < 2 or (np.diff(days) > 0).all():
+        # already one row per day (DefiLlama's usual shape)
+        return days, np.asfortranarray(values, dtype=STORAGE_DTYPE)
+    order = np.argsort(days, kind="stable")
+    days, values = days[order], values[order]
+    unique_days, starts = np.unique(days, return_index=True)
+    group = np.repeat(np.arange(len(unique_days)), np.diff(np.append(starts, len(days))))
+
+    result = np.full((len(unique_days), values.shape[1]), np.nan, dtype=STORAGE_DTYPE, order="F")
+    for column in range(values.shape[1]):
+        valid = np.flatnonzero(~np.isnan(values[:, column]))
+        # rows are in day order, so the last valid row of a group is the last write for it
+        result[group[valid], column] = values[valid, column]
+    return unique_days, result
+
+
+@dataclass(frozen=True)
+class PoolHistory:
+    """A pool's daily history: one row per day (ascending), last observation of the day per column."""
+    days: np.ndarray
+    columns: List[str]
+    values: np.ndarray
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns: Sequence[str] = ("apy", "tvlUsd")) -> "PoolHistory":
+        """Compacts a DefiLlama `/chart/{pool}` frame (a `timestamp` column plus numeric columns)."""
+        columns = list(columns)
+        if df.empty:
+            return cls(np.empty(0, dtype=DAY_DTYPE), columns, np.empty((0, len(columns)), dtype=STORAGE_DTYPE))
+        values = np.column_stack([_numeric(df[column]) for column in columns])
+        days, values = _last_valid_per_day(epoch_days(df["timestamp"]), values)
+        return cls(days, columns, values)
+
+    def tail(self, days: int) -> "PoolHistory":
+        """The most recent `days` rows."""
+        return PoolHistory(self.days[-days:], self.columns, self.values[-days:])
+
+    def column(self, name: str) -> np.ndarray:
+        return self.values[:, self.columns.index(name)]
+
+    def to_frame(self) -> pd.DataFrame:
+        """The daily history as a float64 frame indexed by `datetime.date`, like `groupby(date).last()`."""
+        index = pd.Index(days_to_dates(self.days), name="timestamp")
+        return pd.DataFrame(self.values.astype(np.float64), index=index, columns=self.columns)
+
+    @property
+    def nbytes(self) -> int:
+        return self.days.nbytes + self.values.nbytes
+
+
+@dataclass(frozen=True)
+class Panel:
+    """
+    One field for several assets on a shared day index, newest day first.
+
+    `values` is (days x assets) float32 in column-major order, so each asset's series is contiguous.
+    """
+    days: np.ndarray
+    symbols: List[str]
+    values: np.ndarray
+
+    @classmethod
+    def align(cls, symbols: Sequence[str], histories: Sequence[PoolHistory], field: str, scale: float = 1.0,
+              max_days: int = 365) -> "Panel":
+        """
+        Builds a panel of `field` (multiplied by `scale`) from one history per symbol.
+
+        The day index is the first asset's latest `max_days` days; every asset contributes
+        its own latest `max_days` days aligned on that index, and gaps are filled from the
+        next older day. This matches the frames the model used to assemble column by column.
+        """
+        symbols = list(symbols)
+        if not histories:
+            return cls(np.empty(0, dtype=DAY_DTYPE), symbols, np.empty((0, len(symbols)), dtype=STORAGE_DTYPE))
+        index = histories[0].days[-max_days:][::-1].copy()
+        values = np.full((len(index), len(symbols)), np.nan, dtype=np.float64, order="F")
+        for n, history in enumerate(histories):
+            recent = history.tail(max_days)
+            position = np.searchsorted(recent.days, index)
+            found = position < len(recent.days)
+            found[found] = recent.days[position[found]] == index[found]
+            values[found, n] = recent.column(field)[position[found]] * scale
+        return cls(index, symbols, _backfill(values).astype(STORAGE_DTYPE, order="F"))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "Panel":
+        """Compacts a (date-indexed, one column per asset) frame."""
+        return cls(dates_to_days(list(df.index)), [str(c) for c in df.columns],
+                   np.asfortranarray(df.to_numpy(dtype=STORAGE_DTYPE)))
+
+    def to_frame(self) -> pd.DataFrame:
+        """The panel as a float64 frame indexed by `datetime.date`, one column per asset."""
+        return pd.DataFrame(self.values.astype(np.float64), index=days_to_dates(self.days), columns=self.symbols)
+
+    @property
+    def empty(self) -> bool:
+        return self.values.size == 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.days.nbytes + self.values.nbytes
+
+
+def _backfill(values: np.ndarray) -> np.ndarray:
+    """Fills each NaN with the next non-NaN value below it in the same column, like `DataFrame.bfill()`."""
+    rows = values.shape[0]
+    if rows == 0:
+        return values
+    source = np.where(np.isnan(values), rows, np.arange(rows)[:, None])
+    source = np.minimum.accumulate(source[::-1], axis=0)[::-1]
+    padded = np.vstack([values, np.full((1, values.shape[1]), np.nan)])
+    return np.take_along_axis(padded, source, axis=0)
@@ -0,0 +1,225 @@
+"""
+Covariance of daily APY returns over the union of the symbols requested so far.
+
+`UnionCovariance` keeps, for every active symbol, its daily return series on a shared
+calendar of the last `max_days` days, and per-pair sufficient statistics (observation
+counts, sums and cross products over the days both symbols have returns). A request's
+covariance is a k x k slice of those statistics, so requests over overlapping universes
+only pay for symbols whose history is new or has changed: loading one symbol costs
+O(days x active symbols), answering a request O(k^2).
+
+Each pair uses the days on which both symbols have observations (pairwise-complete), so
+symbols with shorter or later-starting histories do not truncate the others. Within a
+symbol's own history, missing days carry the previous observation forward, as the model
+panels do. Returns and annualisation follow `pypfopt.risk_models.sample_cov`, so for
+requests whose histories share the same days the result matches it exactly.
+
+At most `VV_COVARIANCE_MAX_SYMBOLS` symbols are kept; the least recently requested symbol
+gives up its slot when a new one arrives. `VV_UNION_COVARIANCE=0` makes the model compute
+its covariance per request instead.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from pypfopt.risk_models import fix_nonpositive_semidefinite
+
+from main_app.infrastructure.compact_panels import STORAGE_DTYPE, PoolHistory
+from main_app.infrastructure.metrics import record_cache_lookup, track_stage
+
+UNION_COVARIANCE_ENABLED = os.environ.get("VV_UNION_COVARIANCE", "1").lower() in ("1", "true", "yes")
+COVARIANCE_MAX_SYMBOLS = int(os.environ.get("VV_COVARIANCE_MAX_SYMBOLS", "1000"))
+
+_COMPONENT = "UnionCovariance"
+
+
+class UnionCovariance:
+    """
+    Args:
+        max_days: Length of the shared daily calendar, ending at the newest observed day.
+        frequency: Periods per year used to annualise (as `sample_cov`).
+        max_symbols: Symbols kept before the least recently requested one is replaced.
+        field: The `PoolHistory` column to use.
+        scale: Multiplier applied to the column (APY percentages to fractions).
+    """
+
+    def __init__(self, max_days: int = 365, frequency: int = 252, max_symbols: int = COVARIANCE_MAX_SYMBOLS,
+                 field: str = "apy", scale: float = 1 / 100):
+        self.max_days = max_days
+        self.frequency = frequency
+        self.max_symbols = max_symbols
+        self.field = field
+        self.scale = scale
+        self._lock = threading.Lock()
+        self._end_day: Optional[int] = None
+        self._slots: "OrderedDict[str, int]" = OrderedDict()  # least recently requested first
+        self._keys: Dict[str, str] = {}
+        self._series: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._allocate(0)
+
+    def _allocate(self, capacity: int):
+        rows = max(self.max_days - 1, 0)
+        self._centred = np.zeros((rows, capacity), order="F")  # returns minus their mean, 0 where missing
+        self._valid = np.zeros((rows, capacity), order="F")  # 1.0 where the return is observed
+        self._counts = np.zeros((capacity, capacity))  # days both symbols have returns
+        self._sums = np.zeros((capacity, capacity))  # [i, j]: sum of i's centred returns on those days
+        self._cross = np.zeros((capacity, capacity))  # sum of the products of centred returns on those days
+
+    def clear(self):
+        with self._lock:
+            self._end_day = None
+            self._slots.clear()
+            self._keys.clear()
+            self._series.clear()
+            self._allocate(0)
+
+    @property
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return list(self._slots)
+
+    def covariance(self, symbols: Sequence[str], histories: Sequence[PoolHistory],
+                   fix_psd: bool = True) -> pd.DataFrame:
+        """
+        Returns the annualised covariance of the symbols' daily returns, updating the union
+        with any symbol whose history is new or changed.
+
+        Args:
+            symbols: The request's symbols, in the order of the returned matrix.
+            histories: The daily history of each symbol.
+            fix_psd: Repair a matrix that is not positive semidefinite as `sample_cov` does.
+        """
+        series = {symbol: self._observations(history) for symbol, history in zip(symbols, histories)}
+        if len(series) > self.max_symbols:
+            # larger than the union may grow: compute this request on its own
+            standalone = UnionCovariance(self.max_days, self.frequency, len(series), self.field, self.scale)
+            return standalone.covariance(symbols, histories, fix_psd)
+        with self._lock:
+            newest = max((int(days[-1]) for days, _ in series.values() if len(days)), default=None)
+            if newest is not None and (self._end_day is None or newest > self._end_day):
+                with track_stage(_COMPONENT, "rebuild"):
+                    self._rebuild(newest, series)
+            else:
+                # the request's own symbols must not be the ones evicted to load the others
+                for symbol in series:
+                    if symbol in self._slots:
+                        self._slots.move_to_end(symbol)
+                for symbol, (days, values) in series.items():
+                    key = _series_key(days, values)
+                    record_cache_lookup("union_covariance", self._keys.get(symbol) == key)
+                    if self._keys.get(symbol) != key:
+                        with track_stage(_COMPONENT, "load_symbol"):
+                            self._load(symbol, days, values, key)
+            for symbol in symbols:
+                self._slots.move_to_end(symbol)
+            slots = [self._slots[symbol] for symbol in symbols]
+            with track_stage(_COMPONENT, "slice"):
+                matrix = self._slice(slots)
+        matrix = pd.DataFrame(matrix, index=list(symbols), columns=list(symbols))
+        return fix_nonpositive_semidefinite(matrix, "spectral") if fix_psd else matrix
+
+    def _observations(self, history: PoolHistory) -> Tuple[np.ndarray, np.ndarray]:
+        """The symbol's observed (day, value) pairs, scaled and rounded to panel precision."""
+        values = (history.column(self.field) * self.scale).astype(STORAGE_DTYPE)  # as `Panel.align` scales
+        observed = ~np.isnan(values)
+        return history.days[observed], values[observed].astype(np.float64)
+
+    def _grid_returns(self, days: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (centred returns with 0 where missing, observed mask) on the calendar, newest first."""
+        grid = self._end_day - np.arange(self.max_days)
+        position = np.searchsorted(days, grid, side="right") - 1
+        inside = (position >= 0) & (grid <= (days[-1] if len(days) else -1))
+        levels = np.full(self.max_days, np.nan)
+        levels[inside] = values[position[inside]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = levels[1:] / levels[:-1] - 1  # pct_change over newest-first rows, as the model panels
+        valid = np.isfinite(returns)
+        centred = np.where(valid, returns - (returns[valid].mean() if valid.any() else 0.0), 0.0)
+        return centred, valid.astype(np.float64)
+
+    def _load(self, symbol: str, days: np.ndarray, values: np.ndarray, key: str):
+        slot = self._slots.get(symbol)
+        if slot is None:
+            slot = self._free_slot()
+            self._slots[symbol] = slot
+        self._keys[symbol] = key
+        self._series[symbol] = (days, values)
+
+        x, m = self._grid_returns(days, values)
+        self._centred[:, slot], self._valid[:, slot] = x, m
+        counts, sums_self, sums_other, cross = m @ self._valid, x @ self._valid, m @ self._centred, x @ self._centred
+        self._counts[slot, :], self._counts[:, slot] = counts, counts
+        self._sums[slot, :], self._sums[:, slot] = sums_self, sums_other
+        self._cross[slot, :], self._cross[:, slot] = cross, cross
+
+    def _free_slot(self) -> int:
+        used = set(self._slots.values())
+        capacity = self._counts.shape[0]
+        if len(used) < capacity:
+            return min(set(range(capacity)) - used)
+        if capacity < self.max_symbols:
+            self._grow(min(max(2 * capacity, 16), self.max_symbols))
+            return capacity
+        evicted, slot = self._slots.popitem(last=False)
+        self._keys.pop(evicted, None)
+        self._series.pop(evicted, None)
+        self._centred[:, slot] = self._valid[:, slot] = 0.0
+        return slot
+
+    def _grow(self, capacity: int):
+        old = (self._centred, self._valid, self._counts, self._sums, self._cross)
+        size = old[2].shape[0]
+        self._allocate(capacity)
+        self._centred[:, :size], self._valid[:, :size] = old[0], old[1]
+        for target, source in zip((self._counts, self._sums, self._cross), old[2:]):
+            target[:size, :size] = source
+
+    def _rebuild(self, end_day: int, series: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        """Moves the calendar to end at `end_day` and reloads every kept symbol (request symbols last)."""
+        kept = [(s, self._series[s]) for s in self._slots if s not in series][-(self.max_symbols - len(series)):]
+        if len(series) >= self.max_symbols:
+            kept = []
+        self._end_day = end_day
+        self._slots.clear()
+        self._keys.clear()
+        self._series.clear()
+        loaded = kept + list(series.items())
+        self._allocate(min(max(16, len(loaded)), self.max_symbols))
+        for slot, (symbol, (days, values)) in enumerate(loaded):
+            self._slots[symbol] = slot
+            self._keys[symbol] = _series_key(days, values)
+            self._series[symbol] = (days, values)
+            self._centred[:, slot], self._valid[:, slot] = self._grid_returns(days, values)
+        # all pair statistics at once: a few matrix products instead of one update per symbol
+        n = len(loaded)
+        x, m = self._centred[:, :n], self._valid[:, :n]
+        self._counts[:n, :n], self._sums[:n, :n], self._cross[:n, :n] = m.T @ m, x.T @ m, x.T @ x
+
+    def _slice(self, slots: List[int]) -> np.ndarray:
+        index = np.ix_(slots, slots)
+        counts, sums, cross = self._counts[index], self._sums[index], self._cross[index]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariance = (cross - sums * sums.T / counts) / (counts - 1)
+        covariance[counts < 2] = np.nan
+        return covariance * self.frequency
+
+
+def _series_key(days: np.ndarray, values: np.ndarray) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(days.tobytes())
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+_service: Optional[UnionCovariance] = None
+
+
+def get_union_covariance() -> UnionCovariance:
+    global _service
+    if _service is None:
+        _service = UnionCovariance()
+    return _service
@@ -1,10 +1,34 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 from datetime import date, datetime
-from typing import List, Optional, Dict
+from typing import TYPE_CHECKING, Hashable, List, Optional, Dict
+
+import os
+import time
+
+import numpy as np
 
-import pandas as pd
 import requests
 
+from main_app.infrastructure.metrics import record_upstream_call
+from main_app.infrastructure.pool_resolver import PoolResolver
+from main_app.infrastructure.resilience import UpstreamError, fetch_or_stale, get_upstream_client
+from main_app.infrastructure.series_cache import MARKET_DATA_TTL_SECONDS
+from main_app.infrastructure.shared_panels import read_shared_pool_history, shared_pool_history_version
+from main_app.infrastructure.snapshots import open_snapshot
+
+if TYPE_CHECKING:
+    import pandas as pd  # imported where used, to keep it off the app's startup path
+
+# 'live' calls DefiLlama; 'snapshot' serves the pool summary and pool histories from the latest
+# snapshot written by scripts/update_defillama_integration.py
+DATA_SOURCE = os.environ.get("VV_DATA_SOURCE", "live").lower()
+SNAPSHOT_DATASET = "defillama"
+# base URLs of the DefiLlama APIs; overridden to point the service at a local stand-in (see benchmarks/loadtest.py)
+DEFILLAMA_YIELDS_URL = os.environ.get("VV_DEFILLAMA_YIELDS_URL", "https://yields.llama.fi").rstrip("/")
+DEFILLAMA_COINS_URL = os.environ.get("VV_DEFILLAMA_COINS_URL", "https://coins.llama.fi").rstrip("/")
+
 
 @dataclass
 class PoolPredictions:
@@ -45,75 +69,148 @@ class PoolData:
     rewardTokens: List[str] = field(default_factory=list)
 
 
+def _get(url: str, endpoint: str) -> requests.Response:
+    """
+    Issues a GET request to DefiLlama through the upstream client (deadline, hedging and
+    circuit breaker, see `resilience`).
+
+    Args:
+        url: The URL to request.
+        endpoint: A low-cardinality name for the endpoint, used as a metrics label.
+
+    Raises:
+        UpstreamError: If DefiLlama did not answer in time or its circuit is open.
+    """
+    return get_upstream_client().call(url, endpoint, lambda timeout: _send(url, endpoint, timeout))
+
+
+def _send(url: str, endpoint: str, timeout: float) -> requests.Response:
+    """Issues one GET request and records its latency, status and payload size."""
+    start = time.perf_counter()
+    status = 0
+    num_bytes = 0
+    try:
+        response = requests.get(url, timeout=timeout)
+        status = response.status_code
+        num_bytes = len(response.content)
+        return response
+    finally:
+        record_upstream_call(url, endpoint, status, num_bytes, time.perf_counter() - start)
+
+
 def get_pool_summary_data() -> Dict[str, List[PoolData]]:
-    url = f"https://yields.llama.fi/pools"
-    response = requests.get(url)
+    if DATA_SOURCE == "snapshot":
+        return pools_from_records(get_snapshot_pool_records())
+
+    url = f"{DEFILLAMA_YIELDS_URL}/pools"
+    return pools_from_records(fetch_or_stale(url, "pools", lambda: _pool_records(url)))
+
+
+def _pool_records(url: str) -> List[dict]:
+    response = _get(url, "pools")
     if response.status_code == 200:
         data = response.json()
         if data['status'] != "success":
-            raise Exception(f"Failed to get pool summary data: DefiLlama return status '{data['status']}'.")
-
-        pools = data['data']
-        result = {}
-        for pool in pools:
-            pool_data = PoolData(
-                chain = pool['chain'],
-                exposure = pool['exposure'],
-                ilRisk = pool['ilRisk'],
-                outlier = pool['outlier'],
-                pool = pool['pool'],
-                predictions = pool['predictions'],
-                project = pool['project'],
-                stableCoin = pool['stablecoin'],
-                symbol = pool['symbol'],
-                apy = pool['apy'],
-                apyBase = pool['apyBase'],
-                apyBase7d = pool['apyBase7d'],
-                apyBaseInception = pool['apyBaseInception'],
-                apyMean30d = pool['apyMean30d'],
-                apyPct1D = pool['apyPct1D'],
-                apyPct30D = pool['apyPct30D'],
-                apyPct7D = pool['apyPct7D'],
-                apyReward = pool['apyReward'],
-                count = pool['count'],
-                il7d = pool['il7d'],
-                mu = pool['mu'],
-                poolMeta = pool['poolMeta'],
-                tvlUsd = pool['tvlUsd'],
-                volumeUsd1d = pool['volumeUsd1d'],
-                volumeUsd7d = pool['volumeUsd7d'],
-                sigma = pool['sigma'],
-                underlyingTokens = pool['underlyingTokens'],
-                rewardTokens = pool['rewardTokens']
-            )
-
-            symbol = pool_data.symbol
-            if symbol in result:
-                result[symbol].append(pool_data)
-            else:
-                result[symbol] = [pool_data]
-
-        return result
+            raise UpstreamError(f"Failed to get pool summary data: DefiLlama return status '{data['status']}'.",
+                                response.status_code)
+
+        return data['data']
 
     else:
-        raise Exception(f"Failed to get pool summary data: {response.status_code} - {response.text}")
+        raise UpstreamError(f"Failed to get pool summary data: {response.status_code} - {response.text}",
+                            response.status_code)
+
+
+def pools_from_records(pools: List[dict]) -> Dict[str, List[PoolData]]:
+    result = {}
+    for pool in pools:
+        pool_data = PoolData(
+            chain = pool['chain'],
+            exposure = pool['exposure'],
+            ilRisk = pool['ilRisk'],
+            outlier = pool['outlier'],
+            pool = pool['pool'],
+            predictions = pool['predictions'],
+            project = pool['project'],
+            stableCoin = pool['stablecoin'],
+            symbol = pool['symbol'],
+            apy = pool['apy'],
+            apyBase = pool['apyBase'],
+            apyBase7d = pool['apyBase7d'],
+            apyBaseInception = pool['apyBaseInception'],
+            apyMean30d = pool['apyMean30d'],
+            apyPct1D = pool['apyPct1D'],
+            apyPct30D = pool['apyPct30D'],
+            apyPct7D = pool['apyPct7D'],
+            apyReward = pool['apyReward'],
+            count = pool['count'],
+            il7d = pool['il7d'],
+            mu = pool['mu'],
+            poolMeta = pool['poolMeta'],
+            tvlUsd = pool['tvlUsd'],
+            volumeUsd1d = pool['volumeUsd1d'],
+            volumeUsd7d = pool['volumeUsd7d'],
+            sigma = pool['sigma'],
+            underlyingTokens = pool['underlyingTokens'],
+            rewardTokens = pool['rewardTokens']
+        )
+
+        symbol = pool_data.symbol
+        if symbol in result:
+            result[symbol].append(pool_data)
+        else:
+            result[symbol] = [pool_data]
+
+    return result
+
+
+def get_snapshot_pool_records() -> List[dict]:
+    """Pool summary records from the snapshot, restricted to pools whose history the snapshot also holds."""
+    snapshot = open_snapshot(SNAPSHOT_DATASET)
+    charted = set(snapshot.dictionary("pool_charts", "pool"))
+    # one flag per dictionary entry plus a trailing False for missing ids (code -1)
+    keep = np.array([pool_id in charted for pool_id in snapshot.dictionary("yield_pools", "pool")] + [False])
+    return snapshot.records("yield_pools", np.flatnonzero(keep[snapshot.codes("yield_pools", "pool")]))
+
+
+def get_snapshot_pool_history(pool_id: str) -> "pd.DataFrame":
+    snapshot = open_snapshot(SNAPSHOT_DATASET)
+    code = snapshot.lookup("pool_charts", "pool", pool_id)
+    if code < 0:
+        raise Exception(f"Failed to get historic TVL and APY for {pool_id}: not in snapshot {snapshot.version}")
+    rows = np.flatnonzero(snapshot.codes("pool_charts", "pool") == code)
+    columns = [column for column in snapshot.manifest["tables"]["pool_charts"]["columns"] if column != "pool"]
+    return snapshot.table("pool_charts", rows, columns)
+
+
+_pool_resolver: Optional[PoolResolver] = None
+
+
+def get_pool_resolver() -> PoolResolver:
+    """Returns the process-wide symbol to pool resolver, built from the pool summary on first use."""
+    global _pool_resolver
+    if _pool_resolver is None:
+        _pool_resolver = PoolResolver(load_summary=get_pool_summary_data)
+    return _pool_resolver
 
 
 def get_pool_ids_from_symbol(symbol: str) -> List[str]:
-    summary = get_pool_summary_data()
-    # check case-insensitive
-    symbol_lower = symbol.lower()
-    summary_lower = {key.lower(): key for key in summary.keys()}
-    if symbol_lower not in summary_lower:
-        raise ValueError(f"Symbol '{symbol}' not found in pool summary data.")
-    original_key = summary_lower[symbol_lower]
-    ids = [p.pool for p in summary[original_key]]
-    return ids
-
-
-def get_historic_tvl_and_apy_from_pool_id(pool_id) -> pd.DataFrame:
-    url = f"https://yields.llama.fi/chart/{pool_id}"
-    response = requests.get(url)
+    # case-insensitive; pinned pool first, then by descending TVL
+    return get_pool_resolver().pool_ids(symbol)
+
+
+def get_historic_tvl_and_apy_from_pool_id(pool_id) -> "pd.DataFrame":
+    if DATA_SOURCE == "snapshot":
+        return get_snapshot_pool_history(pool_id)
+
+    # the last good series is served (and the request flagged stale) while DefiLlama is unavailable
+    url = f"{DEFILLAMA_YIELDS_URL}/chart/{pool_id}"
+    return fetch_or_stale(url, "chart", lambda: _pool_chart(pool_id, url))
+
+
+def _pool_chart(pool_id: str, url: str) -> "pd.DataFrame":
+    import pandas as pd
+    response = _get(url, "chart")
     if response.status_code == 200:
         data = response.json()
         time_series = data.get("data", [])
@@ -121,10 +218,11 @@ def get_historic_tvl_and_apy_from_pool_id(pool_id) -> pd.DataFrame:
 
         return df
     else:
-        raise Exception(f"Failed to get historic TVL and APY for {pool_id}: {response.status_code} - {response.text}")
+        raise UpstreamError(f"Failed to get historic TVL and APY for {pool_id}: {response.status_code} - "
+                            f"{response.text}", response.status_code)
 
 
-def get_historical_prices(coins: list[str], start_date: date, end_date: date) -> dict[str, pd.DataFrame]:
+def get_historical_prices(coins: list[str], start_date: date, end_date: date) -> dict[str, "pd.DataFrame"]:
     """
     Fetch daily historical prices from DeFiLlama's /chart/{coin} endpoint.
     
@@ -137,7 +235,8 @@ def get_historical_prices(coins: list[str], start_date: date, end_date: date) ->
         dict[str, pd.DataFrame]:
             Mapping from coin to a DataFrame with columns ['date', 'price'], one entry per calendar day.
     """
-    base_url = "https://coins.llama.fi/chart/"
+    import pandas as pd
+    base_url = f"{DEFILLAMA_COINS_URL}/chart/"
     result: dict[str, pd.DataFrame] = {}
 
     # Build UNIX timestamps at midnight UTC
@@ -150,7 +249,7 @@ def get_historical_prices(coins: list[str], start_date: date, end_date: date) ->
     for coin in coins:
         request = f"{base_url}{coin}?start={start_ts}&period=1d&span={span_days}"
         # request = f"{base_url}{coin}?start={start_ts}&end={end_ts}&span={span_days}&period=1d"
-        resp = requests.get(request)
+        resp = _get(request, "coins_chart")
         if resp.status_code != 200:
             print(f"Error fetching {coin}: {resp.status_code} - {resp.text}")
             continue
@@ -168,19 +267,52 @@ def get_historical_prices(coins: list[str], start_date: date, end_date: date) ->
     return result
 
 
-def get_historic_tvl_and_apy_from_symbol(symbol):
-    pool_map =  {
-                    "STETH": "747c1d2a-c668-4682-b9f9-296708a3dd90",
-                    "GHO": "ff2a68af-030c-4697-b0a1-b62a738eaef0",
-                    "USDC": "aa70268e-4b52-42bf-a116-608b370f9501",
-                    "WBTC": "d4b3c522-6127-4b89-bedf-83641cdcd2eb",
-                    "JITOSOL": "0e7d0722-9054-4907-8593-567b353c0900"
-                }
+_shared_histories: ContextVar[Optional[Dict]] = ContextVar("shared_histories", default=None)
+
+
+@contextmanager
+def shared_market_data():
+    """
+    Within the block, each symbol's history is fetched at most once and the frame is shared by
+    every caller (e.g. by the requests of a batch). Threads see the block's histories if they run
+    in a copy of its context.
+    """
+    token = _shared_histories.set({})
+    try:
+        yield
+    finally:
+        _shared_histories.reset(token)
+
+
+def history_version(symbol: str) -> Hashable:
+    """
+    A cheap version of a symbol's history, for keying what is computed from it without
+    fetching it: the shared panel's version, or without shared panels the current
+    `VV_MARKET_DATA_TTL_SECONDS` window (as `/market_data` serves it).
+    """
+    version = shared_pool_history_version(symbol.upper())
+    if version is not None:
+        return "panel", version
+    return "ttl", int(time.time() // MARKET_DATA_TTL_SECONDS)
+
 
+def get_historic_tvl_and_apy_from_symbol(symbol, use_shared_panels: bool = True):
+    resolver = get_pool_resolver()
     normalized_symbol = symbol.upper()
-    if normalized_symbol not in pool_map:
+    if not resolver.is_supported(normalized_symbol):
         raise ValueError(
-            f"Symbol '{symbol}' not found in pool mapping. Available symbols: " + ', '.join(pool_map.keys()))
+            f"Symbol '{symbol}' not found in pool mapping. Available symbols: " + ', '.join(resolver.supported_symbols()))
 
-    return get_historic_tvl_and_apy_from_pool_id(pool_map[normalized_symbol])
+    shared_histories = _shared_histories.get()
+    key = (normalized_symbol, use_shared_panels)
+    if shared_histories is not None and key in shared_histories:
+        return shared_histories[key]
 
+    history = None
+    if use_shared_panels:
+        history = read_shared_pool_history(normalized_symbol)
+    if history is None:
+        history = get_historic_tvl_and_apy_from_pool_id(resolver.primary_pool(normalized_symbol))
+    if shared_histories is not None:
+        shared_histories[key] = history
+    return history
@@ -0,0 +1,336 @@
+"""
+Incremental ingestion of the Goldsky vault subgraph (`src/goldsky/evm/schema.graphql`).
+
+`GoldskyIngestor` pages through `Vault`, `Transaction` and `PriceUpdate` entities in
+(cursor field, id) order, using the last stored cursor so later runs only fetch newer
+entities. Rows are buffered up to `chunk_rows` and flushed as columnar chunks (see
+`snapshots.write_table`) under `VV_GOLDSKY_STORE_DIR`, so memory stays bounded however many
+entities are ingested. A chunk only becomes visible once the entity's `cursor.json` that
+lists it has been atomically replaced; an interrupted run resumes from the last committed
+cursor and its unlisted chunks are discarded.
+
+Transactions and price updates are immutable and appended. Vaults are mutable, so every run
+upserts the changed vaults into a single chunk.
+
+`GoldskyStore` reads the chunks back as vault flow and price series.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from main_app.infrastructure.metrics import record_upstream_call, track_stage
+from main_app.infrastructure.snapshots import SNAPSHOT_DIR, ColumnarTable, write_table
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+GOLDSKY_SUBGRAPH_URL = os.environ.get("VV_GOLDSKY_SUBGRAPH_URL", "")
+GOLDSKY_STORE_DIR = os.environ.get("VV_GOLDSKY_STORE_DIR", os.path.join(SNAPSHOT_DIR, "goldsky"))
+GOLDSKY_PAGE_SIZE = int(os.environ.get("VV_GOLDSKY_PAGE_SIZE", "1000"))
+GOLDSKY_CHUNK_ROWS = int(os.environ.get("VV_GOLDSKY_CHUNK_ROWS", "100000"))
+GOLDSKY_TIMEOUT_SECONDS = float(os.environ.get("VV_GOLDSKY_TIMEOUT_SECONDS", "30"))
+# chunk readers (and their file mappings) kept open across reads, least recently used dropped first
+GOLDSKY_OPEN_CHUNKS = int(os.environ.get("VV_GOLDSKY_OPEN_CHUNKS", "64"))
+
+
+@dataclass(frozen=True)
+class EntitySpec:
+    """How one subgraph entity is queried, paged and normalised."""
+    name: str
+    collection: str
+    cursor_field: str
+    selection: str
+    integers: Tuple[str, ...] = ()
+    amounts: Tuple[str, ...] = ()
+    append_only: bool = True
+
+
+VAULTS = EntitySpec("vaults", "vaults", "updatedAt", "id owner totalValue createdAt updatedAt",
+                    integers=("createdAt", "updatedAt"), amounts=("totalValue",), append_only=False)
+TRANSACTIONS = EntitySpec("transactions", "transactions", "blockNumber",
+                          "id vault { id } from to amount timestamp transactionHash blockNumber type",
+                          integers=("timestamp", "blockNumber"), amounts=("amount",))
+PRICE_UPDATES = EntitySpec("price_updates", "priceUpdates", "blockNumber",
+                           "id vault { id } asset price timestamp transactionHash blockNumber",
+                           integers=("timestamp", "blockNumber"), amounts=("price",))
+ENTITIES = (VAULTS, TRANSACTIONS, PRICE_UPDATES)
+
+_QUERY = """
+query Page($cursor: BigInt!, $id: ID!, $first: Int!) {{
+  rows: {collection}(
+    first: $first, orderBy: {cursor_field}, orderDirection: asc,
+    where: {{ or: [{{ {cursor_field}_gt: $cursor }}, {{ {cursor_field}: $cursor, id_gt: $id }}] }}
+  ) {{ {selection} }}
+}}
+"""
+
+
+def normalise(spec: EntitySpec, row: dict) -> dict:
+    """Flattens relations to ids and converts BigInt strings (integers exactly, amounts to float)."""
+    record = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            value = value.get("id")
+        elif key in spec.integers and value is not None:
+            value = int(value)
+        elif key in spec.amounts and value is not None:
+            value = float(value)
+        record[key] = value
+    return record
+
+
+class GoldskyStore:
+    """
+    On-disk columnar store of ingested entities.
+
+    Layout: `<root>/<entity>/cursor.json` (committed cursor, chunk list, row count) and
+    `<root>/<entity>/<chunk>/` table directories.
+    """
+
+    def __init__(self, root: str = GOLDSKY_STORE_DIR, open_chunks: int = GOLDSKY_OPEN_CHUNKS):
+        self.root = root
+        self.open_chunks = open_chunks
+        self._readers: "OrderedDict[Tuple[str, str], ColumnarTable]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entity_dir(self, entity: str) -> str:
+        return os.path.join(self.root, entity)
+
+    def state(self, entity: str) -> dict:
+        try:
+            with open(os.path.join(self._entity_dir(entity), "cursor.json"), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"cursor": -1, "id": "", "chunks": [], "rows": 0}
+
+    def version(self, entity: str) -> Tuple[int, str, int]:
+        """Identifies the committed contents of an entity: (cursor, last id, rows)."""
+        state = self.state(entity)
+        return state["cursor"], state["id"], state["rows"]
+
+    def commit(self, entity: str, state: dict):
+        entity_dir = self._entity_dir(entity)
+        tmp_file = os.path.join(entity_dir, f".cursor.{os.getpid()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, os.path.join(entity_dir, "cursor.json"))
+
+    def write_chunk(self, entity: str, records: List[dict]) -> Tuple[str, dict]:
+        """Writes an uncommitted chunk; returns its name and table spec."""
+        entity_dir = self._entity_dir(entity)
+        os.makedirs(entity_dir, exist_ok=True)
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        staging = os.path.join(entity_dir, f".staging-{name}")
+        spec = write_table(staging, records)
+        with open(os.path.join(staging, "table.json"), "w") as f:
+            json.dump(spec, f)
+        os.rename(staging, os.path.join(entity_dir, name))
+        return name, spec
+
+    def remove_uncommitted(self, entity: str):
+        """Deletes chunks (and staging directories) that no committed cursor lists."""
+        entity_dir = self._entity_dir(entity)
+        if not os.path.isdir(entity_dir):
+            return
+        committed = set(self.state(entity)["chunks"])
+        for entry in os.listdir(entity_dir):
+            path = os.path.join(entity_dir, entry)
+            if os.path.isdir(path) and entry not in committed:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def chunks(self, entity: str) -> Iterator[ColumnarTable]:
+        """
+        Yields the committed chunks of an entity in ingestion order. Readers of chunks no longer
+        committed are dropped, and at most `open_chunks` readers are kept open.
+        """
+        names = self.state(entity)["chunks"]
+        committed = set(names)
+        with self._lock:
+            for key in [key for key in self._readers if key[0] == entity and key[1] not in committed]:
+                del self._readers[key]
+        for name in names:
+            yield self._reader(entity, name)
+
+    def _reader(self, entity: str, name: str) -> ColumnarTable:
+        key = (entity, name)
+        with self._lock:
+            reader = self._readers.get(key)
+            if reader is not None:
+                self._readers.move_to_end(key)
+                return reader
+        chunk_dir = os.path.join(self._entity_dir(entity), name)
+        with open(os.path.join(chunk_dir, "table.json"), "r") as f:
+            reader = ColumnarTable(chunk_dir, json.load(f))
+        with self._lock:
+            self._readers[key] = reader
+            while len(self._readers) > max(self.open_chunks, 0):
+                self._readers.popitem(last=False)
+        return reader
+
+    def frame(self, entity: str, columns: Optional[List[str]] = None) -> "pd.DataFrame":
+        import pandas as pd
+        frames = [chunk.frame(columns=columns) for chunk in self.chunks(entity) if chunk.rows]
+        if not frames:
+            return pd.DataFrame(columns=columns or [])
+        return pd.concat(frames, ignore_index=True)
+
+    def vault_flows(self, vault_id: Optional[str] = None, freq: str = "1D") -> "pd.DataFrame":
+        """
+        Deposits, withdrawals and net flow per vault and period.
+
+        Aggregates chunk by chunk, so only the per-period totals are held in memory.
+
+        Returns:
+            pd.DataFrame: Columns ['date', 'vault', 'deposits', 'withdrawals', 'net_flow'].
+        """
+        import pandas as pd
+        partials = []
+        for chunk in self.chunks(TRANSACTIONS.name):
+            if not chunk.rows:
+                continue
+            rows = None
+            if vault_id is not None:
+                code = chunk.lookup("vault", vault_id)
+                rows = np.flatnonzero(np.asarray(chunk.codes("vault")) == code) if code >= 0 else np.array([], int)
+            df = chunk.frame(rows, columns=["vault", "amount", "timestamp", "type"])
+            deposit = df["type"] == "deposit"
+            df["deposits"] = df["amount"].where(deposit, 0.0)
+            df["withdrawals"] = df["amount"].where(~deposit, 0.0)
+            df["date"] = pd.to_datetime(df["timestamp"], unit="s", utc=True).dt.floor(freq)
+            partials.append(df.groupby(["date", "vault"], as_index=False)[["deposits", "withdrawals"]].sum())
+        if not partials:
+            return pd.DataFrame(columns=["date", "vault", "deposits", "withdrawals", "net_flow"])
+        flows = pd.concat(partials).groupby(["date", "vault"], as_index=False).sum()
+        flows["net_flow"] = flows["deposits"] - flows["withdrawals"]
+        return flows.sort_values(["vault", "date"], ignore_index=True)
+
+    def price_series(self, asset: str, vault_id: Optional[str] = None, freq: str = "1D") -> "pd.DataFrame":
+        """
+        Last reported price of an asset per period.
+
+        Returns:
+            pd.DataFrame: Columns ['date', 'price'].
+        """
+        import pandas as pd
+        partials = []
+        for chunk in self.chunks(PRICE_UPDATES.name):
+            code = chunk.lookup("asset", asset) if chunk.rows else -1
+            if code < 0:
+                continue
+            mask = np.asarray(chunk.codes("asset")) == code
+            if vault_id is not None:
+                mask &= np.asarray(chunk.codes("vault")) == chunk.lookup("vault", vault_id)
+            partials.append(chunk.frame(np.flatnonzero(mask), columns=["price", "timestamp", "blockNumber"]))
+        if not partials:
+            return pd.DataFrame(columns=["date", "price"])
+        df = pd.concat(partials).sort_values(["blockNumber", "timestamp"], kind="stable")
+        df["date"] = pd.to_datetime(df["timestamp"], unit="s", utc=True).dt.floor(freq)
+        return df.groupby("date", as_index=False)["price"].last()
+
+
+class GoldskyIngestor:
+    """
+    Pages entities from a subgraph GraphQL endpoint into a `GoldskyStore`.
+
+    Args:
+        url: The subgraph's GraphQL endpoint.
+        store: Destination store.
+        page_size: Entities per GraphQL request (The Graph caps `first` at 1000).
+        chunk_rows: Rows buffered before a chunk is flushed and the cursor committed.
+        post: HTTP POST function, `requests.post` by default.
+    """
+
+    def __init__(self, url: str = GOLDSKY_SUBGRAPH_URL, store: Optional[GoldskyStore] = None,
+                 page_size: int = GOLDSKY_PAGE_SIZE, chunk_rows: int = GOLDSKY_CHUNK_ROWS,
+                 post: Callable = requests.post):
+        if not url:
+            raise ValueError("No subgraph URL configured; set VV_GOLDSKY_SUBGRAPH_URL")
+        self.url = url
+        self.store = store or get_goldsky_store()
+        self.page_size = page_size
+        self.chunk_rows = chunk_rows
+        self._post = post
+
+    def fetch_page(self, spec: EntitySpec, cursor: int, last_id: str) -> List[dict]:
+        query = _QUERY.format(collection=spec.collection, cursor_field=spec.cursor_field, selection=spec.selection)
+        variables = {"cursor": str(cursor), "id": last_id, "first": self.page_size}
+        start = time.perf_counter()
+        status, num_bytes = 0, 0
+        try:
+            response = self._post(self.url, json={"query": query, "variables": variables},
+                                  timeout=GOLDSKY_TIMEOUT_SECONDS)
+            status, num_bytes = response.status_code, len(response.content)
+        finally:
+            record_upstream_call(self.url, f"goldsky_{spec.name}", status, num_bytes, time.perf_counter() - start)
+        if response.status_code != 200:
+            raise Exception(f"Failed to query {spec.collection}: {response.status_code} - {response.text}")
+        body = response.json()
+        if body.get("errors"):
+            raise Exception(f"Failed to query {spec.collection}: {body['errors']}")
+        return body["data"]["rows"]
+
+    def sync(self, spec: EntitySpec) -> int:
+        """Ingests every entity newer than the committed cursor; returns the number of rows ingested."""
+        self.store.remove_uncommitted(spec.name)
+        state = self.store.state(spec.name)
+        buffer: List[dict] = []
+        ingested = 0
+
+        def flush():
+            nonlocal buffer
+            name, _ = self.store.write_chunk(spec.name, buffer)
+            state["chunks"].append(name)
+            state["rows"] += len(buffer)
+            self.store.commit(spec.name, state)
+            buffer = []
+
+        with track_stage("GoldskyIngestor", spec.name):
+            cursor, last_id = state["cursor"], state["id"]
+            while True:
+                page = self.fetch_page(spec, cursor, last_id)
+                if not page:
+                    break
+                buffer.extend(normalise(spec, row) for row in page)
+                cursor, last_id = int(page[-1][spec.cursor_field]), page[-1]["id"]
+                state["cursor"], state["id"] = cursor, last_id
+                ingested += len(page)
+                if spec.append_only and len(buffer) >= self.chunk_rows:
+                    flush()
+                if len(page) < self.page_size:
+                    break
+
+            if not spec.append_only and buffer:
+                # mutable entities: upsert the changed rows into the single latest chunk
+                current = {row["id"]: row for chunk in self.store.chunks(spec.name) for row in chunk.records()}
+                current.update((row["id"], row) for row in buffer)
+                buffer, previous_chunks = list(current.values()), state["chunks"]
+                state["chunks"], state["rows"] = [], 0
+                flush()
+                for name in previous_chunks:
+                    shutil.rmtree(os.path.join(self.store.root, spec.name, name), ignore_errors=True)
+            elif buffer:
+                flush()
+        return ingested
+
+    def sync_all(self) -> Dict[str, int]:
+        return {spec.name: self.sync(spec) for spec in ENTITIES}
+
+
+_store: Optional[GoldskyStore] = None
+
+
+def get_goldsky_store() -> GoldskyStore:
+    global _store
+    if _store is None:
+        _store = GoldskyStore()
+    return _store
+
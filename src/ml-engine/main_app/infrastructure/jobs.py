@@ -0,0 +1,364 @@
+"""
+Asynchronous jobs for long-running model work.
+
+`JobManager.submit` records a job in a `JobStore` and runs it on a thread pool; callers
+poll the store for status, progress events and the serialised result. Progress events
+are emitted for every tracked pipeline stage the job runs, and cancellation is
+cooperative: a cancelled job stops at its next stage boundary.
+
+The store is pluggable. `InMemoryJobStore` serves a single process; `SqliteJobStore`
+keeps jobs in a SQLite file so several uvicorn workers can share them. `create_job_store`
+picks one from a URL such as 'memory://' or 'sqlite:///var/lib/vv/jobs.db'.
+"""
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, List, Optional
+
+from main_app.infrastructure.metrics import REGISTRY, add_stage_listener, remove_stage_listener
+
+JOB_STORE_URL = os.environ.get("VV_JOB_STORE", "memory://")
+JOB_RESULT_TTL_SECONDS = float(os.environ.get("VV_JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_WORKERS = int(os.environ.get("VV_JOB_WORKERS", "2"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+JOBS_SUBMITTED = REGISTRY.counter("vv_jobs_submitted_total", "Jobs submitted.", labels=("kind",))
+JOBS_FINISHED = REGISTRY.counter("vv_jobs_finished_total", "Jobs finished by final status.", labels=("kind", "status"))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class JobEvent:
+    sequence: int
+    timestamp: float
+    event: str
+    data: Dict
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    expires_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[str] = None
+    cancel_requested: bool = False
+
+    def to_status(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "expires_at": self.expires_at,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    """Interface for job persistence. Implementations must be safe to call from several threads."""
+
+    def create(self, job: Job):
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields):
+        raise NotImplementedError
+
+    def append_event(self, job_id: str, event: str, data: Dict) -> int:
+        raise NotImplementedError
+
+    def events_since(self, job_id: str, sequence: int) -> List[JobEvent]:
+        """Returns the job's events with a sequence number greater than `sequence`."""
+        raise NotImplementedError
+
+    def purge_expired(self, now: float) -> int:
+        """Deletes finished jobs whose expiry time has passed and returns how many were removed."""
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._events: Dict[str, List[JobEvent]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: Job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._events[job.job_id] = []
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return replace(job) if job is not None else None
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+
+    def append_event(self, job_id: str, event: str, data: Dict) -> int:
+        with self._lock:
+            events = self._events.setdefault(job_id, [])
+            sequence = len(events) + 1
+            events.append(JobEvent(sequence, time.time(), event, data))
+            return sequence
+
+    def events_since(self, job_id: str, sequence: int) -> List[JobEvent]:
+        with self._lock:
+            return [e for e in self._events.get(job_id, []) if e.sequence > sequence]
+
+    def purge_expired(self, now: float) -> int:
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.expires_at is not None and job.expires_at <= now]
+            for job_id in expired:
+                del self._jobs[job_id]
+                self._events.pop(job_id, None)
+            return len(expired)
+
+
+class SqliteJobStore(JobStore):
+    """Job store backed by a SQLite database file, shareable between worker processes on one host."""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            expires_at REAL,
+            error TEXT,
+            result TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS job_events (
+            job_id TEXT NOT NULL,
+            sequence INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            event TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (job_id, sequence)
+        );
+    """
+    _COLUMNS = ("job_id", "kind", "status", "created_at", "updated_at", "expires_at", "error", "result",
+                "cancel_requested")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(self._SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, job: Job):
+        values = [getattr(job, column) for column in self._COLUMNS]
+        placeholders = ", ".join("?" for _ in self._COLUMNS)
+        self._connection().execute(f"INSERT INTO jobs ({', '.join(self._COLUMNS)}) VALUES ({placeholders})", values)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._connection().execute(
+            f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(**dict(zip(self._COLUMNS, row)))
+        job.cancel_requested = bool(job.cancel_requested)
+        return job
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        unknown = set(fields) - set(self._COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", [*fields.values(), job_id])
+
+    def append_event(self, job_id: str, event: str, data: Dict) -> int:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (sequence,) = conn.execute(
+                "SELECT COALESCE(MAX(sequence), 0) + 1 FROM job_events WHERE job_id = ?", (job_id,)).fetchone()
+            conn.execute("INSERT INTO job_events VALUES (?, ?, ?, ?, ?)",
+                         (job_id, sequence, time.time(), event, json.dumps(data)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return sequence
+
+    def events_since(self, job_id: str, sequence: int) -> List[JobEvent]:
+        rows = self._connection().execute(
+            "SELECT sequence, timestamp, event, data FROM job_events WHERE job_id = ? AND sequence > ? "
+            "ORDER BY sequence", (job_id, sequence)).fetchall()
+        return [JobEvent(seq, timestamp, event, json.loads(data)) for seq, timestamp, event, data in rows]
+
+    def purge_expired(self, now: float) -> int:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM job_events WHERE job_id IN "
+                         "(SELECT job_id FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?)", (now,))
+            removed = conn.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                                   (now,)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+
+def create_job_store(url: str) -> JobStore:
+    """
+    Creates a job store from a URL: 'memory://' or 'sqlite:///<path to database file>'.
+    """
+    if url.startswith("memory://"):
+        return InMemoryJobStore()
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SqliteJobStore(path)
+    raise ValueError(f"Unsupported job store '{url}'. Use 'memory://' or 'sqlite:///<path>'.")
+
+
+_current_job: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("vv_current_job", default=None)
+
+
+class JobManager:
+    """Runs submitted jobs on a thread pool and records their lifecycle in a JobStore."""
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, result_ttl: float = JOB_RESULT_TTL_SECONDS):
+        self.store = store
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vv-job")
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        add_stage_listener(self._on_stage)
+
+    def submit(self, kind: str, work: Callable[[], str]) -> Job:
+        """
+        Queues `work`, a callable returning the job's serialised (JSON) result.
+
+        Returns:
+            Job: The queued job.
+        """
+        self.store.purge_expired(time.time())
+        job = Job(job_id=uuid.uuid4().hex, kind=kind)
+        self.store.create(job)
+        self.store.append_event(job.job_id, "status", {"status": QUEUED})
+        JOBS_SUBMITTED.inc(kind=kind)
+        future = self._executor.submit(self._run, job.job_id, kind, work)
+        with self._lock:
+            self._futures[job.job_id] = future
+        future.add_done_callback(lambda _: self._forget(job.job_id))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self.store.get(job_id)
+        if job is not None and job.expires_at is not None and job.expires_at <= time.time():
+            return None
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Requests cancellation. Queued jobs are cancelled immediately; running jobs stop at
+        their next stage boundary. Finished jobs are left unchanged.
+        """
+        job = self.get(job_id)
+        if job is None or job.status in TERMINAL_STATUSES:
+            return job
+        self.store.update(job_id, cancel_requested=True)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self._finish(job_id, job.kind, CANCELLED)
+        return self.store.get(job_id)
+
+    def shutdown(self, wait: bool = True):
+        remove_stage_listener(self._on_stage)
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _forget(self, job_id: str):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _finish(self, job_id: str, kind: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        self.store.update(job_id, status=status, result=result, error=error,
+                          expires_at=time.time() + self.result_ttl)
+        self.store.append_event(job_id, "status", {"status": status, "error": error})
+        JOBS_FINISHED.inc(kind=kind, status=status)
+
+    def _run(self, job_id: str, kind: str, work: Callable[[], str]):
+        token = _current_job.set(job_id)
+        try:
+            if self.store.get(job_id).cancel_requested:
+                raise JobCancelled()
+            self.store.update(job_id, status=RUNNING)
+            self.store.append_event(job_id, "status", {"status": RUNNING})
+            result = work()
+            self._finish(job_id, kind, SUCCEEDED, result=result)
+        except JobCancelled:
+            self._finish(job_id, kind, CANCELLED)
+        except Exception as e:
+            self._finish(job_id, kind, FAILED, error=str(e))
+        finally:
+            _current_job.reset(token)
+
+    def _on_stage(self, component: str, stage: str):
+        job_id = _current_job.get()
+        if job_id is None:
+            return
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        if job.cancel_requested:
+            raise JobCancelled()
+        self.store.append_event(job_id, "progress", {"component": component, "stage": stage})
+
+
+_job_manager: Optional[JobManager] = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """Returns the process-wide job manager, creating it (and its store) on first use."""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager(create_job_store(JOB_STORE_URL))
+        return _job_manager
@@ -1,4 +1,4 @@
-from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_pool_id, get_historical_prices, get_pool_summary_data
+from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_pool_id, get_historical_prices, get_pool_ids_from_symbol
 import json
 import pandas as pd
 from typing import List, Dict
@@ -33,8 +33,7 @@ def get_historical_data_for_symbol(symbol: str, symbol_to_address_mapping: Dict[
 
     # If pools haven't been specified, load via DefiLlama pool summary
     if pools is None:
-        symbol_to_pools = get_pool_summary_data()
-        pools = [p.pool for p in symbol_to_pools[symbol]]
+        pools = get_pool_ids_from_symbol(symbol)
 
     # Get pool summary data and their corresponding historic TVL and APY
     tvl_apy_data = []
@@ -0,0 +1,378 @@
+"""
+Memory accounting and memory budgets for model requests.
+
+Accounting: a `MemoryAccount` measures the block it encloses and every tracked stage (see
+`metrics.track_stage`) run inside it on the same thread. It records the peak bytes allocated
+above the level at entry and the bytes still held at exit (retained). It reads the totals
+tracemalloc keeps, with one frame per trace, which slows allocations down, so model requests
+are only accounted when `VV_MEMORY_ACCOUNTING` is set (their peak is then returned in the
+`X-VV-Memory-Peak-Bytes` header). tracemalloc sees the whole process, so allocations of
+requests running concurrently count towards each other's figures. Its users share one count of
+users (`start_tracing`) and read peaks through frames (`open_peak_frame`), so none of them stops
+tracing or resets the peak under another.
+
+Budgets: before a model runs, its peak is estimated from the universe size and the expected
+history length with a per-model linear model (`MEMORY_MODELS`), fitted to accounted runs of the
+benchmark's synthetic universes. A request estimated above `VV_MEMORY_REQUEST_BUDGET_MB` is
+downgraded, by dropping optional work such as the risk report, until it fits. If it still
+does not fit, it is rejected. With `VV_MEMORY_PROCESS_BUDGET_MB` set, the estimates of the
+requests running in the process are also reserved against that budget. A request that would
+take the reservations past it is turned away with a retry hint, unless nothing else is running;
+background work (jobs, subscription recomputes) waits for the reservations to be released instead.
+"""
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from main_app.infrastructure.metrics import REGISTRY, add_stage_scope, remove_stage_scope, track_stage
+
+MEMORY_ACCOUNTING = os.environ.get("VV_MEMORY_ACCOUNTING", "0").lower() in ("1", "true", "yes")
+MEMORY_REQUEST_BUDGET_MB = float(os.environ.get("VV_MEMORY_REQUEST_BUDGET_MB", "1024"))
+MEMORY_PROCESS_BUDGET_MB = float(os.environ.get("VV_MEMORY_PROCESS_BUDGET_MB", "0"))
+# DefiLlama charts run back to each pool's launch; most tracked pools have a few years of days
+EXPECTED_HISTORY_DAYS = int(os.environ.get("VV_EXPECTED_HISTORY_DAYS", "1000"))
+MEMORY_RETRY_AFTER_SECONDS = float(os.environ.get("VV_MEMORY_RETRY_AFTER_SECONDS", "1"))
+
+MEMORY_PEAK_HEADER = "X-VV-Memory-Peak-Bytes"
+MEMORY_ESTIMATE_HEADER = "X-VV-Memory-Estimate-Bytes"
+MEMORY_DOWNGRADED_HEADER = "X-VV-Memory-Downgraded"
+
+_MB = 1024 ** 2
+MEMORY_BUCKETS = tuple(float(2 ** power) for power in range(16, 34, 2))  # 64 KiB .. 8 GiB
+
+STAGE_MEMORY_PEAK = REGISTRY.histogram(
+    "vv_stage_memory_peak_bytes", "Peak bytes allocated above the stage's starting level, for accounted requests.",
+    labels=("component", "stage"), buckets=MEMORY_BUCKETS)
+STAGE_MEMORY_RETAINED = REGISTRY.histogram(
+    "vv_stage_memory_retained_bytes", "Bytes allocated by the stage and still held when it ended, for accounted requests.",
+    labels=("component", "stage"), buckets=MEMORY_BUCKETS)
+REQUEST_MEMORY_PEAK = REGISTRY.histogram(
+    "vv_request_memory_peak_bytes", "Peak bytes allocated by accounted model requests.", labels=("model",),
+    buckets=MEMORY_BUCKETS)
+MEMORY_ADMISSIONS = REGISTRY.counter(
+    "vv_memory_admissions_total",
+    "Model requests by memory admission outcome: admitted, downgraded, rejected, deferred or queued.",
+    labels=("model", "result"))
+
+
+class MemoryBudgetExceeded(Exception):
+    """The request is estimated to need more memory than a single request may use."""
+
+    def __init__(self, message: str, estimate: int, budget: int):
+        super().__init__(message)
+        self.estimate = estimate
+        self.budget = budget
+
+
+class MemoryBusy(Exception):
+    """The request fits its own budget, but not next to the requests already running."""
+
+    def __init__(self, message: str, retry_after: float = MEMORY_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ---------------------------------------------------------------------------------------------
+# accounting
+
+@dataclass
+class StageMemory:
+    """Bytes of the runs of one stage: the largest peak and the retained bytes, summed over runs."""
+    peak_bytes: int = 0
+    retained_bytes: int = 0
+    runs: int = 0
+
+
+@dataclass
+class _Frame:
+    start: int
+    peak: int
+
+
+# tracemalloc is process-wide: its users (memory accounts and memory profiles) share one count of
+# users, and read peaks through frames rather than tracemalloc's single peak (see `open_peak_frame`)
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_started_tracing = False
+_open_frames: List[_Frame] = []
+
+
+def start_tracing(frames: int = 1):
+    """
+    Registers a user of tracemalloc, starting it (with `frames` frames per trace) for the first
+    user. Tracing already on keeps its own frame count. Each call is paired with `stop_tracing`.
+    """
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            _started_tracing = True
+        _tracing_users += 1
+
+
+def stop_tracing():
+    """Unregisters a user of tracemalloc, stopping it after the last user if it was started here."""
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _started_tracing and _tracing_users == 0:
+            # tracing started outside this module is left running
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def open_peak_frame() -> _Frame:
+    """
+    Starts measuring the peak from the current level. tracemalloc's peak is reset for the new
+    frame, so every frame already open first takes the highest level seen so far: a peak read
+    through `close_peak_frame` is not lowered by frames opened after it.
+    """
+    with _tracing_lock:
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in _open_frames:
+            frame.peak = max(frame.peak, peak)
+        tracemalloc.reset_peak()
+        frame = _Frame(current, current)
+        _open_frames.append(frame)
+        return frame
+
+
+def close_peak_frame(frame: _Frame) -> Tuple[int, int]:
+    """Closes the frame and returns its (peak, retained) bytes."""
+    with _tracing_lock:
+        current, peak = tracemalloc.get_traced_memory()
+        for open_frame in _open_frames:
+            open_frame.peak = max(open_frame.peak, peak)
+        _open_frames.remove(frame)
+        return max(frame.peak - frame.start, 0), current - frame.start
+
+
+class MemoryAccount:
+    """
+    Measures the enclosed block and the tracked stages it runs (see the module docstring).
+
+    Args:
+        model: The model accounted, for the request histogram (None: not recorded).
+    """
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+        self.peak_bytes = 0
+        self.retained_bytes = 0
+        self.stages: Dict[str, StageMemory] = {}
+        self._thread: Optional[int] = None
+        self._frame: Optional[_Frame] = None
+
+    def __enter__(self):
+        start_tracing()
+        self._thread = threading.get_ident()
+        add_stage_scope(self.stage)
+        self._frame = open_peak_frame()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.peak_bytes, self.retained_bytes = close_peak_frame(self._frame)
+        remove_stage_scope(self.stage)
+        stop_tracing()
+        if self.model is not None:
+            REQUEST_MEMORY_PEAK.observe(self.peak_bytes, model=self.model)
+        return False
+
+    @contextmanager
+    def stage(self, component: str, stage: str) -> Iterator[None]:
+        if threading.get_ident() != self._thread:
+            yield
+            return
+        frame = open_peak_frame()
+        try:
+            yield
+        finally:
+            peak, retained = close_peak_frame(frame)
+            STAGE_MEMORY_PEAK.observe(peak, component=component, stage=stage)
+            STAGE_MEMORY_RETAINED.observe(max(retained, 0), component=component, stage=stage)
+            entry = self.stages.setdefault(f"{component}.{stage}", StageMemory())
+            entry.peak_bytes = max(entry.peak_bytes, peak)
+            entry.retained_bytes += retained
+            entry.runs += 1
+
+    def report(self) -> Dict:
+        return {
+            "peak_bytes": self.peak_bytes,
+            "retained_bytes": self.retained_bytes,
+            "stages": {name: {"peak_bytes": stage.peak_bytes, "retained_bytes": stage.retained_bytes,
+                              "runs": stage.runs} for name, stage in sorted(self.stages.items())},
+        }
+
+
+# ---------------------------------------------------------------------------------------------
+# budgets
+
+@dataclass(frozen=True)
+class MemoryModel:
+    """
+    Peak bytes of a model run: `base + per_asset * n + per_asset_day * n * days + per_asset_pair * n^2`
+    for n assets with `days` days of history, plus the optional work's own terms.
+    """
+    base: float
+    per_asset: float
+    per_asset_day: float
+    per_asset_pair: float
+    optional: Dict[str, "MemoryModel"] = field(default_factory=dict)
+
+    def estimate(self, assets: int, days: int, options: Tuple[str, ...] = ()) -> int:
+        total = self.base + self.per_asset * assets + self.per_asset_day * assets * days \
+            + self.per_asset_pair * assets * assets
+        return int(ESTIMATE_MARGIN * total + sum(self.optional[option].estimate(assets, days) for option in options))
+
+
+@dataclass(frozen=True)
+class Downgrade:
+    """Optional work a payload can drop: whether it asks for it and the payload without it."""
+    name: str
+    requested: Callable[[Dict], bool]
+    drop: Callable[[Dict], Dict]
+
+
+def _parameter(name: str) -> Callable[[Dict], bool]:
+    return lambda payload: bool((payload.get("ModelParameters") or {}).get(name))
+
+
+def _without_parameter(name: str) -> Callable[[Dict], Dict]:
+    return lambda payload: {**payload, "ModelParameters": {**payload["ModelParameters"], name: False}}
+
+
+RISK_REPORT = Downgrade("risk_report", _parameter("RiskReport"), _without_parameter("RiskReport"))
+
+# fitted to accounted runs of benchmarks/pipeline.py's synthetic universes (10-200 assets for the
+# Black-Litterman model, 10-1000 for HRP; 100-1000 days); raised by ESTIMATE_MARGIN, which also covers
+# what tracemalloc does not see, such as the solvers' native buffers, they exceed every run
+ESTIMATE_MARGIN = 1.25
+MEMORY_MODELS: Dict[str, MemoryModel] = {
+    "blacklitterman": MemoryModel(base=2e5, per_asset=1.1e4, per_asset_day=55, per_asset_pair=110,
+                                  optional={RISK_REPORT.name: MemoryModel(1e5, 5e3, 0, 0)}),
+    "hrp": MemoryModel(base=5e4, per_asset=1.1e4, per_asset_day=68, per_asset_pair=48,
+                       optional={RISK_REPORT.name: MemoryModel(1e5, 5e3, 0, 0)}),
+}
+DOWNGRADES: Dict[str, Tuple[Downgrade, ...]] = {
+    "blacklitterman": (RISK_REPORT,),
+    "hrp": (RISK_REPORT,),
+}
+
+
+@dataclass(frozen=True)
+class MemoryPlan:
+    """The payload to run (downgraded if needed), its estimated peak and the work dropped."""
+    payload: Dict
+    estimate: int
+    downgrades: Tuple[str, ...] = ()
+
+
+class MemoryGovernor:
+    """
+    Plans and reserves the memory of model requests. Thread-safe.
+
+    Args:
+        request_budget_mb: The most a single request may be estimated to use (<= 0: unlimited).
+        process_budget_mb: The most the running requests may be estimated to use together (<= 0: unlimited).
+        history_days: The history length estimates assume for each asset.
+    """
+
+    def __init__(self, request_budget_mb: float = MEMORY_REQUEST_BUDGET_MB,
+                 process_budget_mb: float = MEMORY_PROCESS_BUDGET_MB, history_days: int = EXPECTED_HISTORY_DAYS):
+        self.request_budget = int(request_budget_mb * _MB)
+        self.process_budget = int(process_budget_mb * _MB)
+        self.history_days = history_days
+        self.reserved = 0
+        self._running = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def estimate(self, model_name: str, payload: Dict) -> int:
+        """The estimated peak bytes of a validated payload (0 for models without a memory model)."""
+        model_name = str(model_name).lower()
+        memory_model = MEMORY_MODELS.get(model_name)
+        if memory_model is None:
+            return 0
+        options = tuple(downgrade.name for downgrade in DOWNGRADES.get(model_name, ()) if downgrade.requested(payload))
+        return memory_model.estimate(len(payload.get("AssetSymbols") or ()), self.history_days, options)
+
+    def plan(self, model_name: str, payload: Dict) -> MemoryPlan:
+        """
+        Returns the payload to run within the request budget, dropping optional work if needed.
+
+        Raises:
+            MemoryBudgetExceeded: If even the downgraded payload is estimated above the budget.
+        """
+        model_name = str(model_name).lower()
+        estimate, dropped = self.estimate(model_name, payload), []
+        for downgrade in DOWNGRADES.get(model_name, ()):
+            if self.request_budget <= 0 or estimate <= self.request_budget:
+                break
+            if downgrade.requested(payload):
+                payload = downgrade.drop(payload)
+                dropped.append(downgrade.name)
+                estimate = self.estimate(model_name, payload)
+        if 0 < self.request_budget < estimate:
+            MEMORY_ADMISSIONS.inc(model=model_name, result="rejected")
+            assets = len(payload.get("AssetSymbols") or ())
+            raise MemoryBudgetExceeded(
+                f"A {model_name} run over {assets} assets is estimated to need {estimate / _MB:.0f} MB, "
+                f"more than the {self.request_budget / _MB:.0f} MB a request may use; request fewer assets",
+                estimate, self.request_budget)
+        MEMORY_ADMISSIONS.inc(model=model_name, result="downgraded" if dropped else "admitted")
+        return MemoryPlan(payload, estimate, tuple(dropped))
+
+    @contextmanager
+    def reserve(self, model_name: str, estimate: int, wait: bool = False) -> Iterator[None]:
+        """
+        Holds `estimate` bytes of the process budget while the block runs.
+
+        Args:
+            model_name: The model, for metrics.
+            estimate: The bytes to reserve.
+            wait: Wait until running requests have released enough of the budget, rather than
+                raise MemoryBusy. Each `VV_MEMORY_RETRY_AFTER_SECONDS` of waiting is a tracked
+                stage, so a cancelled job stops waiting there.
+
+        Raises:
+            MemoryBusy: If other requests hold too much of the process budget for this one to fit.
+        """
+        queued = False
+        while not self._admit(estimate):
+            if not wait:
+                MEMORY_ADMISSIONS.inc(model=str(model_name).lower(), result="deferred")
+                raise MemoryBusy(f"Running requests hold {self.reserved / _MB:.0f} MB of the "
+                                 f"{self.process_budget / _MB:.0f} MB memory budget; retry shortly")
+            if not queued:
+                MEMORY_ADMISSIONS.inc(model=str(model_name).lower(), result="queued")
+                queued = True
+            with track_stage("MemoryGovernor", "wait"), self._released:
+                self._released.wait(MEMORY_RETRY_AFTER_SECONDS)
+        try:
+            yield
+        finally:
+            with self._released:
+                self.reserved -= estimate
+                self._running -= 1
+                self._released.notify_all()
+
+    def _admit(self, estimate: int) -> bool:
+        with self._lock:
+            if 0 < self.process_budget < self.reserved + estimate and self._running:
+                return False
+            self.reserved += estimate
+            self._running += 1
+            return True
+
+
+_governor: Optional[MemoryGovernor] = None
+
+
+def get_memory_governor() -> MemoryGovernor:
+    global _governor
+    if _governor is None:
+        _governor = MemoryGovernor()
+    return _governor
@@ -0,0 +1,388 @@
+"""
+Lightweight, in-process metrics for the ml-engine service.
+
+Counters, gauges and histograms are kept in plain dictionaries guarded by a lock and
+rendered on demand in the Prometheus text exposition format, so recording a sample
+costs a dictionary lookup and a few additions. The module-level metrics below are the
+ones the service records; `render_metrics()` produces the body of the `/metrics` route.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Match
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def sum(self, **labels) -> float:
+        return self._sums.get(self._key(labels), 0.0)
+
+    def series(self) -> List[Tuple[Dict[str, str], int, float]]:
+        """Returns (labels, count, sum) for every label set observed so far."""
+        with self._lock:
+            return [(dict(zip(self.label_names, key)), sum(counts), self._sums[key])
+                    for key, counts in self._counts.items()]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._sums.clear()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Clear every recorded sample; the metric definitions are kept."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.histogram(
+    "vv_stage_duration_seconds", "Time spent in each pipeline stage.", labels=("component", "stage"))
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "vv_upstream_requests_total", "Calls made to upstream data providers.", labels=("host", "endpoint", "status"))
+UPSTREAM_BYTES = REGISTRY.counter(
+    "vv_upstream_response_bytes_total", "Response bytes received from upstream data providers.",
+    labels=("host", "endpoint"))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "vv_upstream_request_duration_seconds", "Latency of upstream data provider calls.", labels=("host", "endpoint"))
+UPSTREAM_EVENTS = REGISTRY.counter(
+    "vv_upstream_resilience_events_total",
+    "Upstream resilience events: hedge, timeout, error, circuit_open, budget_exhausted, stale_served.",
+    labels=("host", "endpoint", "event"))
+STAGE_RUNS = REGISTRY.counter(
+    "vv_stage_runs_total", "Memoised pipeline stages by outcome (computed or reused).",
+    labels=("component", "stage", "result"))
+CACHE_LOOKUPS = REGISTRY.counter(
+    "vv_cache_lookups_total", "Cache lookups by cache name and outcome (hit or miss).", labels=("cache", "result"))
+OPTIMISER_SOLVES = REGISTRY.counter(
+    "vv_optimiser_solves_total", "Portfolio optimisations by objective, backend and whether the backend was a fallback.",
+    labels=("objective", "backend", "fallback"))
+HTTP_REQUESTS = REGISTRY.counter(
+    "vv_http_requests_total", "HTTP requests served.", labels=("route", "method", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "vv_http_request_duration_seconds", "End-to-end latency of HTTP requests.", labels=("route", "method"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "vv_http_requests_in_flight", "HTTP requests currently being served.", labels=("route",))
+
+
+_stage_listeners: List[Callable[[str, str], None]] = []
+
+
+def add_stage_listener(listener: Callable[[str, str], None]):
+    """
+    Registers a callable invoked with (component, stage) whenever a tracked stage starts.
+
+    Listeners run on the thread executing the stage and may raise to abort it.
+    """
+    _stage_listeners.append(listener)
+
+
+def remove_stage_listener(listener: Callable[[str, str], None]):
+    _stage_listeners.remove(listener)
+
+
+_stage_scopes: List[Callable[[str, str], ContextManager]] = []
+
+
+def add_stage_scope(scope: Callable[[str, str], ContextManager]):
+    """
+    Registers a callable invoked with (component, stage) whenever a tracked stage starts; the
+    context manager it returns is entered around the stage.
+    """
+    _stage_scopes.append(scope)
+
+
+def remove_stage_scope(scope: Callable[[str, str], ContextManager]):
+    _stage_scopes.remove(scope)
+
+
+@contextmanager
+def track_stage(component: str, stage: str) -> Iterator[None]:
+    """
+    Records the wall-clock duration of the enclosed block in the stage latency histogram.
+
+    Args:
+        component: The component running the stage (e.g. 'BlPortfolioModel').
+        stage: The stage name (e.g. 'sample_cov').
+    """
+    for listener in _stage_listeners:
+        listener(component, stage)
+    with ExitStack() as scopes:
+        for scope in list(_stage_scopes):
+            scopes.enter_context(scope(component, stage))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            STAGE_LATENCY.observe(time.perf_counter() - start, component=component, stage=stage)
+
+
+def record_upstream_call(url: str, endpoint: str, status: int, num_bytes: int, duration: float):
+    """
+    Records a single upstream call: its outcome, payload size and latency.
+
+    Args:
+        url: The requested URL; only its host is used as a label.
+        endpoint: A low-cardinality name for the upstream endpoint (e.g. 'chart').
+        status: The HTTP status code, or 0 if the call failed without a response.
+        num_bytes: The size of the response body in bytes.
+        duration: The call latency in seconds.
+    """
+    host = urlparse(url).netloc
+    UPSTREAM_REQUESTS.inc(host=host, endpoint=endpoint, status=str(status))
+    UPSTREAM_BYTES.inc(num_bytes, host=host, endpoint=endpoint)
+    UPSTREAM_LATENCY.observe(duration, host=host, endpoint=endpoint)
+
+
+def record_upstream_event(url: str, endpoint: str, event: str):
+    UPSTREAM_EVENTS.inc(host=urlparse(url).netloc, endpoint=endpoint, event=event)
+
+
+def record_cache_lookup(cache: str, hit: bool, count: int = 1):
+    if count:
+        CACHE_LOOKUPS.inc(count, cache=cache, result="hit" if hit else "miss")
+
+
+def record_stage_run(component: str, stage: str, reused: bool):
+    STAGE_RUNS.inc(component=component, stage=stage, result="reused" if reused else "computed")
+
+
+def record_optimiser_solve(objective: str, backend: str, fallback: bool = False):
+    OPTIMISER_SOLVES.inc(objective=objective, backend=backend, fallback="true" if fallback else "false")
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request counts, latency and in-flight requests per route.
+
+    Requests are labelled with the route template (e.g. '/run_model/{model_name}') rather
+    than the concrete path so label cardinality stays bounded; unmatched paths are
+    grouped under 'unmatched'.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _route_template(self, scope) -> str:
+        router = scope.get("app")
+        for route in getattr(router, "routes", ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "unmatched")
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route_template(scope)
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(route=route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(route=route)
+            HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=method)
+            HTTP_REQUESTS.inc(route=route, method=method, status=str(status["code"]))
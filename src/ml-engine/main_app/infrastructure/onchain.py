@@ -0,0 +1,281 @@
+"""
+ERC-20 state read on-chain in batches through Multicall3.
+
+`MulticallReader.token_states` reads `totalSupply()`, `decimals()` and the balances of the
+tracked vaults for many tokens at once. The tokens are resolved from the symbol to contract
+address map and grouped by chain. Each chain's latest block number is read first (one
+`eth_blockNumber`). All of the chain's reads then go into `aggregate3` calls on the Multicall3
+contract at that block, up to `VV_MULTICALL_BATCH_CALLS` reads per call. A hundred tokens and
+a vault cost two RPC requests, not three hundred.
+
+Results are cached per (chain, block), so reads of a block already read cost no requests.
+Blocks are immutable, so the cache needs no expiry; only the `VV_ONCHAIN_CACHE_BLOCKS` most
+recently used blocks are kept. Reads that revert (e.g. a token without `decimals()`) come back
+as None and do not fail the batch.
+
+Each chain has one pooled HTTP session (`VV_RPC_URLS`, e.g.
+`ethereum=https://eth.example,base=https://base.example`). Its requests go through the
+upstream client, so they get deadlines, hedging and a circuit breaker per RPC host (see
+`resilience`).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import requests
+from eth_abi import decode, encode
+from requests.adapters import HTTPAdapter
+
+from main_app.infrastructure.metrics import record_cache_lookup, record_upstream_call, track_stage
+from main_app.infrastructure.pool_resolver import CONTRACT_ADDRESS_MAP_FILE, load_json_map
+from main_app.infrastructure.resilience import UpstreamError, get_upstream_client
+
+RPC_URLS = os.environ.get("VV_RPC_URLS", "")
+RPC_POOL_CONNECTIONS = int(os.environ.get("VV_RPC_POOL_CONNECTIONS", "8"))
+# Multicall3 is deployed at the same address on nearly every EVM chain
+MULTICALL3_ADDRESS = os.environ.get("VV_MULTICALL3_ADDRESS", "0xca11bde05977b3631167028862be2a173976ca11")
+MULTICALL_BATCH_CALLS = int(os.environ.get("VV_MULTICALL_BATCH_CALLS", "1000"))
+ONCHAIN_CACHE_BLOCKS = int(os.environ.get("VV_ONCHAIN_CACHE_BLOCKS", "16"))
+TRACKED_VAULTS = tuple(vault.strip().lower() for vault in os.environ.get("VV_TRACKED_VAULTS", "").split(",")
+                       if vault.strip())
+
+TOTAL_SUPPLY = bytes.fromhex("18160ddd")
+DECIMALS = bytes.fromhex("313ce567")
+BALANCE_OF = bytes.fromhex("70a08231")
+AGGREGATE3 = bytes.fromhex("82ad56cb")
+
+_COMPONENT = "MulticallReader"
+
+Call = Tuple[str, bytes]  # (target contract, call data)
+
+
+@dataclass(frozen=True)
+class TokenState:
+    """An ERC-20 token's supply, decimals and vault balances (raw units) at a block; None where the read reverted."""
+    symbol: str
+    chain: str
+    address: str
+    block: int
+    total_supply: Optional[int]
+    decimals: Optional[int]
+    balances: Dict[str, Optional[int]] = field(default_factory=dict)
+
+
+def parse_rpc_urls(setting: str) -> Dict[str, str]:
+    """Parses `chain=url` pairs separated by commas."""
+    urls = {}
+    for pair in setting.split(","):
+        if "=" in pair:
+            chain, url = pair.split("=", 1)
+            urls[chain.strip().lower()] = url.strip()
+    return urls
+
+
+def balance_of(holder: str) -> bytes:
+    return BALANCE_OF + encode(["address"], [holder])
+
+
+class RpcConnection:
+    """
+    JSON-RPC over one pooled HTTP session to a chain's node.
+
+    Args:
+        url: The node's JSON-RPC URL.
+        pool_connections: Connections kept open to the node.
+        session: The HTTP session (a new pooled one by default).
+    """
+
+    def __init__(self, url: str, pool_connections: int = RPC_POOL_CONNECTIONS,
+                 session: Optional[requests.Session] = None):
+        self.url = url
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_connections)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self._ids = count(1)
+
+    def request(self, method: str, params: list):
+        """
+        Returns the result of one JSON-RPC call.
+
+        Raises:
+            UpstreamError: If the node did not answer in time, answered with an HTTP error or
+                returned a JSON-RPC error.
+        """
+        body = {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": params}
+        response = get_upstream_client().call(self.url, method, lambda timeout: self._send(method, body, timeout))
+        if response.status_code != 200:
+            raise UpstreamError(f"RPC {method} to {self.url} failed with status {response.status_code}",
+                                response.status_code)
+        payload = response.json()
+        if payload.get("error"):
+            raise UpstreamError(f"RPC {method} to {self.url} failed: {payload['error']}")
+        return payload["result"]
+
+    def _send(self, method: str, body: dict, timeout: float) -> requests.Response:
+        start = time.perf_counter()
+        status = 0
+        num_bytes = 0
+        try:
+            response = self.session.post(self.url, json=body, timeout=timeout)
+            status = response.status_code
+            num_bytes = len(response.content)
+            return response
+        finally:
+            record_upstream_call(self.url, method, status, num_bytes, time.perf_counter() - start)
+
+
+class MulticallReader:
+    """
+    Batched, block-cached contract reads (see the module docstring). Thread-safe.
+
+    Args:
+        rpc_urls: Chain name (as in the contract address map) to JSON-RPC URL.
+        contract_addresses: Upper-cased symbol to 'chain:address' (or an 'Error: ...' marker).
+        multicall_address: The Multicall3 contract.
+        batch_calls: Reads per `aggregate3` call.
+        cache_blocks: (chain, block) results kept, least recently used dropped first.
+        connection_factory: Opens the connection to an RPC URL.
+    """
+
+    def __init__(self, rpc_urls: Optional[Mapping[str, str]] = None,
+                 contract_addresses: Optional[Mapping[str, str]] = None,
+                 multicall_address: str = MULTICALL3_ADDRESS, batch_calls: int = MULTICALL_BATCH_CALLS,
+                 cache_blocks: int = ONCHAIN_CACHE_BLOCKS, connection_factory=RpcConnection):
+        self.rpc_urls = dict(rpc_urls) if rpc_urls is not None else parse_rpc_urls(RPC_URLS)
+        self._contract_addresses = contract_addresses
+        self.multicall_address = multicall_address.lower()
+        self.batch_calls = max(1, batch_calls)
+        self.cache_blocks = cache_blocks
+        self._connection_factory = connection_factory
+        self._connections: Dict[str, RpcConnection] = {}
+        self._blocks: "OrderedDict[Tuple[str, int], Dict[Call, Tuple[bool, bytes]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+    def connection(self, chain: str) -> RpcConnection:
+        chain = chain.lower()
+        with self._lock:
+            if chain not in self._connections:
+                if chain not in self.rpc_urls:
+                    raise ValueError(f"No RPC endpoint configured for chain '{chain}'")
+                self._connections[chain] = self._connection_factory(self.rpc_urls[chain])
+            return self._connections[chain]
+
+    def block_number(self, chain: str) -> int:
+        return int(self.connection(chain).request("eth_blockNumber", []), 16)
+
+    def call(self, chain: str, calls: Sequence[Call], block: Optional[int] = None) -> Tuple[int, List[Tuple[bool, bytes]]]:
+        """
+        Returns the block read and each call's (success, return data), in the order of `calls`.
+
+        Args:
+            chain: The chain to read.
+            calls: (contract, call data) pairs.
+            block: The block to read at; the chain's latest block by default.
+        """
+        chain = chain.lower()
+        if block is None:
+            block = self.block_number(chain)
+        calls = [(target.lower(), data) for target, data in calls]
+        with self._lock:
+            cached = self._blocks.setdefault((chain, block), {})
+            self._blocks.move_to_end((chain, block))
+            missing = list(dict.fromkeys(call for call in calls if call not in cached))
+        record_cache_lookup("onchain_reads", True, len(calls) - len(missing))
+        record_cache_lookup("onchain_reads", False, len(missing))
+
+        results = {}
+        with track_stage(_COMPONENT, "multicall"):
+            for start in range(0, len(missing), self.batch_calls):
+                batch = missing[start:start + self.batch_calls]
+                results.update(zip(batch, self._aggregate(chain, batch, block)))
+        with self._lock:
+            cached = self._blocks.setdefault((chain, block), {})
+            cached.update(results)
+            answers = [cached[call] for call in calls]
+            while len(self._blocks) > self.cache_blocks:
+                self._blocks.popitem(last=False)
+        return block, answers
+
+    def _aggregate(self, chain: str, calls: Sequence[Call], block: int) -> List[Tuple[bool, bytes]]:
+        """One `aggregate3` eth_call of `calls`, each allowed to fail on its own."""
+        data = AGGREGATE3 + encode(["(address,bool,bytes)[]"], [[(target, True, data) for target, data in calls]])
+        result = self.connection(chain).request(
+            "eth_call", [{"to": self.multicall_address, "data": "0x" + data.hex()}, hex(block)])
+        (answers,) = decode(["(bool,bytes)[]"], bytes.fromhex(result.removeprefix("0x")))
+        if len(answers) != len(calls):
+            raise UpstreamError(f"Multicall on '{chain}' returned {len(answers)} results for {len(calls)} calls")
+        return [(bool(success), bytes(data)) for success, data in answers]
+
+    def token_states(self, symbols: Sequence[str], holders: Sequence[str] = TRACKED_VAULTS,
+                     blocks: Optional[Mapping[str, int]] = None) -> Dict[str, TokenState]:
+        """
+        Reads the supply, decimals and `holders`' balances of every token, batched per chain.
+
+        Args:
+            symbols: Token symbols of the contract address map.
+            holders: Addresses whose balances are read (the tracked vaults by default).
+            blocks: The block to read per chain; each chain's latest block by default.
+
+        Raises:
+            ValueError: If a symbol has no contract address or its chain has no RPC endpoint.
+        """
+        tokens = self._resolve(symbols)
+        holders = [holder.lower() for holder in holders]
+        by_chain = defaultdict(list)
+        for symbol, (chain, address) in tokens.items():
+            by_chain[chain].append((symbol, address))
+
+        states = {}
+        for chain, chain_tokens in by_chain.items():
+            calls = []
+            for _, address in chain_tokens:
+                calls += [(address, TOTAL_SUPPLY), (address, DECIMALS)] + [(address, balance_of(h)) for h in holders]
+            block, answers = self.call(chain, calls, (blocks or {}).get(chain))
+            width = 2 + len(holders)
+            for i, (symbol, address) in enumerate(chain_tokens):
+                values = [_uint(answer) for answer in answers[i * width:(i + 1) * width]]
+                states[symbol] = TokenState(symbol, chain, address, block, values[0], values[1],
+                                            dict(zip(holders, values[2:])))
+        return {symbol.upper(): states[symbol.upper()] for symbol in symbols}
+
+    def _resolve(self, symbols: Sequence[str]) -> Dict[str, Tuple[str, str]]:
+        if self._contract_addresses is None:
+            self._contract_addresses = load_json_map(CONTRACT_ADDRESS_MAP_FILE)
+        tokens, unknown = {}, []
+        for symbol in dict.fromkeys(symbol.upper() for symbol in symbols):
+            chain, _, address = self._contract_addresses.get(symbol, "").partition(":")
+            if not address.startswith("0x") or len(address) != 42:
+                unknown.append(symbol)
+            elif chain.lower() not in self.rpc_urls:
+                raise ValueError(f"No RPC endpoint configured for chain '{chain}' of '{symbol}'")
+            else:
+                tokens[symbol] = (chain.lower(), address.lower())
+        if unknown:
+            raise ValueError(f"No EVM contract address for {', '.join(unknown)}")
+        return tokens
+
+
+def _uint(answer: Tuple[bool, bytes]) -> Optional[int]:
+    success, data = answer
+    return int.from_bytes(data[:32], "big") if success and len(data) >= 32 else None
+
+
+_reader: Optional[MulticallReader] = None
+
+
+def get_multicall_reader() -> MulticallReader:
+    global _reader
+    if _reader is None:
+        _reader = MulticallReader()
+    return _reader
@@ -0,0 +1,195 @@
+"""
+Symbol to DefiLlama pool resolution.
+
+`PoolResolver` builds an index once from the DefiLlama pool summary and the static
+symbol to contract address map, then answers case-insensitive lookups from a symbol
+(optionally narrowed to a chain or project) to its pool ids ranked by TVL in O(1).
+Pinned pools from `static_data/pinned_pools.json` (or `VV_PINNED_POOLS_FILE`) always rank
+first and define a symbol's primary pool. The index is rebuilt in the background once it
+is older than `VV_POOL_RESOLVER_REFRESH_SECONDS`; lookups keep using the previous index
+until the new one is swapped in, so no request waits on a refresh.
+"""
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from main_app.infrastructure.metrics import track_stage
+
+STATIC_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                               "static_data")
+CONTRACT_ADDRESS_MAP_FILE = os.path.join(STATIC_DATA_DIR, "symbol_to_contract_address_map.json")
+PINNED_POOLS_FILE = os.environ.get("VV_PINNED_POOLS_FILE", os.path.join(STATIC_DATA_DIR, "pinned_pools.json"))
+POOL_RESOLVER_REFRESH_SECONDS = float(os.environ.get("VV_POOL_RESOLVER_REFRESH_SECONDS", "3600"))
+
+
+@dataclass(frozen=True)
+class PoolIndex:
+    """Immutable lookup tables; replaced wholesale on refresh."""
+    by_symbol: Dict[str, Tuple[str, ...]]
+    by_symbol_chain: Dict[Tuple[str, str], Tuple[str, ...]]
+    by_symbol_project: Dict[Tuple[str, str], Tuple[str, ...]]
+    contract_addresses: Dict[str, str]
+    symbols: Tuple[str, ...]
+    built_at: float
+
+
+def load_json_map(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return {str(key).upper(): value for key, value in json.load(f).items()}
+
+
+def build_pool_index(summary: Dict[str, list], contract_addresses: Dict[str, str],
+                     pinned: Dict[str, str]) -> PoolIndex:
+    """
+    Builds the lookup tables.
+
+    Args:
+        summary: Pool summary keyed by symbol, as returned by `get_pool_summary_data`.
+        contract_addresses: Upper-cased symbol to 'chain:address' (or an 'Error: ...' marker).
+        pinned: Upper-cased symbol to the pool id that must rank first.
+
+    A symbol is supported if it has a pinned pool, or if it has at least one pool and a
+    valid contract address.
+    """
+    ranked: Dict[str, List] = {}
+    for symbol, pools in summary.items():
+        ranked.setdefault(symbol.upper(), []).extend(pools)
+
+    def rank(pools: List, pin: Optional[str]) -> Tuple[str, ...]:
+        ordered = [p.pool for p in sorted(pools, key=lambda p: p.tvlUsd or 0, reverse=True)]
+        if pin is not None:
+            ordered = [pin] + [pool_id for pool_id in ordered if pool_id != pin]
+        return tuple(ordered)
+
+    valid_addresses = {symbol for symbol, address in contract_addresses.items() if "error" not in address.lower()}
+    supported = sorted(set(pinned) | (set(ranked) & valid_addresses))
+
+    by_symbol, by_chain, by_project = {}, {}, {}
+    for symbol in supported:
+        pools = ranked.get(symbol, [])
+        pin = pinned.get(symbol)
+        by_symbol[symbol] = rank(pools, pin)
+        for key_attr, table in (("chain", by_chain), ("project", by_project)):
+            groups: Dict[str, List] = {}
+            for pool in pools:
+                groups.setdefault(str(getattr(pool, key_attr)).lower(), []).append(pool)
+            for value, group in groups.items():
+                # a pin only applies within a chain/project group that contains it
+                table[(symbol, value)] = rank(group, pin if pin in {p.pool for p in group} else None)
+
+    return PoolIndex(by_symbol, by_chain, by_project, contract_addresses, tuple(supported), time.time())
+
+
+class PoolResolver:
+    """
+    Resolves symbols to ranked DefiLlama pool ids.
+
+    Args:
+        load_summary: Returns the pool summary keyed by symbol.
+        contract_address_file: JSON map of symbol to 'chain:address'.
+        pinned_pools_file: JSON map of symbol to pinned pool id.
+        refresh_interval: Seconds after which the index is rebuilt in the background.
+    """
+
+    def __init__(self, load_summary: Callable[[], Dict[str, list]],
+                 contract_address_file: str = CONTRACT_ADDRESS_MAP_FILE,
+                 pinned_pools_file: str = PINNED_POOLS_FILE,
+                 refresh_interval: float = POOL_RESOLVER_REFRESH_SECONDS):
+        self._load_summary = load_summary
+        self.contract_address_file = contract_address_file
+        self.pinned_pools_file = pinned_pools_file
+        self.refresh_interval = refresh_interval
+        self._index: Optional[PoolIndex] = None
+        self._build_lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self) -> PoolIndex:
+        """Rebuilds the index from the upstream summary and the static files, then swaps it in."""
+        pinned = load_json_map(self.pinned_pools_file)
+        contract_addresses = load_json_map(self.contract_address_file)
+        with track_stage("PoolResolver", "build_index"):
+            try:
+                summary = self._load_summary()
+                degraded = False
+            except Exception:
+                if self._index is not None:
+                    raise
+                # first build without upstream: serve the pinned pools only and retry on the next lookup
+                summary, degraded = {}, True
+            index = build_pool_index(summary, contract_addresses, pinned)
+            if degraded:
+                index = replace(index, built_at=0.0)
+        self._index = index
+        return index
+
+    def _current(self) -> PoolIndex:
+        index = self._index
+        if index is None:
+            with self._build_lock:
+                if self._index is None:
+                    self.refresh()
+                index = self._index
+        elif time.time() - index.built_at > self.refresh_interval:
+            self._refresh_in_background()
+        return index
+
+    def _refresh_in_background(self):
+        with self._build_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                pass  # keep serving the previous index; the next lookup retries
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="vv-pool-resolver-refresh", daemon=True).start()
+
+    def supported_symbols(self) -> List[str]:
+        return list(self._current().symbols)
+
+    def is_supported(self, symbol: str) -> bool:
+        return symbol.upper() in self._current().by_symbol
+
+    def pool_ids(self, symbol: str, chain: Optional[str] = None, project: Optional[str] = None) -> List[str]:
+        """
+        Returns the symbol's pool ids, pinned pool first and the rest by descending TVL.
+
+        Raises:
+            ValueError: If the symbol is not supported.
+        """
+        index = self._current()
+        key = symbol.upper()
+        if key not in index.by_symbol:
+            raise ValueError(f"Symbol '{symbol}' not found in pool summary data.")
+        if chain is not None and project is not None:
+            by_project = set(index.by_symbol_project.get((key, project.lower()), ()))
+            return [pool_id for pool_id in index.by_symbol_chain.get((key, chain.lower()), ())
+                    if pool_id in by_project]
+        if chain is not None:
+            return list(index.by_symbol_chain.get((key, chain.lower()), ()))
+        if project is not None:
+            return list(index.by_symbol_project.get((key, project.lower()), ()))
+        return list(index.by_symbol[key])
+
+    def primary_pool(self, symbol: str) -> str:
+        """
+        Raises:
+            ValueError: If the symbol is not supported or has no pools.
+        """
+        pool_ids = self.pool_ids(symbol)
+        if not pool_ids:
+            raise ValueError(f"Symbol '{symbol}' has no pools.")
+        return pool_ids[0]
+
+    def contract_address(self, symbol: str) -> Optional[str]:
+        return self._current().contract_addresses.get(symbol.upper())
@@ -0,0 +1,261 @@
+"""
+Opt-in profiling of individual requests.
+
+A request is profiled only when it carries the profiling header (or `profile` query
+parameter) together with a token matching `VV_PROFILING_TOKEN`; every other request
+pays a single dictionary lookup. Profiles are stored server-side and referenced from
+the response through the `X-VV-Profile-Id` header. They can be downloaded from
+`/profiles/{profile_id}` as folded stacks (flame-graph compatible), a text report or,
+for CPU profiles, the raw pstats dump.
+"""
+import cProfile
+import hmac
+import io
+import marshal
+import os
+import pstats
+import tempfile
+import tracemalloc
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+
+from main_app.infrastructure.memory import close_peak_frame, open_peak_frame, start_tracing, stop_tracing
+
+PROFILING_TOKEN = os.environ.get("VV_PROFILING_TOKEN", "")
+PROFILE_DIR = os.environ.get("VV_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "vv-profiles"))
+PROFILE_RETENTION = int(os.environ.get("VV_PROFILE_RETENTION", "50"))
+
+PROFILE_HEADER = "x-vv-profile"
+PROFILE_QUERY_PARAM = "profile"
+PROFILE_TOKEN_HEADER = "x-vv-profile-token"
+PROFILE_ID_HEADER = "X-VV-Profile-Id"
+
+CPU_MODE = "cpu"
+MEMORY_MODE = "memory"
+PROFILE_MODES = (CPU_MODE, MEMORY_MODE)
+
+TRACEMALLOC_FRAMES = 32
+TEXT_REPORT_LINES = 50
+MAX_STACK_DEPTH = 64
+# subtrees attributed less time than this are folded into their parent frame
+MIN_STACK_SECONDS = 1e-4
+
+
+class ProfilingNotAuthorised(Exception):
+    pass
+
+
+def _frame_name(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name.strip("<>")
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def folded_stacks_from_stats(stats: pstats.Stats) -> List[str]:
+    """
+    Converts cProfile statistics into folded stacks ('a;b;c <microseconds>').
+
+    cProfile records caller/callee edges rather than full stacks, so each edge's share of
+    the callee's cumulative time is propagated down from the root functions. The result
+    is the usual approximation used by pstats-based flame-graph tools. Subtrees worth
+    less than MIN_STACK_SECONDS are cut off, which keeps the number of distinct paths
+    bounded by the profiled duration.
+    """
+    entries = stats.stats  # func -> (cc, nc, tt, ct, callers)
+    callees: Dict[tuple, List[tuple]] = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller in callers:
+            callees.setdefault(caller, []).append(func)
+
+    folded: Dict[str, float] = {}
+
+    def walk(func, stack: List[str], fraction: float):
+        _, _, tt, ct, _ = entries[func]
+        stack = stack + [_frame_name(func)]
+        key = ";".join(stack)
+        folded[key] = folded.get(key, 0.0) + tt * fraction
+        if len(stack) >= MAX_STACK_DEPTH or ct * fraction < MIN_STACK_SECONDS:
+            return
+        for callee in callees.get(func, ()):
+            if _frame_name(callee) in stack:
+                continue  # recursion; its time is already part of this frame's subtree
+            edge_ct = entries[callee][4][func][3]
+            callee_ct = entries[callee][3]
+            if callee_ct > 0 and fraction * edge_ct >= MIN_STACK_SECONDS:
+                walk(callee, stack, fraction * edge_ct / callee_ct)
+
+    roots = [func for func, (_, _, _, _, callers) in entries.items() if not callers]
+    for root in roots:
+        walk(root, [], 1.0)
+
+    return [f"{stack} {int(round(seconds * 1e6))}" for stack, seconds in folded.items() if seconds * 1e6 >= 1]
+
+
+def folded_stacks_from_snapshot(snapshot: tracemalloc.Snapshot) -> List[str]:
+    """Converts a tracemalloc snapshot into folded stacks weighted by allocated bytes."""
+    lines = []
+    for stat in snapshot.statistics("traceback"):
+        # tracemalloc tracebacks are most-recent-call-first; folded stacks are root-first
+        frames = [f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in reversed(stat.traceback)]
+        lines.append(f"{';'.join(frames)} {stat.size}")
+    return lines
+
+
+class ProfileStore:
+    """Stores profile artifacts on disk, keeping only the most recent `retention` profiles."""
+
+    def __init__(self, directory: str = PROFILE_DIR, retention: int = PROFILE_RETENTION):
+        self.directory = directory
+        self.retention = retention
+
+    def _path(self, profile_id: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def save(self, artifacts: Dict[str, bytes]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = uuid.uuid4().hex
+        for extension, content in artifacts.items():
+            tmp_path = self._path(profile_id, extension) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, self._path(profile_id, extension))
+        self._prune()
+        return profile_id
+
+    def load(self, profile_id: str, extension: str) -> Optional[bytes]:
+        # profile ids are uuid4 hex strings; reject anything else before touching the filesystem
+        if len(profile_id) != 32 or not all(c in "0123456789abcdef" for c in profile_id):
+            return None
+        path = self._path(profile_id, extension)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _prune(self):
+        profiles: Dict[str, float] = {}
+        for name in os.listdir(self.directory):
+            profile_id = name.split(".", 1)[0]
+            mtime = os.path.getmtime(os.path.join(self.directory, name))
+            profiles[profile_id] = max(profiles.get(profile_id, 0.0), mtime)
+        stale = sorted(profiles, key=profiles.get, reverse=True)[self.retention:]
+        for name in os.listdir(self.directory):
+            if name.split(".", 1)[0] in stale:
+                os.remove(os.path.join(self.directory, name))
+
+
+PROFILE_STORE = ProfileStore()
+
+
+class ProfilingSession:
+    """
+    Profiles the code run inside its `with` block.
+
+    In 'cpu' mode a cProfile profiler is enabled; in 'memory' mode tracemalloc records
+    allocation tracebacks and the peak traced memory above the level at entry. Tracing is
+    shared with other memory profiles and memory accounts (see `memory.start_tracing`); if
+    one of them started it, tracebacks keep its frame count.
+    """
+
+    def __init__(self, mode: str):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unsupported profiling mode '{mode}'. Supported modes: {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self._profiler: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._peak_bytes = 0
+        self._frame = None
+
+    def __enter__(self):
+        if self.mode == CPU_MODE:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            start_tracing(TRACEMALLOC_FRAMES)
+            self._frame = open_peak_frame()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.mode == CPU_MODE:
+            self._profiler.disable()
+        else:
+            try:
+                self._snapshot = tracemalloc.take_snapshot()
+                self._peak_bytes, _ = close_peak_frame(self._frame)
+            finally:
+                stop_tracing()
+        return False
+
+    def artifacts(self) -> Dict[str, bytes]:
+        if self.mode == CPU_MODE:
+            stats = pstats.Stats(self._profiler)
+            report = io.StringIO()
+            pstats.Stats(self._profiler, stream=report).sort_stats("cumulative").print_stats(TEXT_REPORT_LINES)
+            return {
+                "folded": "\n".join(folded_stacks_from_stats(stats)).encode(),
+                "txt": report.getvalue().encode(),
+                # same layout as cProfile.Profile.dump_stats, loadable by pstats/snakeviz
+                "pstats": marshal.dumps(self._profiler.stats),
+            }
+
+        report = [f"Peak traced memory above the level at entry: {self._peak_bytes} bytes", ""]
+        report.extend(str(stat) for stat in self._snapshot.statistics("lineno")[:TEXT_REPORT_LINES])
+        return {
+            "folded": "\n".join(folded_stacks_from_snapshot(self._snapshot)).encode(),
+            "txt": "\n".join(report).encode(),
+        }
+
+
+def _is_authorised(token: Optional[str]) -> bool:
+    return bool(PROFILING_TOKEN) and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def profiling_session(request: Request) -> Optional[ProfilingSession]:
+    """
+    Returns a profiling session if the request asked for one, otherwise None.
+
+    Raises:
+        ProfilingNotAuthorised: If profiling was requested without a valid token.
+        ValueError: If the requested profiling mode is not supported.
+    """
+    mode = request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY_PARAM)
+    if not mode:
+        return None
+    if not _is_authorised(request.headers.get(PROFILE_TOKEN_HEADER)):
+        raise ProfilingNotAuthorised("Profiling requires a valid profiling token")
+    return ProfilingSession(mode.lower())
+
+
+def attach_profile(response: Response, session: Optional[ProfilingSession],
+                   store: ProfileStore = None) -> Response:
+    """Saves the session's artifacts (if any) and adds a reference to them to the response headers."""
+    if session is None:
+        return response
+    profile_id = (store or PROFILE_STORE).save(session.artifacts())
+    response.headers[PROFILE_ID_HEADER] = profile_id
+    response.headers["Link"] = f'</profiles/{profile_id}>; rel="profile"'
+    return response
+
+
+PROFILE_FORMATS = {"folded": "folded", "text": "txt", "pstats": "pstats"}
+
+
+async def profiles_endpoint(request: Request) -> Response:
+    if not _is_authorised(request.headers.get(PROFILE_TOKEN_HEADER)):
+        return JSONResponse({"error": "Profiling requires a valid profiling token"}, status_code=403)
+
+    profile_format = request.query_params.get("format", "folded")
+    if profile_format not in PROFILE_FORMATS:
+        return JSONResponse({"error": f"Unsupported format. Supported formats: {', '.join(PROFILE_FORMATS)}"},
+                            status_code=400)
+
+    content = PROFILE_STORE.load(request.path_params["profile_id"], PROFILE_FORMATS[profile_format])
+    if content is None:
+        return JSONResponse({"error": "Profile not found"}, status_code=404)
+    if profile_format == "pstats":
+        return Response(content, media_type="application/octet-stream")
+    return PlainTextResponse(content.decode())
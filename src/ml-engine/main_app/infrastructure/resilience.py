@@ -0,0 +1,406 @@
+"""
+Tail-latency protection for upstream HTTP calls.
+
+`UpstreamClient.call` runs one upstream GET with:
+
+- a deadline: each attempt may take `VV_UPSTREAM_TIMEOUT_SECONDS`, cut to what the enclosing
+  `latency_budget` leaves for upstream calls, so no request waits on upstreams past its budget;
+- hedging: if the attempt has not answered after the endpoint's recent p95 latency (and at
+  least `VV_UPSTREAM_HEDGE_AFTER_SECONDS`), one duplicate is sent and the first answer wins;
+- a circuit breaker per host: after `VV_BREAKER_FAILURES` consecutive failures (timeouts,
+  connection errors, 5xx and 429 responses) calls fail fast for `VV_BREAKER_RESET_SECONDS`,
+  after which a single trial call decides whether the circuit closes again. A call that timed
+  out only because the request's budget cut its deadline short is not held against the host.
+
+`fetch_or_stale` keeps the last good value fetched from each upstream URL and serves it when
+the upstream is unavailable, recording the URL in the current budget's `stale` list so the
+endpoint can flag its response.
+
+A `latency_budget` also bounds the work between upstream calls: once it has run out, the next
+tracked pipeline stage raises `DeadlineExceeded`.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from main_app.infrastructure.metrics import add_stage_listener, record_upstream_event
+
+UPSTREAM_TIMEOUT_SECONDS = float(os.environ.get("VV_UPSTREAM_TIMEOUT_SECONDS", "10"))
+UPSTREAM_HEDGE_AFTER_SECONDS = float(os.environ.get("VV_UPSTREAM_HEDGE_AFTER_SECONDS", "0.2"))
+UPSTREAM_HEDGING_ENABLED = os.environ.get("VV_UPSTREAM_HEDGING", "1").lower() in ("1", "true", "yes")
+UPSTREAM_WORKERS = int(os.environ.get("VV_UPSTREAM_WORKERS", "16"))
+BREAKER_FAILURES = int(os.environ.get("VV_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("VV_BREAKER_RESET_SECONDS", "30"))
+STALE_CACHE_ENTRIES = int(os.environ.get("VV_STALE_CACHE_ENTRIES", "256"))
+# hard budget of a /run_model request, and the part of it kept back for the model once data is in
+MODEL_LATENCY_BUDGET_SECONDS = float(os.environ.get("VV_MODEL_LATENCY_BUDGET_SECONDS", "30"))
+MODEL_COMPUTE_RESERVE_SECONDS = float(os.environ.get("VV_MODEL_COMPUTE_RESERVE_SECONDS", "5"))
+
+# latencies kept per endpoint, and how many are needed before hedging on their p95
+LATENCY_WINDOW = 256
+MIN_LATENCY_SAMPLES = 20
+
+
+class UpstreamError(Exception):
+    """
+    An upstream call failed. `status` is the HTTP status, or 0 if there was no response.
+
+    `retryable` failures (no response, 5xx, 429) mean the upstream is unavailable rather
+    than that the request was wrong; they trip the circuit breaker and allow stale fallback.
+    """
+
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        return _is_failure_status(self.status)
+
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request's latency budget ran out."""
+
+
+def _is_failure_status(status: int) -> bool:
+    return status == 0 or status == 429 or status >= 500
+
+
+@dataclass
+class LatencyBudget:
+    """
+    Time allowed for one request. Upstream calls may use it up to `reserve` seconds before
+    the end; `stale` lists the upstream URLs served from their last good value.
+    """
+    seconds: Optional[float]
+    reserve: float = 0.0
+    started: float = field(default_factory=time.monotonic)
+    stale: List[str] = field(default_factory=list)
+
+    def remaining(self) -> float:
+        if self.seconds is None:
+            return float("inf")
+        return self.seconds - (time.monotonic() - self.started)
+
+    def upstream_remaining(self) -> float:
+        return self.remaining() - self.reserve
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_budget: ContextVar[Optional[LatencyBudget]] = ContextVar("vv_latency_budget", default=None)
+
+
+@contextmanager
+def latency_budget(seconds: Optional[float], reserve: float = 0.0) -> Iterator[LatencyBudget]:
+    """
+    Runs the enclosed block under a latency budget (`None` or a non-positive value: unbounded,
+    but stale fallbacks are still recorded).
+    """
+    budget = LatencyBudget(seconds if seconds and seconds > 0 else None, reserve)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+def current_budget() -> Optional[LatencyBudget]:
+    return _budget.get()
+
+
+def _check_budget(component: str, stage: str):
+    budget = _budget.get()
+    if budget is not None and budget.expired:
+        raise DeadlineExceeded(f"Latency budget of {budget.seconds:g}s exhausted before {component}.{stage}")
+
+
+add_stage_listener(_check_budget)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker: closed, then open for `reset_seconds` after
+    `failures` failures in a row, then half-open until one trial call succeeds or fails.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(0.0, self.reset_seconds - (self._clock() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; in half-open state only one trial call is let through."""
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_seconds:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._state == self.HALF_OPEN or self._consecutive >= self.failures:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+            self._trial_in_flight = False
+
+    def release(self):
+        """Ends a call that says nothing about the host; a half-open trial may go ahead again."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class LatencyTracker:
+    """Recent successful call latencies of one endpoint."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class UpstreamClient:
+    """
+    Issues upstream GETs with deadlines, hedging and per-host circuit breakers (see the module
+    docstring). Thread-safe; one process-wide instance is returned by `get_upstream_client`.
+    """
+
+    def __init__(self, timeout: float = UPSTREAM_TIMEOUT_SECONDS, hedge_after: float = UPSTREAM_HEDGE_AFTER_SECONDS,
+                 hedging: bool = UPSTREAM_HEDGING_ENABLED, workers: int = UPSTREAM_WORKERS,
+                 breaker_factory: Callable[[], CircuitBreaker] = CircuitBreaker):
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.hedging = hedging
+        self._breaker_factory = breaker_factory
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[Tuple[str, str], LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vv-upstream")
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = self._breaker_factory()
+            return self._breakers[host]
+
+    def reset(self):
+        """Forgets every host's circuit state and latency history."""
+        with self._lock:
+            self._breakers.clear()
+            self._latencies.clear()
+
+    def latencies(self, host: str, endpoint: str) -> LatencyTracker:
+        with self._lock:
+            return self._latencies.setdefault((host, endpoint), LatencyTracker())
+
+    def call(self, url: str, endpoint: str, send: Callable[[float], requests.Response]) -> requests.Response:
+        """
+        Calls `send(timeout)` for `url` and returns its response, whatever its status.
+
+        Args:
+            url: The requested URL; its host selects the circuit breaker.
+            endpoint: A low-cardinality endpoint name; hedging uses its latency history.
+            send: Performs one attempt with the given socket timeout in seconds.
+
+        Raises:
+            CircuitOpenError: If the host's circuit is open.
+            UpstreamTimeout: If no attempt answered within the deadline.
+            UpstreamError: If the attempt failed without a response.
+        """
+        host = urlparse(url).netloc
+        budget = _budget.get()
+        deadline = self.timeout if budget is None else min(self.timeout, budget.upstream_remaining())
+        if deadline <= 0:
+            record_upstream_event(url, endpoint, "budget_exhausted")
+            raise UpstreamTimeout(f"No latency budget left to call {url}")
+
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            record_upstream_event(url, endpoint, "circuit_open")
+            raise CircuitOpenError(f"Circuit open for {host}", breaker.retry_after())
+        try:
+            response = self._attempts(url, self.latencies(host, endpoint), endpoint, send, deadline)
+        except UpstreamTimeout:
+            if deadline < self.timeout:  # cut short by the request's budget, not the host's fault
+                breaker.release()
+            else:
+                breaker.record_failure()
+            raise
+        except UpstreamError:
+            breaker.record_failure()
+            raise
+        if _is_failure_status(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    def _attempts(self, url: str, latencies: LatencyTracker, endpoint: str,
+                  send: Callable[[float], requests.Response], deadline: float) -> requests.Response:
+        started = time.monotonic()
+
+        def attempt() -> requests.Response:
+            attempt_started = time.monotonic()
+            response = send(max(deadline - (attempt_started - started), 0.001))
+            if not _is_failure_status(response.status_code):
+                latencies.observe(time.monotonic() - attempt_started)
+            return response
+
+        pending = {self._executor.submit(attempt)}
+        p95 = latencies.p95() if self.hedging else None
+        hedge_at = max(p95, self.hedge_after) if p95 is not None else None
+        error: Optional[BaseException] = None
+        while pending:
+            now = time.monotonic() - started
+            hedge_due = hedge_at is not None and hedge_at < deadline and now < hedge_at
+            done, pending = wait(pending, timeout=max((hedge_at if hedge_due else deadline) - now, 0.0),
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:  # a failed attempt: wait for the other one, if any
+                    error = e
+            if not done and hedge_due:
+                record_upstream_event(url, endpoint, "hedge")
+                pending.add(self._executor.submit(attempt))
+                hedge_at = None
+            elif not done:
+                record_upstream_event(url, endpoint, "timeout")
+                raise UpstreamTimeout(f"No response from {url} within {deadline:.3g}s")
+        if isinstance(error, requests.Timeout):
+            record_upstream_event(url, endpoint, "timeout")
+            raise UpstreamTimeout(f"No response from {url} within {deadline:.3g}s") from error
+        record_upstream_event(url, endpoint, "error")
+        raise UpstreamError(f"Request to {url} failed: {error}") from error
+
+
+class StaleCache:
+    """Thread-safe LRU map of upstream URL to (last good value, time it was fetched)."""
+
+    def __init__(self, max_entries: int = STALE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def fetch_or_stale(url: str, endpoint: str, fetch: Callable[[], Any]) -> Any:
+    """
+    Returns `fetch()` and keeps it as the last good value of `url`. If the upstream is
+    unavailable (a retryable `UpstreamError`), returns the last good value instead and adds
+    `url` to the current budget's `stale` list; without one, the error is raised.
+
+    Callers must treat the returned value as read-only: it is shared between requests.
+    """
+    cache = get_stale_cache()
+    try:
+        value = fetch()
+    except UpstreamError as e:
+        entry = cache.get(url) if e.retryable else None
+        if entry is None:
+            raise
+        record_upstream_event(url, endpoint, "stale_served")
+        budget = _budget.get()
+        if budget is not None and url not in budget.stale:
+            budget.stale.append(url)
+        return entry[0]
+    cache.put(url, value)
+    return value
+
+
+_client: Optional[UpstreamClient] = None
+_stale_cache: Optional[StaleCache] = None
+
+
+def get_upstream_client() -> UpstreamClient:
+    global _client
+    if _client is None:
+        _client = UpstreamClient()
+    return _client
+
+
+def get_stale_cache() -> StaleCache:
+    global _stale_cache
+    if _stale_cache is None:
+        _stale_cache = StaleCache()
+    return _stale_cache
@@ -0,0 +1,197 @@
+"""
+Pre-serialised market-data series for conditional and delta responses on `/market_data`.
+
+Each series served by a `/market_data` route is kept as its JSON records (one serialised
+row each), the row timestamps, an ETag (a hash of the content) and a Last-Modified time.
+An entry is reused while the data source's version is unchanged, or, for sources without
+a cheap version, for `VV_MARKET_DATA_TTL_SECONDS`. Within that time, conditional requests
+(`If-None-Match`, `If-Modified-Since`) and `since=` queries are answered from the entry
+alone: a 304, or only the rows newer than `since`, without touching the upstream or
+serialising the series again.
+
+Series loaded while the upstream was unavailable (served from the last good value, see
+`resilience.fetch_or_stale`) are not cached, so the next request tries the upstream again.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+import numpy as np
+
+from main_app.infrastructure.metrics import record_cache_lookup
+from main_app.infrastructure.resilience import current_budget
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+MARKET_DATA_TTL_SECONDS = float(os.environ.get("VV_MARKET_DATA_TTL_SECONDS", "300"))
+SERIES_CACHE_ENTRIES = int(os.environ.get("VV_SERIES_CACHE_ENTRIES", "512"))
+
+_NS_PER_SECOND = 10 ** 9
+
+
+@dataclass(frozen=True)
+class CachedSeries:
+    """
+    A serialised series. `timestamps` holds each row's time in epoch nanoseconds (None if the
+    series has no time column); `last_modified` is in epoch seconds.
+    """
+    etag: str
+    last_modified: Optional[float]
+    rows: Tuple[str, ...]
+    timestamps: Optional[np.ndarray]
+    version: Optional[Hashable]
+    loaded_at: float
+
+    @classmethod
+    def from_frame(cls, df: "pd.DataFrame", time_column: Optional[str] = None, version: Optional[Hashable] = None,
+                   previous: Optional["CachedSeries"] = None) -> "CachedSeries":
+        """
+        Serialises a frame as JSON records (ISO dates). `previous` is the entry being replaced:
+        when the content changed without a newer row, Last-Modified moves to the load time.
+        """
+        import pandas as pd
+        rows = tuple(row for row in df.to_json(orient="records", lines=True, date_format="iso").split("\n") if row)
+        etag = etag_for("\n".join(rows).encode())
+        timestamps = None
+        if time_column is not None and time_column in df.columns:
+            times = pd.to_datetime(df[time_column], utc=True, format="ISO8601")
+            timestamps = times.to_numpy(dtype="datetime64[ns]").view(np.int64)
+        now = time.time()
+        last_modified = float(timestamps.max()) / _NS_PER_SECOND if timestamps is not None and len(rows) else None
+        if previous is not None and previous.etag != etag and previous.last_modified is not None \
+                and (last_modified is None or last_modified <= previous.last_modified):
+            last_modified = now
+        elif previous is not None and previous.etag == etag:
+            last_modified = previous.last_modified
+        return cls(etag, last_modified, rows, timestamps, version, now)
+
+    @property
+    def empty(self) -> bool:
+        return not self.rows
+
+    def body(self, since: Optional[int] = None) -> bytes:
+        """The JSON array of the rows, or of the rows later than `since` (epoch nanoseconds)."""
+        rows = self.rows
+        if since is not None and self.timestamps is not None:
+            rows = [self.rows[i] for i in np.flatnonzero(self.timestamps > since)]
+        return ("[" + ",".join(rows) + "]").encode()
+
+
+class SeriesCache:
+    """
+    Thread-safe LRU of `CachedSeries` by key.
+
+    Args:
+        ttl: Seconds an entry is reused when its source has no version.
+        max_entries: Entries kept before the least recently used one is dropped.
+    """
+
+    def __init__(self, ttl: float = MARKET_DATA_TTL_SECONDS, max_entries: int = SERIES_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CachedSeries]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], "pd.DataFrame"], time_column: Optional[str] = None,
+            version: Optional[Callable[[], Optional[Hashable]]] = None) -> CachedSeries:
+        """
+        Returns the cached series for `key`, loading it with `load()` if it is missing or out of date.
+
+        Args:
+            key: The series key (e.g. the route's provider, metric set and symbol).
+            load: Loads the series as a frame.
+            time_column: The column holding each row's time, used for `since` and Last-Modified.
+            version: Returns the source's current version (None when unknown). An entry stays
+                valid while the version is unchanged; entries without a version expire after `ttl`.
+        """
+        current = version() if version is not None else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        fresh = entry is not None and (
+            entry.version == current if current is not None
+            else entry.version is None and time.time() - entry.loaded_at < self.ttl)
+        record_cache_lookup("market_data_series", fresh)
+        if fresh:
+            return entry
+
+        budget = current_budget()
+        stale_before = len(budget.stale) if budget is not None else 0
+        loaded = CachedSeries.from_frame(load(), time_column, current, previous=entry)
+        if budget is None or len(budget.stale) == stale_before:
+            with self._lock:
+                self._entries[key] = loaded
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return loaded
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def etag_for(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def validator_headers(etag: str, last_modified: Optional[float] = None) -> Dict[str, str]:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def not_modified(request_headers: Mapping[str, str], etag: str, last_modified: Optional[float] = None) -> bool:
+    """
+    Whether a GET with these headers can be answered with 304 (RFC 9110: `If-None-Match`
+    takes precedence over `If-Modified-Since`).
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_since(value: str) -> int:
+    """
+    Parses a `since` query value, an ISO 8601 timestamp or epoch seconds, into epoch nanoseconds.
+
+    Raises:
+        ValueError: If the value is neither.
+    """
+    import pandas as pd
+    try:
+        return int(float(value) * _NS_PER_SECOND)
+    except (ValueError, OverflowError):
+        pass
+    timestamp = pd.Timestamp(value)
+    if timestamp is pd.NaT:
+        raise ValueError(f"Invalid since value '{value}'")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return int(timestamp.value)
+
+
+_cache: Optional[SeriesCache] = None
+
+
+def get_series_cache() -> SeriesCache:
+    global _cache
+    if _cache is None:
+        _cache = SeriesCache()
+    return _cache
@@ -0,0 +1,285 @@
+"""
+Memory-mapped market-data panels shared by every worker process on a node.
+
+A panel is a 2D float64 array (rows x columns) with an int64 row index, stored as `.npy`
+files under `VV_PANEL_STORE_DIR` (RAM-backed `/dev/shm` by default). Readers map the
+files read-only, so all workers share the same physical pages and resident memory stays
+flat as workers are added. Each publish writes a new version directory and then swaps
+the panel's `CURRENT` pointer with an atomic rename; readers that still hold an older
+version keep a valid mapping until they move on. Publishing the current content again keeps
+the current version, so what is cached on the version is not invalidated by a refresh that
+found nothing new.
+
+Exactly one process per node refreshes the panels: `PanelRefresher` elects a leader
+through an exclusive `flock` on the store's lock file, and the other workers only read.
+If the leader exits, its lock is released and another worker takes over.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from main_app.infrastructure.metrics import record_cache_lookup
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SHARED_PANELS_ENABLED = os.environ.get("VV_SHARED_PANELS", "0").lower() in ("1", "true", "yes")
+PANEL_STORE_DIR = os.environ.get(
+    "VV_PANEL_STORE_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "vv-panels"))
+PANEL_REFRESH_SECONDS = float(os.environ.get("VV_PANEL_REFRESH_SECONDS", "900"))
+PANEL_VERSIONS_KEPT = 2
+
+POOL_HISTORY_PREFIX = "pool_history"
+
+
+def pool_history_panel_name(symbol: str) -> str:
+    return f"{POOL_HISTORY_PREFIX}/{symbol.upper()}"
+
+
+@dataclass
+class SharedPanel:
+    name: str
+    version: int
+    index: np.ndarray
+    columns: List[str]
+    values: np.ndarray
+
+    def column(self, name: str) -> np.ndarray:
+        return self.values[:, self.columns.index(name)]
+
+
+class SharedPanelStore:
+    def __init__(self, directory: str = PANEL_STORE_DIR):
+        self.directory = directory
+        self._mapped: Dict[str, SharedPanel] = {}
+        self._lock = threading.Lock()
+
+    def _panel_dir(self, name: str) -> str:
+        parts = name.split("/")
+        if not all(re.fullmatch(r"[A-Za-z0-9_.-]+", part) and part not in (".", "..") for part in parts):
+            raise ValueError(f"Invalid panel name '{name}'")
+        return os.path.join(self.directory, *parts)
+
+    def current_version(self, name: str) -> Optional[int]:
+        try:
+            with open(os.path.join(self._panel_dir(name), "CURRENT"), "r") as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def publish(self, name: str, index: np.ndarray, columns: List[str], values: np.ndarray) -> int:
+        """
+        Writes a new version of a panel and atomically makes it current, unless the current
+        version holds the same content.
+
+        Args:
+            name: Panel name, e.g. 'pool_history/STETH'.
+            index: int64 row labels (e.g. epoch nanoseconds).
+            columns: Column names, one per column of `values`.
+            values: 2D array of shape (len(index), len(columns)); stored as C-contiguous float64.
+
+        Returns:
+            int: The published version (the current one if the content is unchanged).
+        """
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        index = np.ascontiguousarray(index, dtype=np.int64)
+        if values.ndim != 2 or values.shape != (len(index), len(columns)):
+            raise ValueError(f"Panel values must have shape ({len(index)}, {len(columns)}), got {values.shape}")
+
+        panel_dir = self._panel_dir(name)
+        content_hash = _content_hash(index, columns, values)
+        current = self.current_version(name)
+        if current is not None and self._content_hash(panel_dir, current) == content_hash:
+            return current
+        os.makedirs(panel_dir, exist_ok=True)
+        version = max(time.time_ns(), (current or 0) + 1)
+        staging = tempfile.mkdtemp(dir=panel_dir, prefix=".staging-")
+        np.save(os.path.join(staging, "values.npy"), values)
+        np.save(os.path.join(staging, "index.npy"), index)
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump({"columns": list(columns), "version": version, "content_hash": content_hash}, f)
+        os.rename(staging, os.path.join(panel_dir, str(version)))
+
+        pointer_tmp = os.path.join(panel_dir, f".CURRENT.{os.getpid()}")
+        with open(pointer_tmp, "w") as f:
+            f.write(str(version))
+        os.replace(pointer_tmp, os.path.join(panel_dir, "CURRENT"))
+        self._remove_old_versions(panel_dir, version)
+        return version
+
+    def read(self, name: str) -> Optional[SharedPanel]:
+        """Returns the current version of a panel as read-only memory-mapped arrays, or None if absent."""
+        version = self.current_version(name)
+        if version is None:
+            return None
+        with self._lock:
+            panel = self._mapped.get(name)
+            if panel is not None and panel.version == version:
+                return panel
+        version_dir = os.path.join(self._panel_dir(name), str(version))
+        try:
+            with open(os.path.join(version_dir, "meta.json"), "r") as f:
+                meta = json.load(f)
+            panel = SharedPanel(
+                name=name,
+                version=version,
+                index=np.load(os.path.join(version_dir, "index.npy"), mmap_mode="r"),
+                columns=meta["columns"],
+                values=np.load(os.path.join(version_dir, "values.npy"), mmap_mode="r"),
+            )
+        except FileNotFoundError:
+            return None  # removed by a newer publish between reading CURRENT and opening the files
+        with self._lock:
+            self._mapped[name] = panel
+        return panel
+
+    @staticmethod
+    def _content_hash(panel_dir: str, version: int) -> Optional[str]:
+        try:
+            with open(os.path.join(panel_dir, str(version), "meta.json"), "r") as f:
+                return json.load(f).get("content_hash")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _remove_old_versions(self, panel_dir: str, current: int):
+        versions = sorted(int(entry) for entry in os.listdir(panel_dir) if entry.isdigit() and int(entry) <= current)
+        for version in versions[:-PANEL_VERSIONS_KEPT]:
+            # open mappings of removed files stay valid until the reader drops them
+            shutil.rmtree(os.path.join(panel_dir, str(version)), ignore_errors=True)
+
+
+def _content_hash(index: np.ndarray, columns: List[str], values: np.ndarray) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(list(columns)).encode())
+    digest.update(index.tobytes())
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def pool_history_to_panel(df: "pd.DataFrame") -> Tuple[np.ndarray, List[str], np.ndarray]:
+    """Converts a DefiLlama `/chart/{pool}` frame into (epoch-ns index, numeric columns, values)."""
+    import pandas as pd
+    index = pd.to_datetime(df["timestamp"], utc=True).to_numpy(dtype="datetime64[ns]").view(np.int64)
+    columns = [column for column in df.columns if column != "timestamp"]
+    values = df[columns].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    return index, columns, values
+
+
+def panel_to_pool_history(panel: SharedPanel) -> "pd.DataFrame":
+    """
+    Rebuilds the `/chart/{pool}` frame shape: a UTC datetime `timestamp` column (serialised as
+    the same ISO strings) plus the numeric columns.
+
+    The numeric block wraps the shared mapping without copying, and the timestamps are the
+    mapped epoch nanoseconds, so no per-row strings are built here or parsed again downstream.
+    """
+    import pandas as pd
+    df = pd.DataFrame(panel.values, columns=panel.columns, copy=False)
+    df.insert(0, "timestamp", pd.DatetimeIndex(np.asarray(panel.index).view("datetime64[ns]")).tz_localize("UTC"))
+    return df
+
+
+_store: Optional[SharedPanelStore] = None
+
+
+def get_panel_store() -> SharedPanelStore:
+    global _store
+    if _store is None:
+        _store = SharedPanelStore()
+    return _store
+
+
+def read_shared_pool_history(symbol: str) -> Optional["pd.DataFrame"]:
+    """Returns the shared pool history for a symbol, or None if shared panels are disabled or not yet published."""
+    if not SHARED_PANELS_ENABLED:
+        return None
+    panel = get_panel_store().read(pool_history_panel_name(symbol))
+    record_cache_lookup("shared_panels", panel is not None)
+    return panel_to_pool_history(panel) if panel is not None else None
+
+
+def shared_pool_history_version(symbol: str) -> Optional[int]:
+    """The current version of a symbol's shared pool history (None if shared panels are disabled or unpublished)."""
+    if not SHARED_PANELS_ENABLED:
+        return None
+    return get_panel_store().current_version(pool_history_panel_name(symbol))
+
+
+class PanelRefresher:
+    """
+    Periodically refreshes pool-history panels from the upstream provider in the elected leader process.
+
+    Args:
+        store: The store to publish to.
+        symbols: Returns the symbols to refresh.
+        fetch: Returns the `/chart/{pool}` frame for a symbol.
+        interval: Seconds between refreshes.
+    """
+
+    def __init__(self, store: SharedPanelStore, symbols: Callable[[], List[str]],
+                 fetch: Callable[[str], "pd.DataFrame"], interval: float = PANEL_REFRESH_SECONDS):
+        self.store = store
+        self._symbols = symbols
+        self._fetch = fetch
+        self.interval = interval
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_file is not None
+
+    def try_become_leader(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        os.makedirs(self.store.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.store.directory, "refresh.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def refresh_once(self) -> Dict[str, int]:
+        """Fetches and publishes every symbol's history; returns the published version per symbol."""
+        published = {}
+        for symbol in self._symbols():
+            try:
+                index, columns, values = pool_history_to_panel(self._fetch(symbol))
+            except Exception:
+                continue  # keep serving the previous version; the next refresh retries
+            published[symbol] = self.store.publish(pool_history_panel_name(symbol), index, columns, values)
+        return published
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vv-panel-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.try_become_leader():
+                self.refresh_once()
+            self._stop.wait(self.interval)
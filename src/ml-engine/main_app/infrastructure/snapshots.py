@@ -0,0 +1,336 @@
+"""
+Versioned columnar snapshots of upstream API responses.
+
+The integration scripts (`scripts/update_*_integration.py`) write one snapshot per run and
+the ml-engine can serve from the latest one instead of calling the APIs (`VV_DATA_SOURCE=snapshot`).
+
+Layout of a dataset under `VV_SNAPSHOT_DIR` (the repository `data/` directory by default):
+
+    <dataset>/CURRENT                      version of the latest complete snapshot
+    <dataset>/<version>/manifest.json      schema version, as-of time, tables, row counts, column encodings
+    <dataset>/<version>/<table>/<col>.npy  one file per column
+
+Columns are encoded by content:
+
+* `numeric`: bool/int64/float64 array (missing values become NaN), memory-mapped on read.
+* `string`: int32 dictionary codes (-1 for missing) plus a gzip-compressed JSON dictionary.
+* `json`: nested values (lists, dicts) serialised to JSON and then stored like `string`.
+
+Each run writes into a staging directory, renames it into place and then swaps `CURRENT`
+atomically, so readers never see a partially written snapshot.
+"""
+import gzip
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SNAPSHOT_SCHEMA_VERSION = 1
+SNAPSHOT_DIR = os.environ.get(
+    "VV_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))), "data"))
+SNAPSHOT_VERSIONS_KEPT = 3
+
+NUMERIC = "numeric"
+STRING = "string"
+JSON = "json"
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def encode_column(values: list) -> tuple:
+    """
+    Encodes one column of a record list.
+
+    Returns:
+        tuple: (encoding, nullable, data array, dictionary or None).
+    """
+    import pandas as pd
+    present = [value for value in values if value is not None]
+    nullable = len(present) < len(values)
+
+    if present and all(isinstance(value, bool) for value in present) and not nullable:
+        return NUMERIC, False, np.asarray(values, dtype=np.bool_), None
+    if all(_is_number(value) for value in present):
+        if not nullable and all(isinstance(value, int) for value in present) \
+                and all(-2 ** 63 <= value < 2 ** 63 for value in present):
+            return NUMERIC, False, np.asarray(values, dtype=np.int64), None
+        data = np.array([math.nan if value is None else value for value in values], dtype=np.float64)
+        return NUMERIC, nullable, data, None
+
+    encoding = STRING if all(isinstance(value, str) for value in present) else JSON
+    if encoding == JSON:
+        values = [None if value is None else json.dumps(value, separators=(",", ":"), sort_keys=True)
+                  for value in values]
+    codes, dictionary = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    return encoding, nullable, codes.astype(np.int32), [str(item) for item in dictionary]
+
+
+def _table_columns(records: List[dict]) -> List[str]:
+    columns: Dict[str, None] = {}
+    for record in records:
+        columns.update(dict.fromkeys(record))
+    for column in columns:
+        if not column or "/" in column or column.startswith("."):
+            raise ValueError(f"Invalid column name '{column}'")
+    return list(columns)
+
+
+def _link_or_copy(source: str, destination: str):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def write_table(directory: str, records: List[dict]) -> dict:
+    """
+    Writes records as one columnar table directory.
+
+    Returns:
+        dict: The table spec (row count and per-column encoding) to store in a manifest.
+    """
+    os.makedirs(directory)
+    columns = {}
+    for column in _table_columns(records):
+        encoding, nullable, data, dictionary = encode_column([record.get(column) for record in records])
+        np.save(os.path.join(directory, f"{column}.npy"), data)
+        if dictionary is not None:
+            with gzip.open(os.path.join(directory, f"{column}.dict.json.gz"), "wt") as f:
+                json.dump(dictionary, f, separators=(",", ":"))
+        columns[column] = {"encoding": encoding, "dtype": str(data.dtype), "nullable": nullable}
+    return {"rows": len(records), "columns": columns}
+
+
+def write_snapshot(dataset: str, tables: Dict[str, List[dict]], root: str = SNAPSHOT_DIR,
+                   as_of: Optional[datetime] = None, source: Optional[dict] = None,
+                   carry_over: Optional[List[str]] = None) -> str:
+    """
+    Writes a new snapshot of a dataset and atomically makes it current.
+
+    Args:
+        dataset: Dataset name, e.g. 'defillama'.
+        tables: Table name to list of flat-ish records (nested values are stored as JSON).
+        root: Snapshot root directory.
+        as_of: Time the data was fetched; defaults to now.
+        source: Free-form provenance stored in the manifest (API base, script version, ...).
+        carry_over: Unchanged tables to take from the current snapshot; their files are
+            hard-linked rather than rewritten.
+
+    Returns:
+        str: The directory of the written snapshot.
+    """
+    as_of = as_of or datetime.now(timezone.utc)
+    dataset_dir = os.path.join(root, dataset)
+    os.makedirs(dataset_dir, exist_ok=True)
+    version = as_of.strftime("%Y%m%dT%H%M%S%fZ")
+    staging = tempfile.mkdtemp(dir=dataset_dir, prefix=".staging-")
+    try:
+        manifest = {
+            "schema_version": SNAPSHOT_SCHEMA_VERSION,
+            "dataset": dataset,
+            "version": version,
+            "as_of": as_of.isoformat(),
+            "source": source or {},
+            "tables": {},
+        }
+        for table, records in tables.items():
+            manifest["tables"][table] = write_table(os.path.join(staging, table), records)
+        if carry_over:
+            previous = Snapshot(current_snapshot_dir(dataset, root))
+            for table in carry_over:
+                manifest["tables"][table] = previous.manifest["tables"][table]
+                shutil.copytree(os.path.join(previous.directory, table), os.path.join(staging, table),
+                                copy_function=_link_or_copy)
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        snapshot_dir = os.path.join(dataset_dir, version)
+        os.rename(staging, snapshot_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    pointer_tmp = os.path.join(dataset_dir, f".CURRENT.{os.getpid()}")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(dataset_dir, "CURRENT"))
+
+    versions = sorted(entry for entry in os.listdir(dataset_dir)
+                      if not entry.startswith(".") and os.path.isdir(os.path.join(dataset_dir, entry)))
+    for old in versions[:-SNAPSHOT_VERSIONS_KEPT]:
+        shutil.rmtree(os.path.join(dataset_dir, old), ignore_errors=True)
+    return snapshot_dir
+
+
+class ColumnarTable:
+    """A read-only table directory written by `write_table`; numeric columns and dictionary codes are memory-mapped."""
+
+    def __init__(self, directory: str, spec: dict):
+        self.directory = directory
+        self.spec = spec
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._dictionaries: Dict[str, list] = {}
+        self._positions: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def rows(self) -> int:
+        return self.spec["rows"]
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.spec["columns"])
+
+    def codes(self, column: str) -> np.ndarray:
+        """Returns the raw (memory-mapped) array of a column: values for numeric columns, codes otherwise."""
+        self.spec["columns"][column]  # KeyError for unknown columns
+        with self._lock:
+            array = self._arrays.get(column)
+        if array is None:
+            array = np.load(os.path.join(self.directory, f"{column}.npy"), mmap_mode="r")
+            with self._lock:
+                self._arrays[column] = array
+        return array
+
+    def dictionary(self, column: str) -> list:
+        with self._lock:
+            dictionary = self._dictionaries.get(column)
+        if dictionary is None:
+            with gzip.open(os.path.join(self.directory, f"{column}.dict.json.gz"), "rt") as f:
+                dictionary = json.load(f)
+            if self.spec["columns"][column]["encoding"] == JSON:
+                dictionary = [json.loads(item) for item in dictionary]
+            with self._lock:
+                self._dictionaries[column] = dictionary
+        return dictionary
+
+    def lookup(self, column: str, value) -> int:
+        """Returns the dictionary code of a value in a string/JSON column, or -1 if it does not occur."""
+        with self._lock:
+            positions = self._positions.get(column)
+        if positions is None:
+            positions = {item: code for code, item in enumerate(self.dictionary(column))}
+            with self._lock:
+                self._positions[column] = positions
+        return positions.get(value, -1)
+
+    def column(self, column: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Decodes a column, optionally restricted to a row selection (boolean mask or positions).
+
+        Numeric columns are returned as views of the mapping when no selection is given; string
+        and JSON columns are decoded to object arrays with None for missing values.
+        """
+        data = self.codes(column)
+        if rows is not None:
+            data = data[rows]
+        if self.spec["columns"][column]["encoding"] == NUMERIC:
+            return data
+        dictionary = self.dictionary(column)
+        decoded = np.empty(len(dictionary) + 1, dtype=object)
+        decoded[:-1] = dictionary
+        decoded[-1] = None
+        return decoded[np.asarray(data)]  # code -1 picks the trailing None
+
+    def frame(self, rows: Optional[np.ndarray] = None, columns: Optional[List[str]] = None) -> "pd.DataFrame":
+        import pandas as pd
+        return pd.DataFrame({column: self.column(column, rows) for column in columns or self.columns})
+
+    def records(self, rows: Optional[np.ndarray] = None) -> List[dict]:
+        """Rebuilds the original records, with missing values as None."""
+        import pandas as pd
+        df = self.frame(rows).astype(object)
+        return df.where(pd.notna(df), None).to_dict(orient="records")
+
+
+class Snapshot:
+    """A read-only view of one snapshot version."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        if self.manifest["schema_version"] > SNAPSHOT_SCHEMA_VERSION:
+            raise ValueError(f"Snapshot schema version {self.manifest['schema_version']} is newer than the "
+                             f"supported version {SNAPSHOT_SCHEMA_VERSION}")
+        self._tables: Dict[str, ColumnarTable] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    @property
+    def tables(self) -> List[str]:
+        return list(self.manifest["tables"])
+
+    def reader(self, table: str) -> ColumnarTable:
+        with self._lock:
+            reader = self._tables.get(table)
+            if reader is None:
+                reader = ColumnarTable(os.path.join(self.directory, table), self.manifest["tables"][table])
+                self._tables[table] = reader
+            return reader
+
+    def rows(self, table: str) -> int:
+        return self.reader(table).rows
+
+    def codes(self, table: str, column: str) -> np.ndarray:
+        return self.reader(table).codes(column)
+
+    def dictionary(self, table: str, column: str) -> list:
+        return self.reader(table).dictionary(column)
+
+    def lookup(self, table: str, column: str, value) -> int:
+        return self.reader(table).lookup(column, value)
+
+    def column(self, table: str, column: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        return self.reader(table).column(column, rows)
+
+    def table(self, table: str, rows: Optional[np.ndarray] = None, columns: Optional[List[str]] = None) -> "pd.DataFrame":
+        return self.reader(table).frame(rows, columns)
+
+    def records(self, table: str, rows: Optional[np.ndarray] = None) -> List[dict]:
+        return self.reader(table).records(rows)
+
+
+def current_snapshot_dir(dataset: str, root: str = SNAPSHOT_DIR) -> Optional[str]:
+    try:
+        with open(os.path.join(root, dataset, "CURRENT"), "r") as f:
+            return os.path.join(root, dataset, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+_open_snapshots: Dict[tuple, Snapshot] = {}
+_open_lock = threading.Lock()
+
+
+def open_snapshot(dataset: str, root: str = SNAPSHOT_DIR) -> Snapshot:
+    """
+    Returns the current snapshot of a dataset, reusing the open mapping while the version is unchanged.
+
+    Raises:
+        FileNotFoundError: If no snapshot has been written yet.
+    """
+    directory = current_snapshot_dir(dataset, root)
+    if directory is None:
+        raise FileNotFoundError(f"No '{dataset}' snapshot found under {root}")
+    with _open_lock:
+        snapshot = _open_snapshots.get((root, dataset))
+        if snapshot is None or snapshot.directory != directory:
+            snapshot = Snapshot(directory)
+            _open_snapshots[(root, dataset)] = snapshot
+        return snapshot
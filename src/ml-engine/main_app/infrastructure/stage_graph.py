@@ -0,0 +1,259 @@
+"""
+Memoised DAG of named pipeline stages.
+
+A `StageGraph` declares each stage as a function of named inputs, which are either sources
+supplied per run or the outputs of other stages. A `StageRun` evaluates stages lazily, on
+request. Values are identified by content fingerprints, taken when a memoised stage needs
+them: a stage's output is cached process-wide under a key made of the stage name and its
+inputs' fingerprints, together with the output's own fingerprint. A run therefore
+recomputes only the stages downstream of an input that actually changed, and if a
+recomputed stage produces the same output as before, the stages below it are reused.
+
+Stages must treat their inputs as read-only: cached outputs are shared between runs.
+Outputs computed while an upstream was served from its last good value (see
+`resilience.fetch_or_stale`) are not cached, so the next run tries the upstream again.
+The cache holds at most `VV_STAGE_CACHE_ENTRIES` outputs (least recently used evicted).
+"""
+import dataclasses
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from main_app.infrastructure.metrics import record_stage_run, track_stage
+from main_app.infrastructure.resilience import current_budget
+
+STAGE_CACHE_ENTRIES = int(os.environ.get("VV_STAGE_CACHE_ENTRIES", "256"))
+
+REUSED = "reused"
+COMPUTED = "computed"
+
+
+def fingerprint(value: Any) -> str:
+    """
+    A content hash of `value`: scalars, strings, bytes, numpy arrays, pandas objects,
+    lists, tuples, dicts, dataclasses and plain objects (through their attributes).
+
+    Raises:
+        TypeError: If the value (or a nested value) cannot be fingerprinted.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    _update(digest, value)
+    return digest.hexdigest()
+
+
+def _update(digest, value: Any):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+    elif isinstance(value, np.generic):
+        _update(digest, value.item())
+    elif isinstance(value, bytes):
+        digest.update(b"bytes:%d;" % len(value))
+        digest.update(value)
+    elif isinstance(value, np.ndarray):
+        digest.update(f"ndarray:{value.dtype.str}:{value.shape};".encode())
+        if value.dtype.hasobject:
+            _update(digest, value.tolist())
+        else:
+            digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        labels = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        digest.update(f"{type(value).__name__}:{value.shape};".encode())
+        _update(digest, [str(label) for label in labels])
+        _update(digest, [str(dtype) for dtype in np.atleast_1d(value.dtypes)])
+        _update(digest, pd.util.hash_pandas_object(value, index=True).to_numpy())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)};".encode())
+        for item in value:
+            _update(digest, item)
+    elif isinstance(value, dict):
+        digest.update(f"dict:{len(value)};".encode())
+        for key in sorted(value, key=repr):
+            _update(digest, key)
+            _update(digest, value[key])
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        digest.update(f"{type(value).__qualname__};".encode())
+        for item in dataclasses.fields(value):
+            _update(digest, item.name)
+            _update(digest, getattr(value, item.name))
+    elif hasattr(value, "__dict__") and not callable(value):
+        digest.update(f"{type(value).__qualname__};".encode())
+        _update(digest, vars(value))
+    else:
+        raise TypeError(f"Cannot fingerprint a value of type {type(value).__name__}")
+
+
+class StageCache:
+    """A thread-safe LRU map of stage key to (output, output fingerprint)."""
+
+    def __init__(self, max_entries: int = STAGE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[Any, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, value: Any, value_fingerprint: str):
+        with self._lock:
+            self._entries[key] = (value, value_fingerprint)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_cache: Optional[StageCache] = None
+
+
+def get_stage_cache() -> StageCache:
+    global _cache
+    if _cache is None:
+        _cache = StageCache()
+    return _cache
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A named stage computing `compute(*inputs)`; inputs name sources or other stages.
+
+    A stage with `memoise=False` runs on every evaluation and is never cached; use it where
+    hashing the inputs would cost more than the stage itself (e.g. compacting raw upstream
+    frames). Its output is still fingerprinted for the stages below it.
+    """
+    name: str
+    compute: Callable[..., Any]
+    inputs: Tuple[str, ...] = ()
+    memoise: bool = True
+
+
+class StageGraph:
+    """
+    A DAG of stages run by one component; the component name labels stage metrics.
+
+    Args:
+        component: Component name used for the stage latency and reuse metrics.
+        stages: The stages; inputs that are not stage names are sources.
+        cache: Cache of stage outputs (defaults to the process-wide cache).
+
+    Raises:
+        ValueError: If stage names are duplicated or the stages form a cycle.
+    """
+
+    def __init__(self, component: str, stages: Sequence[Stage], cache: Optional[StageCache] = None):
+        self.component = component
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage '{stage.name}'")
+            self.stages[stage.name] = stage
+        self.sources = sorted({name for s in stages for name in s.inputs if name not in self.stages})
+        self._cache = cache
+        self._check_acyclic()
+
+    @property
+    def cache(self) -> StageCache:
+        return self._cache if self._cache is not None else get_stage_cache()
+
+    def _check_acyclic(self):
+        state: Dict[str, int] = {}  # 1 = visiting, 2 = done
+
+        def visit(name: str, path: List[str]):
+            if state.get(name) == 2 or name not in self.stages:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"Stage cycle: {' -> '.join(path + [name])}")
+            state[name] = 1
+            for dependency in self.stages[name].inputs:
+                visit(dependency, path + [name])
+            state[name] = 2
+
+        for name in self.stages:
+            visit(name, [])
+
+    def run(self, **sources) -> "StageRun":
+        """
+        Starts a run over the given sources. Stages are evaluated on `StageRun.get`.
+
+        Raises:
+            ValueError: If a source is missing or unknown.
+        """
+        missing = set(self.sources) - set(sources)
+        unknown = set(sources) - set(self.sources)
+        if missing or unknown:
+            raise ValueError(f"Stage graph sources mismatch: missing {sorted(missing)}, unknown {sorted(unknown)}")
+        return StageRun(self, sources)
+
+
+class StageRun:
+    """
+    One evaluation of a `StageGraph`; stage outputs are computed or reused at most once per run.
+
+    Fingerprints are taken lazily, only for values that key a memoised stage.
+    """
+
+    def __init__(self, graph: StageGraph, sources: Dict[str, Any]):
+        self.graph = graph
+        self._values: Dict[str, Any] = dict(sources)
+        self._fingerprints: Dict[str, str] = {}
+        self._outcomes: Dict[str, str] = {}
+
+    def fingerprint(self, name: str) -> str:
+        if name not in self._fingerprints:
+            self._fingerprints[name] = fingerprint(self.get(name))
+        return self._fingerprints[name]
+
+    def get(self, name: str) -> Any:
+        """Returns the value of a source or stage, evaluating the stage and its inputs if needed."""
+        if name in self._values:
+            return self._values[name]
+        stage = self.graph.stages[name]
+        inputs = [self.get(dependency) for dependency in stage.inputs]
+
+        key, cached = None, None
+        if stage.memoise:
+            key = fingerprint([self.graph.component, name] + [self.fingerprint(d) for d in stage.inputs])
+            cached = self.graph.cache.get(key)
+        if cached is not None:
+            value, self._fingerprints[name] = cached
+        else:
+            budget = current_budget()
+            stale = len(budget.stale) if budget is not None else 0
+            with track_stage(self.graph.component, name):
+                value = stage.compute(*inputs)
+            if stage.memoise and (budget is None or len(budget.stale) == stale):
+                self._values[name] = value
+                self.graph.cache.put(key, value, self.fingerprint(name))
+        record_stage_run(self.graph.component, name, reused=cached is not None)
+
+        self._values[name] = value
+        self._outcomes[name] = REUSED if cached is not None else COMPUTED
+        return value
+
+    def report(self) -> Dict[str, str]:
+        """Stages evaluated so far, in evaluation order, mapped to 'reused' or 'computed'."""
+        return dict(self._outcomes)
+
+    @property
+    def reused(self) -> List[str]:
+        return [name for name, outcome in self._outcomes.items() if outcome == REUSED]
+
+    @property
+    def computed(self) -> List[str]:
+        return [name for name, outcome in self._outcomes.items() if outcome == COMPUTED]
@@ -0,0 +1,229 @@
+"""
+Push-based model subscriptions.
+
+Clients register a model payload once and receive allocation updates over server-sent
+events. Identical payloads map to the same topic, so one computation serves every
+subscriber of that topic. A background poller reads a marker of the latest market-data
+observation of every symbol with active subscribers, all in one upstream call, and
+recomputes only the topics whose symbols received new observations; subscribers are sent
+just the allocations that changed.
+
+All topic state is owned by the event loop; model computations and upstream polling run
+in worker threads via `asyncio.to_thread`.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, Hashable, Optional, Set
+
+from main_app.infrastructure.metrics import REGISTRY
+
+SUBSCRIPTION_POLL_SECONDS = float(os.environ.get("VV_SUBSCRIPTION_POLL_SECONDS", "300"))
+SUBSCRIPTION_IDLE_SECONDS = float(os.environ.get("VV_SUBSCRIPTION_IDLE_SECONDS", "600"))
+SUBSCRIPTION_HEARTBEAT_SECONDS = 15.0
+ALLOCATION_TOLERANCE = 1e-6
+
+SUBSCRIPTION_TOPICS = REGISTRY.gauge("vv_subscription_topics", "Active subscription topics.")
+SUBSCRIPTION_LISTENERS = REGISTRY.gauge("vv_subscription_listeners", "Connected subscription listeners.")
+SUBSCRIPTION_RECOMPUTES = REGISTRY.counter(
+    "vv_subscription_recomputes_total", "Topic recomputations by outcome.", labels=("result",))
+
+
+def topic_id_for(model_name: str, payload: Dict) -> str:
+    canonical = json.dumps({"model": str(model_name).lower(), "payload": payload}, sort_keys=True,
+                           separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+def diff_allocations(previous: Dict[str, float], current: Dict[str, float],
+                     tolerance: float = ALLOCATION_TOLERANCE) -> Dict[str, float]:
+    """Returns the allocations in `current` that differ from `previous`; dropped assets are reported as 0."""
+    changed = {asset: weight for asset, weight in current.items()
+               if asset not in previous or abs(previous[asset] - weight) > tolerance}
+    changed.update({asset: 0.0 for asset in previous if asset not in current})
+    return changed
+
+
+@dataclass
+class Topic:
+    topic_id: str
+    model_name: str
+    payload: Dict
+    symbols: Set[str]
+    allocations: Optional[Dict[str, float]] = None
+    as_of: Optional[float] = None
+    listeners: Set[asyncio.Queue] = field(default_factory=set)
+    last_active: float = field(default_factory=time.time)
+    computing: Optional[asyncio.Task] = None
+    recompute_pending: bool = False
+
+
+class SubscriptionHub:
+    """
+    Tracks subscription topics and pushes recomputed allocations to their listeners.
+
+    Args:
+        compute: Runs a model for (model_name, payload) and returns {asset: weight}.
+        latest_observations: Returns an opaque marker (e.g. the last timestamp) of the newest
+            market-data observation of each of the given symbols; a change in a symbol's marker
+            triggers recomputation. Symbols left out keep their previous marker.
+        poll_interval: Seconds between market-data polls.
+        idle_timeout: Seconds a topic without listeners is kept before it is dropped.
+    """
+
+    def __init__(self, compute: Callable[[str, Dict], Dict[str, float]],
+                 latest_observations: Callable[[Set[str]], Dict[str, Optional[Hashable]]],
+                 poll_interval: float = SUBSCRIPTION_POLL_SECONDS,
+                 idle_timeout: float = SUBSCRIPTION_IDLE_SECONDS):
+        self._compute = compute
+        self._latest_observations = latest_observations
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.topics: Dict[str, Topic] = {}
+        self._observations: Dict[str, Optional[Hashable]] = {}
+        self._poller: Optional[asyncio.Task] = None
+
+    def subscribe(self, model_name: str, payload: Dict) -> Topic:
+        """Registers a payload, returning its (possibly shared) topic. Must be called on the event loop."""
+        topic_id = topic_id_for(model_name, payload)
+        topic = self.topics.get(topic_id)
+        if topic is None:
+            symbols = {str(symbol).upper() for symbol in payload.get("AssetSymbols", [])}
+            topic = self.topics[topic_id] = Topic(topic_id, model_name, payload, symbols)
+            SUBSCRIPTION_TOPICS.set(len(self.topics))
+            self._schedule_recompute(topic)
+        topic.last_active = time.time()
+        self._ensure_poller()
+        return topic
+
+    async def listen(self, topic_id: str, heartbeat: Optional[float] = None) -> AsyncIterator[Dict]:
+        """
+        Yields allocation events for a topic: a full snapshot first (once available), then
+        only the allocations that changed on each recomputation. If `heartbeat` is set, a
+        heartbeat event is yielded whenever that many seconds pass without an update.
+        """
+        topic = self.topics[topic_id]
+        queue: asyncio.Queue = asyncio.Queue()
+        topic.listeners.add(queue)
+        SUBSCRIPTION_LISTENERS.inc()
+        try:
+            if topic.allocations is not None:
+                yield self._event(topic, topic.allocations, full=True)
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield {"event": "heartbeat"}
+        finally:
+            topic.listeners.discard(queue)
+            topic.last_active = time.time()
+            SUBSCRIPTION_LISTENERS.dec()
+
+    async def poll_once(self):
+        """Checks every subscribed symbol for new observations and recomputes affected topics."""
+        self._drop_idle_topics()
+        symbols = set().union(*(topic.symbols for topic in self.topics.values())) if self.topics else set()
+        changed = set()
+        try:
+            markers = await asyncio.to_thread(self._latest_observations, symbols) if symbols else {}
+        except Exception:
+            markers = {}  # keep the previous markers; the next poll will retry
+        for symbol, marker in markers.items():
+            if symbol not in symbols:
+                continue
+            if self._observations.get(symbol) != marker:
+                if symbol in self._observations:
+                    changed.add(symbol)
+                self._observations[symbol] = marker
+
+        for topic in list(self.topics.values()):
+            if topic.symbols & changed:
+                self._schedule_recompute(topic)
+
+        pending = [topic.computing for topic in self.topics.values() if topic.computing is not None]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+
+    def _ensure_poller(self):
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.get_running_loop().create_task(self._poll_forever())
+
+    async def _poll_forever(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.poll_once()
+            if not self.topics:
+                self._poller = None
+                return
+
+    def _drop_idle_topics(self):
+        now = time.time()
+        for topic_id, topic in list(self.topics.items()):
+            in_flight = topic.computing is not None and not topic.computing.done()
+            if not topic.listeners and not in_flight and now - topic.last_active > self.idle_timeout:
+                del self.topics[topic_id]
+        SUBSCRIPTION_TOPICS.set(len(self.topics))
+
+    def _schedule_recompute(self, topic: Topic):
+        if topic.computing is not None and not topic.computing.done():
+            # the running computation may have read its data already; run again once it finishes
+            topic.recompute_pending = True
+            return
+        topic.computing = asyncio.get_running_loop().create_task(self._recompute(topic))
+
+    async def _recompute(self, topic: Topic):
+        try:
+            await self._compute_and_publish(topic)
+        finally:
+            if topic.recompute_pending:
+                topic.recompute_pending = False
+                topic.computing = asyncio.get_running_loop().create_task(self._recompute(topic))
+
+    async def _compute_and_publish(self, topic: Topic):
+        try:
+            allocations = await asyncio.to_thread(self._compute, topic.model_name, topic.payload)
+        except Exception as e:
+            SUBSCRIPTION_RECOMPUTES.inc(result="error")
+            self._broadcast(topic, {"event": "error", "topic": topic.topic_id, "error": str(e)})
+            return
+
+        SUBSCRIPTION_RECOMPUTES.inc(result="ok")
+        previous = topic.allocations
+        topic.allocations = allocations
+        topic.as_of = time.time()
+        if previous is None:
+            self._broadcast(topic, self._event(topic, allocations, full=True))
+            return
+        changed = diff_allocations(previous, allocations)
+        if changed:
+            self._broadcast(topic, self._event(topic, changed, full=False))
+
+    def _event(self, topic: Topic, allocations: Dict[str, float], full: bool) -> Dict:
+        return {
+            "event": "allocations",
+            "topic": topic.topic_id,
+            "as_of": topic.as_of,
+            "full": full,
+            "allocations": [{"asset": asset, "weight": weight} for asset, weight in allocations.items()],
+        }
+
+    def _broadcast(self, topic: Topic, event: Dict):
+        for queue in list(topic.listeners):
+            queue.put_nowait(event)
+
+
+def format_sse(event: Dict) -> str:
+    if event["event"] == "heartbeat":
+        return ": keep-alive\n\n"
+    data = {key: value for key, value in event.items() if key != "event"}
+    return f"event: {event['event']}\ndata: {json.dumps(data)}\n\n"
+
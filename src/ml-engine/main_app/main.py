@@ -1,52 +1,389 @@
 from starlette.applications import Starlette
+from starlette.middleware import Middleware
 from starlette.routing import Route
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response, StreamingResponse
 from starlette.endpoints import HTTPEndpoint
-from jsonschema import validate, ValidationError
-from main_app.models.black_litterman.BlPortfolioModel import BlPortfolioModel
-from main_app.data_classes.BlackLittermanModelData import BlackLittermanModelData
-from infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol
+from main_app.models.registry import MODEL_REGISTRY, ModelInputError, PayloadValidationError, UnknownModelError
+from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol, get_pool_resolver, \
+    get_pool_summary_data
+from main_app.infrastructure.goldsky import PRICE_UPDATES, TRANSACTIONS, get_goldsky_store
+from main_app.infrastructure.metrics import MetricsMiddleware, metrics_endpoint, track_stage
+from main_app.infrastructure.batches import BATCH_MAX_REQUESTS, BatchOutcome, BatchRun
+from main_app.infrastructure.memory import MEMORY_ACCOUNTING, MEMORY_DOWNGRADED_HEADER, MEMORY_ESTIMATE_HEADER, \
+    MEMORY_PEAK_HEADER, MemoryAccount, MemoryBudgetExceeded, MemoryBusy, get_memory_governor
+from main_app.infrastructure.jobs import SUCCEEDED, TERMINAL_STATUSES, get_job_manager
+from main_app.infrastructure.series_cache import etag_for, get_series_cache, not_modified, parse_since, \
+    validator_headers
+from main_app.infrastructure.shared_panels import SHARED_PANELS_ENABLED, PanelRefresher, get_panel_store, \
+    shared_pool_history_version
+from main_app.infrastructure.subscriptions import SUBSCRIPTION_HEARTBEAT_SECONDS, SubscriptionHub, format_sse
+from main_app.infrastructure.profiling import ProfilingNotAuthorised, attach_profile, profiles_endpoint, \
+    profiling_session
+from main_app.infrastructure.resilience import MODEL_COMPUTE_RESERVE_SECONDS, MODEL_LATENCY_BUDGET_SECONDS, \
+    CircuitOpenError, DeadlineExceeded, UpstreamError, UpstreamTimeout, latency_budget
+from contextlib import asynccontextmanager, nullcontext
+from functools import partial
+import anyio
+import asyncio
 import json
 import uvicorn
 
+JOB_EVENT_POLL_SECONDS = 0.25
+
+
+def start_profiling(request):
+    """
+    Returns the profiling session requested by the caller (None if profiling was not requested)
+    and an error response if the request could not be honoured.
+    """
+    try:
+        return profiling_session(request), None
+    except ProfilingNotAuthorised as e:
+        return None, JSONResponse({'error': str(e)}, status_code=403)
+    except ValueError as e:
+        return None, JSONResponse({'error': str(e)}, status_code=400)
+
+
+def validate_model_payload(model_name, data):
+    """Validates a model payload against the model's JSON schema, returning an error response if it is invalid."""
+    try:
+        MODEL_REGISTRY.validate(model_name, data)
+    except UnknownModelError as e:
+        return JSONResponse({'error': e.args[0]}, status_code=404)
+    except PayloadValidationError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    return None
+
+
+def upstream_error_status(error):
+    """The status of an upstream failure or an exhausted latency budget: 504, 503 or 502."""
+    if isinstance(error, (DeadlineExceeded, UpstreamTimeout)):
+        return 504
+    if isinstance(error, CircuitOpenError):
+        return 503
+    return 502
+
+
+def upstream_error_response(error):
+    """Maps an upstream failure or an exhausted latency budget to a 504, 503 or 502 error response."""
+    status = upstream_error_status(error)
+    if status == 503:
+        return JSONResponse({'error': str(error)}, status_code=503,
+                            headers={'Retry-After': str(max(1, round(error.retry_after)))})
+    return JSONResponse({'error': str(error)}, status_code=status)
+
+
+async def run_within_budget(budget, func, *args):
+    """
+    Runs `func(*args)` in a worker thread, so the event loop keeps serving other requests, and
+    raises DeadlineExceeded as soon as the budget has run out. The abandoned run stops at its
+    next tracked stage, where the budget's stage listener raises in its thread.
+    """
+    timeout = None if budget.seconds is None else max(budget.remaining(), 0.0)
+    try:
+        return await asyncio.wait_for(anyio.to_thread.run_sync(partial(func, *args), abandon_on_cancel=True), timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"The {budget.seconds:g}s latency budget ran out") from None
+
+
+def plan_model_memory(model_name, data):
+    """
+    Returns the memory plan of a validated payload (see `memory.MemoryGovernor.plan`) and an
+    error response if the request cannot fit its memory budget.
+    """
+    try:
+        return get_memory_governor().plan(model_name, data), None
+    except MemoryBudgetExceeded as e:
+        return None, JSONResponse({'error': str(e)}, status_code=413)
+
+
+def memory_busy_response(error):
+    return JSONResponse({'error': str(error)}, status_code=503,
+                        headers={'Retry-After': str(max(1, round(error.retry_after)))})
+
+
+def memory_account(model_name):
+    """Accounts the memory of a model run if `VV_MEMORY_ACCOUNTING` is set."""
+    return MemoryAccount(str(model_name).lower()) if MEMORY_ACCOUNTING else nullcontext()
+
+
+def flag_memory(response, plan, account=None):
+    """Reports the estimated (and, if accounted, the measured) peak memory and any downgrades in the headers."""
+    response.headers[MEMORY_ESTIMATE_HEADER] = str(plan.estimate)
+    if plan.downgrades:
+        response.headers[MEMORY_DOWNGRADED_HEADER] = ','.join(plan.downgrades)
+    if account is not None:
+        response.headers[MEMORY_PEAK_HEADER] = str(account.peak_bytes)
+    return response
+
+
+def flag_stale(response, budget):
+    """Lists the upstream sources served from their last good value, if any, in `X-Stale-Sources`."""
+    if budget.stale:
+        response.headers['X-Stale-Sources'] = ','.join(budget.stale)
+    return response
+
+
+def conditional_response(request, body, etag, last_modified=None, media_type='application/json'):
+    """Returns 304 if the request's If-None-Match / If-Modified-Since still match, else the body."""
+    headers = validator_headers(etag, last_modified)
+    if not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def series_response(request, series):
+    """Serves a cached series, conditionally and limited to the rows after `since` if given."""
+    with track_stage("MarketDataEndpoint", "serialise"):
+        since = request.query_params.get('since')
+        body = series.body(parse_since(since) if since else None)
+    return conditional_response(request, body, series.etag, series.last_modified)
+
+
+def run_model(model_name, payload):
+    return MODEL_REGISTRY.run(model_name, payload)
+
 
 class ModelEndpoint(HTTPEndpoint):
     async def post(self, request):
         data = await request.json()
         model_name = request.path_params['model_name']
 
-        schema_file = 'data_classes/BlackLittermanModelDataSchema.json'
-        with open(schema_file, 'r') as file:
-            schema = json.load(file)
-        try:
-            validate(instance=data, schema=schema)
-        except ValidationError as e:
-            return JSONResponse({'error': str(e)}, status_code=400)
+        error_response = validate_model_payload(model_name, data)
+        if error_response is not None:
+            return error_response
 
-        result = self.run_model(model_name, data)
-        response = result.to_json()
+        plan, error_response = plan_model_memory(model_name, data)
+        if error_response is not None:
+            return error_response
 
-        return JSONResponse(response)
+        session, error_response = start_profiling(request)
+        if error_response is not None:
+            return error_response
 
+        # upstream calls stop short of the budget so stale data can still be served and modelled in time
+        with latency_budget(MODEL_LATENCY_BUDGET_SECONDS, MODEL_COMPUTE_RESERVE_SECONDS) as budget:
+            try:
+                response, account = await run_within_budget(budget, self.compute, model_name, plan, session)
+            except MemoryBusy as e:
+                return memory_busy_response(e)
+            except (DeadlineExceeded, UpstreamError) as e:
+                return upstream_error_response(e)
+
+        return attach_profile(flag_memory(flag_stale(JSONResponse(response), budget), plan, account), session)
+
+    def compute(self, model_name, plan, session):
+        # runs in a worker thread, which the profiling session and memory account then observe
+        with get_memory_governor().reserve(model_name, plan.estimate), session or nullcontext(), \
+                memory_account(model_name) as account:
+            result = self.run_model(model_name, plan.payload)
+            with track_stage("ModelEndpoint", "serialise"):
+                return result.to_json(), account
 
     def run_model(self, model_name, payload):
-        if str(model_name).lower() != 'blacklitterman':
-            raise Exception('Only BlackLitterman model is supported at present')
+        return run_model(model_name, payload)
+
+
+def batch_item_failure(error):
+    """Maps the failure of one batched model run to its outcome; unexpected errors are a 500 of that payload only."""
+    if isinstance(error, MemoryBudgetExceeded):
+        return BatchOutcome(413, error=str(error))
+    if isinstance(error, MemoryBusy):
+        return BatchOutcome(503, error=str(error))
+    if isinstance(error, (PayloadValidationError, ModelInputError)):
+        return BatchOutcome(400, error=str(error))
+    if isinstance(error, (DeadlineExceeded, UpstreamError)):
+        return BatchOutcome(upstream_error_status(error), error=str(error))
+    return BatchOutcome(500, error=f"The model run failed ({type(error).__name__})")
+
+
+class BatchEndpoint(HTTPEndpoint):
+    async def post(self, request):
+        # Handle the POST request for `/batch/run_model/{model_name}`: a JSON array of payloads
+        data = await request.json()
+        model_name = request.path_params['model_name']
+        if not isinstance(data, list):
+            return JSONResponse({'error': 'Expected a JSON array of model payloads'}, status_code=400)
+        if len(data) > BATCH_MAX_REQUESTS:
+            return JSONResponse({'error': f'A batch holds at most {BATCH_MAX_REQUESTS} payloads, got {len(data)}'},
+                                status_code=413)
+        try:
+            MODEL_REGISTRY.spec(model_name)
+        except UnknownModelError as e:
+            return JSONResponse({'error': e.args[0]}, status_code=404)
+
+        def run(payload):
+            MODEL_REGISTRY.validate(model_name, payload)
+            plan = get_memory_governor().plan(model_name, payload)
+            with get_memory_governor().reserve(model_name, plan.estimate), memory_account(model_name):
+                result = run_model(model_name, plan.payload)
+                with track_stage("BatchEndpoint", "serialise"):
+                    return json.loads(result.to_json())
+
+        # one budget for the whole batch, run off the event loop; payloads not finished in time are 504s
+        batch = BatchRun(str(model_name).lower(), data)
+        with latency_budget(MODEL_LATENCY_BUDGET_SECONDS, MODEL_COMPUTE_RESERVE_SECONDS) as budget:
+            try:
+                await run_within_budget(budget, batch.run, run, batch_item_failure)
+            except DeadlineExceeded:
+                pass
+        return flag_stale(JSONResponse([outcome.to_dict() for outcome in batch.outcomes()]), budget)
+
+
+class JobsEndpoint(HTTPEndpoint):
+    async def post(self, request):
+        # Handle the POST request for `/jobs/run_model/{model_name}`
+        if 'model_name' not in request.path_params:
+            return JSONResponse({'error': 'Method not allowed'}, status_code=405)
+        data = await request.json()
+        model_name = request.path_params['model_name']
+
+        error_response = validate_model_payload(model_name, data)
+        if error_response is not None:
+            return error_response
+        plan, error_response = plan_model_memory(model_name, data)
+        if error_response is not None:
+            return error_response
+
+        def work():
+            # a job waits for room in the process memory budget rather than being turned away
+            with get_memory_governor().reserve(model_name, plan.estimate, wait=True), memory_account(model_name):
+                result = run_model(model_name, plan.payload)
+                with track_stage("ModelEndpoint", "serialise"):
+                    return result.to_json()
+
+        job = get_job_manager().submit(f"run_model/{str(model_name).lower()}", work)
+        return JSONResponse(job.to_status(), status_code=202, headers={'Location': f'/jobs/{job.job_id}'})
+
+    async def get(self, request):
+        # Handle the GET request for `/jobs/{job_id}`, `/jobs/{job_id}/events` and `/jobs/{job_id}/result`
+        if 'job_id' not in request.path_params:
+            return JSONResponse({'error': 'Method not allowed'}, status_code=405)
+        job = get_job_manager().get(request.path_params['job_id'])
+        if job is None:
+            return JSONResponse({'error': 'Job not found'}, status_code=404)
+
+        if request.url.path.endswith('/result'):
+            if job.status == SUCCEEDED:
+                return Response(job.result, media_type='application/json')
+            if job.status in TERMINAL_STATUSES:
+                return JSONResponse(job.to_status(), status_code=409)
+            return JSONResponse(job.to_status(), status_code=202)
+
+        if request.url.path.endswith('/events'):
+            try:
+                last_event_id = int(request.headers.get('last-event-id', '0') or 0)
+            except ValueError:
+                return JSONResponse({'error': 'Last-Event-ID must be an event id of this job'}, status_code=400)
+            return StreamingResponse(self.stream_events(job.job_id, last_event_id), media_type='text/event-stream',
+                                     headers={'Cache-Control': 'no-cache'})
+
+        return JSONResponse(job.to_status())
+
+    async def delete(self, request):
+        # Handle the DELETE request for `/jobs/{job_id}`
+        if 'job_id' not in request.path_params:
+            return JSONResponse({'error': 'Method not allowed'}, status_code=405)
+        job = get_job_manager().cancel(request.path_params['job_id'])
+        if job is None:
+            return JSONResponse({'error': 'Job not found'}, status_code=404)
+        return JSONResponse(job.to_status(), status_code=202 if job.status not in TERMINAL_STATUSES else 200)
+
+    async def stream_events(self, job_id, last_event_id):
+        """Yields the job's events as server-sent events until the job reaches a terminal status."""
+        manager = get_job_manager()
+        sequence = last_event_id
+        while True:
+            # read the status first so events written before a terminal status are never skipped
+            job = manager.get(job_id)
+            for event in manager.store.events_since(job_id, sequence):
+                sequence = event.sequence
+                yield f"id: {event.sequence}\nevent: {event.event}\ndata: {json.dumps(event.data)}\n\n"
+            if job is None or job.status in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(JOB_EVENT_POLL_SECONDS)
+
+
+def compute_allocations(model_name, payload):
+    # the payload was planned when the topic was subscribed; a recompute waits for room in the process memory budget
+    estimate = get_memory_governor().estimate(model_name, payload)
+    with get_memory_governor().reserve(model_name, estimate, wait=True), memory_account(model_name):
+        result = run_model(model_name, payload)
+    return {allocation.asset: allocation.weight for allocation in result.ModelResults[0].Allocations}
+
+
+def latest_observations(symbols):
+    # one pool summary request per poll, rather than every symbol's chart: the current APY and
+    # TVL of a symbol's primary pool change with each new observation
+    pools = {pool.pool: pool for pools in get_pool_summary_data().values() for pool in pools}
+    resolver = get_pool_resolver()
+    markers = {}
+    for symbol in symbols:
+        pool = pools.get(resolver.primary_pool(symbol)) if resolver.is_supported(symbol) else None
+        markers[symbol] = (pool.apy, pool.tvlUsd) if pool is not None else None
+    return markers
+
+
+_subscription_hub = None
+
+
+def get_subscription_hub():
+    global _subscription_hub
+    if _subscription_hub is None:
+        _subscription_hub = SubscriptionHub(compute_allocations, latest_observations)
+    return _subscription_hub
+
+
+class SubscriptionsEndpoint(HTTPEndpoint):
+    async def post(self, request):
+        # Handle the POST request for `/subscriptions/run_model/{model_name}`
+        if 'model_name' not in request.path_params:
+            return JSONResponse({'error': 'Method not allowed'}, status_code=405)
+        data = await request.json()
+        model_name = request.path_params['model_name']
+
+        error_response = validate_model_payload(model_name, data)
+        if error_response is not None:
+            return error_response
 
-        # Build model and calculate
-        json_payload = json.dumps(payload)
-        model_data = BlackLittermanModelData.from_json(json_payload)
-        model = BlPortfolioModel(model_data=model_data)
-        result = model.calculate()
+        plan, error_response = plan_model_memory(model_name, data)
+        if error_response is not None:
+            return error_response
+
+        topic = get_subscription_hub().subscribe(model_name, plan.payload)
+        events_url = f'/subscriptions/{topic.topic_id}/events'
+        return JSONResponse({'topic_id': topic.topic_id, 'events': events_url}, status_code=201,
+                            headers={'Location': events_url})
+
+    async def get(self, request):
+        # Handle the GET request for `/subscriptions/{topic_id}/events`
+        hub = get_subscription_hub()
+        topic_id = request.path_params.get('topic_id')
+        if topic_id not in hub.topics:
+            return JSONResponse({'error': 'Subscription not found'}, status_code=404)
 
-        return result
+        async def stream():
+            async for event in hub.listen(topic_id, heartbeat=SUBSCRIPTION_HEARTBEAT_SECONDS):
+                yield format_sse(event)
+
+        return StreamingResponse(stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 
 class MarketDataEndpoint(HTTPEndpoint):
     async def get(self, request):
+        session, error_response = start_profiling(request)
+        if error_response is not None:
+            return error_response
+
+        with session or nullcontext():
+            response = await self.dispatch_get(request)
+
+        return attach_profile(response, session)
+
+    async def dispatch_get(self, request):
         # Handle the GET request for `/symbols`
         if request.url.path == "/market_data/symbols":
-            return await self.get_supported_symbols_json()
+            return await self.get_supported_symbols_json(request)
 
         if "metric_set" in request.path_params:
             return await self.get_metrics(request)
@@ -60,12 +397,29 @@ class MarketDataEndpoint(HTTPEndpoint):
         return JSONResponse({"error": "Endpoint not found"}, status_code=404)
 
     async def get_metrics(self, request):
+        since = request.query_params.get('since')
+        try:
+            if since:
+                parse_since(since)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        with latency_budget(None) as budget:
+            try:
+                return flag_stale(self.get_provider_metrics(request), budget)
+            except UpstreamError as e:
+                return upstream_error_response(e)
+
+    def get_provider_metrics(self, request):
         provider = str(request.path_params['provider'])
         metric_set = str(request.path_params['metric_set'])
         symbol = str(request.path_params['symbol'])
     
+        if provider.lower() == 'goldsky':
+            return self.get_goldsky_metrics(request, metric_set.lower(), symbol)
+
         if provider.lower() != 'defillama':
-            return JSONResponse({"error": "'Only DefiLlama market data provider is supported at present'"}, status_code=404)
+            return JSONResponse({"error": "'Only DefiLlama and Goldsky market data providers are supported at present'"}, status_code=404)
     
         if metric_set.lower() != 'tvl_and_apy':
             return JSONResponse({"error": "'Only tvl_and_apy market data metric set is supported at present'"}, status_code=404)
@@ -73,26 +427,75 @@ class MarketDataEndpoint(HTTPEndpoint):
         if symbol.upper() not in self.get_supported_symbols():
             return JSONResponse({"error": "Symbol not supported"}, status_code=404)
     
-        df = get_historic_tvl_and_apy_from_symbol(symbol.upper())
-        json_data = df.to_json(orient="records")
-        return JSONResponse(content=json.loads(json_data), status_code=200)
+        # served from the cached series until the shared panel changes or, without shared panels, its TTL ends
+        symbol = symbol.upper()
+        series = get_series_cache().get(("defillama", "tvl_and_apy", symbol),
+                                        lambda: get_historic_tvl_and_apy_from_symbol(symbol), "timestamp",
+                                        version=lambda: shared_pool_history_version(symbol))
+        return series_response(request, series)
+
+    def get_goldsky_metrics(self, request, metric_set, symbol):
+        # symbol is a vault id for 'vault_flows' and an asset for 'prices'
+        store = get_goldsky_store()
+        if metric_set == 'vault_flows':
+            load, entity = (lambda: store.vault_flows(vault_id=symbol)), TRANSACTIONS.name
+        elif metric_set == 'prices':
+            load, entity = (lambda: store.price_series(symbol)), PRICE_UPDATES.name
+        else:
+            return JSONResponse({"error": "'Only vault_flows and prices Goldsky metric sets are supported at present'"}, status_code=404)
+
+        # cached until the ingestor commits new rows for the entity
+        series = get_series_cache().get(("goldsky", store.root, metric_set, symbol), load, "date",
+                                        version=lambda: store.version(entity))
+        if series.empty:
+            return JSONResponse({"error": "Symbol not supported"}, status_code=404)
+        return series_response(request, series)
 
-    async def get_supported_symbols_json(self):
+    async def get_supported_symbols_json(self, request):
         # Logic to return the supported symbols for market data
-        return JSONResponse({"symbols": self.get_supported_symbols()})
+        response = JSONResponse({"symbols": self.get_supported_symbols()})
+        return conditional_response(request, response.body, etag_for(response.body))
 
     def get_supported_symbols(self):
-        # Logic to return the supported symbols for market data
-        return ["STETH", "GHO", "USDC", "WBTC", "JITOSOL"]
+        return get_supported_symbols()
+
+
+def get_supported_symbols():
+    # Pinned symbols plus every symbol with pools and a known contract address
+    return get_pool_resolver().supported_symbols()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    refresher = None
+    if SHARED_PANELS_ENABLED:
+        # every worker runs a refresher; only the one holding the store lock fetches and publishes
+        refresher = PanelRefresher(
+            get_panel_store(), get_supported_symbols,
+            lambda symbol: get_historic_tvl_and_apy_from_symbol(symbol, use_shared_panels=False))
+        refresher.start()
+    yield
+    if refresher is not None:
+        refresher.stop()
 
 
 routes = [
     Route('/run_model/{model_name}', ModelEndpoint),
     Route('/market_data/metrics/{provider}/{metric_set}/{symbol}', MarketDataEndpoint),
-    Route('/market_data/symbols', MarketDataEndpoint)
+    Route('/market_data/symbols', MarketDataEndpoint),
+    Route('/batch/run_model/{model_name}', BatchEndpoint),
+    Route('/jobs/run_model/{model_name}', JobsEndpoint),
+    Route('/jobs/{job_id}', JobsEndpoint),
+    Route('/jobs/{job_id}/events', JobsEndpoint),
+    Route('/jobs/{job_id}/result', JobsEndpoint),
+    Route('/subscriptions/run_model/{model_name}', SubscriptionsEndpoint),
+    Route('/subscriptions/{topic_id}/events', SubscriptionsEndpoint),
+    Route('/metrics', metrics_endpoint),
+    Route('/profiles/{profile_id}', profiles_endpoint)
 ]
 
-app = Starlette(routes=routes)
+app = Starlette(routes=routes, middleware=[Middleware(MetricsMiddleware)], lifespan=lifespan)
+MODEL_REGISTRY.preload_from_env()
 
 if __name__ == "__main__":
     uvicorn.run(app, port=8000)
\ No newline at end of file
@@ -1,9 +1,29 @@
-from typing import List
+from typing import List, Optional, Union
 
 import numpy as np
 import pandas as pd
 from pypfopt import expected_returns
-from main_app.data_classes.BlackLittermanModelData import ExplicitReturnView
+from main_app.data_classes.BlackLittermanModelData import ExplicitReturnView, SignalWeight
+from main_app.infrastructure.compact_panels import Panel
+from main_app.infrastructure.metrics import track_stage
+from main_app.models.signals import MOMENTUM, get_rolling_signals
+
+_COMPONENT = "BlExplicitReturnViewGenerator"
+VALUATION = "valuation"
+# the generator's original views: one month momentum and the valuation proxy, equally weighted
+DEFAULT_SIGNALS = [SignalWeight(Signal=MOMENTUM, Weight=0.5, Horizon=30), SignalWeight(Signal=VALUATION, Weight=0.5)]
+
+
+def check_signals(signals: List[dict]):
+    """
+    Raises a ValueError if a requested signal cannot be computed: every signal but valuation
+    needs one of the configured horizons (`VV_SIGNAL_HORIZONS`).
+    """
+    horizons = get_rolling_signals().horizons
+    for signal in signals:
+        if signal["Signal"] != VALUATION and signal.get("Horizon") not in horizons:
+            raise ValueError(f"Signal '{signal['Signal']}' needs a horizon in days, one of "
+                             f"{', '.join(map(str, horizons))}; got {signal.get('Horizon')}")
 
 
 class BlView:
@@ -14,25 +34,31 @@ class BlView:
 
 
 class BlExplicitReturnViewGenerator:
-    def __init__(self, indexes: List[str], asset_market_data: pd.DataFrame = None,
-                 portfolio_views_data: List[ExplicitReturnView] = None):
+    def __init__(self, indexes: List[str], asset_market_data: Union[pd.DataFrame, Panel] = None,
+                 portfolio_views_data: List[ExplicitReturnView] = None, signals: Optional[List[SignalWeight]] = None):
         """
         Initializes the ViewGenerator with asset indexes and APY data.
 
         Args:
             indexes: List of asset identifiers.
-            asset_market_data: DataFrame containing APY data for the assets.
+            asset_market_data: APY data for the assets, as a DataFrame or a compact panel.
+            signals: The weighted signals combined into views when no portfolio views are given
+                (`DEFAULT_SIGNALS` if None).
         """
         self._indexes = indexes
         self._asset_market_data = asset_market_data
         self._portfolio_views_data = portfolio_views_data
+        self._signals = signals or DEFAULT_SIGNALS
 
-    def calculate(self) -> List[BlView]:
+    def calculate(self, mu: Optional[pd.Series] = None) -> List[BlView]:
         # Extract data
         """
-        Generates a list of normalized view vectors based on momentum and valuation signals.
+        Returns the portfolio views, or generates one absolute view per asset from market signals.
 
-        Calculates 3-month momentum and a valuation proxy for each asset, combines them using different weights, normalizes each resulting view, and returns the list of view series.
+        Without portfolio views, the weighted signals (momentum, mean reversion and volatility scaled momentum over the configured horizons, see `main_app.models.signals`, and a valuation proxy) are summed per asset and normalised into the view returns; each view's confidence is its return relative to the largest.
+
+        Args:
+            mu: Mean historical returns of the assets, if already computed; calculated from the APY data otherwise.
         """
 
         if self._portfolio_views_data is None and self._asset_market_data is None:
@@ -41,26 +67,40 @@ class BlExplicitReturnViewGenerator:
         portfolio_views = self._portfolio_views_data
         # at present only contain apy data, this could be extended for other data types
         apy_data = self._asset_market_data
+        apy_panel = apy_data if isinstance(apy_data, Panel) else None
+        if isinstance(apy_data, Panel):
+            apy_data = apy_data.to_frame()
 
         # Calculate historical returns
-        mu = expected_returns.mean_historical_return(apy_data)
+        if mu is None:
+            with track_stage(_COMPONENT, "mean_historical_return"):
+                mu = expected_returns.mean_historical_return(apy_data)
 
         # Case where we have no model data and everything must be calculated from market data
         if portfolio_views is None:
-            # Create simple momentum + valuation signals
-            period = min(30, len(apy_data) - 1)
-            if period <= 0:
-                raise ValueError("Not enough history to compute momentum view")
-
-            momentum = 2 * (apy_data.iloc[0] / apy_data.iloc[period] - 1) * 365 / period  # 1-month momentum
-            safe_mu = mu.replace(0, np.nan)
-            valuation = 0.03 / safe_mu.fillna(safe_mu.mean())  # crude valuation proxy: inverse historical return
-
-            # Combine into views
-            m = 0.5
-            returns = (m * momentum + (1 - m) * valuation).pipe(lambda s: 0.05 * s / np.linalg.norm(s))
-            confidences = [np.abs(ret) / returns.abs().max() for ret in returns]
-            weights = pd.Series(1, index=returns.index)
+            with track_stage(_COMPONENT, "signals"):
+                if len(apy_data) < 2:
+                    raise ValueError("Not enough history to compute momentum view")
+                frame = get_rolling_signals().compute(apy_panel if apy_panel is not None else Panel.from_frame(apy_data))
+                combined = np.zeros(len(apy_data.columns))
+                for signal in self._signals:
+                    if signal.Signal == VALUATION:
+                        safe_mu = mu.replace(0, np.nan)
+                        # crude valuation proxy: inverse historical return
+                        values = (0.03 / safe_mu.fillna(safe_mu.mean())).to_numpy()
+                    else:
+                        if signal.Horizon is None:
+                            raise ValueError(f"Signal '{signal.Signal}' needs a horizon")
+                        values = frame.signal(signal.Signal, signal.Horizon)
+                    # an asset without enough history for a signal gets no view from it
+                    combined += signal.Weight * np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0)
+
+                # Combine into one absolute view per asset
+                norm = np.linalg.norm(combined)
+                returns = 0.05 * combined / norm if norm > 0 else combined
+                largest = np.abs(returns).max()
+                confidences = np.abs(returns) / largest if largest > 0 else np.zeros(len(returns))
+                weights = np.eye(len(returns))
         else:
             returns = [view.ExpectedReturn for view in portfolio_views]
             confidences = [view.Confidence for view in portfolio_views]
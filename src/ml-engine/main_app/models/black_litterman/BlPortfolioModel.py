@@ -1,13 +1,88 @@
+import json
+from typing import Dict, List, Tuple
+
 import numpy as np
 import pandas as pd
 from pypfopt.black_litterman import BlackLittermanModel, market_implied_risk_aversion
 from main_app.data_classes.BlackLittermanModelData import BlackLittermanModelData
-from pypfopt import risk_models
-from pypfopt.efficient_frontier import EfficientFrontier
+from pypfopt import expected_returns
 from main_app.data_classes.BlackLittermanModelResults import BlackLittermanModelResults, ModelResult, AllocationResult, ViewResult, \
     AssetViewResult
-from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol
-from main_app.models.black_litterman.BlExplicitReturnViewGenerator import BlExplicitReturnViewGenerator
+from main_app.infrastructure.compact_panels import Panel, PoolHistory
+from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol, history_version
+from main_app.infrastructure.metrics import track_stage
+from main_app.infrastructure.stage_graph import Stage, StageGraph
+from main_app.models import optimisers
+from main_app.models.registry import ModelInputError
+from main_app.models.market_panels import apy_panel, daily_resample, sample_cov, tvl_panel
+from main_app.models.risk_report import allocation_risk
+from main_app.models.black_litterman.BlExplicitReturnViewGenerator import BlExplicitReturnViewGenerator, BlView, \
+    check_signals
+
+
+_COMPONENT = "BlPortfolioModel"
+
+
+def fetch_histories(symbols: List[str], history_versions) -> List[PoolHistory]:
+    # the versions only key the stage; a symbol's history is fetched whenever the stage runs
+    market_data = []
+    for symbol in symbols:
+        with track_stage(_COMPONENT, "fetch"):
+            try:
+                market_data.append(get_historic_tvl_and_apy_from_symbol(symbol))
+            except ValueError as e:  # an unsupported symbol
+                raise ModelInputError(str(e)) from e
+    return daily_resample(market_data)
+
+
+def mean_historical_return(apy: Panel) -> pd.Series:
+    return expected_returns.mean_historical_return(apy.to_frame())
+
+
+def prior(symbols: List[str], S: pd.DataFrame, apy: Panel, tvl: Panel) -> pd.Series:
+    # Compute equilibrium market returns (CAPM-implied)
+    tvl_series = pd.Series(tvl.to_frame().iloc[0], index=symbols)
+    delta = market_implied_risk_aversion(apy.to_frame().iloc[0])  # ~2.5–3 by default
+    return delta * S @ tvl_series / tvl_series.sum()
+
+
+def views(symbols: List[str], apy: Panel, mu: pd.Series, portfolio_views, signals) -> List[BlView]:
+    return BlExplicitReturnViewGenerator(symbols, apy, portfolio_views, signals).calculate(mu=mu)
+
+
+def posterior(S: pd.DataFrame, pi: pd.Series, bl_views: List[BlView]) -> Tuple[pd.Series, pd.DataFrame]:
+    # Create uncertainty (more signal → lower variance)
+    confidence = np.diag([v.Confidence for v in bl_views])
+    omega = np.diag((1 - np.diagonal(confidence) + 0.05))  # add small floor for stability
+
+    picking_matrix = np.array([v.Weights for v in bl_views], dtype=float)  # picking matrix of weights
+    return_vector = np.array([v.ExpectedReturn for v in bl_views])
+    bl = BlackLittermanModel(S, pi=pi, omega=omega, P=picking_matrix, Q=return_vector)
+    return bl.bl_returns(), bl.bl_cov()
+
+
+def max_sharpe(bl_posterior: Tuple[pd.Series, pd.DataFrame]) -> Dict[str, float]:
+    bl_return, bl_cov = bl_posterior
+    # long-only max Sharpe, on the backend chosen by VV_OPTIMISER_BACKEND (pypfopt for unsupported problems)
+    return optimisers.max_sharpe(bl_return, bl_cov)
+
+
+# data -> daily panels -> covariance/mean -> prior -> views -> posterior -> optimise; each stage is
+# memoised on its inputs, so a run recomputes only what changed since an earlier run
+PIPELINE = StageGraph(_COMPONENT, [
+    # keyed on the symbols' history versions, so unchanged histories are neither fetched nor compacted again
+    Stage("histories", fetch_histories, ("symbols", "history_versions")),
+    Stage("apy_panel", apy_panel, ("symbols", "histories")),
+    Stage("tvl_panel", tvl_panel, ("symbols", "histories")),
+    Stage("sample_cov", sample_cov, ("symbols", "histories", "apy_panel")),
+    Stage("mean_historical_return", mean_historical_return, ("apy_panel",)),
+    Stage("prior", prior, ("symbols", "sample_cov", "apy_panel", "tvl_panel")),
+    Stage("views", views, ("symbols", "apy_panel", "mean_historical_return", "portfolio_views", "signals")),
+    Stage("posterior", posterior, ("sample_cov", "prior", "views")),
+    Stage("max_sharpe", max_sharpe, ("posterior",)),
+    # only evaluated when the payload asks for a risk report
+    Stage("risk_report", allocation_risk, ("symbols", "apy_panel", "sample_cov", "max_sharpe", "risk_confidence")),
+])
 
 
 class BlPortfolioModel:
@@ -15,94 +90,69 @@ class BlPortfolioModel:
         """
         Initializes the Black-Litterman portfolio model with market data.
         
-        Constructs asset identifiers, APY, and TVL data frames from the provided model data. Raises a ValueError if required market data is missing. Instantiates a ViewGenerator for generating views based on the APY data.
+        Fetches the APY and TVL history of every asset, unless its version is unchanged since an earlier run, and builds the daily panels of the model's stage pipeline. Raises a ModelInputError if required market data is missing.
         """
         self._model_data = model_data
         self._indexes = model_data.AssetSymbols
 
-        self._apy_data = pd.DataFrame()
-        self._tvl_data = pd.DataFrame()
-
-        # get market data
-        for symbol in self._indexes:
-            df = get_historic_tvl_and_apy_from_symbol(symbol)
-
-            # we only use the last value each day for model purposes to reduce noise
-            df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.date
-            df = df.groupby("timestamp").last()
-
-            # Sort by descending date and only include the last 365 days
-            df = df.sort_index(ascending=False)
-            df = df.iloc[:365]
-
-            self._apy_data[symbol] = df["apy"] / 100
-            self._tvl_data[symbol] = df["tvlUsd"]
-            
-            self._apy_data.fillna(method="bfill", inplace=True)
-            self._tvl_data.fillna(method="bfill", inplace=True)
-
-        if self._apy_data.empty or self._tvl_data.empty:
-            raise ValueError("Missing APY or TVL data")
-
-        # Create a view generator used to create views to be consumed by the model
-        self.view_generator = BlExplicitReturnViewGenerator(self._indexes, self._apy_data, self._model_data.PortfolioViews)
+        self._run = PIPELINE.run(symbols=list(self._indexes),
+                                 history_versions=[history_version(symbol) for symbol in self._indexes],
+                                 portfolio_views=self._model_data.PortfolioViews,
+                                 signals=self._model_data.ModelParameters.Signals,
+                                 risk_confidence=self._model_data.ModelParameters.RiskConfidence)
+        if self._run.get("apy_panel").empty or self._run.get("tvl_panel").empty:
+            raise ModelInputError("Missing APY or TVL data")
 
     def calculate(self) -> BlackLittermanModelResults:
         """
         Runs the Black-Litterman portfolio optimization using APY and TVL data.
         
-        Calculates the sample covariance and equilibrium market returns, generates multiple views based on momentum and valuation signals, and applies the Black-Litterman model to adjust expected returns and covariances. For each view, optimizes the portfolio for maximum Sharpe ratio and aggregates the resulting views and allocations into model results.
+        Calculates the sample covariance and equilibrium market returns, generates multiple views based on momentum and valuation signals, and applies the Black-Litterman model to adjust expected returns and covariances. For each view, optimizes the portfolio for maximum Sharpe ratio and aggregates the resulting views and allocations into model results, with the allocation's risk report if requested. Stages whose inputs are unchanged since an earlier run are reused (see `stage_report`).
         
         Returns:
             BlackLittermanModelResults: The results of the Black-Litterman optimization, including per-view portfolio allocations and view details.
         """
         indexes = self._indexes
-        apy_data = self._apy_data
-        tvl_data = self._tvl_data
-
-        # Calculate historical returns and covariance
-        S = risk_models.sample_cov(apy_data)
-
-        # Step 1: Compute equilibrium market returns (CAPM-implied)
-        tvl = tvl_data.iloc[0]
-        tvl_series = pd.Series(tvl, index=indexes)
-        delta = market_implied_risk_aversion(apy_data.iloc[0])  # ~2.5–3 by default
-        prior = delta * S @ tvl_series / tvl_series.sum()
-
-        # Create uncertainty (more signal → lower variance)
-        views = self.view_generator.calculate()
+        bl_views = self._run.get("views")
+        cleaned_weights = self._run.get("max_sharpe")
 
-        model_results = []
-
-        confidence = np.diag([v.Confidence for v in views])
-        omega = np.diag((1 - np.diagonal(confidence) + 0.05))  # add small floor for stability
-
-        # Step 3: Apply Black-Litterman model
-        picking_matrix = [v.Weights for v in views] # picking matrix of weights
-        return_vector = np.array([v.ExpectedReturn for v in views])
-        bl = BlackLittermanModel(S, pi=prior, omega=omega, P=picking_matrix, Q=return_vector)
-        bl_return = bl.bl_returns()
-        bl_cov = bl.bl_cov()
-
-        # Step 4: Get portfolio weights
-        ef = EfficientFrontier(bl_return, bl_cov)
-        weights = ef.max_sharpe()  # Uncomment this or choose another optimization objective
-        cleaned_weights = ef.clean_weights()
         view_result = [
             ViewResult(
                 Weights=[AssetViewResult(indexes, list(view.Weights))],
                 Return=view.ExpectedReturn,
                 Confidence=view.Confidence
             )
-            for view in views
+            for view in bl_views
         ]
         allocations = [
             AllocationResult(asset, weight)
             for asset, weight in cleaned_weights.items()
         ]
-        model_results.append(ModelResult(Views=view_result, Allocations=allocations))
+        risk = self._run.get("risk_report") if self._model_data.ModelParameters.RiskReport else None
+        model_results = [ModelResult(Views=view_result, Allocations=allocations, Risk=risk)]
 
         return BlackLittermanModelResults(
             Model=self._model_data.Model,
             Submodel=self._model_data.Submodel,
-            ModelResults=model_results)
\ No newline at end of file
+            ModelResults=model_results)
+
+    def stage_report(self) -> Dict[str, str]:
+        """The pipeline stages evaluated so far, each mapped to 'reused' or 'computed'."""
+        return self._run.report()
+
+
+def check_payload(payload: dict):
+    """Checks a schema-valid payload against the configured signal horizons (see `check_signals`)."""
+    check_signals((payload.get("ModelParameters") or {}).get("Signals") or [])
+
+
+def run_model(payload: dict) -> BlackLittermanModelResults:
+    """
+    Decodes a validated `/run_model/blacklitterman` payload, builds the model and runs it.
+
+    This is the entry point registered for the model in `main_app.models.registry`.
+    """
+    with track_stage("ModelEndpoint", "decode"):
+        model_data = BlackLittermanModelData.from_json(json.dumps(payload))
+    model = BlPortfolioModel(model_data=model_data)
+    return model.calculate()
@@ -0,0 +1,161 @@
+"""
+Hierarchical Risk Parity (López de Prado, 2016) over the APY history of large pool universes.
+
+The assets are clustered on the correlation distance `sqrt((1 - corr) / 2)` of their daily
+APY returns, ordered so that similar assets sit next to each other (quasi-diagonalisation),
+and weighted by recursive bisection of that order: each split shares its parent's weight in
+inverse proportion to the variance of the two halves' inverse-variance portfolios. There is
+no quadratic program and no covariance inversion, so the allocation is well defined for
+singular covariances and scales to universes of thousands of pools, where the
+Black-Litterman model's optimiser does not. Weights match pypfopt's `HRPOpt(cov_matrix=...)`.
+"""
+import json
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
+
+from main_app.data_classes.BlackLittermanModelResults import AllocationResult, BlackLittermanModelResults, ModelResult
+from main_app.data_classes.HrpModelData import HrpModelData
+from main_app.infrastructure.compact_panels import PoolHistory
+from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol, history_version
+from main_app.infrastructure.metrics import track_stage
+from main_app.infrastructure.stage_graph import Stage, StageGraph
+from main_app.models import optimisers
+from main_app.models.registry import ModelInputError
+from main_app.models.market_panels import apy_panel, daily_resample, raw_sample_cov
+from main_app.models.risk_report import allocation_risk
+
+_COMPONENT = "HrpPortfolioModel"
+# floor on asset variances, so pools with a flat APY get a large but finite inverse-variance weight
+_MIN_VARIANCE = 1e-12
+
+
+def fetch_histories(symbols: List[str], history_versions) -> List[PoolHistory]:
+    # the versions only key the stage; a symbol's history is fetched whenever the stage runs
+    market_data = []
+    for symbol in symbols:
+        with track_stage(_COMPONENT, "fetch"):
+            try:
+                market_data.append(get_historic_tvl_and_apy_from_symbol(symbol))
+            except ValueError as e:  # an unsupported symbol
+                raise ModelInputError(str(e)) from e
+    return daily_resample(market_data)
+
+
+def _variances(S: pd.DataFrame) -> np.ndarray:
+    variances = np.diagonal(S.to_numpy(dtype=float))
+    if np.isnan(variances).any():
+        missing = [symbol for symbol, v in zip(S.columns, variances) if np.isnan(v)]
+        raise ModelInputError(f"Not enough APY history to estimate the variance of {', '.join(missing)}")
+    return np.maximum(variances, _MIN_VARIANCE)
+
+
+def quasi_diagonal_order(S: pd.DataFrame, linkage_method: str) -> np.ndarray:
+    # positions of the assets in the leaf order of the correlation distance dendrogram
+    if len(S) < 2:
+        return np.arange(len(S))
+    if linkage_method not in hierarchy._LINKAGE_METHODS:
+        raise ModelInputError(f"Unknown linkage method '{linkage_method}'")
+    sd = np.sqrt(_variances(S))
+    # pairs without overlapping history are taken as uncorrelated; rounded as pypfopt does
+    corr = np.round(np.nan_to_num(S.to_numpy(dtype=float) / np.outer(sd, sd), nan=0.0), 6)
+    distance = np.sqrt(np.clip((1.0 - corr) / 2.0, 0.0, 1.0))
+    clusters = hierarchy.linkage(squareform(distance, checks=False), linkage_method)
+    return hierarchy.leaves_list(clusters)
+
+
+def _cluster_variance(cov: np.ndarray, start: int, stop: int) -> float:
+    block = cov[start:stop, start:stop]
+    inverse_variance = 1.0 / np.diagonal(block)
+    inverse_variance /= inverse_variance.sum()
+    return float(inverse_variance @ block @ inverse_variance)
+
+
+def recursive_bisection(S: pd.DataFrame, order: np.ndarray) -> Dict[str, float]:
+    variances = _variances(S)
+    cov = np.nan_to_num(S.to_numpy(dtype=float), nan=0.0)
+    np.fill_diagonal(cov, variances)
+    # with the covariance permuted into leaf order every cluster is a contiguous block
+    cov = cov[np.ix_(order, order)]
+    ordered_weights = np.ones(len(order))
+    clusters = [(0, len(order))]
+    while clusters:
+        clusters = [half for start, stop in clusters if stop - start > 1
+                    for half in ((start, (start + stop) // 2), ((start + stop) // 2, stop))]
+        for (start, middle), (_, stop) in zip(clusters[::2], clusters[1::2]):
+            first = _cluster_variance(cov, start, middle)
+            second = _cluster_variance(cov, middle, stop)
+            alpha = 1 - first / (first + second)
+            ordered_weights[start:middle] *= alpha
+            ordered_weights[middle:stop] *= 1 - alpha
+    weights = np.empty(len(order))
+    weights[order] = ordered_weights
+    return optimisers.clean_weights(S.columns, weights)
+
+
+# data -> daily panels -> covariance -> dendrogram order -> bisection; the market-data stages are
+# those of the Black-Litterman pipeline, so both models share the union covariance. HRP only reads
+# correlations and diagonal blocks, so it takes the covariance as estimated, as pypfopt's HRPOpt does
+PIPELINE = StageGraph(_COMPONENT, [
+    # keyed on the symbols' history versions, so unchanged histories are neither fetched nor compacted again
+    Stage("histories", fetch_histories, ("symbols", "history_versions")),
+    Stage("apy_panel", apy_panel, ("symbols", "histories")),
+    Stage("sample_cov", raw_sample_cov, ("symbols", "histories", "apy_panel")),
+    Stage("quasi_diagonal_order", quasi_diagonal_order, ("sample_cov", "linkage_method")),
+    Stage("recursive_bisection", recursive_bisection, ("sample_cov", "quasi_diagonal_order")),
+    # only evaluated when the payload asks for a risk report
+    Stage("risk_report", allocation_risk,
+          ("symbols", "apy_panel", "sample_cov", "recursive_bisection", "risk_confidence")),
+])
+
+
+class HrpPortfolioModel:
+    def __init__(self, model_data: HrpModelData):
+        """
+        Initializes the Hierarchical Risk Parity model with market data.
+
+        Fetches the APY history of every asset, unless its version is unchanged since an earlier run, and builds the daily panel of the model's stage pipeline. Raises a ModelInputError if required market data is missing.
+        """
+        self._model_data = model_data
+        self._indexes = model_data.AssetSymbols
+
+        self._run = PIPELINE.run(symbols=list(self._indexes),
+                                 history_versions=[history_version(symbol) for symbol in self._indexes],
+                                 linkage_method=model_data.ModelParameters.LinkageMethod or "single",
+                                 risk_confidence=model_data.ModelParameters.RiskConfidence)
+        if self._run.get("apy_panel").empty:
+            raise ModelInputError("Missing APY data")
+
+    def calculate(self) -> BlackLittermanModelResults:
+        """
+        Runs the Hierarchical Risk Parity allocation on the covariance of daily APY returns.
+
+        Returns:
+            BlackLittermanModelResults: A single model result with the allocations, no views and, if requested, the allocation's risk report.
+        """
+        weights = self._run.get("recursive_bisection")
+        allocations = [AllocationResult(asset, weight) for asset, weight in weights.items()]
+        risk = self._run.get("risk_report") if self._model_data.ModelParameters.RiskReport else None
+        return BlackLittermanModelResults(
+            Model=self._model_data.Model,
+            Submodel=self._model_data.Submodel,
+            ModelResults=[ModelResult(Views=[], Allocations=allocations, Risk=risk)])
+
+    def stage_report(self) -> Dict[str, str]:
+        """The pipeline stages evaluated so far, each mapped to 'reused' or 'computed'."""
+        return self._run.report()
+
+
+def run_model(payload: dict) -> BlackLittermanModelResults:
+    """
+    Decodes a validated `/run_model/hrp` payload, builds the model and runs it.
+
+    This is the entry point registered for the model in `main_app.models.registry`.
+    """
+    with track_stage("ModelEndpoint", "decode"):
+        model_data = HrpModelData.from_json(json.dumps(payload))
+    model = HrpPortfolioModel(model_data=model_data)
+    return model.calculate()
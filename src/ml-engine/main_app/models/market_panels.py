@@ -0,0 +1,46 @@
+"""
+Market-data stages shared by the models' stage pipelines.
+
+Raw DefiLlama `/chart/{pool}` frames are compacted into daily pool histories, aligned into
+float32 APY/TVL panels over the latest `HISTORY_DAYS` days, and turned into the annualised
+covariance of daily APY returns (repaired to be positive semidefinite, or raw).
+"""
+from typing import List
+
+import pandas as pd
+from pypfopt import risk_models
+
+from main_app.infrastructure.compact_panels import Panel, PoolHistory
+from main_app.infrastructure.covariance import UNION_COVARIANCE_ENABLED, get_union_covariance
+
+HISTORY_DAYS = 365
+
+
+def daily_resample(market_data: List[pd.DataFrame]) -> List[PoolHistory]:
+    # we only use the last value each day for model purposes to reduce noise
+    return [PoolHistory.from_frame(df, columns=("apy", "tvlUsd")) for df in market_data]
+
+
+def apy_panel(symbols: List[str], histories: List[PoolHistory]) -> Panel:
+    # newest day first, limited to the last 365 days; kept as a compact float32 panel
+    # and promoted to float64 frames only for the covariance and optimiser math
+    return Panel.align(symbols, histories, "apy", scale=1 / 100, max_days=HISTORY_DAYS)
+
+
+def tvl_panel(symbols: List[str], histories: List[PoolHistory]) -> Panel:
+    return Panel.align(symbols, histories, "tvlUsd", max_days=HISTORY_DAYS)
+
+
+def sample_cov(symbols: List[str], histories: List[PoolHistory], apy: Panel) -> pd.DataFrame:
+    if UNION_COVARIANCE_ENABLED:
+        # a slice of the covariance kept over every symbol requested so far
+        return get_union_covariance().covariance(symbols, histories)
+    return risk_models.sample_cov(apy.to_frame())
+
+
+def raw_sample_cov(symbols: List[str], histories: List[PoolHistory], apy: Panel) -> pd.DataFrame:
+    # `sample_cov` without the positive semidefinite repair, for models that never invert the
+    # matrix; with more assets than days the repair costs an eigendecomposition and cannot succeed
+    if UNION_COVARIANCE_ENABLED:
+        return get_union_covariance().covariance(symbols, histories, fix_psd=False)
+    return risk_models.returns_from_prices(apy.to_frame()).cov() * 252
@@ -0,0 +1,228 @@
+"""
+Long-only, fully invested portfolio optimisers shared by the models.
+
+`max_sharpe` and `min_volatility` solve the problems of pypfopt's
+`EfficientFrontier.max_sharpe()` and `.min_volatility()` under per-asset weight bounds and
+return weights cleaned as `clean_weights()` does. Two backends are available, selected with
+`VV_OPTIMISER_BACKEND`:
+
+- `native` (default): a dense primal active-set QP solver in numpy. On the 4-30 asset
+  universes the models run, building the cvxpy problem and setting up a general-purpose
+  solver costs far more than solving, so this is one to two orders of magnitude faster.
+- `pypfopt`: `EfficientFrontier`, as the models used before.
+
+The native backend covers non-negative lower bounds and a positive definite covariance. For
+anything else (short positions, a singular covariance, an infeasible or unsolved problem) it
+falls back to pypfopt, which then solves the problem or raises its own error.
+"""
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from main_app.infrastructure.metrics import record_optimiser_solve, track_stage
+
+NATIVE = "native"
+PYPFOPT = "pypfopt"
+BACKENDS = (NATIVE, PYPFOPT)
+OPTIMISER_BACKEND = os.environ.get("VV_OPTIMISER_BACKEND", NATIVE).lower()
+
+WEIGHT_CUTOFF = 1e-4
+WEIGHT_ROUNDING = 5
+
+_COMPONENT = "Optimiser"
+
+Bounds = Union[Tuple[float, float], Sequence[Tuple[float, float]]]
+
+
+class UnsupportedProblem(ValueError):
+    """The native backend cannot solve the problem; it is handed to pypfopt."""
+
+
+def max_sharpe(expected_returns: pd.Series, cov_matrix: pd.DataFrame, risk_free_rate: float = 0.0,
+               weight_bounds: Bounds = (0, 1), backend: Optional[str] = None) -> Dict[str, float]:
+    """
+    Returns the cleaned weights of the maximum Sharpe ratio portfolio.
+
+    Args:
+        expected_returns: Expected (annual) return per asset.
+        cov_matrix: Covariance of the asset returns, in the order of `expected_returns`.
+        risk_free_rate: Rate subtracted from the expected returns.
+        weight_bounds: (low, high) for every asset, or one (low, high) per asset.
+        backend: 'native' or 'pypfopt' (defaults to `VV_OPTIMISER_BACKEND`).
+
+    Raises:
+        ValueError: If no asset's expected return exceeds the risk-free rate, or the backend is unknown.
+    """
+    return _optimise("max_sharpe", expected_returns, cov_matrix, risk_free_rate, weight_bounds, backend)
+
+
+def min_volatility(cov_matrix: pd.DataFrame, weight_bounds: Bounds = (0, 1),
+                   backend: Optional[str] = None) -> Dict[str, float]:
+    """
+    Returns the cleaned weights of the minimum variance portfolio.
+
+    Args:
+        cov_matrix: Covariance of the asset returns.
+        weight_bounds: (low, high) for every asset, or one (low, high) per asset.
+        backend: 'native' or 'pypfopt' (defaults to `VV_OPTIMISER_BACKEND`).
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    expected_returns = pd.Series(0.0, index=cov_matrix.columns)
+    return _optimise("min_volatility", expected_returns, cov_matrix, 0.0, weight_bounds, backend)
+
+
+def clean_weights(symbols: Sequence[str], weights: np.ndarray, cutoff: float = WEIGHT_CUTOFF,
+                  rounding: int = WEIGHT_ROUNDING) -> Dict[str, float]:
+    """Zeroes weights below `cutoff` in absolute value and rounds the rest, as pypfopt's `clean_weights`."""
+    weights = np.where(np.abs(weights) < cutoff, 0.0, weights)
+    return OrderedDict((symbol, float(w)) for symbol, w in zip(symbols, np.round(weights, rounding)))
+
+
+def _optimise(objective: str, expected_returns: pd.Series, cov_matrix: pd.DataFrame, risk_free_rate: float,
+              weight_bounds: Bounds, backend: Optional[str]) -> Dict[str, float]:
+    backend = (backend or OPTIMISER_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown optimiser backend '{backend}', expected one of {BACKENDS}")
+    if backend == NATIVE:
+        try:
+            with track_stage(_COMPONENT, f"native_{objective}"):
+                weights = _native(objective, expected_returns.to_numpy(dtype=float),
+                                  cov_matrix.to_numpy(dtype=float), risk_free_rate, weight_bounds)
+            record_optimiser_solve(objective, NATIVE)
+            return clean_weights(list(cov_matrix.columns), weights)
+        except UnsupportedProblem:
+            record_optimiser_solve(objective, PYPFOPT, fallback=True)
+    else:
+        record_optimiser_solve(objective, PYPFOPT)
+    with track_stage(_COMPONENT, f"pypfopt_{objective}"):
+        return _pypfopt(objective, expected_returns, cov_matrix, risk_free_rate, weight_bounds)
+
+
+def _pypfopt(objective: str, expected_returns: pd.Series, cov_matrix: pd.DataFrame, risk_free_rate: float,
+             weight_bounds: Bounds) -> Dict[str, float]:
+    # imported here: loading cvxpy is a noticeable part of a cold start and the native path never needs it
+    from pypfopt.efficient_frontier import EfficientFrontier
+
+    ef = EfficientFrontier(expected_returns, cov_matrix, weight_bounds=weight_bounds)
+    if objective == "max_sharpe":
+        ef.max_sharpe(risk_free_rate=risk_free_rate)
+    else:
+        ef.min_volatility()
+    return dict(ef.clean_weights(cutoff=WEIGHT_CUTOFF, rounding=WEIGHT_ROUNDING))
+
+
+def _bounds(weight_bounds: Bounds, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    bounds = np.asarray(weight_bounds, dtype=float)
+    if bounds.shape == (2,):
+        bounds = np.tile(bounds, (n, 1))
+    if bounds.shape != (n, 2):
+        raise UnsupportedProblem(f"Weight bounds of shape {bounds.shape} for {n} assets")
+    low = np.where(np.isnan(bounds[:, 0]), 0.0, bounds[:, 0])  # pypfopt reads None as unbounded
+    high = np.where(np.isnan(bounds[:, 1]), 1.0, bounds[:, 1])
+    return low, np.minimum(high, 1.0)
+
+
+def _native(objective: str, mu: np.ndarray, cov: np.ndarray, risk_free_rate: float,
+            weight_bounds: Bounds) -> np.ndarray:
+    n = len(mu)
+    low, high = _bounds(weight_bounds, n)
+    if n == 0 or (low < 0).any():
+        raise UnsupportedProblem("Only long-only problems are solved natively")
+    if low.sum() > 1 or high.sum() < 1 or (low > high).any():
+        raise UnsupportedProblem("Weight bounds admit no fully invested portfolio")
+    if not (np.isfinite(mu).all() and np.isfinite(cov).all()):
+        raise UnsupportedProblem("Non-finite expected returns or covariance")
+    try:
+        np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        raise UnsupportedProblem("Covariance is not positive definite")
+
+    # a feasible starting portfolio: proportionally between the bounds
+    spread = high - low
+    start = low + spread * ((1 - low.sum()) / spread.sum() if spread.sum() > 0 else 0.0)
+    capped = high < 1  # an upper bound of 1 is implied by the others once weights are non-negative
+
+    if objective == "min_volatility":
+        rows = np.vstack([-np.eye(n), np.eye(n)[capped]])
+        limits = np.concatenate([-low, high[capped]])
+        return _active_set_qp(2 * cov, np.ones((1, n)), np.ones(1), rows, limits, start)
+
+    # max Sharpe, after the substitution y = w / k with k = sum(y) chosen so that (mu - rf)' y = 1:
+    # minimise y' S y subject to (mu - rf)' y = 1, low * sum(y) <= y <= high * sum(y)
+    excess = mu - risk_free_rate
+    if excess.max() <= 0:
+        raise ValueError("at least one of the assets must have an expected return exceeding the risk-free rate")
+    if excess @ start <= 0:
+        start = _best_return_portfolio(excess, low, high)
+        if excess @ start <= 0:
+            raise UnsupportedProblem("No portfolio within the bounds has a positive excess return")
+    ones = np.ones((n, n))
+    rows = np.vstack([low[:, None] * ones - np.eye(n), (np.eye(n) - high[:, None] * ones)[capped]])
+    y = _active_set_qp(2 * cov, excess[None, :], np.ones(1), rows, np.zeros(len(rows)), start / (excess @ start))
+    return (y / y.sum()).round(16) + 0.0
+
+
+def _best_return_portfolio(excess: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """The portfolio within the bounds with the highest excess return (fills the best assets first)."""
+    weights = low.copy()
+    remaining = 1 - low.sum()
+    for i in np.argsort(-excess, kind="stable"):
+        step = min(high[i] - low[i], remaining)
+        weights[i] += step
+        remaining -= step
+    return weights
+
+
+def _active_set_qp(Q: np.ndarray, A: np.ndarray, b: np.ndarray, G: np.ndarray, h: np.ndarray,
+                   x: np.ndarray, tol: float = 1e-12, max_iter: Optional[int] = None) -> np.ndarray:
+    """
+    Minimises 1/2 x'Qx subject to Ax = b and Gx <= h from a feasible `x` (primal active set).
+
+    Each iteration solves the equality-constrained problem over the working set of active
+    inequalities, then either steps to the first inequality it would violate (adding it) or,
+    at the working set's optimum, drops the inequality with the most negative multiplier.
+
+    Raises:
+        UnsupportedProblem: If the start is infeasible or the solver does not converge.
+    """
+    n, m = len(x), len(b)
+    scale = max(1.0, np.abs(G).max(initial=0.0))
+    if np.abs(A @ x - b).max(initial=0.0) > 1e-9 or (G @ x - h).max(initial=-1.0) > 1e-9 * scale:
+        raise UnsupportedProblem("Infeasible starting point")
+    working = []
+    for _ in range(max_iter or 10 * (n + len(h)) + 50):
+        C = np.vstack([A, G[working]])
+        kkt = np.zeros((n + len(C), n + len(C)))
+        kkt[:n, :n], kkt[:n, n:], kkt[n:, :n] = Q, C.T, C
+        rhs = np.zeros(n + len(C))
+        rhs[:n] = -(Q @ x)
+        try:
+            solution = np.linalg.solve(kkt, rhs)
+        except np.linalg.LinAlgError:
+            solution = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+        step, multipliers = solution[:n], solution[n + m:]
+
+        if np.abs(step).max() <= tol * max(1.0, np.abs(x).max()):
+            if not working or multipliers.min() >= -tol * max(1.0, np.abs(Q @ x).max()):
+                return x
+            working.pop(int(np.argmin(multipliers)))
+            continue
+
+        rate = G @ step
+        slack = h - G @ x
+        blocking = rate > tol * scale * np.abs(step).max()
+        blocking[working] = False
+        ratios = np.full(len(h), np.inf)
+        ratios[blocking] = np.maximum(slack[blocking], 0.0) / rate[blocking]
+        nearest = int(np.argmin(ratios)) if len(h) else 0
+        if len(h) and ratios[nearest] < 1:
+            x = x + ratios[nearest] * step
+            working.append(nearest)
+        else:
+            x = x + step
+    raise UnsupportedProblem("Active-set solver did not converge")
@@ -0,0 +1,158 @@
+"""
+Registry of the models served by `/run_model/{model_name}`.
+
+Models are registered by name with a dotted entry point ('package.module:function') and
+the path of their payload JSON schema. Nothing is imported at registration time: a
+model's module (and with it pandas/pypfopt/cvxpy) and its schema validator are loaded
+on first use, so workers that never run a model never pay for those imports. Models
+listed in `VV_PRELOAD_MODELS` (comma separated, or '*' for all) can be loaded up-front
+with `preload()` to move that cost from the first request to startup.
+"""
+import importlib
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from main_app.infrastructure.metrics import track_stage
+
+DATA_CLASSES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_classes")
+PRELOAD_MODELS = os.environ.get("VV_PRELOAD_MODELS", "")
+
+
+class UnknownModelError(KeyError):
+    pass
+
+
+class PayloadValidationError(ValueError):
+    pass
+
+
+class ModelInputError(ValueError):
+    """The payload is valid, but the model cannot run on the market data it asks for."""
+
+
+@dataclass
+class ModelSpec:
+    name: str
+    entry_point: str
+    schema_file: str
+    description: str = ""
+    checks: Optional[str] = None
+    _runner: Optional[Callable[[Dict], Any]] = field(default=None, repr=False)
+    _validator: Any = field(default=None, repr=False)
+    _checks: Optional[Callable[[Dict], None]] = field(default=None, repr=False)
+
+    @property
+    def loaded(self) -> bool:
+        return self._runner is not None
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._models: Dict[str, ModelSpec] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, entry_point: str, schema_file: str, description: str = "",
+                 checks: Optional[str] = None):
+        """
+        Registers a model without importing it.
+
+        Args:
+            name: Name used in `/run_model/{model_name}`; matched case-insensitively.
+            entry_point: 'module:function' of a callable taking the payload dict and returning
+                a dataclass_json result.
+            schema_file: Path of the JSON schema validating the payload.
+            description: Optional human readable description.
+            checks: Optional 'module:function' of a callable taking a schema-valid payload and
+                raising ValueError for what the schema cannot express (e.g. configured values).
+        """
+        key = name.lower()
+        with self._lock:
+            if key in self._models:
+                raise ValueError(f"Model '{name}' is already registered")
+            self._models[key] = ModelSpec(key, entry_point, schema_file, description, checks)
+
+    def __contains__(self, name: str) -> bool:
+        return str(name).lower() in self._models
+
+    def names(self) -> List[str]:
+        return sorted(self._models)
+
+    def spec(self, name: str) -> ModelSpec:
+        try:
+            return self._models[str(name).lower()]
+        except KeyError:
+            raise UnknownModelError(
+                f"Model '{name}' is not supported. Supported models: {', '.join(self.names())}") from None
+
+    def load(self, name: str) -> ModelSpec:
+        """Imports the model's entry point and compiles its schema validator if not done already."""
+        spec = self.spec(name)
+        if spec.loaded:
+            return spec
+        with self._lock:
+            if not spec.loaded:
+                with track_stage("ModelRegistry", f"load_{spec.name}"):
+                    from jsonschema import Draft7Validator
+
+                    with open(spec.schema_file, "r") as file:
+                        schema = json.load(file)
+                    module_name, function_name = spec.entry_point.split(":")
+                    runner = getattr(importlib.import_module(module_name), function_name)
+                    if spec.checks is not None:
+                        module_name, function_name = spec.checks.split(":")
+                        spec._checks = getattr(importlib.import_module(module_name), function_name)
+                    spec._validator = Draft7Validator(schema)
+                    spec._runner = runner
+        return spec
+
+    def validate(self, name: str, payload: Dict):
+        """
+        Raises:
+            UnknownModelError: If the model is not registered.
+            PayloadValidationError: If the payload does not match the model's schema or checks.
+        """
+        spec = self.load(name)
+        from jsonschema import ValidationError
+
+        try:
+            spec._validator.validate(payload)
+        except ValidationError as e:
+            raise PayloadValidationError(str(e)) from e
+        if spec._checks is not None:
+            try:
+                spec._checks(payload)
+            except ValueError as e:
+                raise PayloadValidationError(str(e)) from e
+
+    def run(self, name: str, payload: Dict) -> Any:
+        return self.load(name)._runner(payload)
+
+    def preload(self, names: Optional[List[str]] = None):
+        """Loads the given models, or all registered models if `names` is None."""
+        for name in names if names is not None else self.names():
+            self.load(name)
+
+    def preload_from_env(self, setting: str = PRELOAD_MODELS):
+        setting = setting.strip()
+        if not setting:
+            return
+        self.preload(None if setting == "*" else [name.strip() for name in setting.split(",") if name.strip()])
+
+
+MODEL_REGISTRY = ModelRegistry()
+MODEL_REGISTRY.register(
+    "blacklitterman",
+    entry_point="main_app.models.black_litterman.BlPortfolioModel:run_model",
+    schema_file=os.path.join(DATA_CLASSES_DIR, "BlackLittermanModelDataSchema.json"),
+    description="Black-Litterman allocation with explicit or generated return views.",
+    checks="main_app.models.black_litterman.BlPortfolioModel:check_payload",
+)
+MODEL_REGISTRY.register(
+    "hrp",
+    entry_point="main_app.models.hrp.HrpPortfolioModel:run_model",
+    schema_file=os.path.join(DATA_CLASSES_DIR, "HrpModelDataSchema.json"),
+    description="Hierarchical Risk Parity allocation for large pool universes.",
+)
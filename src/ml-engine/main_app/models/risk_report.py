@@ -0,0 +1,121 @@
+"""
+Risk figures of model allocations, from the APY panel and covariance a model run already holds.
+
+Returns are the daily relative changes of the APY panel and the covariance is the model's
+annualised covariance of those changes, the same inputs the allocation was computed from. For
+each portfolio:
+
+- historical VaR/CVaR: the loss quantile of the portfolio's daily returns and the mean loss
+  beyond it;
+- parametric VaR/CVaR: the same under a normal distribution with the covariance's daily volatility;
+- marginal risk contributions (the change in annualised volatility per unit of weight) and
+  component contributions (weight times marginal, which sum to the volatility);
+- drawdowns of the portfolio's cumulative return: maximum, current, mean and the longest
+  stretch in days below a previous peak.
+
+Losses are positive numbers. Every figure is computed for all portfolios at once with matrix
+operations over (days x assets) and (assets x portfolios).
+"""
+from statistics import NormalDist
+from typing import List, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+from main_app.data_classes.BlackLittermanModelResults import AssetRiskContribution, RiskReport
+from main_app.infrastructure.compact_panels import Panel
+
+RISK_CONFIDENCE = 0.95
+_PERIODS_PER_YEAR = 252  # as the annualised covariance
+
+
+def daily_returns(apy: Panel) -> np.ndarray:
+    """The panel's daily relative changes, oldest first, 0 where a change is not defined."""
+    levels = apy.values[::-1].astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = levels[1:] / levels[:-1] - 1
+    return np.where(np.isfinite(returns), returns, 0.0)
+
+
+def risk_reports(symbols: Sequence[str], allocations: Sequence[Mapping[str, float]], apy: Panel,
+                 cov_matrix: pd.DataFrame, confidence: float = RISK_CONFIDENCE) -> List[RiskReport]:
+    """
+    Returns one risk report per allocation (asset -> weight; missing assets weigh 0).
+
+    Args:
+        symbols: The assets of the panel and the covariance, in their order.
+        allocations: The portfolios' weights.
+        apy: The model's APY panel.
+        cov_matrix: The model's annualised covariance of daily APY changes.
+        confidence: VaR/CVaR confidence level, e.g. 0.95.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError(f"Risk confidence must be between 0 and 1, got {confidence}")
+    weights = np.array([[allocation.get(symbol, 0.0) for allocation in allocations] for symbol in symbols],
+                       dtype=float).reshape(len(symbols), len(allocations))
+    returns = daily_returns(apy) @ weights  # (days x portfolios)
+    cov = np.nan_to_num(cov_matrix.loc[list(symbols), list(symbols)].to_numpy(dtype=float), nan=0.0)
+
+    # historical: the empirical loss quantile and the mean of the returns at or below it
+    cutoff = np.quantile(returns, 1 - confidence, axis=0) if len(returns) else np.zeros(len(allocations))
+    tail = returns <= cutoff
+    with np.errstate(invalid="ignore"):
+        historical_cvar = -np.where(tail, returns, 0.0).sum(axis=0) / tail.sum(axis=0)
+
+    # parametric: normal daily returns with the sample mean and the covariance's volatility
+    marginal_variance = cov @ weights
+    variance = np.einsum("ij,ij->j", weights, marginal_variance)
+    volatility = np.sqrt(np.clip(variance, 0, None))
+    daily_volatility = volatility / np.sqrt(_PERIODS_PER_YEAR)
+    mean = returns.mean(axis=0) if len(returns) else np.zeros(len(allocations))
+    normal = NormalDist()
+    z = normal.inv_cdf(confidence)
+    parametric_var = z * daily_volatility - mean
+    parametric_cvar = daily_volatility * normal.pdf(z) / (1 - confidence) - mean
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        marginal = np.where(volatility > 0, marginal_variance / volatility, 0.0)
+    component = weights * marginal
+
+    wealth = np.cumprod(1 + returns, axis=0)
+    drawdown = 1 - wealth / np.maximum.accumulate(wealth, axis=0) if len(returns) else np.zeros((1, len(allocations)))
+    durations = _longest_runs(drawdown > 1e-12)
+
+    reports = []
+    for p in range(len(allocations)):
+        contributions = [
+            AssetRiskContribution(asset=symbol, marginal=float(marginal[i, p]), component=float(component[i, p]),
+                                  percent=float(component[i, p] / volatility[p]) if volatility[p] > 0 else 0.0)
+            for i, symbol in enumerate(symbols)
+        ]
+        reports.append(RiskReport(
+            Confidence=confidence,
+            Volatility=float(volatility[p]),
+            HistoricalVaR=float(-cutoff[p]),
+            HistoricalCVaR=float(np.nan_to_num(historical_cvar[p])),
+            ParametricVaR=float(parametric_var[p]),
+            ParametricCVaR=float(parametric_cvar[p]),
+            MaxDrawdown=float(drawdown[:, p].max()),
+            CurrentDrawdown=float(drawdown[-1, p]),
+            MeanDrawdown=float(drawdown[:, p].mean()),
+            LongestDrawdownDays=int(durations[p]),
+            RiskContributions=contributions,
+        ))
+    return reports
+
+
+def allocation_risk(symbols: Sequence[str], apy: Panel, cov_matrix: pd.DataFrame, weights: Mapping[str, float],
+                    confidence: float) -> RiskReport:
+    """The risk report of a single allocation, for the models' stage pipelines."""
+    return risk_reports(symbols, [weights], apy, cov_matrix, confidence)[0]
+
+
+def _longest_runs(flags: np.ndarray) -> np.ndarray:
+    """The longest run of consecutive True values in each column of a (days x columns) array."""
+    padded = np.vstack([np.zeros((1, flags.shape[1]), dtype=bool), flags, np.zeros((1, flags.shape[1]), dtype=bool)])
+    longest = np.zeros(flags.shape[1], dtype=int)
+    for column in range(flags.shape[1]):
+        edges = np.flatnonzero(np.diff(padded[:, column].astype(np.int8)))
+        if len(edges):
+            longest[column] = (edges[1::2] - edges[::2]).max()
+    return longest
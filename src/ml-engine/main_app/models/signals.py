@@ -0,0 +1,200 @@
+"""
+Return signals over the APY panel, for several lookback horizons in one vectorised pass.
+
+For every horizon h (days) and asset, as of the panel's newest day:
+
+- `momentum`: the annualised change of the APY over h days, doubled (the view generator's
+  original signal).
+- `mean_reversion`: the annualised move of the APY back to its mean over the last h days.
+- `volatility_scaled_momentum`: the h-day change of the APY in units of its expected
+  standard deviation, from the daily changes over the same days (a t-statistic).
+
+Horizons longer than the panel are cut to its length, as the generator did for momentum.
+
+All three come from per-horizon window sums (of APY levels and of daily APY returns, with
+their counts). `RollingSignals` keeps those sums per symbol. When a symbol's panel has moved
+on by k days and the days it shares with the stored window are unchanged, its sums are
+advanced by adding the k new days and dropping the k oldest. That costs O(k x horizons) in
+place of O(max horizon). Other symbols are computed from scratch with one cumulative sum.
+Both paths run on all the symbols they apply to at once, so a request costs
+O(assets x horizons) plus the new days. After `max horizon` consecutive updates a symbol is
+recomputed, which keeps the rounding error of the running sums bounded.
+"""
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from main_app.infrastructure.compact_panels import Panel
+from main_app.infrastructure.metrics import record_cache_lookup, track_stage
+from main_app.models.registry import ModelInputError
+
+SIGNAL_HORIZONS = tuple(int(h) for h in os.environ.get("VV_SIGNAL_HORIZONS", "7,30,90,180").split(",") if h.strip())
+SIGNAL_CACHE_SYMBOLS = int(os.environ.get("VV_SIGNAL_CACHE_SYMBOLS", "4096"))
+
+MOMENTUM = "momentum"
+MEAN_REVERSION = "mean_reversion"
+VOLATILITY_SCALED_MOMENTUM = "volatility_scaled_momentum"
+SIGNALS = (MOMENTUM, MEAN_REVERSION, VOLATILITY_SCALED_MOMENTUM)
+
+_COMPONENT = "RollingSignals"
+_DAYS_PER_YEAR = 365
+# rows of the window statistics: sums over the newest h levels and the newest h daily returns
+_LEVEL_SUM, _LEVEL_COUNT, _RETURN_SUM, _RETURN_SQUARES, _RETURN_COUNT = range(5)
+_STATISTICS = 5
+
+
+@dataclass(frozen=True)
+class SignalFrame:
+    """Every signal for every horizon: `values[signal]` is (horizons x assets), NaN where undefined."""
+    symbols: List[str]
+    horizons: Tuple[int, ...]
+    values: Dict[str, np.ndarray]
+
+    def signal(self, name: str, horizon: int) -> np.ndarray:
+        if name not in self.values:
+            raise ValueError(f"Unknown signal '{name}', expected one of {', '.join(self.values)}")
+        if horizon not in self.horizons:
+            raise ValueError(f"Signal horizon {horizon} is not computed, expected one of {self.horizons}")
+        return self.values[name][self.horizons.index(horizon)]
+
+
+@dataclass
+class _Entry:
+    day: int
+    levels: np.ndarray  # the newest `window` levels, newest first, NaN before the history starts
+    statistics: np.ndarray  # (statistics x horizons)
+    updates: int = 0
+
+
+class RollingSignals:
+    """
+    Args:
+        horizons: Lookback horizons in days.
+        max_symbols: Symbols whose window statistics are kept; the least recently used one is dropped first.
+    """
+
+    def __init__(self, horizons: Sequence[int] = SIGNAL_HORIZONS, max_symbols: int = SIGNAL_CACHE_SYMBOLS):
+        self.horizons = tuple(sorted({int(h) for h in horizons}))
+        if not self.horizons or self.horizons[0] < 1:
+            raise ValueError(f"Signal horizons must be positive day counts, got {horizons}")
+        self.window = self.horizons[-1] + 1
+        self.max_symbols = max_symbols
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def compute(self, panel: Panel) -> SignalFrame:
+        """
+        Returns every signal for every horizon for the panel's symbols, as of its newest day.
+
+        Raises:
+            ModelInputError: If the panel has fewer than two days.
+        """
+        if len(panel.days) < 2:
+            raise ModelInputError("Not enough history to compute signals")
+        symbols, day = list(panel.symbols), int(panel.days[0])
+        levels = np.full((self.window, len(symbols)), np.nan)
+        rows = min(self.window, len(panel.days))
+        levels[:rows] = panel.values[:rows]
+
+        with self._lock:
+            entries = [self._entries.get(symbol) for symbol in symbols]
+        statistics = np.empty((_STATISTICS, len(self.horizons), len(symbols)))
+        recompute = np.ones(len(symbols), dtype=bool)
+        by_shift = defaultdict(list)
+        for column, entry in enumerate(entries):
+            shift = day - entry.day if entry is not None else -1
+            if 0 <= shift < self.window and entry.updates < self.window:
+                by_shift[shift].append(column)
+        for shift, columns in by_shift.items():
+            columns = np.asarray(columns)
+            previous = np.column_stack([entries[column].levels for column in columns])
+            # the stored window is only advanced if the days it shares with the panel are unchanged
+            current, stored = levels[shift:, columns], previous[:self.window - shift]
+            unchanged = ((current == stored) | (np.isnan(current) & np.isnan(stored))).all(axis=0)
+            if unchanged.any():
+                advanced = columns[unchanged]
+                recompute[advanced] = False
+                with track_stage(_COMPONENT, "advance"):
+                    statistics[:, :, advanced] = self._advance(
+                        levels[:, advanced], previous[:, unchanged], shift,
+                        np.stack([entries[column].statistics for column in advanced], axis=-1))
+        record_cache_lookup("rolling_signals", True, int((~recompute).sum()))
+        record_cache_lookup("rolling_signals", False, int(recompute.sum()))
+        if recompute.any():
+            with track_stage(_COMPONENT, "compute"):
+                statistics[:, :, recompute] = self._statistics(levels[:, recompute])
+
+        with self._lock:
+            for column, symbol in enumerate(symbols):
+                entry = entries[column]
+                if recompute[column]:
+                    self._entries[symbol] = _Entry(day, levels[:, column].copy(), statistics[:, :, column].copy())
+                elif entry.day != day:
+                    self._entries[symbol] = _Entry(day, levels[:, column].copy(), statistics[:, :, column].copy(),
+                                                   entry.updates + 1)
+                self._entries.move_to_end(symbol)
+            while len(self._entries) > self.max_symbols:
+                self._entries.popitem(last=False)
+        return SignalFrame(symbols, self.horizons, self._signals(levels, statistics, len(panel.days)))
+
+    def _statistics(self, levels: np.ndarray) -> np.ndarray:
+        """The window statistics of every horizon from scratch: one cumulative sum over the window."""
+        cumulative = np.cumsum(_terms(levels), axis=1)
+        return cumulative[:, np.asarray(self.horizons) - 1]
+
+    def _advance(self, levels: np.ndarray, previous: np.ndarray, shift: int, statistics: np.ndarray) -> np.ndarray:
+        """Moves window statistics `shift` days on: adds the newest days' terms and drops the oldest."""
+        if shift == 0:
+            return statistics
+        entering = np.cumsum(_terms(levels[:shift + 1]), axis=1)
+        advanced = statistics.copy()
+        for index, horizon in enumerate(self.horizons):
+            moved = min(shift, horizon)
+            leaving = _terms(previous[horizon - moved:horizon + 1]).sum(axis=1)
+            advanced[:, index] += entering[:, moved - 1] - leaving
+        return advanced
+
+    def _signals(self, levels: np.ndarray, statistics: np.ndarray, days: int) -> Dict[str, np.ndarray]:
+        horizons = np.minimum(self.horizons, days - 1)[:, None]
+        latest, past = levels[0], levels[horizons[:, 0]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = latest / past - 1
+            mean_level = statistics[_LEVEL_SUM] / statistics[_LEVEL_COUNT]
+            count = statistics[_RETURN_COUNT]
+            variance = (statistics[_RETURN_SQUARES] - statistics[_RETURN_SUM] ** 2 / count) / (count - 1)
+            deviation = np.sqrt(np.clip(variance, 0, None) * horizons)
+            return {
+                MOMENTUM: 2 * change * _DAYS_PER_YEAR / horizons,
+                MEAN_REVERSION: (mean_level / latest - 1) * _DAYS_PER_YEAR / horizons,
+                VOLATILITY_SCALED_MOMENTUM: np.where(deviation > 0, change / deviation, np.nan),
+            }
+
+
+def _terms(levels: np.ndarray) -> np.ndarray:
+    """
+    The per-day terms of the window statistics, (statistics x days x assets), for all but the last
+    (oldest) of `levels`, whose only role is to give the oldest day its return.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = levels[:-1] / levels[1:] - 1
+    observed, finite = ~np.isnan(levels[:-1]), np.isfinite(returns)
+    returns = np.where(finite, returns, 0.0)
+    return np.stack([np.where(observed, levels[:-1], 0.0), observed, returns, returns ** 2, finite])
+
+
+_engine: Optional[RollingSignals] = None
+
+
+def get_rolling_signals() -> RollingSignals:
+    global _engine
+    if _engine is None:
+        _engine = RollingSignals()
+    return _engine
@@ -0,0 +1,173 @@
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+import requests
+
+from main_app.infrastructure.covariance import get_union_covariance
+from main_app.infrastructure.metrics import REGISTRY
+from main_app.infrastructure.resilience import get_stale_cache, get_upstream_client
+from main_app.infrastructure.series_cache import get_series_cache
+from main_app.infrastructure.stage_graph import get_stage_cache
+from main_app.models.signals import get_rolling_signals
+
+POOL_IDS = {
+    "STETH": "747c1d2a-c668-4682-b9f9-296708a3dd90",
+    "GHO": "ff2a68af-030c-4697-b0a1-b62a738eaef0",
+    "USDC": "aa70268e-4b52-42bf-a116-608b370f9501",
+    "WBTC": "d4b3c522-6127-4b89-bedf-83641cdcd2eb",
+    "JITOSOL": "0e7d0722-9054-4907-8593-567b353c0900",
+}
+
+CHART_END = datetime(2025, 5, 1, 23, 1, 56, tzinfo=timezone.utc)
+CHART_DAYS = 400
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code: int = 200, headers: dict = None):
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode()
+        self.text = self.content.decode()
+        self.headers = headers or {}
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+
+def make_chart(pool_id: str, days: int = CHART_DAYS) -> list:
+    """
+    Builds a deterministic, DefiLlama-shaped `/chart/{pool}` series for a pool id.
+
+    Args:
+        pool_id: Pool id; seeds the random walk so each pool gets its own history.
+        days: Number of daily observations, ending at CHART_END.
+    """
+    rng = np.random.default_rng(zlib.crc32(pool_id.encode()))
+    apy = np.clip(4 + np.cumsum(rng.normal(0, 0.1, days)), 0.5, None)
+    tvl = 1e8 * np.exp(np.cumsum(rng.normal(0, 0.01, days)))
+    start = CHART_END - timedelta(days=days - 1)
+    return [
+        {
+            "timestamp": (start + timedelta(days=i)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "tvlUsd": int(tvl[i]),
+            "apy": float(apy[i]),
+            "apyBase": float(apy[i]),
+            "apyReward": None,
+            "il7d": None,
+            "apyBase7d": None,
+        }
+        for i in range(days)
+    ]
+
+
+def make_pool(symbol: str, pool_id: str, tvl: float = 1e8, chain: str = "Ethereum", project: str = "test") -> dict:
+    return {
+        "chain": chain, "exposure": "single", "ilRisk": "no", "outlier": False, "pool": pool_id,
+        "predictions": {"predictedClass": None, "predictedProbability": None, "binnedConfidence": None},
+        "project": project, "stablecoin": False, "symbol": symbol, "apy": 4.0, "apyBase": 4.0,
+        "apyBase7d": None, "apyBaseInception": None, "apyMean30d": 4.0, "apyPct1D": 0.0, "apyPct30D": 0.0,
+        "apyPct7D": 0.0, "apyReward": None, "count": CHART_DAYS, "il7d": None, "mu": 4.0, "poolMeta": None,
+        "tvlUsd": tvl, "volumeUsd1d": None, "volumeUsd7d": None, "sigma": 0.1,
+        "underlyingTokens": [], "rewardTokens": [],
+    }
+
+
+class FakeDefiLlama:
+    """Serves `yields.llama.fi` and `coins.llama.fi` requests from synthetic data and records every URL."""
+
+    def __init__(self):
+        self.calls = []
+        self.pools = [make_pool(symbol, pool_id) for symbol, pool_id in POOL_IDS.items()]
+
+    def get(self, url, *args, **kwargs):
+        self.calls.append(url)
+        if url.endswith("/pools"):
+            return FakeResponse({"status": "success", "data": self.pools})
+        if "yields.llama.fi/chart/" in url:
+            pool_id = url.rsplit("/", 1)[-1]
+            return FakeResponse({"status": "success", "data": make_chart(pool_id)})
+        return FakeResponse({"message": "not found"}, status_code=404)
+
+
+@pytest.fixture
+def fake_defillama(monkeypatch):
+    """Routes DefiLlama HTTP calls made by the infrastructure layer to an offline stand-in."""
+    fake = FakeDefiLlama()
+    monkeypatch.setattr("main_app.infrastructure.defi_llama.requests.get", fake.get)
+    monkeypatch.setattr("main_app.infrastructure.defi_llama._pool_resolver", None)
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def stage_cache():
+    """Memoised pipeline stages would otherwise carry over from one test to the next."""
+    get_stage_cache().clear()
+    yield get_stage_cache()
+    get_stage_cache().clear()
+
+
+@pytest.fixture(autouse=True)
+def union_covariance():
+    get_union_covariance().clear()
+    yield get_union_covariance()
+    get_union_covariance().clear()
+
+
+@pytest.fixture(autouse=True)
+def rolling_signals():
+    get_rolling_signals().clear()
+    yield get_rolling_signals()
+    get_rolling_signals().clear()
+
+
+@pytest.fixture(autouse=True)
+def upstream_state():
+    """Circuit breakers, latency history and last good series are process-wide."""
+    get_upstream_client().reset()
+    get_stale_cache().clear()
+    yield get_upstream_client()
+    get_upstream_client().reset()
+    get_stale_cache().clear()
+
+
+@pytest.fixture(autouse=True)
+def series_cache():
+    get_series_cache().clear()
+    yield get_series_cache()
+    get_series_cache().clear()
+
+
+@pytest.fixture
+def metrics_registry():
+    REGISTRY.reset()
+    yield REGISTRY
+    REGISTRY.reset()
+
+
+@pytest.fixture
+def model_payload() -> dict:
+    return {
+        "Model": "BlackLitterman",
+        "Submodel": "ExplicitExcessReturnView-v0",
+        "AssetSymbols": ["STETH", "GHO", "USDC", "WBTC"],
+        "ModelParameters": {"RiskAversion": 2.5, "UncertaintyInPrior": 0.05},
+        "RiskFreeRates": [{"term": "1Y", "rate": 0.0175}],
+        "PortfolioViews": [
+            {"Symbols": symbols, "Weights": weights, "ExpectedReturn": expected_return, "Confidence": confidence}
+            for weights, expected_return, confidence in [
+                ([1, 0, 0, 0], 0.025, 0.5),
+                ([0, 1, 0, 0], 0.16, 0.5),
+                ([0, 0, 1, 0], 0.03, 0.5),
+                ([1, 0, 0, -1], 0.005, 0.75),
+            ]
+            for symbols in [["STETH", "GHO", "USDC", "WBTC"]]
+        ],
+        "AssetStaticData": [{"Symbol": symbol} for symbol in ["STETH", "GHO", "USDC", "WBTC"]],
+    }
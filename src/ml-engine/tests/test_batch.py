@@ -0,0 +1,127 @@
+import copy
+import json
+import time
+
+from starlette.testclient import TestClient
+
+from main_app import main
+from main_app.infrastructure import batches
+from main_app.main import app
+
+ROUTE = "/batch/run_model/blacklitterman"
+
+
+def chart_calls(fake):
+    return [url for url in fake.calls if "/chart/" in url]
+
+
+def test_results_follow_the_request_order(fake_defillama, model_payload):
+    client = TestClient(app)
+    other = copy.deepcopy(model_payload)
+    other["PortfolioViews"][1]["ExpectedReturn"] = 0.3
+    reordered = dict(reversed(list(model_payload.items())))  # equal payload, other key order
+
+    response = client.post(ROUTE, json=[model_payload, other, reordered, model_payload])
+    assert response.status_code == 200
+    outcomes = response.json()
+    assert [outcome["status"] for outcome in outcomes] == [200] * 4
+    assert outcomes[0] == outcomes[2] == outcomes[3] != outcomes[1]
+
+    single = json.loads(client.post("/run_model/blacklitterman", json=other).json())
+    assert outcomes[1]["result"] == single
+
+
+def test_duplicates_and_shared_symbols_are_fetched_once(fake_defillama, model_payload, metrics_registry):
+    client = TestClient(app)
+    subset = copy.deepcopy(model_payload)
+    subset["AssetSymbols"] = subset["AssetSymbols"][:3]
+    subset["AssetStaticData"] = subset["AssetStaticData"][:3]
+    del subset["PortfolioViews"]
+
+    response = client.post(ROUTE, json=[model_payload] * 3 + [subset])
+    assert [outcome["status"] for outcome in response.json()] == [200] * 4
+    assert len(chart_calls(fake_defillama)) == len(model_payload["AssetSymbols"])
+    assert batches.BATCH_ITEMS.value(model="blacklitterman", result="deduplicated") == 2
+    assert batches.BATCH_ITEMS.value(model="blacklitterman", result="computed") == 2
+
+
+def test_items_fail_on_their_own(fake_defillama, model_payload):
+    client = TestClient(app)
+    invalid = copy.deepcopy(model_payload)
+    invalid["ModelParameters"]["RiskAversion"] = "high"
+    unknown = copy.deepcopy(model_payload)
+    unknown["AssetSymbols"][0] = unknown["AssetStaticData"][0]["Symbol"] = "NOPE"
+
+    outcomes = client.post(ROUTE, json=[invalid, model_payload, unknown]).json()
+    assert [outcome["status"] for outcome in outcomes] == [400, 200, 400]
+    assert "error" in outcomes[0] and "NOPE" in outcomes[2]["error"]
+
+
+def test_model_errors_fail_only_their_payload(fake_defillama, model_payload, monkeypatch):
+    run_model = main.run_model
+    errors = {0.01: KeyError("weights"), 0.03: ValueError("at least one of the assets must have an expected return "
+                                                            "exceeding the risk-free rate")}
+
+    def failing_runs(model_name, payload):
+        error = errors.get(payload["PortfolioViews"][0]["ExpectedReturn"])
+        if error is not None:
+            raise error
+        return run_model(model_name, payload)
+
+    monkeypatch.setattr("main_app.main.run_model", failing_runs)
+    outcomes = TestClient(app).post(ROUTE, json=distinct_payloads(model_payload, 3)).json()
+    assert [outcome["status"] for outcome in outcomes] == [500, 200, 500]
+    assert "result" in outcomes[1]
+
+
+def distinct_payloads(model_payload, count):
+    payloads = []
+    for i in range(count):
+        payload = copy.deepcopy(model_payload)
+        payload["PortfolioViews"][0]["ExpectedReturn"] = 0.01 * (i + 1)
+        payloads.append(payload)
+    return payloads
+
+
+def test_a_slow_upstream_costs_one_budget_for_the_whole_batch(fake_defillama, model_payload, monkeypatch):
+    monkeypatch.setattr("main_app.main.MODEL_LATENCY_BUDGET_SECONDS", 0.5)
+    monkeypatch.setattr("main_app.main.MODEL_COMPUTE_RESERVE_SECONDS", 0.1)
+
+    def hang(url, *args, **kwargs):
+        if "/chart/" in url:
+            time.sleep(1)
+        return fake_defillama.get(url, *args, **kwargs)
+
+    monkeypatch.setattr("main_app.infrastructure.defi_llama.requests.get", hang)
+    start = time.perf_counter()
+    response = TestClient(app).post(ROUTE, json=distinct_payloads(model_payload, 4))
+    assert time.perf_counter() - start < 1
+    assert [outcome["status"] for outcome in response.json()] == [504] * 4
+
+
+def test_payloads_unfinished_at_the_deadline_are_504s(fake_defillama, model_payload, monkeypatch):
+    client = TestClient(app)
+    assert client.post("/run_model/blacklitterman", json=model_payload).status_code == 200  # loads the model
+    monkeypatch.setattr("main_app.main.MODEL_LATENCY_BUDGET_SECONDS", 0.5)
+    run_model = main.run_model
+
+    def slow_second_run(model_name, payload):
+        if payload["PortfolioViews"][0]["ExpectedReturn"] == 0.02:
+            time.sleep(2)
+        return run_model(model_name, payload)
+
+    monkeypatch.setattr("main_app.main.run_model", slow_second_run)
+    start = time.perf_counter()
+    outcomes = client.post(ROUTE, json=distinct_payloads(model_payload, 3)).json()
+    assert time.perf_counter() - start < 1.5
+    assert [outcome["status"] for outcome in outcomes] == [200, 504, 504]
+    assert "result" in outcomes[0]
+
+
+def test_rejects_malformed_batches(fake_defillama, model_payload, monkeypatch):
+    client = TestClient(app)
+    assert client.post(ROUTE, json=model_payload).status_code == 400
+    assert client.post("/batch/run_model/nope", json=[model_payload]).status_code == 404
+    monkeypatch.setattr("main_app.main.BATCH_MAX_REQUESTS", 2)
+    assert client.post(ROUTE, json=[model_payload] * 3).status_code == 413
+    assert client.post(ROUTE, json=[]).json() == []
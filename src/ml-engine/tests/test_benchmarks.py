@@ -0,0 +1,32 @@
+from benchmarks.pipeline import compare, measure_scenario
+
+
+def test_measures_every_pipeline_stage():
+    result = measure_scenario(assets=6, days=60, views=3, repeat=1)
+    assert {"ModelEndpoint.validate", "ModelEndpoint.decode", "ModelEndpoint.serialise", "BlPortfolioModel.fetch",
+            "BlPortfolioModel.posterior", "BlPortfolioModel.max_sharpe",
+            "BlPortfolioModel.mean_historical_return"} <= set(result["stages"])
+    assert result["total"] >= max(result["stages"].values())
+
+
+def test_flags_only_material_regressions():
+    baseline = {"scenarios": {"s": {"stages": {"a": 1.0, "b": 0.001}, "total": 1.001}}}
+    current = {"scenarios": {"s": {"stages": {"a": 1.1, "b": 0.002, "c": 5.0}, "total": 1.102},
+                             "new": {"stages": {"a": 9.0}, "total": 9.0}}}
+    assert compare(current, baseline, threshold=0.25) == []
+
+    current["scenarios"]["s"]["stages"]["a"] = 1.5
+    current["scenarios"]["s"]["total"] = 1.502
+    assert [line.split(":")[0] for line in compare(current, baseline, threshold=0.25)] == ["s a", "s total"]
+
+
+def test_flags_peak_memory_regressions():
+    def scenario(peak, stage_peak):
+        return {"stages": {"a": 1.0}, "total": 1.0,
+                "memory": {"peak_bytes": peak, "retained_bytes": 0, "stages": {"a": stage_peak}}}
+
+    mib = 2 ** 20
+    baseline = {"scenarios": {"s": scenario(100 * mib, 10 * mib)}}
+    assert compare({"scenarios": {"s": scenario(120 * mib, 10.9 * mib)}}, baseline, threshold=0.25) == []
+    regressions = compare({"scenarios": {"s": scenario(130 * mib, 20 * mib)}}, baseline, threshold=0.25)
+    assert [line.split(":")[0] for line in regressions] == ["s a peak memory", "s total peak memory"]
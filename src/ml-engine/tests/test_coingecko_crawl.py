@@ -0,0 +1,86 @@
+import importlib.util
+import os
+import threading
+
+import pytest
+
+from conftest import FakeResponse
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))),
+                      "scripts", "update_coingecko_integration.py")
+
+
+class FakeMarkets:
+    """Serves `/coins/markets` pages over a fixed universe; pages listed in `fail` error once."""
+
+    def __init__(self, coins: int, fail=()):
+        self.coins = [{"id": f"coin-{n}", "market_cap_rank": n + 1, "current_price": float(n)} for n in range(coins)]
+        self.fail = set(fail)
+        self.pages = []
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        page, per_page = params["page"], params["per_page"]
+        with self._lock:
+            self.pages.append(page)
+            if page in self.fail:
+                self.fail.discard(page)
+                return FakeResponse({"error": "boom"}, status_code=500)
+        return FakeResponse(self.coins[(page - 1) * per_page:page * per_page])
+
+
+@pytest.fixture
+def script(monkeypatch):
+    spec = importlib.util.spec_from_file_location("update_coingecko_integration", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, "RATE_BUDGET", module.RateBudget(1e9))
+    return module
+
+
+def test_crawls_every_page_and_streams_them_to_disk(script, tmp_path, monkeypatch):
+    server = FakeMarkets(coins=45)
+    monkeypatch.setattr(script.requests, "get", server.get)
+    crawl = script.MarketsCrawl(root=str(tmp_path), per_page=10, workers=3)
+
+    directory, pages, coins = crawl.run()
+    assert (pages, coins) == (5, 45)
+    assert [coin["id"] for coin in crawl.iter_coins(directory, pages)] == [f"coin-{n}" for n in range(45)]
+    assert open(tmp_path / "CURRENT").read() == os.path.basename(directory)
+    assert not (tmp_path / "in-progress").exists()
+
+
+def test_interrupted_crawl_resumes_with_missing_pages_only(script, tmp_path, monkeypatch):
+    server = FakeMarkets(coins=45, fail={3})
+    monkeypatch.setattr(script.requests, "get", server.get)
+    crawl = script.MarketsCrawl(root=str(tmp_path), per_page=10, workers=1)
+
+    with pytest.raises(Exception):
+        crawl.run()
+    assert server.pages == [1, 2, 3]
+
+    server.pages.clear()
+    directory, pages, coins = crawl.run()
+    assert server.pages == [3, 4, 5]
+    assert (pages, coins) == (5, 45)
+    assert len(list(crawl.iter_coins(directory, pages))) == 45
+
+
+def test_rate_budget_is_shared_and_pauses_on_429(script):
+    now = [0.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    budget = script.RateBudget(60, burst=2, clock=lambda: now[0], sleep=sleep)
+    budget.acquire()
+    budget.acquire()
+    assert slept == []
+    budget.acquire()  # bucket empty: one token per second
+    assert slept == [pytest.approx(1.0)]
+
+    budget.observe(FakeResponse({}, status_code=429, headers={"Retry-After": "30"}))
+    budget.acquire()
+    assert now[0] == pytest.approx(31.0)
@@ -0,0 +1,80 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import synthetic_history
+from main_app.infrastructure.compact_panels import Panel, PoolHistory, epoch_days
+
+
+def intraday_history(symbol: str, days: int) -> pd.DataFrame:
+    """A synthetic chart with several observations on some days, gaps and missing values."""
+    df = synthetic_history(symbol, days)
+    extra = df.iloc[::7].copy()
+    extra["timestamp"] = extra["timestamp"].str.replace("T23:01:56", "T08:15:00")
+    extra["apy"] *= 1.5
+    df = pd.concat([df, extra]).sort_values("timestamp", kind="stable").reset_index(drop=True)
+    df.loc[df.index[5::11], "apy"] = np.nan
+    return df.drop(df.index[::13]).reset_index(drop=True)
+
+
+def reference_frames(symbols, histories):
+    """The frames the model assembled column by column before the compact panels."""
+    apy_data, tvl_data = pd.DataFrame(), pd.DataFrame()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        for symbol in symbols:
+            df = histories[symbol].copy()
+            df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.date
+            df = df.groupby("timestamp").last().sort_index(ascending=False).iloc[:365]
+            apy_data[symbol] = df["apy"] / 100
+            tvl_data[symbol] = df["tvlUsd"]
+            apy_data.fillna(method="bfill", inplace=True)
+            tvl_data.fillna(method="bfill", inplace=True)
+    return apy_data, tvl_data
+
+
+def test_epoch_days_use_the_utc_date():
+    days = epoch_days(["1970-01-02T00:00:00.000Z", "2025-05-01T23:59:59.999Z", "2025-05-01T22:00:00-03:00"])
+    assert days.dtype == np.int32 and days.tolist() == [1, 20209, 20210]
+
+
+def test_panels_match_the_frames_the_model_used_to_build():
+    symbols = ["A", "B", "C"]
+    histories = {"A": intraday_history("A", 500), "B": intraday_history("B", 200), "C": intraday_history("C", 420)}
+    histories["C"] = histories["C"].iloc[:-30]  # ends a month earlier than A
+    apy_expected, tvl_expected = reference_frames(symbols, histories)
+
+    compact = [PoolHistory.from_frame(histories[symbol]) for symbol in symbols]
+    apy, tvl = Panel.align(symbols, compact, "apy", scale=1 / 100), Panel.align(symbols, compact, "tvlUsd")
+
+    assert apy.values.dtype == np.float32 and apy.values.flags.f_contiguous and apy.days.dtype == np.int32
+    pd.testing.assert_frame_equal(apy.to_frame(), apy_expected, check_names=False, rtol=1e-6)
+    pd.testing.assert_frame_equal(tvl.to_frame(), tvl_expected.astype(float), check_names=False, rtol=1e-6)
+    pd.testing.assert_frame_equal(Panel.from_frame(apy_expected).to_frame(), apy.to_frame())
+
+
+def test_panels_take_half_the_memory_of_frames():
+    symbols = [f"S{n}" for n in range(50)]
+    histories = {symbol: synthetic_history(symbol, 400) for symbol in symbols}
+    apy_expected, _ = reference_frames(symbols, histories)
+    apy = Panel.align(symbols, [PoolHistory.from_frame(histories[s]) for s in symbols], "apy", scale=1 / 100)
+    assert apy.nbytes <= 0.55 * apy_expected.memory_usage(deep=True).sum()
+
+
+def test_model_results_are_unchanged_by_float32_storage(fake_defillama, model_payload, monkeypatch):
+    from main_app.infrastructure import compact_panels
+    from main_app.infrastructure.stage_graph import get_stage_cache
+    from main_app.models.black_litterman.BlPortfolioModel import run_model
+
+    compact = run_model(model_payload)
+    # float64 all the way through, as before the compact panels
+    get_stage_cache().clear()
+    monkeypatch.setattr(compact_panels, "STORAGE_DTYPE", np.float64)
+    reference = run_model(model_payload)
+
+    weights = {a.asset: a.weight for a in compact.ModelResults[0].Allocations}
+    expected = {a.asset: a.weight for a in reference.ModelResults[0].Allocations}
+    assert weights.keys() == expected.keys()
+    assert list(weights.values()) == pytest.approx(list(expected.values()), abs=1e-4)
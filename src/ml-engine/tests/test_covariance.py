@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pypfopt import risk_models
+
+from benchmarks.synthetic import synthetic_history
+from main_app.infrastructure.compact_panels import Panel, PoolHistory
+from main_app.infrastructure.covariance import UnionCovariance
+from main_app.infrastructure.metrics import CACHE_LOOKUPS
+
+
+@pytest.fixture
+def histories():
+    return {symbol: PoolHistory.from_frame(synthetic_history(symbol, 400)) for symbol in "ABCDE"}
+
+
+def per_request_cov(symbols, histories):
+    panel = Panel.align(symbols, [histories[s] for s in symbols], "apy", scale=1 / 100)
+    return risk_models.sample_cov(panel.to_frame())
+
+
+def test_matches_per_request_sample_cov_on_aligned_histories(histories):
+    service = UnionCovariance()
+    for symbols in (["A", "B", "C"], ["C", "A", "D"], ["E", "B"]):
+        union = service.covariance(symbols, [histories[s] for s in symbols])
+        pd.testing.assert_frame_equal(union, per_request_cov(symbols, histories), rtol=1e-9)
+    assert service.symbols == ["C", "A", "D", "E", "B"]
+
+
+def test_overlapping_requests_only_load_new_symbols(histories, metrics_registry):
+    service = UnionCovariance()
+    service.covariance(["A", "B", "C"], [histories[s] for s in "ABC"])
+    service.covariance(["A", "C", "D"], [histories[s] for s in "ACD"])
+    assert CACHE_LOOKUPS.value(cache="union_covariance", result="hit") == 2
+    assert CACHE_LOOKUPS.value(cache="union_covariance", result="miss") == 1
+
+    changed = PoolHistory(histories["C"].days, histories["C"].columns, histories["C"].values * 1.01)
+    service.covariance(["C", "D"], [changed, histories["D"]])
+    assert CACHE_LOOKUPS.value(cache="union_covariance", result="miss") == 2
+
+
+def test_pairs_use_the_days_both_symbols_were_observed(histories):
+    late = PoolHistory.from_frame(synthetic_history("B", 400).iloc[150:])
+    early_end = PoolHistory.from_frame(synthetic_history("C", 400).iloc[:-40])
+    service = UnionCovariance()
+    union = service.covariance(["A", "B", "C"], [histories["A"], late, early_end])
+
+    # A with the later-starting B: exactly the covariance over B's days
+    pair = per_request_cov(["B", "A"], {"A": histories["A"], "B": late})
+    assert union.loc["A", "B"] == pytest.approx(pair.loc["A", "B"], rel=1e-9)
+    # A on its own keeps its full year rather than being truncated to B's history
+    assert union.loc["A", "A"] == pytest.approx(per_request_cov(["A"], histories).loc["A", "A"], rel=1e-9)
+    assert np.isfinite(union.to_numpy()).all()
+
+
+def test_new_days_and_evictions_keep_slices_exact(histories):
+    service = UnionCovariance(max_symbols=3)
+    for symbols in (["A", "B"], ["C", "D"], ["E", "A"], ["B", "C", "E"]):
+        union = service.covariance(symbols, [histories[s] for s in symbols])
+        pd.testing.assert_frame_equal(union, per_request_cov(symbols, histories), rtol=1e-9)
+    assert len(service.symbols) == 3
+
+    newer = {s: PoolHistory.from_frame(synthetic_history(s, 401).iloc[1:]) for s in "AB"}
+    newer["A"] = PoolHistory(newer["A"].days + 1, newer["A"].columns, newer["A"].values)
+    newer["B"] = PoolHistory(newer["B"].days + 1, newer["B"].columns, newer["B"].values)
+    union = service.covariance(["A", "B"], [newer["A"], newer["B"]])
+    pd.testing.assert_frame_equal(union, per_request_cov(["A", "B"], newer), rtol=1e-9)
+
+
+def test_a_full_union_never_evicts_the_requests_own_symbols(histories):
+    service = UnionCovariance(max_symbols=3)
+    for symbols in (["A"], ["D", "E"], ["A", "B"], ["C", "B", "A"]):
+        union = service.covariance(symbols, [histories[s] for s in symbols])
+        pd.testing.assert_frame_equal(union, per_request_cov(symbols, histories), rtol=1e-9)
+    assert service.symbols == ["C", "B", "A"]
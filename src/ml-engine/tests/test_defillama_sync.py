@@ -0,0 +1,88 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+from conftest import POOL_IDS, FakeResponse, make_chart, make_pool
+from main_app.infrastructure.snapshots import open_snapshot
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))),
+                      "scripts", "update_defillama_integration.py")
+
+
+class ConditionalDefiLlama:
+    """Serves the synced endpoints with ETags and answers 304 when the client's ETag still matches."""
+
+    def __init__(self):
+        self.protocols = [{"id": str(n), "name": f"protocol-{n}", "tvl": 1e6 * n, "chains": ["Ethereum"]}
+                          for n in range(1, 4)]
+        self.requests = []
+
+    def body(self, url):
+        if url.endswith("/protocols"):
+            return self.protocols
+        if url.endswith("/charts"):
+            return [{"date": "1700000000", "totalLiquidityUSD": 1e9}]
+        if url.endswith("/chains"):
+            return [{"name": "Ethereum", "tvl": 1e9}]
+        if url.endswith("/pools"):
+            return {"status": "success", "data": [make_pool(s, p) for s, p in list(POOL_IDS.items())[:2]]}
+        return {"status": "success", "data": make_chart(url.rsplit("/", 1)[-1], days=30)}
+
+    def get(self, url, headers=None, timeout=None):
+        payload = self.body(url)
+        etag = f'"{hash(json.dumps(payload, sort_keys=True))}"'
+        conditional = (headers or {}).get("If-None-Match") == etag
+        self.requests.append((url, conditional))
+        if conditional:
+            return FakeResponse(None, status_code=304, headers={"ETag": etag})
+        return FakeResponse(payload, headers={"ETag": etag})
+
+
+@pytest.fixture
+def sync_script(tmp_path, monkeypatch):
+    spec = importlib.util.spec_from_file_location("update_defillama_integration", SCRIPT)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    pinned = tmp_path / "pinned.json"
+    pinned.write_text(json.dumps({symbol: POOL_IDS[symbol] for symbol in ("STETH", "GHO")}))
+    server = ConditionalDefiLlama()
+    monkeypatch.setattr(script, "SNAPSHOT_ROOT", str(tmp_path / "data"))
+    monkeypatch.setattr(script, "METADATA_FILE", str(tmp_path / "data" / "defillama" / "metadata.json"))
+    monkeypatch.setattr(script, "PINNED_POOLS_FILE", str(pinned))
+    monkeypatch.setattr(script.requests, "get", server.get)
+    script.server = server
+    return script
+
+
+def test_unchanged_sync_is_conditional_and_writes_nothing(sync_script):
+    first_dir, first = sync_script.sync()
+    assert first_dir is not None
+    assert first["protocols"]["diff"] == {"added": 3, "changed": 0, "removed": 0}
+    assert all(entry["status"] == 200 and entry["changed"] for entry in first.values())
+
+    sync_script.server.requests.clear()
+    second_dir, second = sync_script.sync()
+    assert second_dir is None
+    assert all(conditional for _, conditional in sync_script.server.requests)
+    assert all(entry["status"] == 304 and not entry["changed"] for entry in second.values())
+
+
+def test_changed_protocols_are_diffed_and_other_tables_carried_over(sync_script):
+    sync_script.sync()
+    server = sync_script.server
+    server.protocols = [dict(server.protocols[0], tvl=5e6), server.protocols[1],
+                        {"id": "9", "name": "protocol-9", "tvl": 1.0, "chains": []}]
+
+    snapshot_dir, report = sync_script.sync()
+    assert report["protocols"]["diff"] == {"added": 1, "changed": 1, "removed": 1}
+    assert not report["chains"]["changed"]
+
+    snapshot = open_snapshot("defillama", root=sync_script.SNAPSHOT_ROOT)
+    assert snapshot.directory == snapshot_dir
+    assert sorted((r["id"], r["change"]) for r in snapshot.records("protocol_changes")) == [
+        ("1", "changed"), ("3", "removed"), ("9", "added")]
+    assert snapshot.rows("protocols") == 3
+    assert snapshot.records("chains") == [{"name": "Ethereum", "tvl": 1e9}]
+    assert snapshot.rows("pool_charts") == 60
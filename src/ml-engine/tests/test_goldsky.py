@@ -0,0 +1,117 @@
+import re
+
+import pytest
+from starlette.testclient import TestClient
+
+from conftest import FakeResponse
+from main_app.infrastructure import goldsky
+from main_app.infrastructure.goldsky import GoldskyIngestor, GoldskyStore
+from main_app.main import app
+
+DAY = 86_400
+
+
+class LocalSubgraph:
+    """
+    GraphQL stand-in for the vault subgraph: answers the ingestor's paging queries from
+    in-memory entities, honouring `first`, `orderBy` and the (cursor, id) `where` filter.
+    """
+
+    def __init__(self):
+        self.entities = {"vaults": [], "transactions": [], "priceUpdates": []}
+        self.requests = 0
+
+    def add_transactions(self, count, start_block=1, vault="0xvault"):
+        for n in range(count):
+            block = start_block + n // 2  # two transactions per block to exercise the id tie-break
+            self.entities["transactions"].append({
+                "id": f"tx-{block:08d}-{n % 2}", "vault": {"id": vault}, "from": "0xabc", "to": None,
+                "amount": str(10 ** 18 * (n % 5 + 1)), "timestamp": str(block * DAY // 2),
+                "transactionHash": f"0x{n:064x}", "blockNumber": str(block),
+                "type": "deposit" if n % 3 else "withdrawal"})
+
+    def post(self, url, json=None, timeout=None):
+        self.requests += 1
+        query, variables = json["query"], json["variables"]
+        collection = re.search(r"rows: (\w+)\(", query).group(1)
+        cursor_field = re.search(r"orderBy: (\w+)", query).group(1)
+        cursor, last_id, first = int(variables["cursor"]), variables["id"], variables["first"]
+        rows = sorted(self.entities[collection], key=lambda row: (int(row[cursor_field]), row["id"]))
+        rows = [row for row in rows if (int(row[cursor_field]), row["id"]) > (cursor, last_id)]
+        return FakeResponse({"data": {"rows": rows[:first]}})
+
+
+@pytest.fixture
+def subgraph(tmp_path, monkeypatch):
+    store = GoldskyStore(str(tmp_path))
+    monkeypatch.setattr(goldsky, "_store", store)
+    local = LocalSubgraph()
+    local.ingestor = GoldskyIngestor("http://subgraph.local", store, page_size=100, chunk_rows=1000, post=local.post)
+    return local
+
+
+def test_incremental_ingest_in_bounded_chunks(subgraph):
+    subgraph.add_transactions(2500)
+    assert subgraph.ingestor.sync(goldsky.TRANSACTIONS) == 2500
+    store = subgraph.ingestor.store
+    assert [chunk.rows for chunk in store.chunks("transactions")] == [1000, 1000, 500]
+
+    subgraph.requests = 0
+    assert subgraph.ingestor.sync(goldsky.TRANSACTIONS) == 0
+    assert subgraph.requests == 1
+
+    subgraph.add_transactions(150, start_block=2000)
+    assert subgraph.ingestor.sync(goldsky.TRANSACTIONS) == 150
+    ids = store.frame("transactions", columns=["id"])["id"]
+    assert len(ids) == 2650 and ids.is_unique
+
+
+def test_vaults_are_upserted(subgraph):
+    subgraph.entities["vaults"] = [
+        {"id": "0xa", "owner": "0x1", "totalValue": "100", "createdAt": "1", "updatedAt": "1"},
+        {"id": "0xb", "owner": "0x2", "totalValue": "200", "createdAt": "1", "updatedAt": "2"}]
+    subgraph.ingestor.sync(goldsky.VAULTS)
+    subgraph.entities["vaults"][0].update(totalValue="150", updatedAt="5")
+    assert subgraph.ingestor.sync(goldsky.VAULTS) == 1
+
+    vaults = subgraph.ingestor.store.frame("vaults").set_index("id")
+    assert vaults.loc["0xa", "totalValue"] == 150.0 and vaults.loc["0xb", "totalValue"] == 200.0
+    assert len(list(subgraph.ingestor.store.chunks("vaults"))) == 1
+
+
+def test_open_chunk_readers_are_bounded(subgraph):
+    store = subgraph.ingestor.store
+    store.open_chunks = 2
+    subgraph.add_transactions(2500)
+    subgraph.ingestor.sync(goldsky.TRANSACTIONS)
+    assert [chunk.rows for chunk in store.chunks("transactions")] == [1000, 1000, 500]
+    assert len(store._readers) == 2
+
+    subgraph.entities["vaults"] = [
+        {"id": "0xa", "owner": "0x1", "totalValue": "100", "createdAt": "1", "updatedAt": "1"}]
+    subgraph.ingestor.sync(goldsky.VAULTS)
+    list(store.chunks("vaults"))
+    subgraph.entities["vaults"][0].update(totalValue="150", updatedAt="5")
+    subgraph.ingestor.sync(goldsky.VAULTS)
+    list(store.chunks("vaults"))
+    # the replaced vault chunk's reader is dropped with the version it belonged to
+    assert [name for entity, name in store._readers if entity == "vaults"] == store.state("vaults")["chunks"]
+
+
+def test_flow_and_price_series_are_served_by_market_data(subgraph):
+    subgraph.add_transactions(40)
+    subgraph.entities["priceUpdates"] = [
+        {"id": f"p{n}", "vault": {"id": "0xvault"}, "asset": "ETH", "price": str(3000 + n),
+         "timestamp": str(n * DAY // 4), "transactionHash": "0x0", "blockNumber": str(n)} for n in range(8)]
+    subgraph.ingestor.sync_all()
+
+    flows = subgraph.ingestor.store.vault_flows("0xvault")
+    assert list(flows.columns) == ["date", "vault", "deposits", "withdrawals", "net_flow"]
+    assert flows["net_flow"].sum() == pytest.approx(flows["deposits"].sum() - flows["withdrawals"].sum())
+    assert list(subgraph.ingestor.store.price_series("ETH")["price"]) == [3003.0, 3007.0]
+
+    client = TestClient(app)
+    response = client.get("/market_data/metrics/goldsky/vault_flows/0xvault")
+    assert response.status_code == 200 and len(response.json()) == len(flows)
+    assert client.get("/market_data/metrics/goldsky/prices/ETH").json()[-1]["price"] == 3007.0
+    assert client.get("/market_data/metrics/goldsky/prices/BTC").status_code == 404
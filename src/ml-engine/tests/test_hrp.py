@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from pypfopt import HRPOpt
+from starlette.testclient import TestClient
+
+from benchmarks.pipeline import measure_scenario
+from benchmarks.synthetic import synthetic_hrp_payload
+from main_app.main import app
+from main_app.models.hrp.HrpPortfolioModel import quasi_diagonal_order, recursive_bisection
+
+
+def random_cov(seed: int, n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, 0.05, (300, n)) @ rng.normal(0, 1, (n, n))
+    symbols = [f"A{i:02d}" for i in range(n)][::-1]
+    return pd.DataFrame(np.cov(returns.T) * 252, index=symbols, columns=symbols)
+
+
+@pytest.mark.parametrize("n", [2, 3, 9, 40])
+@pytest.mark.parametrize("linkage_method", ["single", "average", "ward"])
+def test_matches_pypfopt_hrp(n, linkage_method):
+    for seed in range(3):
+        cov = random_cov(seed, n)
+        weights = pd.Series(recursive_bisection(cov, quasi_diagonal_order(cov, linkage_method)))
+        reference = pd.Series(HRPOpt(cov_matrix=cov).optimize(linkage_method))[cov.columns]
+        assert list(weights.index) == list(cov.columns)
+        np.testing.assert_allclose(weights, reference, atol=1e-5)
+
+
+def test_singular_covariance_and_missing_pairs():
+    cov = random_cov(0, 6)
+    cov.iloc[:, 5] = cov.iloc[5, :] = cov.iloc[:, 4]  # a duplicate asset
+    cov.iloc[5, 5] = cov.iloc[4, 4]
+    cov.iloc[0, 1] = cov.iloc[1, 0] = np.nan  # no overlapping history
+    weights = recursive_bisection(cov, quasi_diagonal_order(cov, "single"))
+    assert sum(weights.values()) == pytest.approx(1, abs=1e-4) and min(weights.values()) > 0
+
+    cov.iloc[2, 2] = np.nan
+    with pytest.raises(ValueError):
+        recursive_bisection(cov, quasi_diagonal_order(cov, "single"))
+
+
+def test_runs_through_the_model_endpoint(fake_defillama):
+    client = TestClient(app)
+    payload = synthetic_hrp_payload(["STETH", "GHO", "USDC", "WBTC"], linkage_method="average")
+    response = client.post("/run_model/hrp", json=payload)
+    assert response.status_code == 200
+    result = json.loads(response.json())  # the endpoint returns the result serialised as a JSON string
+    assert result["Model"] == "HierarchicalRiskParity"
+    (model_result,) = result["ModelResults"]
+    assert model_result["Views"] == []
+    assert [a["asset"] for a in model_result["Allocations"]] == payload["AssetSymbols"]
+    assert sum(a["weight"] for a in model_result["Allocations"]) == pytest.approx(1, abs=1e-4)
+
+    payload["ModelParameters"]["LinkageMethod"] = "nearest"
+    assert client.post("/run_model/hrp", json=payload).status_code == 400
+
+
+def test_benchmark_measures_the_hrp_pipeline():
+    result = measure_scenario(assets=30, days=60, views=0, repeat=1, model="hrp")
+    assert {"HrpPortfolioModel.histories", "HrpPortfolioModel.sample_cov",
+            "HrpPortfolioModel.quasi_diagonal_order", "HrpPortfolioModel.recursive_bisection"} <= set(result["stages"])
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from main_app.infrastructure.jobs import CANCELLED, FAILED, SUCCEEDED, TERMINAL_STATUSES, InMemoryJobStore, Job, \
+    JobManager, SqliteJobStore, create_job_store
+from main_app.infrastructure.metrics import track_stage
+from main_app.main import app
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryJobStore()
+    return SqliteJobStore(str(tmp_path / "jobs.db"))
+
+
+@pytest.fixture
+def manager(store):
+    manager = JobManager(store, workers=1, result_ttl=60)
+    yield manager
+    manager.shutdown()
+
+
+def wait_for(manager, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job.status in TERMINAL_STATUSES:
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_store_round_trip_and_purge(store):
+    store.create(Job(job_id="a", kind="test"))
+    store.update("a", status=SUCCEEDED, result='{"x": 1}', expires_at=100.0)
+    assert store.append_event("a", "progress", {"stage": "one"}) == 1
+    assert store.append_event("a", "progress", {"stage": "two"}) == 2
+
+    job = store.get("a")
+    assert (job.status, job.result, job.cancel_requested) == (SUCCEEDED, '{"x": 1}', False)
+    assert [e.data["stage"] for e in store.events_since("a", 1)] == ["two"]
+
+    assert store.purge_expired(now=99.0) == 0
+    assert store.purge_expired(now=100.0) == 1
+    assert store.get("a") is None
+
+
+def test_job_records_result_and_progress(manager):
+    def work():
+        with track_stage("test", "stage_one"):
+            pass
+        return '{"ok": true}'
+
+    job = wait_for(manager, manager.submit("test", work).job_id)
+    assert job.status == SUCCEEDED
+    assert job.result == '{"ok": true}'
+    assert job.expires_at is not None
+    events = manager.store.events_since(job.job_id, 0)
+    assert {"component": "test", "stage": "stage_one"} in [e.data for e in events]
+
+
+def test_failed_job_keeps_error(manager):
+    def work():
+        raise ValueError("bad payload")
+
+    job = wait_for(manager, manager.submit("test", work).job_id)
+    assert (job.status, job.error) == (FAILED, "bad payload")
+
+
+def test_running_job_is_cancelled_at_next_stage(manager):
+    started, release = threading.Event(), threading.Event()
+
+    def work():
+        with track_stage("test", "first"):
+            started.set()
+            release.wait(10)
+        with track_stage("test", "second"):
+            pass
+        return "{}"
+
+    job = manager.submit("test", work)
+    started.wait(10)
+    manager.cancel(job.job_id)
+    release.set()
+    assert wait_for(manager, job.job_id).status == CANCELLED
+
+
+def test_expired_jobs_are_hidden(store):
+    manager = JobManager(store, workers=1, result_ttl=0)
+    try:
+        job_id = manager.submit("test", lambda: "{}").job_id
+        deadline = time.time() + 10
+        while store.get(job_id).status not in TERMINAL_STATUSES and time.time() < deadline:
+            time.sleep(0.01)
+        assert manager.get(job_id) is None
+    finally:
+        manager.shutdown()
+
+
+def test_create_job_store_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        create_job_store("redis://localhost")
+
+
+def test_job_api_end_to_end(fake_defillama, model_payload):
+    client = TestClient(app)
+    submitted = client.post("/jobs/run_model/blacklitterman", json=model_payload)
+    assert submitted.status_code == 202
+    job_id = submitted.json()["job_id"]
+
+    events = client.get(f"/jobs/{job_id}/events")
+    assert events.headers["content-type"].startswith("text/event-stream")
+    assert "event: progress" in events.text
+    assert '"status": "succeeded"' in events.text
+
+    assert client.get(f"/jobs/{job_id}").json()["status"] == SUCCEEDED
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert result.json()["Model"] == "BlackLitterman"
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_job_api_rejects_misdirected_requests(fake_defillama, model_payload):
+    client = TestClient(app)
+    assert client.get("/jobs/run_model/blacklitterman").status_code == 405
+    assert client.delete("/jobs/run_model/blacklitterman").status_code == 405
+
+    job_id = client.post("/jobs/run_model/blacklitterman", json=model_payload).json()["job_id"]
+    assert client.get(f"/jobs/{job_id}/events", headers={"Last-Event-ID": "abc"}).status_code == 400
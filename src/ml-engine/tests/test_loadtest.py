@@ -0,0 +1,58 @@
+import asyncio
+
+import httpx
+import pytest
+
+from benchmarks.loadtest import (DEFAULT_REQUESTS_FILE, Sample, arrival_offsets, parse_http_file, parse_mix,
+                                 run_open_loop, summarise)
+from benchmarks.upstream import UpstreamStandIn
+from main_app.infrastructure import defi_llama
+from main_app.main import app
+
+
+def test_parses_the_repo_http_requests_into_a_weighted_mix():
+    templates = parse_http_file(DEFAULT_REQUESTS_FILE)
+    assert [t.route for t in templates] == ["GET /market_data/metrics/defillama/tvl_and_apy/steth",
+                                            "POST /run_model/blacklitterman"]
+    assert templates[1].body.startswith(b"{") and ("Content-Type", "application/json") in templates[1].headers
+
+    assert parse_mix("market_data=4,run_model=1", templates) == [4.0, 1.0]
+    assert parse_mix("run_model=1", templates) == [0.0, 1.0]
+    with pytest.raises(ValueError):
+        parse_mix("jobs=1", templates)
+
+
+def test_open_loop_schedule_is_independent_of_response_time():
+    assert arrival_offsets(4, 1) == [0.0, 0.25, 0.5, 0.75]
+    poisson = arrival_offsets(100, 10, poisson=True)
+    assert 900 < len(poisson) < 1100 and max(poisson) < 10
+
+
+def test_summary_reports_percentiles_and_errors_per_route():
+    samples = [Sample("GET /a", 200, n / 1000, 0.0) for n in range(1, 101)] + [Sample("GET /b", 0, 1.0, 0.002),
+                                                                               Sample("GET /b", 503, 0.5, 0.0)]
+    summary = summarise(samples, elapsed=2.0)
+    assert summary["GET /a"]["latency_ms"]["p50"] == pytest.approx(50.5)
+    assert summary["GET /a"]["latency_ms"]["p99"] == pytest.approx(99.01)
+    assert summary["GET /b"]["error_rate"] == 1.0 and summary["GET /b"]["statuses"] == {"0": 1, "503": 1}
+    assert summary["all"]["requests"] == 102 and summary["all"]["throughput_rps"] == 51.0
+
+
+def test_open_loop_run_against_the_stand_in(monkeypatch):
+    upstream = UpstreamStandIn(days=120).start()
+    try:
+        monkeypatch.setattr(defi_llama, "DEFILLAMA_YIELDS_URL", upstream.url)
+        monkeypatch.setattr(defi_llama, "_pool_resolver", None)
+        templates = parse_http_file(DEFAULT_REQUESTS_FILE)
+
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://service") as client:
+                return await run_open_loop(client, templates, [1.0, 1.0], rate=40, duration=0.25)
+
+        samples, elapsed = asyncio.run(run())
+    finally:
+        upstream.stop()
+
+    assert len(samples) == 10 and {s.status for s in samples} == {200}
+    assert upstream.requests["pools"] == 1 and upstream.requests["chart"] >= 1
@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+from starlette.testclient import TestClient
+
+from benchmarks.pipeline import measure_scenario
+from main_app.infrastructure import memory
+from main_app.infrastructure.jobs import CANCELLED, RUNNING, SUCCEEDED, TERMINAL_STATUSES, InMemoryJobStore, \
+    JobManager
+from main_app.infrastructure.memory import MemoryAccount, MemoryBudgetExceeded, MemoryBusy, MemoryGovernor
+from main_app.infrastructure.metrics import track_stage
+from main_app.main import app
+
+MB = 1024 ** 2
+
+
+def test_accounts_peak_and_retained_bytes_per_stage():
+    with MemoryAccount() as account:
+        with track_stage("Test", "outer"):
+            kept = np.ones(2 * MB // 8)
+            with track_stage("Test", "inner"):
+                np.ones(8 * MB // 8).sum()
+        del kept
+    assert not tracemalloc.is_tracing()
+    inner, outer = account.stages["Test.inner"], account.stages["Test.outer"]
+    assert 8 * MB <= inner.peak_bytes < 9 * MB and abs(inner.retained_bytes) < MB // 4
+    assert 10 * MB <= outer.peak_bytes < 11 * MB and 2 * MB <= outer.retained_bytes < 3 * MB
+    assert account.peak_bytes >= outer.peak_bytes and abs(account.retained_bytes) < MB // 4
+
+
+def test_stages_of_other_threads_are_not_accounted():
+    def elsewhere():
+        with track_stage("Test", "elsewhere"):
+            pass
+
+    with MemoryAccount() as account:
+        thread = threading.Thread(target=elsewhere)
+        thread.start()
+        thread.join()
+    assert account.stages == {}
+
+
+def test_tracing_outlives_the_account_while_others_use_it():
+    memory.start_tracing()
+    try:
+        outer = memory.open_peak_frame()
+        with MemoryAccount():
+            with track_stage("Test", "stage"):
+                np.ones(4 * MB // 8).sum()
+            with track_stage("Test", "stage"):  # resets tracemalloc's peak again
+                pass
+        assert tracemalloc.is_tracing()
+        peak, _ = memory.close_peak_frame(outer)
+        assert peak >= 4 * MB
+    finally:
+        memory.stop_tracing()
+    assert not tracemalloc.is_tracing()
+
+
+def test_estimates_cover_accounted_runs():
+    governor = MemoryGovernor(history_days=400)
+    for model in ("blacklitterman", "hrp"):
+        peak = measure_scenario(assets=100, days=400, views=5, repeat=1, model=model)["memory"]["peak_bytes"]
+        estimate = governor.estimate(model, {"AssetSymbols": ["X"] * 100})
+        assert peak <= estimate < 2 * peak
+    assert governor.estimate("unknown", {"AssetSymbols": ["X"] * 100}) == 0
+
+
+def test_plans_downgrade_then_reject(model_payload):
+    model_payload["ModelParameters"]["RiskReport"] = True
+    estimate = MemoryGovernor().estimate("blacklitterman", model_payload)
+    lean = MemoryGovernor().estimate("blacklitterman", {**model_payload, "ModelParameters": {}})
+
+    plan = MemoryGovernor(request_budget_mb=estimate / MB).plan("blacklitterman", model_payload)
+    assert plan.payload is model_payload and plan.downgrades == ()
+
+    plan = MemoryGovernor(request_budget_mb=(estimate - 1) / MB).plan("blacklitterman", model_payload)
+    assert plan.downgrades == ("risk_report",) and plan.estimate == lean
+    assert plan.payload["ModelParameters"]["RiskReport"] is False
+    assert model_payload["ModelParameters"]["RiskReport"] is True
+
+    with pytest.raises(MemoryBudgetExceeded):
+        MemoryGovernor(request_budget_mb=(lean - 1) / MB).plan("blacklitterman", model_payload)
+
+
+def test_process_budget_defers_concurrent_requests():
+    governor = MemoryGovernor(process_budget_mb=10)
+    with governor.reserve("hrp", 20 * MB):  # alone, a request always runs
+        with pytest.raises(MemoryBusy):
+            with governor.reserve("hrp", MB):
+                pass
+    with governor.reserve("hrp", 6 * MB), governor.reserve("hrp", 4 * MB):
+        assert governor.reserved == 10 * MB
+    assert governor.reserved == 0
+
+
+def test_background_work_waits_for_the_process_budget(monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_RETRY_AFTER_SECONDS", 0.05)
+    governor = MemoryGovernor(process_budget_mb=10)
+    manager = JobManager(InMemoryJobStore(), workers=2, result_ttl=60)
+
+    def work():
+        with governor.reserve("hrp", 6 * MB, wait=True):
+            return '{"ok": true}'
+
+    try:
+        with governor.reserve("hrp", 6 * MB):
+            queued, cancelled = manager.submit("test", work), manager.submit("test", work)
+            time.sleep(0.2)
+            assert manager.get(queued.job_id).status == manager.get(cancelled.job_id).status == RUNNING
+            manager.cancel(cancelled.job_id)
+            time.sleep(0.2)
+        for job_id, status in ((queued.job_id, SUCCEEDED), (cancelled.job_id, CANCELLED)):
+            while manager.get(job_id).status not in TERMINAL_STATUSES:
+                time.sleep(0.01)
+            assert manager.get(job_id).status == status
+    finally:
+        manager.shutdown()
+    assert governor.reserved == 0
+
+
+def test_model_endpoint_applies_the_budget(fake_defillama, model_payload, monkeypatch):
+    client = TestClient(app)
+    model_payload["ModelParameters"]["RiskReport"] = True
+    estimate = MemoryGovernor().estimate("blacklitterman", model_payload)
+
+    monkeypatch.setattr(memory, "_governor", MemoryGovernor(request_budget_mb=(estimate - 1) / MB))
+    monkeypatch.setattr("main_app.main.MEMORY_ACCOUNTING", True)
+    response = client.post("/run_model/blacklitterman", json=model_payload)
+    assert response.status_code == 200
+    assert response.headers["X-VV-Memory-Downgraded"] == "risk_report"
+    assert int(response.headers["X-VV-Memory-Estimate-Bytes"]) < estimate
+    assert int(response.headers["X-VV-Memory-Peak-Bytes"]) > 0
+    assert "Risk" not in json.loads(response.json())["ModelResults"][0]
+
+    monkeypatch.setattr(memory, "_governor", MemoryGovernor(request_budget_mb=0.01))
+    assert client.post("/run_model/blacklitterman", json=model_payload).status_code == 413
+    outcomes = client.post("/batch/run_model/blacklitterman", json=[model_payload]).json()
+    assert outcomes[0]["status"] == 413
@@ -0,0 +1,51 @@
+import pytest
+from starlette.testclient import TestClient
+
+from main_app.infrastructure.metrics import MetricsRegistry, STAGE_LATENCY, UPSTREAM_REQUESTS, track_stage
+from main_app.main import app
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Test histogram.", labels=("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5.0, stage="a")
+
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'test_seconds_count{stage="a"} 3' in text
+
+
+def test_counter_rejects_unknown_labels():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter.", labels=("route",))
+    with pytest.raises(ValueError):
+        counter.inc(route="/", method="GET")
+
+
+def test_track_stage_records_on_error(metrics_registry):
+    with pytest.raises(RuntimeError):
+        with track_stage("test", "failing"):
+            raise RuntimeError("boom")
+    assert STAGE_LATENCY.count(component="test", stage="failing") == 1
+
+
+def test_metrics_endpoint_reports_model_stages(fake_defillama, metrics_registry, model_payload):
+    client = TestClient(app)
+    response = client.post("/run_model/blacklitterman", json=model_payload)
+    assert response.status_code == 200
+
+    for stage in ["fetch", "histories", "sample_cov", "prior", "views", "posterior", "max_sharpe"]:
+        assert STAGE_LATENCY.count(component="BlPortfolioModel", stage=stage) > 0
+    assert STAGE_LATENCY.count(component="ModelEndpoint", stage="serialise") == 1
+    assert UPSTREAM_REQUESTS.value(host="yields.llama.fi", endpoint="chart", status="200") == 4
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'vv_http_requests_total{route="/run_model/{model_name}",method="POST",status="200"} 1' in metrics.text
+    assert 'vv_http_requests_in_flight{route="/run_model/{model_name}"} 0' in metrics.text
@@ -0,0 +1,58 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from main_app.models.registry import MODEL_REGISTRY, ModelRegistry, PayloadValidationError, UnknownModelError
+
+ML_ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_app_import_does_not_load_models():
+    probe = ("import json, sys; import main_app.main; "
+             "print(json.dumps([m for m in ('pypfopt', 'cvxpy', 'jsonschema', 'pandas') if m in sys.modules]))")
+    output = subprocess.run([sys.executable, "-c", probe], cwd=ML_ENGINE_DIR, check=True, capture_output=True,
+                            text=True).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == []
+
+
+def test_models_load_on_first_use(tmp_path):
+    schema = tmp_path / "schema.json"
+    schema.write_text(json.dumps({"type": "object", "required": ["x"]}))
+    registry = ModelRegistry()
+    registry.register("Echo", entry_point="json:dumps", schema_file=str(schema))
+    registry.register("Other", entry_point="does_not_exist:run", schema_file=str(schema))
+
+    assert "echo" in registry
+    assert not registry.spec("echo").loaded
+    assert registry.run("ECHO", {"x": 1}) == '{"x": 1}'
+    assert registry.spec("echo").loaded
+    assert not registry.spec("other").loaded  # registering a second model costs nothing
+
+    with pytest.raises(PayloadValidationError):
+        registry.validate("echo", {})
+    with pytest.raises(UnknownModelError):
+        registry.run("missing", {})
+    with pytest.raises(ValueError):
+        registry.register("echo", entry_point="json:loads", schema_file=str(schema))
+
+
+def test_preload_from_env_setting(tmp_path):
+    schema = tmp_path / "schema.json"
+    schema.write_text("{}")
+    registry = ModelRegistry()
+    registry.register("a", entry_point="json:dumps", schema_file=str(schema))
+    registry.register("b", entry_point="json:loads", schema_file=str(schema))
+
+    registry.preload_from_env("b")
+    assert [registry.spec(name).loaded for name in ("a", "b")] == [False, True]
+    registry.preload_from_env("*")
+    assert registry.spec("a").loaded
+
+
+def test_default_registry_serves_black_litterman(fake_defillama, model_payload):
+    MODEL_REGISTRY.validate("BlackLitterman", model_payload)
+    result = MODEL_REGISTRY.run("blacklitterman", model_payload)
+    assert result.Model == "BlackLitterman"
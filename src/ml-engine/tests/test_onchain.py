@@ -0,0 +1,96 @@
+import pytest
+from eth_abi import decode, encode
+
+from conftest import FakeResponse
+from main_app.infrastructure.onchain import AGGREGATE3, BALANCE_OF, DECIMALS, TOTAL_SUPPLY, MulticallReader, \
+    RpcConnection
+
+MULTICALL = "0xca11bde05977b3631167028862be2a173976ca11"
+VAULT = "0x00000000000000000000000000000000000000aa"
+TOKENS = {f"TOK{i}": f"0x{i + 1:040x}" for i in range(100)}
+
+
+class FakeEvm:
+    """A JSON-RPC node stand-in that serves ERC-20 reads through Multicall3 `aggregate3`."""
+
+    def __init__(self, block: int = 100):
+        self.block = block
+        self.requests = []
+        self.tokens = {address: {"supply": 10 ** 24 + i, "decimals": 18, "vault": i}
+                       for i, address in enumerate(TOKENS.values())}
+        self.tokens[TOKENS["TOK7"]]["decimals"] = None  # no decimals(): the read reverts
+
+    def post(self, url, json=None, timeout=None):
+        self.requests.append(json)
+        if json["method"] == "eth_blockNumber":
+            return FakeResponse({"jsonrpc": "2.0", "id": json["id"], "result": hex(self.block)})
+        call, block = json["params"]
+        assert call["to"] == MULTICALL and int(block, 16) <= self.block
+        data = bytes.fromhex(call["data"][2:])
+        assert data[:4] == AGGREGATE3
+        (calls,) = decode(["(address,bool,bytes)[]"], data[4:])
+        answers = [self.answer(target, payload) for target, _, payload in calls]
+        result = "0x" + encode(["(bool,bytes)[]"], [answers]).hex()
+        return FakeResponse({"jsonrpc": "2.0", "id": json["id"], "result": result})
+
+    def answer(self, target, payload):
+        token = self.tokens.get(target.lower())
+        value = None
+        if token is not None and payload[:4] == TOTAL_SUPPLY:
+            value = token["supply"]
+        elif token is not None and payload[:4] == DECIMALS:
+            value = token["decimals"]
+        elif token is not None and payload[:4] == BALANCE_OF:
+            (holder,) = decode(["address"], payload[4:])
+            value = token["vault"] if holder.lower() == VAULT else 0
+        return (True, encode(["uint256"], [value])) if value is not None else (False, b"")
+
+
+@pytest.fixture
+def evm():
+    return FakeEvm()
+
+
+def reader(evm, **kwargs):
+    addresses = {symbol: f"ethereum:{address}" for symbol, address in TOKENS.items()}
+    addresses["SOL"] = "solana:J1toso1uCk3RLmjorhTtrVwY9HJ7X8V9yYac6Y7kGCPn"
+    addresses["GONE"] = "Error: Symbol not found"
+    addresses["BASED"] = "base:0x" + "b" * 40
+    return MulticallReader({"ethereum": "http://evm.local"}, addresses,
+                           connection_factory=lambda url: RpcConnection(url, session=evm), **kwargs)
+
+
+def test_a_hundred_tokens_take_two_requests(evm):
+    states = reader(evm).token_states(list(TOKENS), holders=[VAULT])
+    assert [request["method"] for request in evm.requests] == ["eth_blockNumber", "eth_call"]
+    assert list(states) == list(TOKENS)
+    tok3 = states["TOK3"]
+    assert (tok3.block, tok3.address, tok3.total_supply, tok3.decimals) == (100, TOKENS["TOK3"], 10 ** 24 + 3, 18)
+    assert tok3.balances == {VAULT: 3}
+    assert states["TOK7"].decimals is None and states["TOK7"].total_supply == 10 ** 24 + 7
+
+
+def test_reads_are_cached_per_block(evm):
+    onchain = reader(evm)
+    first = onchain.token_states(["TOK1", "TOK2"], holders=[VAULT])
+    assert onchain.token_states(["tok2", "TOK1"], holders=[VAULT]) == {"TOK2": first["TOK2"], "TOK1": first["TOK1"]}
+    assert [request["method"] for request in evm.requests] == ["eth_blockNumber", "eth_call", "eth_blockNumber"]
+
+    evm.block = 101
+    evm.tokens[TOKENS["TOK1"]]["supply"] = 5
+    assert onchain.token_states(["TOK1"], holders=[])["TOK1"].total_supply == 5
+    assert onchain.token_states(["TOK1"], holders=[], blocks={"ethereum": 100})["TOK1"].total_supply == 10 ** 24 + 1
+    assert len(evm.requests) == 5  # the block-100 read came from the cache
+
+
+def test_large_batches_are_split(evm):
+    reader(evm, batch_calls=120).token_states(list(TOKENS), holders=[VAULT])
+    assert [request["method"] for request in evm.requests].count("eth_call") == 3
+
+
+def test_unresolvable_tokens(evm):
+    onchain = reader(evm)
+    for symbols in (["TOK1", "GONE"], ["SOL"], ["BASED"], ["MISSING"]):
+        with pytest.raises(ValueError):
+            onchain.token_states(symbols)
+    assert evm.requests == []
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from main_app.infrastructure.metrics import OPTIMISER_SOLVES
+from main_app.models import optimisers
+
+
+def random_problem(seed: int, n: int):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, 0.05, (300, n)) @ rng.normal(0, 1, (n, n)) * 0.3
+    symbols = [f"A{i}" for i in range(n)]
+    cov = pd.DataFrame(np.cov(returns.T) * 252 + np.eye(n) * 1e-4, index=symbols, columns=symbols)
+    mu = pd.Series(np.abs(rng.normal(0.05, 0.05, n)), index=symbols)
+    return mu, cov
+
+
+@pytest.mark.parametrize("n", [2, 4, 12, 30])
+@pytest.mark.parametrize("bounds", [(0, 1), (0, 0.5), "per_asset"])
+def test_native_matches_pypfopt(n, bounds):
+    for seed in range(5):
+        mu, cov = random_problem(seed, n)
+        if bounds == "per_asset":
+            bounds = [(0.01, 0.6)] * n
+        for solve, args in [(optimisers.max_sharpe, (mu, cov, 0.01, bounds)),
+                            (optimisers.min_volatility, (cov, bounds))]:
+            native = pd.Series(solve(*args, backend="native"))
+            reference = pd.Series(solve(*args, backend="pypfopt"))
+            assert list(native.index) == list(cov.columns)
+            np.testing.assert_allclose(native, reference, atol=1e-4)
+            assert native.sum() == pytest.approx(1, abs=1e-4)
+
+
+def test_falls_back_to_pypfopt_for_unsupported_problems(metrics_registry):
+    mu, cov = random_problem(0, 4)
+    shorting = optimisers.max_sharpe(mu, cov, weight_bounds=(-1, 1), backend="native")
+    assert min(shorting.values()) < 0
+    assert OPTIMISER_SOLVES.value(objective="max_sharpe", backend="pypfopt", fallback="true") == 1
+
+    optimisers.min_volatility(cov, backend="native")
+    assert OPTIMISER_SOLVES.value(objective="min_volatility", backend="native", fallback="false") == 1
+
+
+def test_rejects_problems_without_positive_excess_return():
+    mu, cov = random_problem(0, 4)
+    with pytest.raises(ValueError):
+        optimisers.max_sharpe(mu, cov, risk_free_rate=1.0, backend="native")
+    with pytest.raises(ValueError):
+        optimisers.max_sharpe(mu, cov, backend="cvx")
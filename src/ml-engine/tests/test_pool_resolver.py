@@ -0,0 +1,84 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import POOL_IDS
+from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol, get_pool_resolver
+from main_app.infrastructure.pool_resolver import PoolResolver
+
+
+def pool_data(symbol, pool_id, tvl, chain="Ethereum", project="test"):
+    return SimpleNamespace(symbol=symbol, pool=pool_id, tvlUsd=tvl, chain=chain, project=project)
+
+
+@pytest.fixture
+def static_files(tmp_path):
+    addresses = tmp_path / "addresses.json"
+    addresses.write_text(json.dumps({"STETH": "ethereum:0x1", "WETH": "ethereum:0x2", "BAD": "Error: not found"}))
+    pinned = tmp_path / "pinned.json"
+    pinned.write_text(json.dumps({"STETH": "pinned-steth"}))
+    return str(addresses), str(pinned)
+
+
+@pytest.fixture
+def summary():
+    return {
+        "STETH": [pool_data("STETH", "small", 1e6), pool_data("STETH", "pinned-steth", 1e7),
+                  pool_data("STETH", "big", 1e9, chain="Arbitrum", project="aave")],
+        "weth": [pool_data("WETH", "weth-low", 1e6, project="aave"), pool_data("WETH", "weth-high", 1e8)],
+        "BAD": [pool_data("BAD", "bad", 1e9)],
+        "NOADDR": [pool_data("NOADDR", "noaddr", 1e9)],
+    }
+
+
+def test_ranks_pools_with_pin_first(summary, static_files):
+    resolver = PoolResolver(lambda: summary, *static_files)
+    assert resolver.supported_symbols() == ["STETH", "WETH"]
+    assert resolver.pool_ids("steth") == ["pinned-steth", "big", "small"]
+    assert resolver.primary_pool("Weth") == "weth-high"
+    assert resolver.contract_address("weth") == "ethereum:0x2"
+    with pytest.raises(ValueError):
+        resolver.pool_ids("NOADDR")
+
+
+def test_filters_by_chain_and_project(summary, static_files):
+    resolver = PoolResolver(lambda: summary, *static_files)
+    assert resolver.pool_ids("STETH", chain="arbitrum") == ["big"]
+    assert resolver.pool_ids("STETH", chain="ethereum") == ["pinned-steth", "small"]
+    assert resolver.pool_ids("WETH", project="AAVE") == ["weth-low"]
+    assert resolver.pool_ids("STETH", chain="Ethereum", project="aave") == []
+
+
+def test_serves_pinned_pools_when_upstream_fails(static_files):
+    attempts = []
+
+    def failing():
+        attempts.append(1)
+        raise ConnectionError("upstream down")
+
+    resolver = PoolResolver(failing, *static_files)
+    assert resolver.supported_symbols() == ["STETH"]
+    assert resolver.primary_pool("STETH") == "pinned-steth"
+    assert len(attempts) >= 1
+
+
+def test_stale_index_refreshes_in_background(summary, static_files):
+    current = {"summary": {"WETH": [pool_data("WETH", "old", 1e6)]}}
+    resolver = PoolResolver(lambda: current["summary"], *static_files, refresh_interval=0.0)
+    assert resolver.pool_ids("WETH") == ["old"]
+
+    current["summary"] = summary
+    deadline = time.time() + 5
+    while resolver.pool_ids("WETH") == ["old"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert resolver.pool_ids("WETH") == ["weth-high", "weth-low"]
+
+
+def test_symbol_history_uses_resolved_pool(fake_defillama):
+    assert set(POOL_IDS) <= set(get_pool_resolver().supported_symbols())
+    get_historic_tvl_and_apy_from_symbol("gho", use_shared_panels=False)
+    assert fake_defillama.calls[-1].endswith(POOL_IDS["GHO"])
+    with pytest.raises(ValueError):
+        get_historic_tvl_and_apy_from_symbol("NOT_A_TOKEN")
@@ -0,0 +1,100 @@
+import cProfile
+import pstats
+import tracemalloc
+
+import numpy as np
+import pytest
+from starlette.testclient import TestClient
+
+from main_app.infrastructure import profiling
+from main_app.infrastructure.memory import MemoryAccount
+from main_app.infrastructure.profiling import ProfileStore, ProfilingSession, folded_stacks_from_stats
+from main_app.main import app
+
+TOKEN = "test-token"
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", TOKEN)
+    monkeypatch.setattr(profiling, "PROFILE_STORE", ProfileStore(str(tmp_path), retention=2))
+    return TestClient(app)
+
+
+def test_unflagged_request_is_not_profiled(client, fake_defillama):
+    response = client.get("/market_data/metrics/defillama/tvl_and_apy/steth")
+    assert response.status_code == 200
+    assert profiling.PROFILE_ID_HEADER not in response.headers
+
+
+def test_profiling_requires_token(client, fake_defillama):
+    response = client.get("/market_data/symbols", headers={"X-VV-Profile": "cpu", "X-VV-Profile-Token": "wrong"})
+    assert response.status_code == 403
+
+
+def test_unknown_mode_is_rejected(client, fake_defillama):
+    response = client.get("/market_data/symbols", headers={"X-VV-Profile": "gpu", "X-VV-Profile-Token": TOKEN})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("mode", ["cpu", "memory"])
+def test_profiled_model_run_stores_artifact(client, fake_defillama, model_payload, mode):
+    headers = {"X-VV-Profile-Token": TOKEN}
+    response = client.post(f"/run_model/blacklitterman?profile={mode}", json=model_payload, headers=headers)
+    assert response.status_code == 200
+    profile_id = response.headers[profiling.PROFILE_ID_HEADER]
+
+    folded = client.get(f"/profiles/{profile_id}", headers=headers)
+    assert folded.status_code == 200
+    stack, weight = folded.text.splitlines()[0].rsplit(" ", 1)
+    assert stack and int(weight) >= 0
+
+    report = client.get(f"/profiles/{profile_id}?format=text", headers=headers)
+    assert report.status_code == 200
+    assert client.get(f"/profiles/{profile_id}").status_code == 403
+
+
+def test_overlapping_memory_profiles_share_tracing():
+    first, second = ProfilingSession("memory"), ProfilingSession("memory")
+    first.__enter__()
+    second.__enter__()
+    np.ones(4 * 1024 ** 2 // 8).sum()
+    first.__exit__(None, None, None)
+    third = ProfilingSession("memory").__enter__()  # must not reset the peak the second is measuring
+    second.__exit__(None, None, None)
+    third.__exit__(None, None, None)
+    assert first._peak_bytes >= 4 * 1024 ** 2 and second._peak_bytes >= 4 * 1024 ** 2
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_profile_outlives_an_account_it_joined():
+    account = MemoryAccount().__enter__()
+    with ProfilingSession("memory") as session:
+        account.__exit__(None, None, None)
+        np.ones(1024 ** 2 // 8).sum()
+    assert session._peak_bytes >= 1024 ** 2 and session.artifacts()["txt"]
+    assert not tracemalloc.is_tracing()
+
+
+def test_store_keeps_only_recent_profiles(tmp_path):
+    store = ProfileStore(str(tmp_path), retention=2)
+    ids = [store.save({"txt": b"report"}) for _ in range(3)]
+    assert store.load(ids[-1], "txt") == b"report"
+    assert len(list(tmp_path.iterdir())) == 2
+    assert store.load("../../etc/passwd", "txt") is None
+
+
+def test_folded_stacks_attribute_time_to_callers():
+    def leaf():
+        return sum(i * i for i in range(20000))
+
+    def parent():
+        return leaf()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    parent()
+    profiler.disable()
+
+    stacks = folded_stacks_from_stats(pstats.Stats(profiler))
+    assert any("parent" in line and "leaf" in line.rsplit(" ", 1)[0].split(";")[-1] for line in stacks)
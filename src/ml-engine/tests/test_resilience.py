@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from conftest import FakeResponse
+from main_app.infrastructure.metrics import UPSTREAM_EVENTS
+from main_app.infrastructure.resilience import CircuitBreaker, CircuitOpenError, UpstreamClient, UpstreamTimeout, \
+    latency_budget
+from main_app.main import app
+
+URL = "https://upstream.test/chart/pool"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures_and_lets_one_trial_through():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=3, reset_seconds=10, clock=clock)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    clock.now = 10
+    assert breaker.allow() and not breaker.allow()  # a single half-open trial
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_calls_time_out_and_trip_the_circuit(metrics_registry):
+    client = UpstreamClient(timeout=0.05, breaker_factory=lambda: CircuitBreaker(failures=2, reset_seconds=60))
+
+    def hang(timeout):
+        time.sleep(0.3)
+        return FakeResponse({})
+
+    for _ in range(2):
+        start = time.perf_counter()
+        with pytest.raises(UpstreamTimeout):
+            client.call(URL, "chart", hang)
+        assert time.perf_counter() - start < 0.25
+    with pytest.raises(CircuitOpenError):
+        client.call(URL, "chart", hang)
+    assert UPSTREAM_EVENTS.value(host="upstream.test", endpoint="chart", event="circuit_open") == 1
+
+
+def test_calls_cut_short_by_the_request_budget_do_not_trip_the_circuit():
+    client = UpstreamClient(timeout=5, breaker_factory=lambda: CircuitBreaker(failures=2, reset_seconds=60))
+
+    def hang(timeout):
+        time.sleep(0.3)
+        return FakeResponse({})
+
+    for _ in range(3):
+        with latency_budget(0.05):
+            with pytest.raises(UpstreamTimeout):
+                client.call(URL, "chart", hang)
+    assert client.breaker("upstream.test").state == CircuitBreaker.CLOSED
+
+
+def test_slow_call_is_hedged_after_the_endpoint_p95(metrics_registry):
+    client = UpstreamClient(timeout=2, hedge_after=0.05)
+    for _ in range(20):
+        client.latencies("upstream.test", "chart").observe(0.01)
+    attempts = []
+    lock = threading.Lock()
+
+    def first_attempt_hangs(timeout):
+        with lock:
+            attempts.append(timeout)
+            first = len(attempts) == 1
+        if first:
+            time.sleep(0.5)
+            return FakeResponse({"attempt": 1})
+        return FakeResponse({"attempt": 2})
+
+    start = time.perf_counter()
+    response = client.call(URL, "chart", first_attempt_hangs)
+    assert response.json() == {"attempt": 2}
+    assert time.perf_counter() - start < 0.4
+    assert UPSTREAM_EVENTS.value(host="upstream.test", endpoint="chart", event="hedge") == 1
+
+
+@pytest.fixture
+def flaky_defillama(fake_defillama, monkeypatch):
+    """The fake DefiLlama, whose `/chart` calls fail with `mode` 'error' or hang with 'hang'."""
+    state = {"mode": "ok"}
+
+    def get(url, *args, **kwargs):
+        if "/chart/" in url and state["mode"] == "error":
+            return FakeResponse({"message": "upstream down"}, status_code=503)
+        if "/chart/" in url and state["mode"] == "hang":
+            time.sleep(1)
+        return fake_defillama.get(url, *args, **kwargs)
+
+    monkeypatch.setattr("main_app.infrastructure.defi_llama.requests.get", get)
+    return state
+
+
+def test_model_serves_last_good_series_flagged_stale(flaky_defillama, model_payload, metrics_registry, monkeypatch):
+    client = TestClient(app)
+    fresh = client.post("/run_model/blacklitterman", json=model_payload)
+    assert fresh.status_code == 200 and "x-stale-sources" not in fresh.headers
+
+    # the histories are fetched again once their TTL window has passed
+    monkeypatch.setattr("main_app.infrastructure.defi_llama.MARKET_DATA_TTL_SECONDS", 1e-9)
+    flaky_defillama["mode"] = "error"
+    stale = client.post("/run_model/blacklitterman", json=model_payload)
+    assert stale.status_code == 200
+    assert stale.json() == fresh.json()
+    assert len(stale.headers["x-stale-sources"].split(",")) == 4
+    assert UPSTREAM_EVENTS.value(host="yields.llama.fi", endpoint="chart", event="stale_served") == 4
+
+
+def test_upstream_failure_without_a_good_series_is_a_bad_gateway(flaky_defillama):
+    flaky_defillama["mode"] = "error"
+    response = TestClient(app).get("/market_data/metrics/defillama/tvl_and_apy/GHO")
+    assert response.status_code == 502
+
+
+def test_model_latency_budget_holds_while_upstream_hangs(flaky_defillama, model_payload, monkeypatch):
+    monkeypatch.setattr("main_app.main.MODEL_LATENCY_BUDGET_SECONDS", 0.4)
+    monkeypatch.setattr("main_app.main.MODEL_COMPUTE_RESERVE_SECONDS", 0.1)
+    flaky_defillama["mode"] = "hang"
+    start = time.perf_counter()
+    response = TestClient(app).post("/run_model/blacklitterman", json=model_payload)
+    assert response.status_code == 504
+    assert time.perf_counter() - start < 0.9
+
+
+def test_model_compute_is_cut_off_at_the_latency_budget(fake_defillama, model_payload, monkeypatch):
+    monkeypatch.setattr("main_app.main.MODEL_LATENCY_BUDGET_SECONDS", 0.3)
+    monkeypatch.setattr("main_app.main.ModelEndpoint.run_model", lambda self, name, payload: time.sleep(1.5))
+    start = time.perf_counter()
+    response = TestClient(app).post("/run_model/blacklitterman", json=model_payload)
+    assert response.status_code == 504
+    assert time.perf_counter() - start < 1
+
+
+def test_budget_serves_stale_once_upstream_time_is_used_up(flaky_defillama):
+    from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol
+
+    fresh = get_historic_tvl_and_apy_from_symbol("GHO", use_shared_panels=False)
+    flaky_defillama["mode"] = "hang"
+    with latency_budget(0.2, reserve=0.2) as budget:
+        start = time.perf_counter()
+        stale = get_historic_tvl_and_apy_from_symbol("GHO", use_shared_panels=False)
+    assert time.perf_counter() - start < 0.1
+    assert stale is fresh and len(budget.stale) == 1
@@ -0,0 +1,82 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from starlette.testclient import TestClient
+
+from benchmarks.synthetic import synthetic_hrp_payload
+from main_app.infrastructure.compact_panels import Panel
+from main_app.main import app
+from main_app.models.risk_report import daily_returns, risk_reports
+
+SYMBOLS = ["A", "B", "C"]
+
+
+def random_panel(days: int = 250, seed: int = 0) -> Panel:
+    rng = np.random.default_rng(seed)
+    levels = 5 * np.exp(np.cumsum(rng.normal(0, 0.02, (days, len(SYMBOLS))) @ rng.normal(0, 1, (3, 3)), axis=0))
+    index = pd.date_range("2025-01-01", periods=days, freq="D").date[::-1]
+    return Panel.from_frame(pd.DataFrame(levels[::-1], index=index, columns=SYMBOLS))
+
+
+def figures(report) -> list:
+    values = report.to_dict()
+    contributions = values.pop("RiskContributions")
+    return list(values.values()) + [c[key] for c in contributions for key in ("marginal", "component", "percent")]
+
+
+def test_figures_match_their_definitions():
+    panel = random_panel()
+    returns = pd.DataFrame(daily_returns(panel), columns=SYMBOLS)
+    cov = returns.cov() * 252
+    weights = {"A": 0.5, "B": 0.3, "C": 0.2}
+    (report,) = risk_reports(SYMBOLS, [weights], panel, cov, confidence=0.9)
+
+    portfolio = returns @ pd.Series(weights)
+    assert report.HistoricalVaR == pytest.approx(-portfolio.quantile(0.1))
+    assert report.HistoricalCVaR == pytest.approx(-portfolio[portfolio <= portfolio.quantile(0.1)].mean())
+    sigma = np.sqrt(pd.Series(weights) @ cov @ pd.Series(weights))
+    assert report.Volatility == pytest.approx(sigma)
+    assert report.ParametricVaR == pytest.approx(1.2815516 * sigma / np.sqrt(252) - portfolio.mean(), rel=1e-6)
+    assert report.ParametricCVaR > report.ParametricVaR
+    assert sum(c.component for c in report.RiskContributions) == pytest.approx(sigma)
+    assert sum(c.percent for c in report.RiskContributions) == pytest.approx(1)
+
+    wealth = (1 + portfolio).cumprod()
+    drawdown = 1 - wealth / wealth.cummax()
+    assert report.MaxDrawdown == pytest.approx(drawdown.max())
+    assert report.CurrentDrawdown == pytest.approx(drawdown.iloc[-1])
+    underwater = (drawdown > 1e-12).astype(int)
+    longest = underwater.groupby((underwater == 0).cumsum()).sum().max()
+    assert report.LongestDrawdownDays == longest
+
+
+def test_portfolios_are_reported_together_as_separately():
+    panel = random_panel(seed=1)
+    cov = pd.DataFrame(np.cov(daily_returns(panel).T) * 252, index=SYMBOLS, columns=SYMBOLS)
+    allocations = [{"A": 1.0}, {"A": 0.2, "B": 0.2, "C": 0.6}, {"B": 0.5, "C": 0.5}]
+    together = risk_reports(SYMBOLS, allocations, panel, cov)
+    for report, allocation in zip(together, allocations):
+        assert figures(report) == pytest.approx(figures(risk_reports(SYMBOLS, [allocation], panel, cov)[0]))
+    assert together[0].RiskContributions[1].component == 0
+    with pytest.raises(ValueError):
+        risk_reports(SYMBOLS, allocations, panel, cov, confidence=1.5)
+
+
+def test_reports_are_attached_only_when_requested(fake_defillama, model_payload):
+    client = TestClient(app)
+    plain = json.loads(client.post("/run_model/blacklitterman", json=model_payload).json())
+    assert "Risk" not in plain["ModelResults"][0]
+
+    model_payload["ModelParameters"]["RiskReport"] = True
+    with_risk = json.loads(client.post("/run_model/blacklitterman", json=model_payload).json())
+    (result,) = with_risk["ModelResults"]
+    assert result["Allocations"] == plain["ModelResults"][0]["Allocations"]
+    assert result["Risk"]["Confidence"] == 0.95
+    assert [c["asset"] for c in result["Risk"]["RiskContributions"]] == model_payload["AssetSymbols"]
+
+    payload = synthetic_hrp_payload(model_payload["AssetSymbols"])
+    payload["ModelParameters"].update(RiskReport=True, RiskConfidence=0.99)
+    hrp = json.loads(client.post("/run_model/hrp", json=payload).json())
+    assert hrp["ModelResults"][0]["Risk"]["Confidence"] == 0.99
@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+from starlette.testclient import TestClient
+
+from conftest import make_chart
+from main_app.infrastructure.series_cache import SeriesCache, not_modified, parse_since
+from main_app.main import app
+
+ROUTE = "/market_data/metrics/defillama/tvl_and_apy/GHO"
+
+
+def chart_calls(fake):
+    return [url for url in fake.calls if "/chart/" in url]
+
+
+def test_revalidation_is_answered_without_the_upstream(fake_defillama):
+    client = TestClient(app)
+    first = client.get(ROUTE)
+    assert first.status_code == 200 and len(first.json()) == 400
+    etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+    assert last_modified == "Thu, 01 May 2025 23:01:56 GMT"
+
+    assert client.get(ROUTE, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(ROUTE, headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get(ROUTE, headers={"If-None-Match": '"other"', "If-Modified-Since": last_modified}).status_code == 200
+    assert len(chart_calls(fake_defillama)) == 1
+
+
+def test_since_returns_only_newer_rows(fake_defillama):
+    client = TestClient(app)
+    full = client.get(ROUTE).json()
+    delta = client.get(ROUTE, params={"since": full[-3]["timestamp"]})
+    assert delta.status_code == 200
+    assert delta.json() == full[-2:]
+    assert delta.headers["etag"] == client.get(ROUTE).headers["etag"]
+
+    epoch = pd.Timestamp(full[-2]["timestamp"]).timestamp()
+    assert client.get(ROUTE, params={"since": str(epoch)}).json() == full[-1:]
+    assert client.get(ROUTE, params={"since": "not a time"}).status_code == 400
+    assert len(chart_calls(fake_defillama)) == 1
+
+
+def test_symbols_route_has_an_etag(fake_defillama):
+    client = TestClient(app)
+    response = client.get("/market_data/symbols")
+    again = client.get("/market_data/symbols", headers={"If-None-Match": response.headers["etag"]})
+    assert again.status_code == 304 and again.content == b""
+
+
+def test_entries_expire_with_ttl_or_source_version():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return pd.DataFrame(make_chart("pool", days=5))
+
+    clock_cache = SeriesCache(ttl=0)
+    clock_cache.get("a", load, "timestamp")
+    clock_cache.get("a", load, "timestamp")
+    assert len(loads) == 2
+
+    version = {"value": 1}
+    cache = SeriesCache(ttl=3600)
+    first = cache.get("a", load, "timestamp", version=lambda: version["value"])
+    assert cache.get("a", load, "timestamp", version=lambda: version["value"]) is first
+    version["value"] = 2
+    reloaded = cache.get("a", load, "timestamp", version=lambda: version["value"])
+    assert reloaded is not first and reloaded.etag == first.etag
+    assert reloaded.last_modified == first.last_modified
+    assert len(loads) == 4
+
+
+def test_validators_and_since_parsing():
+    assert not_modified({"if-none-match": 'W/"abc", "def"'}, '"abc"')
+    assert not not_modified({"if-none-match": '"abc"'}, '"def"')
+    assert not not_modified({"if-modified-since": "garbage"}, '"abc"', 0.0)
+    assert parse_since("1700000000") == 1_700_000_000 * 10 ** 9
+    assert parse_since("2023-11-14T22:13:20Z") == 1_700_000_000 * 10 ** 9
+    with pytest.raises(ValueError):
+        parse_since("yesterday-ish")
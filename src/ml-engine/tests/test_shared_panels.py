@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import POOL_IDS, make_chart
+from main_app.infrastructure import shared_panels
+from main_app.infrastructure.compact_panels import PoolHistory
+from main_app.infrastructure.defi_llama import get_historic_tvl_and_apy_from_symbol
+from main_app.infrastructure.shared_panels import PanelRefresher, SharedPanelStore, panel_to_pool_history, \
+    pool_history_panel_name, pool_history_to_panel
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SharedPanelStore(str(tmp_path))
+
+
+def test_publish_and_read_memory_mapped(store):
+    index = np.arange(3, dtype=np.int64)
+    values = np.arange(6, dtype=np.float64).reshape(3, 2)
+    version = store.publish("pool_history/STETH", index, ["apy", "tvlUsd"], values)
+
+    panel = store.read("pool_history/STETH")
+    assert panel.version == version
+    assert isinstance(panel.values, np.memmap)
+    assert not panel.values.flags.writeable
+    np.testing.assert_array_equal(panel.column("tvlUsd"), [1, 3, 5])
+    assert store.read("pool_history/STETH") is panel  # mapping reused while the version is current
+
+
+def test_publish_swaps_versions_and_keeps_old_mappings_valid(store, tmp_path):
+    name = "pool_history/GHO"
+    first = store.publish(name, np.arange(2), ["apy"], np.array([[1.0], [2.0]]))
+    old_panel = store.read(name)
+    store.publish(name, np.arange(2), ["apy"], np.array([[3.0], [4.0]]))
+    latest = store.publish(name, np.arange(2), ["apy"], np.array([[5.0], [6.0]]))
+
+    assert store.read(name).version == latest
+    np.testing.assert_array_equal(store.read(name).column("apy"), [5.0, 6.0])
+    assert not (tmp_path / "pool_history" / "GHO" / str(first)).exists()
+    np.testing.assert_array_equal(old_panel.column("apy"), [1.0, 2.0])
+
+
+def test_rejects_bad_names_and_shapes(store):
+    with pytest.raises(ValueError):
+        store.publish("../escape", np.arange(1), ["apy"], np.zeros((1, 1)))
+    with pytest.raises(ValueError):
+        store.publish("pool_history/X", np.arange(2), ["apy"], np.zeros((1, 1)))
+    assert store.read("pool_history/MISSING") is None
+
+
+def test_pool_history_round_trip(store):
+    original = pd.DataFrame(make_chart(POOL_IDS["USDC"], days=10))
+    store.publish("pool_history/USDC", *pool_history_to_panel(original))
+    restored = panel_to_pool_history(store.read("pool_history/USDC"))
+    assert list(restored.columns) == list(original.columns)
+    assert list(restored["timestamp"]) == list(pd.to_datetime(original["timestamp"], utc=True))
+    np.testing.assert_allclose(restored["apy"], original["apy"])
+    # served and modelled as the upstream frame is
+    assert restored[["timestamp"]].to_json(orient="records", date_format="iso") == \
+        original[["timestamp"]].to_json(orient="records")
+    np.testing.assert_array_equal(PoolHistory.from_frame(restored).days, PoolHistory.from_frame(original).days)
+
+
+def test_republishing_unchanged_content_keeps_the_version(store):
+    name = "pool_history/GHO"
+    version = store.publish(name, np.arange(2), ["apy"], np.array([[1.0], [2.0]]))
+    assert store.publish(name, np.arange(2), ["apy"], np.array([[1.0], [2.0]])) == version
+    assert store.publish(name, np.arange(2), ["apy"], np.array([[1.0], [3.0]])) > version
+
+
+def test_single_leader_per_store(store):
+    first = PanelRefresher(store, lambda: [], lambda symbol: None)
+    second = PanelRefresher(store, lambda: [], lambda symbol: None)
+    try:
+        assert first.try_become_leader()
+        assert not second.try_become_leader()
+        first.stop()
+        assert second.try_become_leader()
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_symbol_history_is_served_from_shared_panel(store, fake_defillama, monkeypatch):
+    refresher = PanelRefresher(store, lambda: ["STETH"],
+                               lambda symbol: get_historic_tvl_and_apy_from_symbol(symbol, use_shared_panels=False))
+    version = refresher.refresh_once()["STETH"]
+    assert refresher.refresh_once() == {"STETH": version}  # nothing new upstream
+    assert store.read(pool_history_panel_name("STETH")) is not None
+
+    monkeypatch.setattr(shared_panels, "SHARED_PANELS_ENABLED", True)
+    monkeypatch.setattr(shared_panels, "_store", store)
+    calls = len(fake_defillama.calls)
+    df = get_historic_tvl_and_apy_from_symbol("steth")
+    assert len(fake_defillama.calls) == calls
+    assert len(df) == len(make_chart(POOL_IDS["STETH"]))
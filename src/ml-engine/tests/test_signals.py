@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from starlette.testclient import TestClient
+
+from benchmarks.pipeline import synthetic_market_data
+from benchmarks.synthetic import synthetic_history, synthetic_payload, synthetic_symbols
+from main_app.infrastructure.compact_panels import Panel, PoolHistory
+from main_app.infrastructure.metrics import CACHE_LOOKUPS
+from main_app.main import app
+from main_app.models.registry import MODEL_REGISTRY, PayloadValidationError
+from main_app.models.signals import MOMENTUM, SIGNALS, RollingSignals
+
+SYMBOLS = synthetic_symbols(12)
+
+
+def apy_panel(days: int, newest_dropped: int = 0, revise: str = None) -> Panel:
+    histories = []
+    for symbol in SYMBOLS:
+        df = synthetic_history(symbol, days)
+        df = df.iloc[:len(df) - newest_dropped].copy()
+        if symbol == revise:
+            df.loc[df.index[-10], "apy"] *= 1.1
+        histories.append(PoolHistory.from_frame(df))
+    return Panel.align(SYMBOLS, histories, "apy", scale=1 / 100)
+
+
+def assert_same_signals(frame, reference):
+    for name in SIGNALS:
+        np.testing.assert_allclose(frame.values[name], reference.values[name], rtol=1e-9, equal_nan=True)
+
+
+def test_advances_with_new_days_as_if_computed_from_scratch(metrics_registry):
+    panels = [apy_panel(400, newest_dropped=dropped) for dropped in (4, 3, 1, 0)] + [apy_panel(400, revise=SYMBOLS[3])]
+    references = [RollingSignals((7, 30, 90)).compute(panel) for panel in panels]
+    metrics_registry.reset()
+    engine = RollingSignals((7, 30, 90))
+    for panel, reference in zip(panels, references):
+        assert_same_signals(engine.compute(panel), reference)
+    # a symbol whose older days were revised is computed again
+    assert CACHE_LOOKUPS.value(cache="rolling_signals", result="hit") == 4 * len(SYMBOLS) - 1
+    assert CACHE_LOOKUPS.value(cache="rolling_signals", result="miss") == len(SYMBOLS) + 1
+
+
+def test_momentum_matches_the_original_view_signal_and_short_histories_are_cut():
+    panel = apy_panel(400)
+    apy = panel.to_frame()
+    frame = RollingSignals((7, 30)).compute(panel)
+    expected = 2 * (apy.iloc[0] / apy.iloc[30] - 1) * 365 / 30
+    np.testing.assert_allclose(frame.signal(MOMENTUM, 30), expected.to_numpy(), rtol=1e-12)
+
+    short = apy_panel(12)
+    np.testing.assert_allclose(RollingSignals((30,)).compute(short).signal(MOMENTUM, 30),
+                               RollingSignals((11,)).compute(short).signal(MOMENTUM, 11))
+    with pytest.raises(ValueError):
+        frame.signal(MOMENTUM, 90)
+    with pytest.raises(ValueError):
+        RollingSignals((7,)).compute(apy_panel(1))
+
+
+def generated_views_payload(signals=None):
+    symbols = SYMBOLS[:6]
+    payload = synthetic_payload(symbols, views=0)
+    del payload["PortfolioViews"]
+    if signals is not None:
+        payload["ModelParameters"]["Signals"] = signals
+    return symbols, payload
+
+
+@pytest.mark.parametrize("signals", [None, [
+    {"Signal": "momentum", "Horizon": 7, "Weight": 0.25},
+    {"Signal": "mean_reversion", "Horizon": 90, "Weight": 0.25},
+    {"Signal": "volatility_scaled_momentum", "Horizon": 30, "Weight": 0.5},
+]])
+def test_model_generates_one_absolute_view_per_asset(signals):
+    symbols, payload = generated_views_payload(signals)
+    MODEL_REGISTRY.validate("blacklitterman", payload)
+    with synthetic_market_data({symbol: synthetic_history(symbol, 400) for symbol in symbols}):
+        result = MODEL_REGISTRY.run("blacklitterman", payload)
+    views = result.ModelResults[0].Views
+    assert [view.Weights[0].Weights for view in views] == np.eye(len(symbols)).tolist()
+    assert max(view.Confidence for view in views) == pytest.approx(1)
+    assert sum(a.weight for a in result.ModelResults[0].Allocations) == pytest.approx(1, abs=1e-4)
+
+
+def test_signal_horizons_must_be_computed():
+    symbols, payload = generated_views_payload([{"Signal": "momentum", "Horizon": 11, "Weight": 1}])
+    with synthetic_market_data({symbol: synthetic_history(symbol, 400) for symbol in symbols}):
+        with pytest.raises(ValueError):
+            MODEL_REGISTRY.run("blacklitterman", payload)
+
+
+@pytest.mark.parametrize("signal", [{"Signal": "momentum", "Horizon": 14, "Weight": 1},
+                                    {"Signal": "momentum", "Weight": 1},
+                                    {"Signal": "mean_reversion", "Horizon": None, "Weight": 1}])
+def test_payloads_with_uncomputed_horizons_are_rejected_before_the_run(signal, fake_defillama):
+    _, payload = generated_views_payload([signal, {"Signal": "valuation", "Weight": 1}])
+    with pytest.raises(PayloadValidationError):
+        MODEL_REGISTRY.validate("blacklitterman", payload)
+
+    client = TestClient(app)
+    assert client.post("/run_model/blacklitterman", json=payload).status_code == 400
+    assert client.post("/batch/run_model/blacklitterman", json=[payload]).json()[0]["status"] == 400
@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from conftest import POOL_IDS, FakeDefiLlama, make_chart, make_pool
+from main_app.infrastructure import defi_llama
+from main_app.infrastructure.snapshots import current_snapshot_dir, open_snapshot, write_snapshot
+
+RECORDS = [
+    {"id": "a", "price": 1.5, "rank": 1, "active": True, "tags": ["x", "y"], "meta": None},
+    {"id": "b", "price": None, "rank": 2, "active": False, "tags": [], "meta": {"k": 1}},
+    {"id": None, "price": 3.0, "rank": 3, "active": True, "tags": ["x", "y"], "meta": None, "extra": "only here"},
+]
+
+
+def test_round_trip_preserves_records_and_types(tmp_path):
+    write_snapshot("test", {"items": RECORDS, "empty": []}, root=str(tmp_path), source={"api_base": "x"})
+    snapshot = open_snapshot("test", root=str(tmp_path))
+
+    assert snapshot.manifest["schema_version"] == 1
+    assert snapshot.manifest["source"] == {"api_base": "x"}
+    assert snapshot.rows("items") == 3 and snapshot.rows("empty") == 0
+    columns = snapshot.manifest["tables"]["items"]["columns"]
+    assert {name: spec["encoding"] for name, spec in columns.items()} == {
+        "id": "string", "price": "numeric", "rank": "numeric", "active": "numeric", "tags": "json", "meta": "json",
+        "extra": "string"}
+    assert isinstance(snapshot.codes("items", "rank"), np.memmap)
+
+    expected = [dict({"extra": None}, **record) for record in RECORDS]
+    assert snapshot.records("items") == expected
+    assert snapshot.records("items", np.array([2])) == expected[2:]
+    assert snapshot.lookup("items", "id", "b") == 1 and snapshot.lookup("items", "id", "zzz") == -1
+
+
+def test_new_version_becomes_current_and_old_versions_are_pruned(tmp_path):
+    root = str(tmp_path)
+    directories = [write_snapshot("test", {"items": [{"n": n}]}, root=root) for n in range(5)]
+
+    assert current_snapshot_dir("test", root) == directories[-1]
+    assert open_snapshot("test", root=root).records("items") == [{"n": 4}]
+    assert sorted(os.listdir(tmp_path / "test")) == sorted([os.path.basename(d) for d in directories[-3:]] + ["CURRENT"])
+    with pytest.raises(FileNotFoundError):
+        open_snapshot("missing", root=root)
+
+
+def test_snapshot_is_much_smaller_than_pretty_json(tmp_path):
+    charts = [dict(point, pool=pool_id) for pool_id in POOL_IDS.values() for point in make_chart(pool_id)]
+    snapshot_dir = write_snapshot("defillama", {"pool_charts": charts}, root=str(tmp_path))
+    snapshot_bytes = sum(os.path.getsize(os.path.join(path, name))
+                         for path, _, names in os.walk(snapshot_dir) for name in names)
+    assert snapshot_bytes * 4 < len(json.dumps(charts, indent=2))
+
+
+@pytest.fixture
+def snapshot_mode(tmp_path, monkeypatch):
+    fake = FakeDefiLlama()
+    pools = fake.pools + [make_pool("STETH", "uncharted", tvl=1e12)]
+    charts = [dict(point, pool=pool_id) for pool_id in POOL_IDS.values() for point in make_chart(pool_id)]
+    write_snapshot("defillama", {"yield_pools": pools, "pool_charts": charts}, root=str(tmp_path))
+
+    monkeypatch.setattr(defi_llama, "DATA_SOURCE", "snapshot")
+    monkeypatch.setattr(defi_llama, "open_snapshot", lambda dataset: open_snapshot(dataset, root=str(tmp_path)))
+    monkeypatch.setattr(defi_llama, "_pool_resolver", None)
+    monkeypatch.setattr(defi_llama.requests, "get", lambda *args, **kwargs: pytest.fail("network used offline"))
+
+
+def test_offline_mode_serves_pool_summary_and_history(snapshot_mode):
+    summary = defi_llama.get_pool_summary_data()
+    assert {pool.pool for pools in summary.values() for pool in pools} == set(POOL_IDS.values())
+    assert summary["STETH"][0].underlyingTokens == []
+
+    df = defi_llama.get_historic_tvl_and_apy_from_symbol("gho", use_shared_panels=False)
+    expected = make_chart(POOL_IDS["GHO"])
+    assert list(df.columns) == list(expected[0])
+    assert list(df["timestamp"]) == [point["timestamp"] for point in expected]
+    np.testing.assert_allclose(df["apy"], [point["apy"] for point in expected])
+
+    with pytest.raises(Exception):
+        defi_llama.get_historic_tvl_and_apy_from_pool_id("uncharted")
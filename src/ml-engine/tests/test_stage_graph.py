@@ -0,0 +1,91 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from main_app.infrastructure.metrics import STAGE_RUNS
+from main_app.infrastructure.stage_graph import Stage, StageCache, StageGraph, fingerprint
+from main_app.data_classes.BlackLittermanModelData import BlackLittermanModelData
+from main_app.models.black_litterman.BlPortfolioModel import BlPortfolioModel, run_model
+
+
+@pytest.fixture
+def counting_graph():
+    calls = []
+
+    def stage(name, compute):
+        def run(*args):
+            calls.append(name)
+            return compute(*args)
+        return run
+
+    graph = StageGraph("Test", [
+        Stage("total", stage("total", lambda xs: float(np.sum(xs))), ("xs",)),
+        Stage("sign", stage("sign", lambda total: total >= 0), ("total",)),
+        Stage("scaled", stage("scaled", lambda total, factor: total * factor), ("total", "factor")),
+        Stage("label", stage("label", lambda positive: "up" if positive else "down"), ("sign",)),
+    ], cache=StageCache())
+    return graph, calls
+
+
+def test_rerun_recomputes_only_downstream_of_changes(counting_graph):
+    graph, calls = counting_graph
+    assert graph.sources == ["factor", "xs"]
+    first = graph.run(xs=np.array([1.0, 2.0]), factor=2)
+    assert (first.get("scaled"), first.get("label")) == (6.0, "up")
+    assert first.computed == ["total", "scaled", "sign", "label"]
+
+    calls.clear()
+    same = graph.run(xs=np.array([1.0, 2.0]), factor=3)
+    assert same.get("scaled") == 9.0 and same.get("label") == "up"
+    assert calls == ["scaled"]
+    assert same.report() == {"total": "reused", "scaled": "computed", "sign": "reused", "label": "reused"}
+
+    # total changes but its sign does not: everything below 'sign' is reused
+    calls.clear()
+    changed = graph.run(xs=np.array([5.0, 2.0]), factor=3)
+    assert changed.get("label") == "up" and calls == ["total", "sign"]
+    assert changed.reused == ["label"]
+
+
+def test_graph_validation():
+    with pytest.raises(ValueError, match="cycle"):
+        StageGraph("Test", [Stage("a", lambda b: b, ("b",)), Stage("b", lambda a: a, ("a",))])
+    graph = StageGraph("Test", [Stage("a", lambda x: x, ("x",))])
+    with pytest.raises(ValueError):
+        graph.run(y=1)
+
+
+def test_fingerprints_follow_content():
+    frame = pd.DataFrame({"a": [1.0, 2.0]}, index=["x", "y"])
+    assert fingerprint(frame) == fingerprint(frame.copy())
+    assert fingerprint(frame) != fingerprint(frame.rename(columns={"a": "b"}))
+    assert fingerprint(frame) != fingerprint(frame.astype(np.float32))
+    assert fingerprint({"a": [1, 2]}) != fingerprint({"a": [1, 3]})
+    assert fingerprint(np.array(["a", None], dtype=object)) == fingerprint(np.array(["a", None], dtype=object))
+    with pytest.raises(TypeError):
+        fingerprint(lambda: None)
+
+
+def test_changing_only_views_reuses_the_market_data_stages(fake_defillama, model_payload, metrics_registry,
+                                                           stage_cache):
+    first = BlPortfolioModel(BlackLittermanModelData.from_dict(model_payload))
+    first.calculate()
+    assert set(first.stage_report().values()) == {"computed"}
+
+    payload = copy.deepcopy(model_payload)
+    payload["PortfolioViews"][0]["ExpectedReturn"] = 0.04
+    fetched = len(fake_defillama.calls)
+    second = BlPortfolioModel(BlackLittermanModelData.from_dict(payload))
+    result = second.calculate()
+    # the histories' versions are unchanged, so nothing is fetched again
+    assert len(fake_defillama.calls) == fetched
+    assert second.stage_report() == {
+        "histories": "reused", "apy_panel": "reused", "tvl_panel": "reused", "sample_cov": "reused",
+        "mean_historical_return": "reused", "views": "computed", "prior": "reused", "posterior": "computed",
+        "max_sharpe": "computed"}
+    assert STAGE_RUNS.value(component="BlPortfolioModel", stage="sample_cov", result="reused") == 1
+
+    stage_cache.clear()  # the memoised result matches a cold run
+    assert run_model(payload).to_json() == result.to_json()
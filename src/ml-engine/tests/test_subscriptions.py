@@ -0,0 +1,111 @@
+import asyncio
+
+from starlette.testclient import TestClient
+
+from main_app.infrastructure.subscriptions import SubscriptionHub, diff_allocations, format_sse, topic_id_for
+from main_app.main import app, latest_observations
+
+
+class FakeMarket:
+    def __init__(self):
+        self.markers = {"STETH": "t0", "USDC": "t0", "WBTC": "t0"}
+        self.weights = {"STETH": 0.5, "USDC": 0.5}
+        self.computations = 0
+
+    def compute(self, model_name, payload):
+        self.computations += 1
+        return {symbol: self.weights.get(symbol, 0.0) for symbol in payload["AssetSymbols"]}
+
+    def latest_observations(self, symbols):
+        return {symbol: self.markers[symbol] for symbol in symbols}
+
+
+async def next_event(listener, timeout=5):
+    return await asyncio.wait_for(listener.__anext__(), timeout)
+
+
+def test_topic_id_is_shared_by_identical_payloads():
+    assert topic_id_for("blacklitterman", {"a": 1, "b": 2}) == topic_id_for("BlackLitterman", {"b": 2, "a": 1})
+    assert topic_id_for("blacklitterman", {"a": 1}) != topic_id_for("blacklitterman", {"a": 2})
+
+
+def test_diff_reports_changed_and_dropped_assets():
+    assert diff_allocations({"A": 0.5, "B": 0.5}, {"A": 0.5, "C": 0.5}) == {"C": 0.5, "B": 0.0}
+
+
+def test_recomputes_only_topics_with_new_observations():
+    async def scenario():
+        market = FakeMarket()
+        hub = SubscriptionHub(market.compute, market.latest_observations, poll_interval=3600)
+        first = hub.subscribe("blacklitterman", {"AssetSymbols": ["STETH", "USDC"]})
+        shared = hub.subscribe("blacklitterman", {"AssetSymbols": ["STETH", "USDC"]})
+        other = hub.subscribe("blacklitterman", {"AssetSymbols": ["WBTC"]})
+        assert first is shared
+
+        listener_a = hub.listen(first.topic_id)
+        listener_b = hub.listen(first.topic_id)
+        snapshot = await next_event(listener_a)
+        assert snapshot["full"] and len(snapshot["allocations"]) == 2
+        await next_event(listener_b)
+
+        await hub.poll_once()  # records the initial markers
+        computations = market.computations
+        assert computations == 2  # one per topic, not per subscriber
+
+        await hub.poll_once()  # nothing changed upstream
+        assert market.computations == computations
+
+        market.markers["USDC"] = "t1"
+        market.weights = {"STETH": 0.5, "USDC": 0.25}
+        await hub.poll_once()
+        assert market.computations == computations + 1  # the WBTC topic is untouched
+        update = await next_event(listener_a)
+        assert update == {
+            "event": "allocations", "topic": first.topic_id, "as_of": first.as_of, "full": False,
+            "allocations": [{"asset": "USDC", "weight": 0.25}],
+        }
+        assert (await next_event(listener_b))["allocations"] == update["allocations"]
+        assert other.allocations == {"WBTC": 0.0}
+
+        await listener_a.aclose()
+        await listener_b.aclose()
+        await hub.close()
+
+    asyncio.run(scenario())
+
+
+def test_idle_topics_are_dropped():
+    async def scenario():
+        market = FakeMarket()
+        hub = SubscriptionHub(market.compute, market.latest_observations, poll_interval=3600, idle_timeout=0)
+        hub.subscribe("blacklitterman", {"AssetSymbols": ["STETH"]})
+        await hub.poll_once()  # kept while its first computation is in flight
+        assert len(hub.topics) == 1 and market.computations == 1
+        await hub.poll_once()
+        assert hub.topics == {}
+        await hub.close()
+
+    asyncio.run(scenario())
+
+
+def test_heartbeat_is_sent_as_comment():
+    assert format_sse({"event": "heartbeat"}) == ": keep-alive\n\n"
+
+
+def test_subscribe_endpoint_returns_shared_topic(fake_defillama, model_payload):
+    with TestClient(app) as client:
+        first = client.post("/subscriptions/run_model/blacklitterman", json=model_payload)
+        second = client.post("/subscriptions/run_model/blacklitterman", json=model_payload)
+        assert first.status_code == 201
+        assert first.json()["topic_id"] == second.json()["topic_id"]
+        assert client.get("/subscriptions/unknown/events").status_code == 404
+
+
+def test_observation_markers_come_from_one_pool_summary_call(fake_defillama):
+    symbols = {"STETH", "USDC"}
+    first = latest_observations(symbols)
+    next(pool for pool in fake_defillama.pools if pool["symbol"] == "STETH")["apy"] = 4.5
+    fake_defillama.calls.clear()
+    second = latest_observations(symbols)
+    assert fake_defillama.calls == ["https://yields.llama.fi/pools"]
+    assert {symbol for symbol in symbols if first[symbol] != second[symbol]} == {"STETH"}